@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Benchmark cho segment_words_into_sentences trên transcript tổng hợp 200k từ.
+
+Dùng làm regression guard: output phải giống hệt thuật toán cũ (nối chuỗi + split),
+và thời gian phải tăng tuyến tính theo số từ.
+"""
+
+import random
+import re
+import sys
+import time
+
+from pipeline import segment_words_into_sentences
+
+VOCABULARY = [
+    'the', 'a', 'this', 'that', 'we', 'they', 'and', 'but', 'so', 'because', 'then', 'now',
+    'agent', 'video', 'model', 'really', 'build', 'people', 'money', 'hours', 'actually', 'paid',
+    'about', 'with', 'into', 'over', 'just', 'very', 'going', 'think', 'know', 'right',
+]
+SPECIAL_WORDS = ['Mr.', 'Dr.', 'etc.', 'U.S.', '1.', '2.', 'done.', 'what?', 'wow!', 'well,', 'so;', 'note:']
+
+
+def make_transcript(word_count, seed=42, punctuation_rate=0.04):
+    """Tạo danh sách words giống AssemblyAI (text/start/end) với dấu câu ngẫu nhiên"""
+    rng = random.Random(seed)
+    words = []
+    position = 0
+    for _ in range(word_count):
+        if rng.random() < punctuation_rate:
+            text = rng.choice(SPECIAL_WORDS)
+        else:
+            text = rng.choice(VOCABULARY)
+        duration = rng.randint(120, 480)
+        words.append({"text": text, "start": position, "end": position + duration})
+        position += duration + rng.randint(0, 200)
+    return words
+
+
+def reference_segment(words, min_length=20, max_length=150):
+    """Thuật toán cũ của json_to_srt_with_sentences (giữ lại để so sánh output)"""
+    abbreviations = {
+        'mr.', 'mrs.', 'ms.', 'dr.', 'prof.', 'vs.', 'etc.', 'i.e.', 'e.g.', 'a.m.', 'p.m.',
+        'inc.', 'corp.', 'co.', 'ltd.', 'llc.', 'u.s.', 'u.k.', 'e.u.', 'n.a.t.o.',
+        'jan.', 'feb.', 'mar.', 'apr.', 'jun.', 'jul.', 'aug.', 'sep.', 'oct.', 'nov.', 'dec.',
+        'mon.', 'tue.', 'wed.', 'thu.', 'fri.', 'sat.', 'sun.',
+        'st.', 'nd.', 'rd.', 'th.', '1st', '2nd', '3rd', '4th', '5th', '6th', '7th', '8th', '9th', '10th'
+    }
+    strong_endings = ['.', '!', '?']
+    weak_endings = [',', ';', ':']
+    sentence_starters = {
+        'the', 'a', 'an', 'this', 'that', 'these', 'those', 'i', 'you', 'he', 'she', 'it', 'we', 'they',
+        'my', 'your', 'his', 'her', 'its', 'our', 'their', 'mine', 'yours', 'hers', 'ours', 'theirs',
+        'and', 'but', 'or', 'nor', 'for', 'yet', 'so', 'because', 'although', 'however', 'therefore',
+        'first', 'second', 'third', 'finally', 'next', 'then', 'now', 'here', 'there', 'when', 'where',
+        'why', 'how', 'what', 'which', 'who', 'whom', 'whose'
+    }
+
+    def is_sentence_end(current_text, next_word, current_word):
+        current_text = current_text.strip().lower()
+        current_word = current_word.lower()
+        next_word = next_word.lower() if next_word else ""
+        if current_word.endswith(tuple(strong_endings)):
+            if current_word in abbreviations:
+                return False
+            if re.match(r'^\d+\.$', current_word):
+                return False
+            return True
+        if len(current_text.split()) > max_length:
+            return True
+        if (next_word in sentence_starters and
+                len(current_text.split()) > min_length and
+                not current_word.endswith(tuple(weak_endings))):
+            return True
+        return False
+
+    def clean_sentence(text):
+        text = re.sub(r'\s+', ' ', text.strip())
+        if text and not text[0].isupper():
+            text = text[0].upper() + text[1:]
+        return text
+
+    sentences = []
+    current_sentence = ""
+    current_start = None
+    current_end = None
+    for i, word in enumerate(words):
+        word_text = word.get("text", "")
+        if current_start is None:
+            current_start = word.get("start", 0)
+        current_sentence += word_text + " "
+        current_end = word.get("end", 0)
+        next_word = words[i + 1].get("text", "") if i + 1 < len(words) else ""
+        if is_sentence_end(current_sentence, next_word, word_text):
+            cleaned_text = clean_sentence(current_sentence)
+            if cleaned_text and len(cleaned_text.strip()) > 5:
+                sentences.append({"text": cleaned_text, "start": current_start, "end": current_end})
+            current_sentence = ""
+            current_start = None
+            current_end = None
+    if current_sentence.strip():
+        cleaned_text = clean_sentence(current_sentence)
+        if cleaned_text and len(cleaned_text.strip()) > 5:
+            sentences.append({"text": cleaned_text, "start": current_start or 0, "end": current_end or 0})
+
+    merged_sentences = []
+    for sentence in sentences:
+        if len(sentence["text"].split()) < min_length and merged_sentences:
+            prev = merged_sentences[-1]
+            prev["text"] += " " + sentence["text"]
+            prev["end"] = sentence["end"]
+        else:
+            merged_sentences.append(sentence)
+    return merged_sentences
+
+
+def time_call(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    print("⏱️ Sentence segmentation benchmark")
+    print("=" * 50)
+    failed = False
+
+    # 1. Output phải giống hệt thuật toán cũ (nhiều cấu hình min/max)
+    for seed, (min_length, max_length) in enumerate([(20, 150), (5, 40), (0, 10), (30, 2000)]):
+        words = make_transcript(20_000, seed=seed)
+        expected = reference_segment(words, min_length, max_length)
+        actual = segment_words_into_sentences(words, min_length, max_length)
+        if actual != expected:
+            print(f"❌ Output mismatch for min={min_length}, max={max_length}")
+            failed = True
+        else:
+            print(f"✅ Identical output for min={min_length}, max={max_length} ({len(actual)} sentences)")
+
+    # 2. 200k từ: thời gian tuyến tính (cũ vs mới), kể cả khi câu rất dài
+    for label, punctuation_rate, min_length, max_length in [("punctuated", 0.04, 20, 150), ("long sentences", 0.0, 400, 1500)]:
+        small = make_transcript(50_000, punctuation_rate=punctuation_rate)
+        large = make_transcript(200_000, punctuation_rate=punctuation_rate)
+        _, small_time = time_call(segment_words_into_sentences, small, min_length, max_length)
+        result, large_time = time_call(segment_words_into_sentences, large, min_length, max_length)
+        _, reference_time = time_call(reference_segment, large, min_length, max_length)
+        ratio = large_time / max(small_time, 1e-9)
+        print(f"\n📊 200k words ({label}, min={min_length}, max={max_length}): {len(result)} sentences")
+        print(f"   new: {large_time:.3f}s | old: {reference_time:.3f}s | 200k/50k ratio: {ratio:.1f}x")
+        # 4x dữ liệu -> kỳ vọng ~4x thời gian; > 8x nghĩa là đã quay lại độ phức tạp bậc hai
+        if ratio > 8.0:
+            print("❌ Segmentation no longer scales linearly")
+            failed = True
+
+    print("\n" + "=" * 50)
+    if failed:
+        print("❌ Benchmark regression detected")
+        sys.exit(1)
+    print("🎯 Benchmark passed!")
+
+
+if __name__ == "__main__":
+    main()
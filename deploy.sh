@@ -108,7 +108,7 @@ sudo -u "$APP_USER" "$APP_DIR/venv/bin/pip" install --upgrade pip
 # Install Python dependencies
 print_status "Cài đặt Python dependencies..."
 sudo -u "$APP_USER" "$APP_DIR/venv/bin/pip" install -r web_requirements.txt
-sudo -u "$APP_USER" "$APP_DIR/venv/bin/pip" install gunicorn
+sudo -u "$APP_USER" "$APP_DIR/venv/bin/pip" install gunicorn gevent
 
 # Create necessary directories
 print_status "Tạo các thư mục cần thiết..."
@@ -131,7 +131,9 @@ sudo tee "$APP_DIR/gunicorn.conf.py" > /dev/null <<EOF
 # Gunicorn configuration
 bind = "127.0.0.1:8000"
 workers = 2
-worker_class = "sync"
+# gthread cho request thường; stream SSE (/api/events) chạy ở $APP_NAME-events (gevent), không giữ thread ở đây
+worker_class = "gthread"
+threads = 32
 worker_connections = 1000
 timeout = 300
 keepalive = 2
@@ -148,6 +150,22 @@ loglevel = "info"
 capture_output = True
 EOF
 
+# SSE /api/events: mỗi tab giữ một kết nối lâu -> worker gevent (greenlet, không tốn thread / kết nối)
+sudo tee "$APP_DIR/gunicorn-events.conf.py" > /dev/null <<EOF
+bind = "127.0.0.1:8001"
+workers = 1
+worker_class = "gevent"
+worker_connections = 2000
+timeout = 300
+# Không preload: gevent phải monkey-patch trước khi import web_app (thread theo dõi job store)
+preload_app = False
+user = "$APP_USER"
+group = "$APP_USER"
+accesslog = "$APP_DIR/logs/gunicorn_events_access.log"
+errorlog = "$APP_DIR/logs/gunicorn_events_error.log"
+loglevel = "info"
+EOF
+
 # Create systemd service
 print_status "Tạo systemd service..."
 sudo tee "/etc/systemd/system/$APP_NAME.service" > /dev/null <<EOF
@@ -161,6 +179,8 @@ User=$APP_USER
 Group=$APP_USER
 WorkingDirectory=$APP_DIR
 Environment=PATH=$APP_DIR/venv/bin
+# Pipeline chạy trong $APP_NAME-worker, web tier chỉ enqueue và báo trạng thái
+Environment=EMBEDDED_WORKER=0
 ExecStart=$APP_DIR/venv/bin/gunicorn -c $APP_DIR/gunicorn.conf.py web_app:app
 ExecReload=/bin/kill -s HUP \$MAINPID
 Restart=always
@@ -170,6 +190,51 @@ RestartSec=3
 WantedBy=multi-user.target
 EOF
 
+sudo tee "/etc/systemd/system/$APP_NAME-events.service" > /dev/null <<EOF
+[Unit]
+Description=Auto Translate Video live updates (SSE)
+After=network.target
+
+[Service]
+Type=exec
+User=$APP_USER
+Group=$APP_USER
+WorkingDirectory=$APP_DIR
+Environment=PATH=$APP_DIR/venv/bin
+Environment=EMBEDDED_WORKER=0
+ExecStart=$APP_DIR/venv/bin/gunicorn -c $APP_DIR/gunicorn-events.conf.py web_app:app
+Restart=always
+RestartSec=3
+
+[Install]
+WantedBy=multi-user.target
+EOF
+
+# Worker process chạy pipeline (claim project từ job store projects/jobs.db)
+print_status "Tạo systemd service cho pipeline worker..."
+sudo tee "/etc/systemd/system/$APP_NAME-worker.service" > /dev/null <<EOF
+[Unit]
+Description=Auto Translate Video Pipeline Worker
+After=network.target
+
+[Service]
+Type=exec
+User=$APP_USER
+Group=$APP_USER
+WorkingDirectory=$APP_DIR
+Environment=PATH=$APP_DIR/venv/bin:/usr/bin:/bin
+# resource_limits dùng chung giữa các process trên máy (flock trong cache/resource_slots), không nhân theo --processes
+ExecStart=$APP_DIR/venv/bin/python pipeline_worker.py --processes 2 --slots 1
+# SIGTERM: worker trả project đang chạy về hàng đợi, runner dừng ở ranh giới stage
+KillSignal=SIGTERM
+TimeoutStopSec=60
+Restart=always
+RestartSec=3
+
+[Install]
+WantedBy=multi-user.target
+EOF
+
 # Create Nginx configuration
 print_status "Tạo cấu hình Nginx..."
 sudo tee "/etc/nginx/sites-available/$APP_NAME" > /dev/null <<EOF
@@ -217,6 +282,17 @@ server {
         add_header Cache-Control "public, immutable";
     }
     
+    # Live updates (SSE): service gevent riêng, không buffer để event tới ngay
+    location /api/events {
+        proxy_pass http://127.0.0.1:8001;
+        proxy_set_header Host \$host;
+        proxy_set_header X-Forwarded-For \$proxy_add_x_forwarded_for;
+        proxy_http_version 1.1;
+        proxy_set_header Connection "";
+        proxy_buffering off;
+        proxy_read_timeout 600s;
+    }
+
     # Main application
     location / {
         proxy_pass http://127.0.0.1:8000;
@@ -253,8 +329,8 @@ sudo nginx -t
 # Start and enable services
 print_status "Khởi động các service..."
 sudo systemctl daemon-reload
-sudo systemctl enable "$APP_NAME"
-sudo systemctl start "$APP_NAME"
+sudo systemctl enable "$APP_NAME" "$APP_NAME-events" "$APP_NAME-worker"
+sudo systemctl start "$APP_NAME" "$APP_NAME-events" "$APP_NAME-worker"
 sudo systemctl restart nginx
 
 # Get SSL certificate
@@ -312,15 +388,15 @@ APP_DIR="$APP_DIR"
 case "\$1" in
     start)
         echo "Khởi động ứng dụng..."
-        sudo systemctl start \$APP_NAME
+        sudo systemctl start \$APP_NAME \$APP_NAME-events \$APP_NAME-worker
         ;;
     stop)
         echo "Dừng ứng dụng..."
-        sudo systemctl stop \$APP_NAME
+        sudo systemctl stop \$APP_NAME \$APP_NAME-events \$APP_NAME-worker
         ;;
     restart)
         echo "Khởi động lại ứng dụng..."
-        sudo systemctl restart \$APP_NAME
+        sudo systemctl restart \$APP_NAME \$APP_NAME-events \$APP_NAME-worker
         ;;
     status)
         echo "Trạng thái ứng dụng:"
@@ -336,7 +412,7 @@ case "\$1" in
         git pull
         source venv/bin/activate
         pip install -r web_requirements.txt
-        sudo systemctl restart \$APP_NAME
+        sudo systemctl restart \$APP_NAME \$APP_NAME-events \$APP_NAME-worker
         ;;
     ssl-renew)
         echo "Gia hạn SSL certificate..."
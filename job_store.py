@@ -0,0 +1,870 @@
+#!/usr/bin/env python3
+"""
+Job store lưu trạng thái project/step trong SQLite (WAL), dùng chung giữa các gunicorn worker
+và còn nguyên sau khi restart.
+
+- Cột status/priority/queued_at có index để lấy hàng đợi / đếm theo trạng thái không cần quét hết
+- Phần còn lại của project (steps, progress, output_file...) nằm trong cột data (JSON)
+- Mỗi lần chạy được claim với run_id riêng; runner chỉ ghi được khi run_id còn khớp và project
+  vẫn 'running', nên stop/restart từ worker khác không bị runner cũ ghi đè
+- WAL: nhiều reader đọc song song không chặn writer của pipeline
+- config của lần chạy lưu ở cột riêng (có API key, không trả về qua API) để worker process khác đọc được
+- Lần chạy giữ lease có hạn, được gia hạn bằng heartbeat (hold_lease); lease hết hạn (node chết, mất mạng)
+  thì project được đưa lại vào hàng đợi cho worker khác
+- active_run: lần chạy mà process runner vẫn đang chạy (kể cả khi đã bị stop / restart và đang dừng lại);
+  lease thuộc về nó nên project chỉ được claim lại sau khi runner cũ đã thoát hẳn (hoặc lease hết hạn),
+  nghĩa là mỗi project có tối đa một runner. Runner thấy lần chạy của mình không còn hiện hành (qua
+  change feed) thì hủy công việc đang dở (hold_lease(on_lost=...))
+- needs: resource class mà stage tiếp theo cần (stage affinity); chỉ worker có đủ capability mới claim được
+- version: mỗi lần status/priority/data của project đổi (hoặc project bị xóa) store tăng một số thứ tự chung
+  (trigger SQLite, nên mọi process ghi đều được tính); changes_since(version) trả về phần thay đổi cho
+  SSE /api/events thay vì client poll toàn bộ danh sách; project trả về có field version của lần đổi cuối
+- Danh sách phân trang theo keyset (created_at, id), có index cả khi lọc theo status
+- batches: nhiều project tạo trong một transaction, dùng chung một bản config (project không có config
+  riêng thì đọc config của batch); batch_progress gộp tiến độ theo batch
+- duration: thời lượng video (probe lúc submit) để xếp hàng đợi theo policy (sjf / fifo / weighted_fair,
+  có aging để job dài không bị bỏ đói) và ước lượng thời điểm bắt đầu / xong (estimate_queue)
+- Thứ tự hàng đợi là cột (queue_rank, queue_key) có index, tính khi project vào hàng (hoặc đổi thời lượng /
+  policy) nên lấy project đầu hàng là ORDER BY ... LIMIT 1; policy / aging lưu trong bảng settings, dùng chung
+  giữa web process và mọi worker
+"""
+
+import contextlib
+import heapq
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+
+JOB_STORE_PATH = Path(os.getenv("JOB_STORE_PATH", "projects/jobs.db"))
+# Trạng thái có thể chạy tiếp khi process chạy nó đã chết
+RESUMABLE_STATUSES = ("starting", "running")
+# Trạng thái kết thúc (batch xong khi mọi project ở một trong các trạng thái này)
+FINISHED_STATUSES = ("completed", "error", "stopped")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS projects (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    created_at TEXT NOT NULL,
+    queued_at REAL,
+    updated_at REAL NOT NULL,
+    owner TEXT,
+    run_id TEXT,
+    active_run TEXT,
+    lease_expires_at REAL,
+    needs TEXT,
+    batch_id TEXT,
+    duration REAL,
+    config TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_projects_status ON projects (status, priority DESC, queued_at);
+DROP INDEX IF EXISTS idx_projects_created;
+CREATE INDEX IF NOT EXISTS idx_projects_created_id ON projects (created_at, id);
+CREATE INDEX IF NOT EXISTS idx_projects_status_created ON projects (status, created_at, id);
+CREATE TABLE IF NOT EXISTS batches (
+    id TEXT PRIMARY KEY,
+    name TEXT,
+    created_at TEXT NOT NULL,
+    config TEXT
+);
+CREATE TABLE IF NOT EXISTS workers (
+    id TEXT PRIMARY KEY,
+    slots INTEGER NOT NULL,
+    capabilities TEXT,
+    started_at REAL NOT NULL,
+    heartbeat_at REAL NOT NULL
+);
+"""
+# Worker không gửi heartbeat quá số giây này coi như đã dừng
+WORKER_STALE_SEC = 30
+# Thời hạn lease của một lần chạy; được gia hạn mỗi JOB_LEASE_SEC / 3 giây khi runner còn sống
+JOB_LEASE_SEC = float(os.getenv("JOB_LEASE_SEC", "60"))
+# Cột thêm sau khi bảng đã được tạo (store cũ được ALTER TABLE khi mở)
+ADDED_COLUMNS = {
+    "projects": {"config": "TEXT", "lease_expires_at": "REAL", "needs": "TEXT", "active_run": "TEXT", "batch_id": "TEXT", "version": "INTEGER NOT NULL DEFAULT 0",
+                 "duration": "REAL", "queue_rank": "INTEGER NOT NULL DEFAULT 0", "queue_key": "REAL"},
+    "workers": {"capabilities": "TEXT"},
+}
+# Change feed (+ index theo batch): chạy sau khi đã thêm cột version / batch_id (store cũ chưa có khi SCHEMA chạy)
+CHANGE_FEED_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO meta (name, value) VALUES ('version', 0);
+CREATE TABLE IF NOT EXISTS deleted_projects (
+    id TEXT PRIMARY KEY,
+    version INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_projects_version ON projects (version);
+CREATE INDEX IF NOT EXISTS idx_projects_batch ON projects (batch_id, status);
+CREATE TRIGGER IF NOT EXISTS projects_version_insert AFTER INSERT ON projects BEGIN
+    UPDATE meta SET value = value + 1 WHERE name = 'version';
+    UPDATE projects SET version = (SELECT value FROM meta WHERE name = 'version') WHERE id = NEW.id;
+    DELETE FROM deleted_projects WHERE id = NEW.id;
+END;
+CREATE TRIGGER IF NOT EXISTS projects_version_update AFTER UPDATE OF status, priority, data ON projects BEGIN
+    UPDATE meta SET value = value + 1 WHERE name = 'version';
+    UPDATE projects SET version = (SELECT value FROM meta WHERE name = 'version') WHERE id = NEW.id;
+END;
+CREATE TRIGGER IF NOT EXISTS projects_version_delete AFTER DELETE ON projects BEGIN
+    UPDATE meta SET value = value + 1 WHERE name = 'version';
+    INSERT OR REPLACE INTO deleted_projects (id, version) VALUES (OLD.id, (SELECT value FROM meta WHERE name = 'version'));
+END;
+"""
+# Thứ tự hàng đợi (chạy sau ADDED_COLUMNS như CHANGE_FEED_SCHEMA) + policy dùng chung giữa các process
+QUEUE_SCHEMA = """
+CREATE INDEX IF NOT EXISTS idx_projects_queue ON projects (status, queue_rank, queue_key, queued_at, id);
+CREATE TABLE IF NOT EXISTS settings (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+# ORDER BY của hàng đợi (khớp idx_projects_queue)
+QUEUE_ORDER = "queue_rank, queue_key, queued_at, id"
+# Policy xếp hàng đợi:
+# - sjf: video ngắn chạy trước (cùng priority)
+# - fifo: vào hàng trước chạy trước (cùng priority)
+# - weighted_fair: chia lượt giữa các batch (project lẻ là một nhóm riêng) theo tổng thời lượng đã dồn;
+#   priority là trọng số (1 + priority) thay vì thứ tự tuyệt đối
+QUEUE_POLICIES = ("sjf", "fifo", "weighted_fair")
+QUEUE_POLICY = os.getenv("QUEUE_POLICY", "sjf")
+# Aging: mỗi giây chờ trừ đi bấy nhiêu giây thời lượng ước lượng (sjf / weighted_fair), job dài rồi cũng tới lượt.
+# QUEUE_POLICY / QUEUE_AGING_FACTOR chỉ là giá trị ban đầu khi tạo store; sau đó đổi qua configure_queue
+QUEUE_AGING_FACTOR = float(os.getenv("QUEUE_AGING_FACTOR", "1.0"))
+# Thời lượng (giây) giả định cho project chưa probe được
+DEFAULT_JOB_DURATION_SEC = 600.0
+# Số project đã xong gần nhất dùng để ước lượng giây xử lý / giây video
+ESTIMATE_SAMPLE_SIZE = 20
+
+# Chu kỳ (giây) thread theo dõi version của store khi có client chờ thay đổi (wait_for_change)
+CHANGE_POLL_SEC = 0.5
+
+
+def process_owner() -> str:
+    """Định danh process đang chạy job: host:pid"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _owner_alive(owner) -> bool:
+    """Process chủ còn sống không. Chỉ kiểm tra được owner trên cùng host, host khác coi như còn sống"""
+    if not owner:
+        return False
+    host, _, pid = owner.rpartition(":")
+    if host != socket.gethostname():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, ValueError):
+        return True
+    return True
+
+
+class JobStore:
+    def __init__(self, path=JOB_STORE_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        conn = self._connect()
+        conn.executescript(SCHEMA)
+        for table, added in ADDED_COLUMNS.items():
+            columns = {row["name"] for row in conn.execute(f"PRAGMA table_info({table})")}
+            for column, column_type in added.items():
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+        conn.executescript(CHANGE_FEED_SCHEMA)
+        conn.executescript(QUEUE_SCHEMA)
+        with self._transaction() as conn:
+            conn.execute("INSERT OR IGNORE INTO settings (name, value) VALUES ('queue_policy', ?)",
+                         (QUEUE_POLICY if QUEUE_POLICY in QUEUE_POLICIES else "sjf",))
+            conn.execute("INSERT OR IGNORE INTO settings (name, value) VALUES ('queue_aging', ?)",
+                         (str(max(0.0, QUEUE_AGING_FACTOR)),))
+            # Store cũ: project đang chờ chưa có queue_key
+            self._update_queue_keys(conn, "queue_key IS NULL")
+        self._leases = {}  # run_id -> (project_id, on_lost)
+        self._lease_lock = threading.Lock()
+        self._lease_thread = None
+        # Một thread theo dõi version cho mọi client đang chờ trong process (không phải mỗi client một query)
+        self._changed = threading.Condition()
+        self._version = 0
+        self._waiters = 0
+        self._watch_thread = None
+
+    @staticmethod
+    def _queue_settings(conn) -> tuple:
+        rows = dict(conn.execute("SELECT name, value FROM settings WHERE name IN ('queue_policy', 'queue_aging')").fetchall())
+        return rows.get("queue_policy", "sjf"), float(rows.get("queue_aging", QUEUE_AGING_FACTOR))
+
+    @property
+    def queue_policy(self) -> str:
+        return self._queue_settings(self._connect())[0]
+
+    @property
+    def queue_aging(self) -> float:
+        return self._queue_settings(self._connect())[1]
+
+    def configure_queue(self, policy=None, aging=None) -> None:
+        """
+        Đổi policy / aging của hàng đợi. Lưu trong store nên áp dụng cho mọi process (web, worker) từ lần chọn
+        project tiếp theo; thứ tự của các project đang chờ được tính lại.
+        """
+        if policy is not None and policy not in QUEUE_POLICIES:
+            raise ValueError(f"Unknown queue policy: {policy}")
+        with self._transaction() as conn:
+            current = self._queue_settings(conn)
+            updated = (policy if policy is not None else current[0],
+                       max(0.0, float(aging)) if aging is not None else current[1])
+            if updated == current:
+                return
+            conn.execute("INSERT OR REPLACE INTO settings (name, value) VALUES ('queue_policy', ?)", (updated[0],))
+            conn.execute("INSERT OR REPLACE INTO settings (name, value) VALUES ('queue_aging', ?)", (str(updated[1]),))
+            self._update_queue_keys(conn)
+
+    def _update_queue_keys(self, conn, where: str = "1", params=()) -> None:
+        """
+        Tính (queue_rank, queue_key) của các project 'queued' khớp where theo policy hiện tại;
+        hàng đợi là ORDER BY QUEUE_ORDER. Cùng khóa thì vào hàng trước chạy trước.
+        - fifo: (-priority, queued_at)
+        - sjf: (-priority, thời lượng + aging * queued_at), tức thời lượng - aging * thời gian chờ cộng một hằng số
+          chung cho mọi project nên không cần tính lại theo thời gian
+        - weighted_fair: (0, backlog của nhóm / (1 + priority) + aging * queued_at). Nhóm là batch, hoặc project lẻ.
+          Backlog = thời lượng đang chạy + đang chờ phía trước trong nhóm + chính nó, tính lúc vào hàng: nhóm dồn
+          nhiều việc phải nhường nhóm khác; priority là trọng số thay vì thứ tự tuyệt đối
+        """
+        policy, aging = self._queue_settings(conn)
+        duration = f"COALESCE(duration, {DEFAULT_JOB_DURATION_SEC})"
+        queued_at = "COALESCE(queued_at, 0)"
+        if policy == "fifo":
+            rank, key, values = "-priority", queued_at, ()
+        elif policy == "sjf":
+            rank, key, values = "-priority", f"{duration} + ? * {queued_at}", (aging,)
+        else:
+            backlog = (
+                f"CASE WHEN batch_id IS NULL THEN {duration} ELSE ("
+                f"SELECT SUM(COALESCE(other.duration, {DEFAULT_JOB_DURATION_SEC})) FROM projects AS other "
+                "WHERE other.batch_id = projects.batch_id AND (other.status = 'running' OR (other.status = 'queued' "
+                "AND (COALESCE(other.queued_at, 0) < COALESCE(projects.queued_at, 0) "
+                "OR (COALESCE(other.queued_at, 0) = COALESCE(projects.queued_at, 0) AND other.id <= projects.id))))) END"
+            )
+            rank, key, values = "0", f"{backlog} / (1 + MAX(priority, 0)) + ? * {queued_at}", (aging,)
+        conn.execute(
+            f"UPDATE projects SET queue_rank = {rank}, queue_key = {key} WHERE status = 'queued' AND ({where})",
+            values + tuple(params),
+        )
+
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Mỗi thread một connection (sqlite3 không chia sẻ connection giữa các thread).
+        Connection không dùng lại sau fork (gunicorn preload_app) mà mở lại trong process con.
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _transaction(self):
+        """BEGIN IMMEDIATE: giữ write lock ngay từ đầu để read-modify-write không bị chen"""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        return _Transaction(conn)
+
+    @staticmethod
+    def _row_to_project(row) -> dict:
+        project = json.loads(row["data"])
+        project["status"] = row["status"]
+        project["priority"] = row["priority"]
+        project["version"] = row["version"]
+        return project
+
+    # ---- Đọc ----
+
+    def get(self, project_id: str):
+        row = self._connect().execute("SELECT status, priority, data, version FROM projects WHERE id = ?", (project_id,)).fetchone()
+        return self._row_to_project(row) if row else None
+
+    def exists(self, project_id: str) -> bool:
+        return self._connect().execute("SELECT 1 FROM projects WHERE id = ?", (project_id,)).fetchone() is not None
+
+    def is_current_run(self, project_id: str, run_id: str) -> bool:
+        """Lần chạy run_id còn là lần chạy hiện hành (chưa bị stop / restart / xóa)"""
+        return self._connect().execute(
+            "SELECT 1 FROM projects WHERE id = ? AND run_id = ? AND status = 'running'", (project_id, run_id)
+        ).fetchone() is not None
+
+    def get_config(self, project_id: str):
+        """Config đã lưu cùng project khi enqueue, không có thì config của batch (None nếu không có)"""
+        row = self._connect().execute(
+            "SELECT COALESCE(projects.config, batches.config) AS config FROM projects "
+            "LEFT JOIN batches ON batches.id = projects.batch_id WHERE projects.id = ?",
+            (project_id,),
+        ).fetchone()
+        return json.loads(row["config"]) if row and row["config"] else None
+
+    def list(self, status=None) -> list:
+        """Project theo thứ tự tạo; status: một trạng thái hoặc tuple trạng thái"""
+        if status is None:
+            rows = self._connect().execute("SELECT status, priority, data, version FROM projects ORDER BY created_at, id").fetchall()
+        else:
+            statuses = (status,) if isinstance(status, str) else tuple(status)
+            marks = ",".join("?" * len(statuses))
+            rows = self._connect().execute(
+                f"SELECT status, priority, data, version FROM projects WHERE status IN ({marks}) ORDER BY created_at, id", statuses
+            ).fetchall()
+        return [self._row_to_project(row) for row in rows]
+
+    def page(self, status=None, limit=50, after=None):
+        """
+        Một trang project theo thứ tự tạo, sau cursor after = (created_at, id) của trang trước.
+        Trả về (projects, cursor của trang sau hoặc None nếu đã hết).
+        """
+        conditions, params = [], []
+        if status is not None:
+            statuses = (status,) if isinstance(status, str) else tuple(status)
+            conditions.append(f"status IN ({','.join('?' * len(statuses))})")
+            params.extend(statuses)
+        if after is not None:
+            conditions.append("(created_at, id) > (?, ?)")
+            params.extend(after)
+        where = f"WHERE {' AND '.join(conditions)} " if conditions else ""
+        rows = self._connect().execute(
+            f"SELECT id, created_at, status, priority, data, version FROM projects {where}ORDER BY created_at, id LIMIT ?",
+            params + [limit + 1],
+        ).fetchall()
+        cursor = (rows[limit - 1]["created_at"], rows[limit - 1]["id"]) if len(rows) > limit else None
+        return [self._row_to_project(row) for row in rows[:limit]], cursor
+
+    def batch_progress(self, batch_id: str):
+        """Tiến độ gộp của batch: số project theo status, % trung bình, project còn chưa xong. None nếu không có batch"""
+        conn = self._connect()
+        batch = conn.execute("SELECT id, name, created_at FROM batches WHERE id = ?", (batch_id,)).fetchone()
+        if batch is None:
+            return None
+        rows = conn.execute(
+            "SELECT id, status, json_extract(data, '$.name') AS name, json_extract(data, '$.progress') AS progress "
+            "FROM projects WHERE batch_id = ? ORDER BY created_at, id",
+            (batch_id,),
+        ).fetchall()
+        counts = {}
+        for row in rows:
+            counts[row["status"]] = counts.get(row["status"], 0) + 1
+        finished = sum(counts.get(status, 0) for status in FINISHED_STATUSES)
+        return {
+            "id": batch["id"],
+            "name": batch["name"],
+            "created_at": batch["created_at"],
+            "total": len(rows),
+            "counts": counts,
+            "progress": int(sum(row["progress"] or 0 for row in rows) / len(rows)) if rows else 100,
+            "finished": finished == len(rows),
+            "projects": [
+                {"id": row["id"], "name": row["name"], "status": row["status"], "progress": row["progress"] or 0}
+                for row in rows
+            ],
+        }
+
+    def list_batches(self, limit: int = 50) -> list:
+        """Batch mới nhất trước, kèm số project theo status"""
+        conn = self._connect()
+        batches = conn.execute(
+            "SELECT id, name, created_at FROM batches ORDER BY created_at DESC LIMIT ?", (limit,)
+        ).fetchall()
+        result = []
+        for batch in batches:
+            counts = {
+                row["status"]: row["n"]
+                for row in conn.execute(
+                    "SELECT status, COUNT(*) AS n FROM projects WHERE batch_id = ? GROUP BY status", (batch["id"],)
+                )
+            }
+            result.append({"id": batch["id"], "name": batch["name"], "created_at": batch["created_at"],
+                           "total": sum(counts.values()), "counts": counts})
+        return result
+
+    def queued_ids(self) -> list:
+        """Hàng đợi theo thứ tự sẽ chạy (theo queue_policy, xem _update_queue_keys)"""
+        return [row["id"] for row in self._queued_rows(self._connect())]
+
+    def queue_head(self, limit: int = 1) -> list:
+        """limit project claim được đầu hàng đợi (index scan, không sắp cả hàng đợi)"""
+        return [row["id"] for row in self._queued_rows(self._connect(), time.time(), limit)]
+
+    @staticmethod
+    def _queued_rows(conn, now=None, limit=None) -> list:
+        """Project đang chờ theo thứ tự hàng đợi; now: chỉ lấy project claim được (runner của lần chạy trước đã thoát)"""
+        query = "SELECT id, duration, needs FROM projects WHERE status = 'queued'"
+        params = []
+        if now is not None:
+            query += " AND (active_run IS NULL OR lease_expires_at < ?)"
+            params.append(now)
+        query += f" ORDER BY {QUEUE_ORDER}"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(int(limit))
+        return conn.execute(query, params).fetchall()
+
+    @staticmethod
+    def _running_rows(conn) -> list:
+        return conn.execute(
+            "SELECT id, priority, duration, batch_id, json_extract(data, '$.start_time') AS start_time "
+            "FROM projects WHERE status = 'running'"
+        ).fetchall()
+
+    def processing_ratio(self) -> float:
+        """Giây xử lý trên mỗi giây video, trung vị của các project xong gần nhất (1.0 nếu chưa có số liệu)"""
+        rows = self._connect().execute(
+            "SELECT (updated_at - json_extract(data, '$.start_time')) / duration AS ratio FROM projects "
+            "WHERE status = 'completed' AND duration > 0 AND json_extract(data, '$.start_time') IS NOT NULL "
+            "ORDER BY updated_at DESC LIMIT ?",
+            (ESTIMATE_SAMPLE_SIZE,),
+        ).fetchall()
+        ratios = sorted(row["ratio"] for row in rows if row["ratio"] and row["ratio"] > 0)
+        return ratios[len(ratios) // 2] if ratios else 1.0
+
+    def estimate_queue(self, slots: int) -> dict:
+        """
+        Ước lượng thời điểm bắt đầu / xong (epoch) của project đang chạy và đang chờ với slots project song song:
+        project chờ lấy slot rảnh sớm nhất theo thứ tự của queue_policy.
+        Trả về {project_id: {"estimated_start", "estimated_finish", "estimated_seconds"}}.
+        """
+        conn = self._connect()
+        now = time.time()
+        ratio = self.processing_ratio()
+        running = self._running_rows(conn)
+        estimates = {}
+        free_at = []
+        for row in running:
+            started = row["start_time"] or now
+            finish = max(now, started + (row["duration"] or DEFAULT_JOB_DURATION_SEC) * ratio)
+            estimates[row["id"]] = {"estimated_start": started, "estimated_finish": finish,
+                                    "estimated_seconds": finish - started}
+            free_at.append(finish)
+        # Slot đang rảnh sẵn sàng ngay; dư project đang chạy (vd vừa giảm max_concurrent_projects) thì chỉ
+        # slots slot rảnh sớm nhất được dùng tiếp
+        free_at = sorted(free_at + [now] * max(0, slots - len(free_at)))[:max(1, slots)]
+        heapq.heapify(free_at)
+        for row in self._queued_rows(conn):
+            seconds = (row["duration"] or DEFAULT_JOB_DURATION_SEC) * ratio
+            start = heapq.heappop(free_at)
+            estimates[row["id"]] = {"estimated_start": start, "estimated_finish": start + seconds,
+                                    "estimated_seconds": seconds}
+            heapq.heappush(free_at, start + seconds)
+        return estimates
+
+    def count_by_status(self) -> dict:
+        rows = self._connect().execute("SELECT status, COUNT(*) AS n FROM projects GROUP BY status").fetchall()
+        return {row["status"]: row["n"] for row in rows}
+
+    # ---- Change feed ----
+
+    def current_version(self) -> int:
+        return self._connect().execute("SELECT value FROM meta WHERE name = 'version'").fetchone()["value"]
+
+    def changes_since(self, version: int):
+        """
+        Project thay đổi và id project bị xóa sau version (dùng index version).
+        Trả về (projects, deleted_ids, version mới nhất đã thấy).
+        """
+        conn = self._connect()
+        rows = conn.execute(
+            "SELECT status, priority, data, version FROM projects WHERE version > ? ORDER BY version", (version,)
+        ).fetchall()
+        deleted = conn.execute(
+            "SELECT id, version FROM deleted_projects WHERE version > ? ORDER BY version", (version,)
+        ).fetchall()
+        latest = max([version] + [row["version"] for row in rows] + [row["version"] for row in deleted])
+        return [self._row_to_project(row) for row in rows], [row["id"] for row in deleted], latest
+
+    def wait_for_change(self, version: int, timeout: float) -> int:
+        """Chờ tới khi store có version mới hơn version hoặc hết timeout. Trả về version hiện tại"""
+        deadline = time.monotonic() + timeout
+        with self._changed:
+            if self._watch_thread is None or not self._watch_thread.is_alive():
+                self._watch_thread = threading.Thread(target=self._watch_changes_loop, name="job-changes", daemon=True)
+                self._watch_thread.start()
+            self._waiters += 1
+            self._changed.notify_all()
+            try:
+                while self._version <= version:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._changed.wait(remaining)
+            finally:
+                self._waiters -= 1
+            return self._version
+
+    def _watch_changes_loop(self) -> None:
+        """Poll version khi có client chờ; không có ai chờ thì ngủ trên condition, không query"""
+        while True:
+            with self._changed:
+                while self._waiters == 0:
+                    self._changed.wait()
+            try:
+                version = self.current_version()
+            except sqlite3.Error as e:
+                print(f"⚠️ Could not read job store version: {e}")
+                version = None
+            if version is not None:
+                with self._changed:
+                    if version != self._version:
+                        self._version = version
+                        self._changed.notify_all()
+            time.sleep(CHANGE_POLL_SEC)
+
+    # ---- Ghi từ web tier ----
+
+    def put(self, project: dict, config=None) -> None:
+        """
+        Ghi đè toàn bộ project (tạo mới, restart, stop...). Lần chạy đang giữ run_id cũ sẽ không ghi được nữa
+        (và bị hủy); lease của runner cũ được giữ tới khi nó thoát để project không bị chạy hai nơi.
+        config: config cho lần chạy tới; None thì giữ config đã lưu.
+        """
+        with self._transaction() as conn:
+            self._put(conn, project, config, time.time())
+            self._update_queue_keys(conn, "id = ?", (project["id"],))
+
+    @staticmethod
+    def _put(conn, project: dict, config, now: float, batch_id=None) -> None:
+        queued_at = now if project["status"] == "queued" else None
+        conn.execute(
+            "INSERT INTO projects (id, status, priority, created_at, queued_at, updated_at, owner, run_id, batch_id, "
+            "duration, config, data) VALUES (?, ?, ?, ?, ?, ?, NULL, NULL, ?, ?, ?, ?) "
+            "ON CONFLICT(id) DO UPDATE SET status = excluded.status, priority = excluded.priority, "
+            "queued_at = excluded.queued_at, updated_at = excluded.updated_at, run_id = NULL, needs = NULL, "
+            "batch_id = COALESCE(excluded.batch_id, projects.batch_id), "
+            "duration = COALESCE(excluded.duration, projects.duration), "
+            "config = COALESCE(excluded.config, projects.config), data = excluded.data",
+            (project["id"], project["status"], int(project.get("priority", 0)), project.get("created_at", ""),
+             queued_at, now, batch_id, project.get("duration"), json.dumps(config) if config is not None else None,
+             json.dumps(project)),
+        )
+
+    def put_batch(self, batch: dict, projects: list, config=None) -> None:
+        """Tạo batch và toàn bộ project của nó trong một transaction; các project dùng chung config của batch"""
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO batches (id, name, created_at, config) VALUES (?, ?, ?, ?)",
+                (batch["id"], batch.get("name", ""), batch["created_at"], json.dumps(config) if config is not None else None),
+            )
+            for project in projects:
+                self._put(conn, project, None, now, batch_id=batch["id"])
+            self._update_queue_keys(conn, "batch_id = ?", (batch["id"],))
+
+    def set_duration(self, project_id: str, duration: float) -> bool:
+        """Ghi thời lượng đã probe (cột dùng để xếp lịch + field duration trong data cho UI)"""
+        with self._transaction() as conn:
+            updated = conn.execute(
+                "UPDATE projects SET duration = ?, data = json_set(data, '$.duration', ?) WHERE id = ?",
+                (duration, duration, project_id),
+            ).rowcount > 0
+            self._update_queue_keys(conn, "id = ?", (project_id,))
+            return updated
+
+    def update_status(self, project_id: str, status: str, expected=None, **fields) -> bool:
+        """
+        Đổi status (và các field trong data) nếu status hiện tại nằm trong expected (None = bất kỳ).
+        Trả về False nếu project không tồn tại hoặc status đã đổi.
+        """
+        with self._transaction() as conn:
+            row = conn.execute("SELECT status, data FROM projects WHERE id = ?", (project_id,)).fetchone()
+            if row is None:
+                return False
+            if expected is not None:
+                statuses = (expected,) if isinstance(expected, str) else tuple(expected)
+                if row["status"] not in statuses:
+                    return False
+            data = json.loads(row["data"])
+            data.update(fields)
+            data["status"] = status
+            conn.execute(
+                "UPDATE projects SET status = ?, updated_at = ?, data = ?, "
+                "queued_at = CASE WHEN ? = 'queued' THEN ? ELSE queued_at END, "
+                "run_id = CASE WHEN ? = 'running' THEN run_id ELSE NULL END WHERE id = ?",
+                (status, time.time(), json.dumps(data), status, time.time(), status, project_id),
+            )
+            self._update_queue_keys(conn, "id = ?", (project_id,))
+            return True
+
+    def delete(self, project_id: str) -> bool:
+        with self._transaction() as conn:
+            return conn.execute("DELETE FROM projects WHERE id = ?", (project_id,)).rowcount > 0
+
+    # ---- Ghi từ runner ----
+
+    def claim(self, project_id: str, owner=None):
+        """
+        queued -> running cho đúng một process. Trả về run_id, None nếu project đã được lấy / đổi trạng thái
+        hoặc runner của lần chạy trước vẫn chưa thoát.
+        """
+        run_id = uuid.uuid4().hex
+        now = time.time()
+        with self._transaction() as conn:
+            updated = conn.execute(
+                "UPDATE projects SET status = 'running', owner = ?, run_id = ?, active_run = ?, lease_expires_at = ?, "
+                "needs = NULL, updated_at = ? WHERE id = ? AND status = 'queued' "
+                "AND (active_run IS NULL OR lease_expires_at < ?)",
+                (owner or process_owner(), run_id, run_id, now + JOB_LEASE_SEC, now, project_id, now),
+            ).rowcount
+        return run_id if updated else None
+
+    def claim_next(self, owner=None, capabilities=None):
+        """
+        Lấy project đầu hàng đợi (queued -> running) mà worker chạy được.
+        capabilities: resource class worker nhận (None = mọi class); project có needs không nằm trong đó bị bỏ qua.
+        Lease hết hạn được thu hồi trước khi chọn. Trả về (project_id, run_id), None nếu không có project phù hợp.
+        """
+        run_id = uuid.uuid4().hex
+        now = time.time()
+        with self._transaction() as conn:
+            self._reclaim_expired(conn, now)
+            # Worker nhận mọi class thì lấy đúng project đầu hàng; không thì duyệt index tới project đầu tiên phù hợp
+            rows = self._queued_rows(conn, now, limit=1 if capabilities is None else None)
+            project_id = None
+            for row in rows:
+                needs = set(filter(None, (row["needs"] or "").split(",")))
+                if capabilities is None or needs <= set(capabilities):
+                    project_id = row["id"]
+                    break
+            if project_id is None:
+                return None
+            conn.execute(
+                "UPDATE projects SET status = 'running', owner = ?, run_id = ?, active_run = ?, lease_expires_at = ?, "
+                "needs = NULL, updated_at = ? WHERE id = ?",
+                (owner or process_owner(), run_id, run_id, now + JOB_LEASE_SEC, now, project_id),
+            )
+        return project_id, run_id
+
+    def _reclaim_expired(self, conn, now) -> list:
+        rows = conn.execute(
+            "SELECT id, owner FROM projects WHERE status = 'running' AND lease_expires_at < ?", (now,)
+        ).fetchall()
+        for row in rows:
+            conn.execute(
+                "UPDATE projects SET status = 'queued', owner = NULL, run_id = NULL, active_run = NULL, "
+                "lease_expires_at = NULL, updated_at = ? WHERE id = ?",
+                (now, row["id"]),
+            )
+            print(f"🔄 Job store: lease of {row['owner']} on project {row['id']} expired, re-queued")
+        # Runner đã bị stop / restart nhưng chết trước khi kịp nhả lease
+        conn.execute(
+            "UPDATE projects SET owner = NULL, active_run = NULL, lease_expires_at = NULL "
+            "WHERE active_run IS NOT NULL AND lease_expires_at < ?",
+            (now,),
+        )
+        if rows:
+            self._update_queue_keys(conn, f"id IN ({', '.join('?' * len(rows))})", [row["id"] for row in rows])
+        return [row["id"] for row in rows]
+
+    def reclaim_expired(self) -> list:
+        """Đưa lại vào hàng đợi các lần chạy có lease hết hạn. Trả về id các project bị thu hồi"""
+        with self._transaction() as conn:
+            return self._reclaim_expired(conn, time.time())
+
+    def renew_lease(self, project_id: str, run_id: str) -> bool:
+        """
+        Gia hạn lease của runner run_id (kể cả khi lần chạy đã bị stop và runner đang dừng lại).
+        False nếu lease đã bị thu hồi (hết hạn, project bị xóa).
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            return conn.execute(
+                "UPDATE projects SET lease_expires_at = ? WHERE id = ? AND active_run = ?",
+                (now + JOB_LEASE_SEC, project_id, run_id),
+            ).rowcount > 0
+
+    def release(self, project_id: str, run_id: str) -> bool:
+        """Runner run_id đã thoát: project được claim lại ngay"""
+        with self._transaction() as conn:
+            return conn.execute(
+                "UPDATE projects SET owner = NULL, active_run = NULL, lease_expires_at = NULL "
+                "WHERE id = ? AND active_run = ?",
+                (project_id, run_id),
+            ).rowcount > 0
+
+    @contextlib.contextmanager
+    def hold_lease(self, project_id: str, run_id: str, on_lost=None):
+        """
+        with store.hold_lease(id, run_id, on_lost=token.cancel): ...
+        Gia hạn lease trong nền cho tới khi ra khỏi block rồi nhả lease. on_lost() được gọi (một lần) ngay khi
+        lần chạy không còn hiện hành (stop / restart / xóa / timeout / lease bị thu hồi), phát hiện qua change feed.
+        """
+        with self._lease_lock:
+            self._leases[run_id] = (project_id, on_lost)
+            if self._lease_thread is None or not self._lease_thread.is_alive():
+                self._lease_thread = threading.Thread(target=self._watch_leases_loop, name="job-leases", daemon=True)
+                self._lease_thread.start()
+        try:
+            yield
+        finally:
+            with self._lease_lock:
+                self._leases.pop(run_id, None)
+            self.release(project_id, run_id)
+
+    def _watch_leases_loop(self) -> None:
+        """Thức dậy khi store đổi version (kiểm tra lần chạy còn hiện hành) hoặc tới hạn gia hạn lease"""
+        version = self.current_version()
+        next_renew = time.monotonic() + JOB_LEASE_SEC / 3
+        lost = set()
+        while True:
+            with self._lease_lock:
+                if not self._leases:
+                    self._lease_thread = None
+                    return
+                held = list(self._leases.items())
+            renew = time.monotonic() >= next_renew
+            if renew:
+                next_renew = time.monotonic() + JOB_LEASE_SEC / 3
+            for run_id, (project_id, on_lost) in held:
+                try:
+                    if renew and not self.renew_lease(project_id, run_id):
+                        print(f"⚠️ Lost lease on project {project_id}")
+                    if run_id not in lost and not self.is_current_run(project_id, run_id):
+                        lost.add(run_id)
+                        print(f"🛑 Run {run_id[:8]} of project {project_id} is no longer current, cancelling")
+                        if on_lost is not None:
+                            on_lost()
+                except sqlite3.Error as e:
+                    print(f"⚠️ Could not check lease on project {project_id}: {e}")
+            version = self.wait_for_change(version, max(0.0, next_renew - time.monotonic()))
+
+    def save_run(self, project: dict, run_id: str) -> bool:
+        """Lưu tiến độ (steps, progress...) của lần chạy run_id; bỏ qua nếu lần chạy đã bị thay thế / dừng"""
+        with self._transaction() as conn:
+            return conn.execute(
+                "UPDATE projects SET data = ?, updated_at = ? WHERE id = ? AND run_id = ? AND status = 'running'",
+                (json.dumps(project), time.time(), project["id"], run_id),
+            ).rowcount > 0
+
+    def requeue(self, project_id: str) -> bool:
+        """
+        running -> queued khi process chạy nó dừng (worker shutdown / deploy): runner nhả lease khi thoát.
+        Giữ nguyên queued_at như handoff, project bị gián đoạn không bị xếp xuống cuối hàng.
+        """
+        with self._transaction() as conn:
+            updated = conn.execute(
+                "UPDATE projects SET status = 'queued', run_id = NULL, updated_at = ?, "
+                "data = json_set(data, '$.status', 'queued') WHERE id = ? AND status = 'running'",
+                (time.time(), project_id),
+            ).rowcount > 0
+            self._update_queue_keys(conn, "id = ?", (project_id,))
+            return updated
+
+    def handoff(self, project: dict, run_id: str, needs) -> bool:
+        """
+        Trả project về hàng đợi vì stage tiếp theo cần resource class mà worker này không có (stage affinity).
+        Giữ nguyên queued_at để project không bị xếp xuống cuối hàng.
+        """
+        with self._transaction() as conn:
+            updated = conn.execute(
+                "UPDATE projects SET status = 'queued', run_id = NULL, needs = ?, "
+                "data = ?, updated_at = ? WHERE id = ? AND run_id = ? AND status = 'running'",
+                (",".join(sorted(needs)), json.dumps(project), time.time(), project["id"], run_id),
+            ).rowcount > 0
+            self._update_queue_keys(conn, "id = ?", (project["id"],))
+            return updated
+
+    def finish_run(self, project: dict, run_id: str) -> bool:
+        """Ghi trạng thái cuối (completed/error) của lần chạy run_id nếu nó vẫn là lần chạy hiện hành"""
+        with self._transaction() as conn:
+            return conn.execute(
+                "UPDATE projects SET status = ?, data = ?, updated_at = ?, run_id = NULL "
+                "WHERE id = ? AND run_id = ? AND status = 'running'",
+                (project["status"], json.dumps(project), time.time(), project["id"], run_id),
+            ).rowcount > 0
+
+    # ---- Worker process ----
+
+    def heartbeat_worker(self, worker_id: str, slots: int, capabilities=None) -> None:
+        now = time.time()
+        capabilities = ",".join(sorted(capabilities)) if capabilities is not None else None
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO workers (id, slots, capabilities, started_at, heartbeat_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET slots = excluded.slots, capabilities = excluded.capabilities, "
+                "heartbeat_at = excluded.heartbeat_at",
+                (worker_id, slots, capabilities, now, now),
+            )
+
+    def remove_worker(self, worker_id: str) -> None:
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM workers WHERE id = ?", (worker_id,))
+
+    def live_workers(self, max_age: float = WORKER_STALE_SEC) -> list:
+        rows = self._connect().execute(
+            "SELECT id, slots, capabilities, started_at, heartbeat_at FROM workers WHERE heartbeat_at >= ? ORDER BY id",
+            (time.time() - max_age,),
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    # ---- Khởi động ----
+
+    def reconcile(self, projects_dir, new_project) -> list:
+        """
+        Đồng bộ store với thư mục projects/ khi khởi động:
+        - row không còn thư mục -> xóa
+        - thư mục chưa có row -> tạo project bằng new_project(project_id, project_dir)
+        - project 'running'/'starting' mà process chạy nó đã chết hoặc lease đã hết hạn -> đưa lại vào hàng đợi
+          (stage graph sẽ tiếp tục từ artifact hợp lệ cuối cùng)
+        Trả về id các project đang 'queued'.
+        """
+        projects_dir = Path(projects_dir)
+        directories = {path.name: path for path in projects_dir.iterdir() if path.is_dir()} if projects_dir.exists() else {}
+        with self._transaction() as conn:
+            self._reclaim_expired(conn, time.time())
+            rows = conn.execute("SELECT id, status, owner, active_run FROM projects").fetchall()
+            known = set()
+            for row in rows:
+                known.add(row["id"])
+                if row["id"] not in directories:
+                    conn.execute("DELETE FROM projects WHERE id = ?", (row["id"],))
+                    print(f"🗑️ Job store: dropped {row['id']} (project folder missing)")
+                elif row["status"] in RESUMABLE_STATUSES and not _owner_alive(row["owner"]):
+                    conn.execute(
+                        "UPDATE projects SET status = 'queued', owner = NULL, run_id = NULL, active_run = NULL, "
+                        "lease_expires_at = NULL, queued_at = ?, updated_at = ? WHERE id = ?",
+                        (time.time(), time.time(), row["id"]),
+                    )
+                    self._update_queue_keys(conn, "id = ?", (row["id"],))
+                    print(f"🔄 Job store: re-queued interrupted project {row['id']}")
+                elif row["active_run"] and not _owner_alive(row["owner"]):
+                    # Runner đã bị stop / restart nhưng process của nó chết trước khi nhả lease
+                    conn.execute(
+                        "UPDATE projects SET owner = NULL, active_run = NULL, lease_expires_at = NULL WHERE id = ?",
+                        (row["id"],),
+                    )
+        for project_id, project_dir in directories.items():
+            if project_id in known:
+                continue
+            project = new_project(project_id, project_dir)
+            if project is not None:
+                self.put(project)
+                print(f"📂 Job store: recovered project {project_id} ({project['status']})")
+        return self.queued_ids()
+
+
+class _Transaction:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
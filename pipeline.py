@@ -1,15 +1,27 @@
 import argparse
+import bisect
+import contextlib
+import copy
+import heapq
 import io
+import itertools
+import math
 import os
+import queue
 import re
 import shutil
 import subprocess
+import threading
 import time
 import sys
 from pathlib import Path
 from typing import List, Optional, Callable, Iterator
 
-import srt
+try:
+	import fcntl
+except ImportError:  # Windows: ResourcePool chỉ giới hạn trong process
+	fcntl = None
+
 from tqdm import tqdm
 from dotenv import load_dotenv
 from pydub import AudioSegment
@@ -21,7 +33,7 @@ import requests
 def _has_audio_stream(video_path: Path) -> bool:
 	"""Check if video file has audio stream"""
 	probe_cmd = ["ffprobe", "-v", "quiet", "-print_format", "json", "-show_streams", str(video_path)]
-	result = subprocess.run(probe_cmd, capture_output=True, text=True)
+	result = run_process(probe_cmd, capture_output=True, text=True)
 	
 	if result.returncode == 0:
 		try:
@@ -33,10 +45,216 @@ def _has_audio_stream(video_path: Path) -> bool:
 	return False
 
 
+# -------------------- Cancellation --------------------
+
+class Cancelled(BaseException):
+	"""
+	Job bị hủy (stop / restart / xóa / timeout) giữa chừng.
+	Kế thừa BaseException để các khối retry `except Exception` không nuốt mất nó.
+	"""
+
+
+class CancelToken:
+	"""
+	Token hủy của một lần chạy. cancel() có hiệu lực ngay với công việc đang dở:
+	- process con đăng ký qua run_process / run_command bị terminate (kill nếu không thoát)
+	- HTTP call qua http_request trả về ngay bằng Cancelled (response đến sau bị bỏ)
+	- cancel_sleep / check_cancelled trong vòng retry, poll, TTS raise Cancelled
+	Các hàm trên dùng token của thread hiện tại (cancel_scope), nên không phải truyền qua mọi hàm.
+	"""
+
+	KILL_GRACE_SEC = 5
+
+	def __init__(self):
+		self._event = threading.Event()
+		self._lock = threading.Lock()
+		self._processes = set()
+		self._waiters = set()
+		self._callbacks = set()
+
+	@property
+	def cancelled(self) -> bool:
+		return self._event.is_set()
+
+	def cancel(self) -> None:
+		with self._lock:
+			if self._event.is_set():
+				return
+			self._event.set()
+			processes = list(self._processes)
+			waiters = list(self._waiters)
+			callbacks = list(self._callbacks)
+		for callback in callbacks:
+			try:
+				callback()
+			except Exception as e:
+				print(f"⚠️ Cancel callback failed: {e}")
+		for waiter in waiters:
+			waiter.set()
+		for process in processes:
+			self._terminate(process)
+
+	def _terminate(self, process: subprocess.Popen) -> None:
+		if process.poll() is not None:
+			return
+		process.terminate()
+
+		def kill_after_grace() -> None:
+			try:
+				process.wait(self.KILL_GRACE_SEC)
+			except subprocess.TimeoutExpired:
+				process.kill()
+
+		threading.Thread(target=kill_after_grace, daemon=True).start()
+
+	def check(self) -> None:
+		if self._event.is_set():
+			raise Cancelled()
+
+	def sleep(self, seconds: float) -> None:
+		if self._event.wait(seconds):
+			raise Cancelled()
+
+	@contextlib.contextmanager
+	def process(self, process: subprocess.Popen):
+		"""Đăng ký process con: bị terminate khi token bị hủy"""
+		with self._lock:
+			self._processes.add(process)
+			cancelled = self._event.is_set()
+		if cancelled:
+			self._terminate(process)
+		try:
+			yield process
+		finally:
+			with self._lock:
+				self._processes.discard(process)
+
+	@contextlib.contextmanager
+	def on_cancel(self, callback: Callable[[], None]):
+		"""Gọi callback khi token bị hủy trong khối with (vd đóng session HTTP đang dùng)"""
+		with self._lock:
+			self._callbacks.add(callback)
+			cancelled = self._event.is_set()
+		if cancelled:
+			callback()
+		try:
+			yield
+		finally:
+			with self._lock:
+				self._callbacks.discard(callback)
+
+	def call(self, func: Callable, *args, **kwargs):
+		"""
+		Chạy func (blocking I/O) trong thread phụ; token bị hủy thì raise Cancelled ngay, không chờ func.
+		Thread phụ không bị dừng: func phải tự dừng khi bị hủy (xem on_cancel, http_request).
+		"""
+		self.check()
+		done = threading.Event()
+		outcome = {}
+
+		def target() -> None:
+			try:
+				outcome["result"] = func(*args, **kwargs)
+			except BaseException as e:
+				outcome["error"] = e
+			finally:
+				done.set()
+
+		with self._lock:
+			self._waiters.add(done)
+		try:
+			threading.Thread(target=target, daemon=True).start()
+			done.wait()
+		finally:
+			with self._lock:
+				self._waiters.discard(done)
+		if "error" in outcome:
+			raise outcome["error"]
+		if "result" not in outcome:
+			raise Cancelled()
+		return outcome["result"]
+
+
+_cancel_local = threading.local()
+
+
+def current_cancel_token() -> Optional[CancelToken]:
+	return getattr(_cancel_local, "token", None)
+
+
+@contextlib.contextmanager
+def cancel_scope(token: Optional[CancelToken]):
+	"""Gắn token cho thread hiện tại (mỗi stage thread / thread phụ của stage phải tự gắn)"""
+	previous = current_cancel_token()
+	_cancel_local.token = token
+	try:
+		yield token
+	finally:
+		_cancel_local.token = previous
+
+
+def check_cancelled() -> None:
+	token = current_cancel_token()
+	if token is not None:
+		token.check()
+
+
+def cancel_sleep(seconds: float) -> None:
+	"""time.sleep dừng ngay (raise Cancelled) khi job bị hủy"""
+	token = current_cancel_token()
+	if token is None:
+		time.sleep(seconds)
+	else:
+		token.sleep(seconds)
+
+
+def http_request(method: str, url: str, **kwargs) -> requests.Response:
+	"""
+	requests.request bỏ chờ ngay khi job bị hủy (không đợi hết timeout của request).
+	Request chạy trên session riêng, bị đóng khi hủy; body dạng generator (vd _file_chunks) nên tự check token
+	để upload dừng gửi ở chunk kế tiếp.
+	"""
+	token = current_cancel_token()
+	if token is None:
+		return requests.request(method, url, **kwargs)
+	session = requests.Session()
+
+	def send() -> requests.Response:
+		with session:
+			return session.request(method, url, **kwargs)
+
+	with token.on_cancel(session.close):
+		return token.call(send)
+
+
+def run_process(command_args: List[str], cwd: Optional[Path] = None, capture_output: bool = False,
+                text: bool = False, timeout: Optional[float] = None) -> subprocess.CompletedProcess:
+	"""subprocess.run có thể hủy: process con bị terminate khi job bị hủy"""
+	token = current_cancel_token()
+	if token is not None:
+		token.check()
+	pipe = subprocess.PIPE if capture_output else None
+	process = subprocess.Popen(command_args, cwd=str(cwd) if cwd else None, stdout=pipe, stderr=pipe, text=text)
+	with (token.process(process) if token is not None else contextlib.nullcontext(process)):
+		try:
+			stdout, stderr = process.communicate(timeout=timeout)
+		except subprocess.TimeoutExpired:
+			process.kill()
+			process.communicate()
+			raise
+		except BaseException:
+			process.kill()
+			process.wait()
+			raise
+	if token is not None:
+		token.check()
+	return subprocess.CompletedProcess(command_args, process.returncode, stdout, stderr)
+
+
 # -------------------- Utilities --------------------
 
 def run_command(command_args: List[str], cwd: Optional[Path] = None) -> None:
-	result = subprocess.run(command_args, cwd=str(cwd) if cwd else None)
+	result = run_process(command_args, cwd=cwd)
 	if result.returncode != 0:
 		raise RuntimeError(f"Command failed: {' '.join(command_args)}")
 
@@ -56,53 +274,1384 @@ def _notify(cb: Optional[Callable[[str], None]], stage: str) -> None:
 			pass
 
 
-def download_with_ytdlp(url: str, output_path: Path) -> None:
-	cli = shutil.which("yt-dlp")
-	
-	# Common yt-dlp options to handle various issues
-	base_options = [
-		"--merge-output-format", "mp4",
-		"--no-check-certificates",  # Skip SSL certificate verification
-		"--user-agent", "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
-		"--extractor-args", "youtube:player_client=android",  # Use Android client
-		"-o", str(output_path)
-	]
-	
+YTDLP_USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+# Chọn format một lần trước khi tải: ưu tiên mp4+m4a (merge không cần re-encode), rồi tới file đơn <=720p
+YTDLP_FORMAT = "bv*[ext=mp4]+ba[ext=m4a]/b[ext=mp4]/bv*+ba/best[height<=720]/b"
+YTDLP_DOWNLOAD_ATTEMPTS = 3
+
+
+def _ytdlp_options(**extra) -> dict:
+	options = {
+		"format": YTDLP_FORMAT,
+		"merge_output_format": "mp4",
+		"nocheckcertificate": True,  # Skip SSL certificate verification
+		"http_headers": {"User-Agent": YTDLP_USER_AGENT},
+		"extractor_args": {"youtube": {"player_client": ["android"]}},  # Use Android client
+		"noplaylist": True,
+		"quiet": True,
+		"no_warnings": True,
+		"noprogress": True,
+	}
+	options.update(extra)
+	return options
+
+
+# URL stream trong metadata yt-dlp là URL đã ký, hết hạn sau vài giờ: info cũ hơn thì extract lại
+YTDLP_INFO_MAX_AGE_SEC = 1800
+
+
+def extract_video_info(url: str) -> dict:
+	"""
+	Metadata yt-dlp của URL (chưa chọn format, chưa tải), JSON-serializable. Là lần gọi extractor duy nhất:
+	probe thời lượng, cache key và các lần tải (audio / video) dùng lại dict này thay vì extract_info lại.
+	"""
+	import yt_dlp
+
+	with yt_dlp.YoutubeDL(_ytdlp_options()) as ydl:
+		return ydl.sanitize_info(ydl.extract_info(url, download=False, process=False))
+
+
+class _YtdlpProgress:
+	"""Gộp progress byte-level của các stream (video + audio) thành một phần trăm duy nhất"""
+
+	def __init__(self, callback: Optional[Callable[[dict], None]]):
+		self.callback = callback
+		self.streams = {}
+		# Hook được gọi từ thread tải fragment của yt-dlp, không có cancel_scope của stage
+		self.cancel = current_cancel_token()
+
+	def __call__(self, status: dict) -> None:
+		if self.cancel is not None:
+			self.cancel.check()
+		if not self.callback:
+			return
+		filename = status.get("filename") or status.get("tmpfilename") or ""
+		downloaded = status.get("downloaded_bytes") or 0
+		total = status.get("total_bytes") or status.get("total_bytes_estimate") or 0
+		if status.get("status") == "finished":
+			total = total or downloaded
+			downloaded = total
+		self.streams[filename] = (downloaded, total)
+		downloaded_sum = sum(d for d, _ in self.streams.values())
+		total_sum = sum(t for _, t in self.streams.values())
+		try:
+			self.callback({
+				"downloaded_bytes": downloaded_sum,
+				"total_bytes": total_sum,
+				"percent": min(100.0, downloaded_sum * 100.0 / total_sum) if total_sum else 0.0,
+				"speed": status.get("speed"),
+				"eta": status.get("eta"),
+			})
+		except Exception:
+			pass
+
+
+def _ytdlp_download(url: str, outtmpl: str, format_selector: str, progress: Callable[[dict], None],
+                    concurrent_fragments: int = 4, merge: bool = True, info: Optional[dict] = None) -> Path:
+	"""
+	Tải một format selector qua yt-dlp API, retry sẽ tải tiếp file .part. Trả về đường dẫn file đã tải.
+	info: kết quả extract_video_info đã có (không gọi extractor lại); lần retry sau lỗi thì extract lại
+	vì URL stream trong info có thể đã hết hạn.
+	"""
+	import yt_dlp
+
+	options = _ytdlp_options(
+		format=format_selector,
+		outtmpl=outtmpl,
+		concurrent_fragment_downloads=max(1, int(concurrent_fragments)),
+		continuedl=True,
+		retries=10,
+		fragment_retries=10,
+		progress_hooks=[progress],
+	)
+	if not merge:
+		options.pop("merge_output_format")
+
+	result = None
+	reused = info is not None
+	with yt_dlp.YoutubeDL(options) as ydl:
+		if info is None:
+			info = ydl.extract_info(url, download=False, process=False)
+		print(f"📥 Downloading {info.get('id')} format {format_selector}")
+		last_error = None
+		for attempt in range(1, YTDLP_DOWNLOAD_ATTEMPTS + 1):
+			try:
+				if reused and attempt > 1:
+					info = ydl.extract_info(url, download=False, process=False)
+				# process_ie_result chọn format và sửa dict -> mỗi lần dùng một bản sao
+				result = ydl.process_ie_result(copy.deepcopy(info), download=True)
+				last_error = None
+				break
+			except yt_dlp.utils.DownloadError as e:
+				last_error = e
+				print(f"⚠️ Download attempt {attempt}/{YTDLP_DOWNLOAD_ATTEMPTS} failed: {e}")
+				if attempt < YTDLP_DOWNLOAD_ATTEMPTS:
+					print("🔄 Resuming partial download...")
+					cancel_sleep(2 * attempt)
+	if last_error is not None:
+		raise RuntimeError(f"yt-dlp download failed: {last_error}")
+	downloads = (result or {}).get("requested_downloads") or []
+	filepath = downloads[0].get("filepath") if downloads else None
+	return Path(filepath) if filepath else Path(outtmpl)
+
+
+def download_with_ytdlp(url: str, output_path: Path, progress_callback: Optional[Callable[[dict], None]] = None,
+                        concurrent_fragments: int = 4, info: Optional[dict] = None) -> None:
+	"""
+	Tải video bằng yt-dlp Python API (in-process).
+	- Format được chọn một lần lúc extract_info, các lần retry dùng lại đúng format đó
+	- Tải song song nhiều fragment (DASH/HLS)
+	- File .part được giữ lại và tải tiếp khi retry thay vì tải lại từ đầu
+	- progress_callback nhận dict {downloaded_bytes, total_bytes, percent, speed, eta}
+	- info: metadata đã extract (extract_video_info), không gọi extractor lại
+	"""
+	output_path = Path(output_path)
+	output_path.parent.mkdir(parents=True, exist_ok=True)
+	_ytdlp_download(url, str(output_path), YTDLP_FORMAT, _YtdlpProgress(progress_callback), concurrent_fragments,
+	                info=info)
+	if not output_path.exists():
+		raise RuntimeError(f"yt-dlp finished but {output_path} was not created")
+
+
+def import_local_video(source: Path, output_path: Path) -> None:
+	"""Video upload / file local làm input thay cho tải: hard link (file nhiều GB không bị copy), khác filesystem thì copy"""
+	source = Path(source)
+	if not source.is_file():
+		raise FileNotFoundError(f"Uploaded video {source.name} no longer exists")
+	output_path = Path(output_path)
+	output_path.parent.mkdir(parents=True, exist_ok=True)
+	_link_or_copy(source, output_path)
+	print(f"📁 Using uploaded video {source.name}")
+
+
+# -------------------- Download cache --------------------
+
+DOWNLOAD_CACHE_DIR = Path(os.getenv("DOWNLOAD_CACHE_DIR", "cache/downloads"))
+DOWNLOAD_CACHE_MAX_BYTES = int(float(os.getenv("DOWNLOAD_CACHE_MAX_GB", "20")) * 1024 ** 3)
+# Lock file được touch mỗi _FILE_LOCK_REFRESH_SEC giây khi đang giữ; quá _FILE_LOCK_STALE_SEC không được touch
+# thì coi như process giữ khóa đã chết (không phải "giữ quá lâu": tải dài vẫn giữ được khóa)
+_FILE_LOCK_REFRESH_SEC = 20
+_FILE_LOCK_STALE_SEC = 120
+
+_keyed_locks = {}
+_keyed_lock_guard = threading.Lock()
+
+
+def resolve_video_key(url: str, info: Optional[dict] = None) -> Optional[str]:
+	"""
+	Hỏi yt-dlp (không tải) extractor, video ID và format sẽ được chọn cho URL.
+	info: metadata đã extract (extract_video_info), chỉ chạy chọn format trên đó.
+	Trả về key dạng "youtube_<id>_<format>" hoặc None nếu không resolve được.
+	"""
 	try:
-		if cli:
-			# Try with yt-dlp CLI first
-			run_command([cli] + base_options + [url])
-		else:
-			# Fallback to Python module
-			python_exe = sys.executable or "python"
-			run_command([python_exe, "-m", "yt_dlp"] + base_options + [url])
+		import yt_dlp
+		with yt_dlp.YoutubeDL(_ytdlp_options()) as ydl:
+			if info is None:
+				info = ydl.extract_info(url, download=False, process=False)
+			info = ydl.process_ie_result(copy.deepcopy(info), download=False)
 	except Exception as e:
-		# If first attempt fails, try with different format
-		print(f"First download attempt failed: {e}")
-		print("Trying with alternative format...")
-		
-		alt_options = [
-			"--merge-output-format", "mp4",
-			"--format", "best[height<=720]",  # Limit resolution
-			"--no-check-certificates",
-			"--user-agent", "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36",
-			"-o", str(output_path)
-		]
-		
-		if cli:
-			run_command([cli] + alt_options + [url])
+		print(f"⚠️ Could not resolve video ID for cache: {str(e)[:200]}")
+		return None
+	if not info or not info.get("id"):
+		return None
+	parts = [info.get("extractor_key") or "video", info["id"], info.get("format_id") or "best"]
+	return re.sub(r"[^A-Za-z0-9_.+-]", "_", "_".join(parts)).lower()
+
+
+def probe_duration(source: str, info: Optional[dict] = None) -> Optional[float]:
+	"""
+	Thời lượng (giây) của video để xếp lịch, không tải: ffprobe với file local (upload), metadata yt-dlp với URL
+	(info: metadata đã extract). None nếu không xác định được.
+	"""
+	try:
+		if info is None and Path(source).is_file():
+			result = run_process(["ffprobe", "-v", "quiet", "-show_entries", "format=duration", "-of", "csv=p=0", source],
+			                     capture_output=True, text=True, timeout=60)
+			return float(result.stdout.strip()) if result.returncode == 0 and result.stdout.strip() else None
+		if info is None:
+			info = extract_video_info(source)
+	except Exception as e:
+		print(f"⚠️ Could not probe duration of {source}: {str(e)[:200]}")
+		return None
+	duration = (info or {}).get("duration")
+	return float(duration) if duration else None
+
+
+def _link_or_copy(src: Path, dst: Path) -> None:
+	"""Đưa file cache vào project: hard link, nếu không được thì reflink/copy"""
+	if dst.exists() or dst.is_symlink():
+		dst.unlink()
+	try:
+		os.link(src, dst)
+		return
+	except OSError:
+		pass
+	if os.name != "nt" and shutil.which("cp"):
+		# --reflink=auto: copy-on-write trên btrfs/xfs, copy thường ở nơi khác
+		if subprocess.run(["cp", "--reflink=auto", str(src), str(dst)]).returncode == 0:
+			return
+	shutil.copy2(src, dst)
+
+
+class _KeyedFileLock:
+	"""
+	Khóa theo key: threading.Lock trong process + lock file giữa các process (gunicorn workers).
+	Chờ khóa có thể bị hủy (cancel token của thread). refresh: giây giữa hai lần touch lock file khi đang giữ,
+	để stale_after ngắn được (process giữ khóa chết thì khóa được gỡ sớm) mà không cướp khóa của job dài.
+	Lock file chứa token của người giữ: khóa đã bị gỡ vì stale (process bị treo) thì không touch / xóa khóa mới.
+	"""
+
+	def __init__(self, lock_path: Path, key: str, stale_after: float = _FILE_LOCK_STALE_SEC,
+	             refresh: Optional[float] = _FILE_LOCK_REFRESH_SEC):
+		self.lock_path = lock_path
+		self.stale_after = stale_after
+		self.refresh = refresh
+		self._released = None
+		self._token = None
+		with _keyed_lock_guard:
+			self.thread_lock = _keyed_locks.setdefault(key, threading.Lock())
+
+	def locked(self) -> bool:
+		"""Khóa đang bị giữ (trong process này hoặc process khác)"""
+		return self.thread_lock.locked() or self.lock_path.exists()
+
+	def __enter__(self):
+		while not self.thread_lock.acquire(timeout=1):
+			check_cancelled()
+		try:
+			while True:
+				try:
+					fd = os.open(str(self.lock_path), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+					self._token = f"{os.getpid()} {threading.get_ident()} {time.time_ns()}".encode()
+					os.write(fd, self._token)
+					os.close(fd)
+					if self.refresh:
+						self._released = threading.Event()
+						threading.Thread(target=self._keep_alive, args=(self._released,), daemon=True).start()
+					return self
+				except FileExistsError:
+					try:
+						if time.time() - self.lock_path.stat().st_mtime > self.stale_after:
+							print(f"⚠️ Removing stale lock {self.lock_path.name}")
+							self.lock_path.unlink()
+							continue
+					except FileNotFoundError:
+						continue
+					cancel_sleep(1)
+		except BaseException:
+			self.thread_lock.release()
+			raise
+
+	def _owned(self) -> bool:
+		try:
+			return self.lock_path.read_bytes() == self._token
+		except FileNotFoundError:
+			return False
+
+	def _keep_alive(self, released: threading.Event) -> None:
+		while not released.wait(self.refresh):
+			if not self._owned():
+				print(f"⚠️ Lost lock {self.lock_path.name} (removed as stale)")
+				return
+			try:
+				os.utime(self.lock_path, None)
+			except FileNotFoundError:
+				return
+
+	def __exit__(self, *exc):
+		if self._released is not None:
+			self._released.set()
+			self._released = None
+		try:
+			if self._owned():
+				self.lock_path.unlink()
+		except FileNotFoundError:
+			pass
+		finally:
+			self.thread_lock.release()
+
+
+def evict_download_cache(cache_dir: Path = DOWNLOAD_CACHE_DIR, max_bytes: int = DOWNLOAD_CACHE_MAX_BYTES) -> None:
+	"""Xóa file ít được dùng nhất (theo mtime) cho tới khi tổng dung lượng cache <= max_bytes"""
+	if not cache_dir.exists():
+		return
+	entries = []
+	for path in cache_dir.glob("*.mp4"):
+		if ".tmp." in path.name:
+			continue  # file đang tải dở
+		try:
+			stat = path.stat()
+		except FileNotFoundError:
+			continue
+		entries.append((stat.st_mtime, stat.st_size, path))
+	total = sum(size for _, size, _ in entries)
+	for _, size, path in sorted(entries):
+		if total <= max_bytes:
+			break
+		if path.with_suffix(".lock").exists():
+			continue
+		try:
+			path.unlink()
+			total -= size
+			print(f"🗑️ Evicted {path.name} from download cache")
+		except OSError as e:
+			print(f"⚠️ Could not evict {path.name}: {e}")
+
+
+def download_with_cache(url: str, output_path: Path, cache_dir: Path = DOWNLOAD_CACHE_DIR,
+                        max_bytes: int = DOWNLOAD_CACHE_MAX_BYTES,
+                        progress_callback: Optional[Callable[[dict], None]] = None,
+                        concurrent_fragments: int = 4, info: Optional[dict] = None) -> bool:
+	"""
+	Tải video qua cache dùng chung: cùng (extractor, video ID, format) chỉ tải một lần,
+	các project sau nhận file bằng hard link/reflink. Trả về True nếu cache hit.
+	info: metadata đã extract, dùng chung cho cache key và lần tải.
+	"""
+	if info is None:
+		try:
+			info = extract_video_info(url)
+		except Exception as e:
+			print(f"⚠️ Could not extract video info: {str(e)[:200]}")
+	key = resolve_video_key(url, info) if info is not None else None
+	if not key:
+		# Không resolve được ID -> tải thẳng như cũ
+		download_with_ytdlp(url, output_path, progress_callback, concurrent_fragments, info=info)
+		return False
+
+	cache_dir.mkdir(parents=True, exist_ok=True)
+	cached = cache_dir / f"{key}.mp4"
+	with _KeyedFileLock(cache_dir / f"{key}.lock", key):
+		hit = cached.exists() and cached.stat().st_size > 0
+		if hit:
+			print(f"♻️ Download cache hit: {key}")
+			if progress_callback:
+				size = cached.stat().st_size
+				progress_callback({"downloaded_bytes": size, "total_bytes": size, "percent": 100.0, "speed": None, "eta": 0})
 		else:
-			python_exe = sys.executable or "python"
-			run_command([python_exe, "-m", "yt_dlp"] + alt_options + [url])
+			print(f"📥 Download cache miss: {key}")
+			# Tên tạm cố định theo key nên file .part của lần trước bị gián đoạn sẽ được tải tiếp
+			tmp_path = cache_dir / f"{key}.tmp.mp4"
+			download_with_ytdlp(url, tmp_path, progress_callback, concurrent_fragments, info=info)
+			os.replace(tmp_path, cached)
+		# Cập nhật mtime để LRU biết file vừa được dùng
+		os.utime(cached, None)
+		_link_or_copy(cached, output_path)
+
+	evict_download_cache(cache_dir, max_bytes)
+	return hit
+
+
+# -------------------- Audio-first download --------------------
+
+YTDLP_AUDIO_FORMAT = "ba[ext=m4a]/ba/b"
+YTDLP_VIDEO_ONLY_FORMAT = "bv*[ext=mp4]/bv*/b"
+
+
+class AudioFirstDownload:
+	"""
+	Tải audio-only trước để STT chạy ngay, video-only tải song song trong thread riêng
+	và được merge với audio đã có khi gọi wait().
+
+	    downloader = AudioFirstDownload(url, workdir / "input.mp4")
+	    audio_path = downloader.start()   # trả về khi audio xong
+	    ...                                # STT / dịch trên audio_path
+	    downloader.wait()                 # video xong + merge -> input.mp4
+
+	info: metadata đã extract (extract_video_info); không có thì start() extract một lần cho cả cache key,
+	audio và video.
+	"""
+
+	def __init__(self, url: str, output_path: Path, progress_callback: Optional[Callable[[dict], None]] = None,
+	             concurrent_fragments: int = 4, cache_dir: Optional[Path] = None,
+	             max_bytes: int = DOWNLOAD_CACHE_MAX_BYTES, info: Optional[dict] = None):
+		self.url = url
+		self.info = info
+		self.output_path = Path(output_path)
+		self.concurrent_fragments = concurrent_fragments
+		self.cache_dir = Path(cache_dir) if cache_dir else None
+		self.max_bytes = max_bytes
+		# Một progress chung: phần trăm tính trên tổng byte của cả audio lẫn video
+		self.progress = _YtdlpProgress(progress_callback)
+		self.progress_callback = progress_callback
+		self.cache_key = None
+		self.audio_path = None
+		self._video_path = None
+		self._video_error = None
+		self._thread = None
+
+	def start(self) -> Path:
+		"""Bắt đầu tải video ở background, tải audio (blocking) và trả về file dùng cho STT"""
+		self.output_path.parent.mkdir(parents=True, exist_ok=True)
+		if self.info is None:
+			self.info = extract_video_info(self.url)
+		if self.cache_dir is not None:
+			self.cache_key = resolve_video_key(self.url, self.info)
+			cached = self.cache_dir / f"{self.cache_key}.mp4" if self.cache_key else None
+			if cached is not None and cached.exists() and cached.stat().st_size > 0:
+				# Video đã có trong cache -> không cần tách audio
+				download_with_cache(self.url, self.output_path, self.cache_dir, self.max_bytes,
+				                    self.progress_callback, self.concurrent_fragments, info=self.info)
+				self.audio_path = self.output_path
+				return self.audio_path
+
+		# Token riêng của lần tải video (con của token job): audio lỗi thì dừng được video mà không hủy cả job
+		video_cancel = CancelToken()
+		self._thread = threading.Thread(target=self._download_video, args=(video_cancel,), daemon=True)
+		self._thread.start()
+
+		stem = self.output_path.with_suffix("")
+		try:
+			self.audio_path = _ytdlp_download(self.url, f"{stem}_audio.%(ext)s", YTDLP_AUDIO_FORMAT,
+			                                  self.progress, self.concurrent_fragments, merge=False, info=self.info)
+		except BaseException:
+			# Không để thread video tải tiếp khi không còn ai gọi wait()
+			video_cancel.cancel()
+			self._thread.join()
+			self._thread = None
+			raise
+		print(f"🎧 Audio stream ready: {self.audio_path.name}")
+		return self.audio_path
+
+	def _download_video(self, video_cancel: CancelToken) -> None:
+		stem = self.output_path.with_suffix("")
+
+		def progress(status: dict) -> None:
+			video_cancel.check()
+			self.progress(status)
+
+		job_cancel = self.progress.cancel
+		try:
+			with (job_cancel.on_cancel(video_cancel.cancel) if job_cancel is not None else contextlib.nullcontext()), \
+					cancel_scope(video_cancel):
+				self._video_path = _ytdlp_download(self.url, f"{stem}_video.%(ext)s", YTDLP_VIDEO_ONLY_FORMAT,
+				                                   progress, self.concurrent_fragments, merge=False,
+				                                   info=self.info)
+		except BaseException as e:
+			self._video_error = e
+
+	def wait(self) -> Path:
+		"""Chờ video tải xong, merge với audio thành output_path"""
+		if self._thread is None:
+			if self.audio_path is None:
+				raise RuntimeError("AudioFirstDownload.start() has not been called")
+			return self.output_path
+		self._thread.join()
+		if isinstance(self._video_error, Cancelled):
+			raise self._video_error
+		if self._video_error is not None:
+			raise RuntimeError(f"Video download failed: {self._video_error}")
+
+		audio_codec = "copy" if self.audio_path.suffix.lower() in (".m4a", ".mp4", ".aac") else "aac"
+		tmp_output = self.output_path.with_name(self.output_path.stem + ".merge.mp4")
+		run_command([
+			"ffmpeg", "-y",
+			"-i", str(self._video_path),
+			"-i", str(self.audio_path),
+			"-map", "0:v:0", "-map", "1:a:0",
+			"-c:v", "copy", "-c:a", audio_codec,
+			str(tmp_output),
+		])
+		os.replace(tmp_output, self.output_path)
+		try:
+			self._video_path.unlink()
+		except OSError:
+			pass
+
+		if self.cache_dir is not None and self.cache_key:
+			self.cache_dir.mkdir(parents=True, exist_ok=True)
+			cached = self.cache_dir / f"{self.cache_key}.mp4"
+			with _KeyedFileLock(self.cache_dir / f"{self.cache_key}.lock", self.cache_key):
+				if not cached.exists():
+					_link_or_copy(self.output_path, cached)
+			evict_download_cache(self.cache_dir, self.max_bytes)
+		self._thread = None
+		return self.output_path
+
+
+# -------------------- Artifact store --------------------
+
+ARTIFACT_STORE_DIR = Path(os.getenv("ARTIFACT_STORE_DIR", "cache/artifacts"))
+# Tăng khi thay đổi cách một stage tạo output để các blob cũ không được dùng lại
+ARTIFACT_STORE_VERSION = 1
+# Lock "đang chạy" của một key được touch mỗi ARTIFACT_INFLIGHT_REFRESH_SEC giây; quá ARTIFACT_INFLIGHT_STALE_SEC
+# không được touch thì coi như process chạy nó đã chết
+ARTIFACT_INFLIGHT_REFRESH_SEC = 20
+ARTIFACT_INFLIGHT_STALE_SEC = 120
+
+_file_digest_memo = {}
+
+
+def file_digest(path: Path) -> str:
+	"""sha256 nội dung file, nhớ theo (inode, size, mtime) để không hash lại file lớn trong cùng process"""
+	import hashlib
+
+	stat = os.stat(path)
+	memo_key = (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+	digest = _file_digest_memo.get(memo_key)
+	if digest is None:
+		hasher = hashlib.sha256()
+		with open(path, "rb") as f:
+			for chunk in iter(lambda: f.read(1024 * 1024), b""):
+				hasher.update(chunk)
+		digest = hasher.hexdigest()
+		_file_digest_memo[memo_key] = digest
+	return digest
+
+
+def artifact_key(stage: str, inputs: List[Path], params: Optional[dict] = None) -> str:
+	"""Hash của (stage, nội dung các input, tham số stage) -> key của blob trong artifact store"""
+	import hashlib
+	import json
+
+	hasher = hashlib.sha256()
+	hasher.update(f"{stage}:v{ARTIFACT_STORE_VERSION}\n".encode())
+	for path in inputs:
+		hasher.update(file_digest(path).encode() + b"\n")
+	hasher.update(json.dumps(params or {}, sort_keys=True, default=str).encode())
+	return hasher.hexdigest()
+
+
+class ArtifactStore:
+	"""
+	Kho output của các stage dùng chung giữa các project, địa chỉ theo artifact_key.
+	Mỗi key là một thư mục blobs/<xx>/<key>/ chứa các file output theo tên,
+	được hard link (hoặc copy) vào projects/<id>/. Tham chiếu lưu theo từng blob: refs/<key>/<project_id>
+	(project nào dùng key nào) và owners/<project_id>/<key> (chỉ mục ngược cho release_project()), nên
+	fetch / put / release chỉ khóa và ghi đúng key liên quan, không phụ thuộc tổng số tham chiếu.
+	inflight/<key>.lock: key đang được một project tạo ra (single-flight, xem run_stage_cached).
+	"""
+
+	def __init__(self, root: Path = ARTIFACT_STORE_DIR):
+		self.root = Path(root)
+		self.blobs_dir = self.root / "blobs"
+		self.refs_dir = self.root / "refs"
+		self.owners_dir = self.root / "owners"
+		legacy_refs = self.root / "refs.json"
+		if legacy_refs.exists():
+			self._migrate_refs_json(legacy_refs)
+
+	def _blob_dir(self, key: str) -> Path:
+		return self.blobs_dir / key[:2] / key
+
+	def _key_lock(self, key: str) -> "_KeyedFileLock":
+		"""Khóa tham chiếu + blob của một key (giữ vài thao tác file; lock file được touch trong lúc giữ)"""
+		lock_dir = self.root / "locks"
+		lock_dir.mkdir(parents=True, exist_ok=True)
+		return _KeyedFileLock(lock_dir / f"{key}.lock", f"artifact-key:{self.root.resolve()}:{key}")
+
+	def _add_ref_locked(self, key: str, project_id: str) -> None:
+		# Chỉ mục ngược trước: bị ngắt giữa chừng thì release_project vẫn tìm thấy key để dọn
+		owner_marker = self.owners_dir / project_id / key
+		owner_marker.parent.mkdir(parents=True, exist_ok=True)
+		owner_marker.touch()
+		ref_marker = self.refs_dir / key / project_id
+		ref_marker.parent.mkdir(parents=True, exist_ok=True)
+		ref_marker.touch()
+
+	def _migrate_refs_json(self, legacy_refs: Path) -> None:
+		"""Chuyển refs.json (một file cho cả store) sang marker theo từng blob, một lần"""
+		import json
+
+		with _KeyedFileLock(self.root / "refs.lock", f"artifact-refs:{self.root.resolve()}"):
+			if not legacy_refs.exists():
+				return
+			try:
+				with open(legacy_refs, "r", encoding="utf-8") as f:
+					refs = json.load(f)
+			except (OSError, ValueError) as e:
+				print(f"⚠️ Could not read legacy artifact refs, skipping migration: {e}")
+				refs = {}
+			for key, owners in refs.items():
+				with self._key_lock(key):
+					for project_id in owners:
+						self._add_ref_locked(key, project_id)
+			os.replace(legacy_refs, legacy_refs.with_suffix(".json.migrated"))
+			print(f"📦 Migrated {len(refs)} artifact refs to per-blob markers")
+
+	def in_flight(self, key: str) -> "_KeyedFileLock":
+		"""Khóa single-flight của key, dùng chung giữa các process / node cùng store"""
+		lock_dir = self.root / "inflight"
+		lock_dir.mkdir(parents=True, exist_ok=True)
+		return _KeyedFileLock(lock_dir / f"{key}.lock", f"artifact-inflight:{self.root.resolve()}:{key}",
+		                      stale_after=ARTIFACT_INFLIGHT_STALE_SEC, refresh=ARTIFACT_INFLIGHT_REFRESH_SEC)
+
+	def has(self, key: str, names: List[str]) -> bool:
+		blob_dir = self._blob_dir(key)
+		return all((blob_dir / name).exists() for name in names)
+
+	def fetch(self, key: str, workdir: Path, names: List[str], project_id: str) -> bool:
+		"""Link các output đã lưu của key vào workdir. Trả về False nếu store chưa có đủ"""
+		if not self.has(key, names):
+			return False
+		workdir.mkdir(parents=True, exist_ok=True)
+		blob_dir = self._blob_dir(key)
+		with self._key_lock(key):
+			# put(replace=True) đổi blob dưới cùng lock -> không link nửa cũ nửa mới
+			if not self.has(key, names):
+				return False
+			for name in names:
+				_link_or_copy(blob_dir / name, workdir / name)
+			self._add_ref_locked(key, project_id)
+		return True
+
+	def put(self, key: str, workdir: Path, names: List[str], project_id: str, replace: bool = False) -> None:
+		"""
+		Lưu các output vừa tạo trong workdir vào store (hard link nên không tốn thêm dung lượng).
+		replace=True: thay blob cũ cùng key (chạy lại bắt buộc, vd dịch lại), project cũ vẫn giữ file của mình.
+		"""
+		blob_dir = self._blob_dir(key)
+		tmp_dir = blob_dir.with_name(f"{key}.tmp{os.getpid()}_{threading.get_ident()}")
+		if tmp_dir.exists():
+			shutil.rmtree(tmp_dir)
+		tmp_dir.mkdir(parents=True)
+		for name in names:
+			_link_or_copy(workdir / name, tmp_dir / name)
+		# Đổi blob dưới khóa của key (fetch cũng giữ khóa này): không project nào thấy blob thiếu file.
+		# Blob cũ được đổi tên sang chỗ khác trước rồi mới xóa, file đã link ra các project vẫn còn nguyên
+		old_dir = blob_dir.with_name(f"{key}.old{os.getpid()}_{threading.get_ident()}")
+		with self._key_lock(key):
+			if blob_dir.exists() and (replace or not self.has(key, names)):
+				# replace=True, hoặc blob dở dang (bị gián đoạn lần trước) -> thay bằng bản đầy đủ
+				os.rename(blob_dir, old_dir)
+			if blob_dir.exists():
+				# Project khác đã lưu cùng key trước (nội dung giống nhau) -> bỏ bản tạm
+				shutil.rmtree(tmp_dir, ignore_errors=True)
+			else:
+				os.rename(tmp_dir, blob_dir)
+			self._add_ref_locked(key, project_id)
+		shutil.rmtree(old_dir, ignore_errors=True)
+
+	def release_project(self, project_id: str) -> List[str]:
+		"""Bỏ mọi tham chiếu của project, xóa các blob không còn project nào dùng. Trả về các key đã xóa"""
+		removed = []
+		owned_dir = self.owners_dir / project_id
+		if not owned_dir.is_dir():
+			return removed
+		for owner_marker in owned_dir.iterdir():
+			key = owner_marker.name
+			with self._key_lock(key):
+				ref_dir = self.refs_dir / key
+				(ref_dir / project_id).unlink(missing_ok=True)
+				try:
+					ref_dir.rmdir()  # chỉ thành công khi không còn project nào tham chiếu
+				except FileNotFoundError:
+					pass
+				except OSError:
+					owner_marker.unlink(missing_ok=True)
+					continue
+				shutil.rmtree(self._blob_dir(key), ignore_errors=True)
+				removed.append(key)
+			owner_marker.unlink(missing_ok=True)
+		try:
+			owned_dir.rmdir()
+		except OSError:
+			pass
+		return removed
+
+	def disk_usage(self) -> int:
+		"""Tổng dung lượng thật của store (mỗi inode chỉ tính một lần)"""
+		seen = set()
+		total = 0
+		for path in self.blobs_dir.rglob("*"):
+			if path.is_file():
+				stat = path.stat()
+				if (stat.st_dev, stat.st_ino) not in seen:
+					seen.add((stat.st_dev, stat.st_ino))
+					total += stat.st_size
+		return total
+
+
+def detach_artifact(path: Path) -> None:
+	"""
+	Xóa file output cũ trước khi stage ghi lại nó: file có thể là hard link tới blob trong store,
+	ghi đè tại chỗ (ffmpeg -y, open('w')) sẽ làm hỏng blob dùng chung.
+	"""
+	try:
+		path.unlink()
+	except FileNotFoundError:
+		pass
+
+
+_stage_run = threading.local()
+
+
+def mark_artifact_incomplete(reason: str) -> None:
+	"""
+	Báo output của stage đang chạy không đầy đủ (vd vài segment TTS lỗi thành im lặng):
+	project hiện tại vẫn dùng output đó, nhưng run_stage_cached không lưu nó vào store
+	nên project khác (kể cả đang chờ single-flight) sẽ tự chạy lại thay vì dùng chung bản lỗi.
+	"""
+	_stage_run.incomplete = reason
+
+
+def run_stage_cached(store: Optional[ArtifactStore], project_id: str, stage: str, workdir: Path,
+                     inputs: List[Path], params: Optional[dict], outputs: List[str],
+                     run: Callable[[], None], force: bool = False) -> bool:
+	"""
+	Chạy một stage qua artifact store: nếu (inputs, params) đã có output thì link vào workdir,
+	nếu chưa thì chạy run() rồi lưu output. Trả về True nếu dùng lại output có sẵn.
+	Single-flight: project khác đang chạy đúng stage này (cùng key) thì chờ nó xong rồi dùng chung output;
+	lần chạy đó lỗi / bị hủy thì project chờ tự chạy.
+	force=True: luôn chạy lại và thay output đã lưu.
+	"""
+	if store is None:
+		for name in outputs:
+			detach_artifact(workdir / name)
+		run()
+		return False
+	key = artifact_key(stage, inputs, params)
+	if force:
+		return _run_and_store(store, project_id, stage, workdir, outputs, run, key, replace=True)
+	if store.fetch(key, workdir, outputs, project_id):
+		print(f"♻️ Reusing stored artifact for stage '{stage}' ({key[:12]})")
+		return True
+	in_flight = store.in_flight(key)
+	if in_flight.locked():
+		print(f"⏳ Stage '{stage}' ({key[:12]}) is already running for another project, waiting for its output")
+	with in_flight:
+		if store.fetch(key, workdir, outputs, project_id):
+			print(f"♻️ Sharing in-flight output of stage '{stage}' ({key[:12]})")
+			return True
+		return _run_and_store(store, project_id, stage, workdir, outputs, run, key)
+
+
+def _run_and_store(store: ArtifactStore, project_id: str, stage: str, workdir: Path, outputs: List[str],
+                   run: Callable[[], None], key: str, replace: bool = False) -> bool:
+	for name in outputs:
+		detach_artifact(workdir / name)
+	_stage_run.incomplete = None
+	try:
+		run()
+		incomplete = _stage_run.incomplete
+	finally:
+		_stage_run.incomplete = None
+	produced = [name for name in outputs if (workdir / name).exists()]
+	if incomplete:
+		print(f"⚠️ Stage '{stage}' output is incomplete ({incomplete}), not stored")
+	elif len(produced) == len(outputs):
+		store.put(key, workdir, outputs, project_id, replace=replace)
+	else:
+		print(f"⚠️ Stage '{stage}' did not produce {sorted(set(outputs) - set(produced))}, not stored")
+	return False
+
+
+# -------------------- Stage graph --------------------
+
+STAGE_MANIFEST_FILE = ".stages.json"
+
+
+def stage_params(config: dict, keys) -> dict:
+	"""Lấy các config key mà một stage phụ thuộc (key kết thúc bằng '_' là prefix)"""
+	params = {}
+	for key in keys:
+		if key.endswith("_"):
+			params.update({k: v for k, v in config.items() if k.startswith(key)})
+		elif key in config:
+			params[key] = config[key]
+	return params
+
+
+# Slot file của ResourcePool dùng chung giữa các process trên cùng máy (web, pipeline_worker --processes N).
+# Để trên ổ cục bộ: flock trên NFS không đáng tin, và cpu là giới hạn của từng máy
+RESOURCE_SLOTS_DIR = Path(os.getenv("RESOURCE_SLOTS_DIR", "cache/resource_slots"))
+# Chu kỳ (giây) thử lại slot đang bị process khác giữ (không có notify giữa các process)
+RESOURCE_POLL_SEC = 0.5
+
+
+class ResourcePool:
+	"""
+	Giới hạn số stage chạy đồng thời theo resource class (vd "cpu" cho ffmpeg, "network" cho tải video,
+	"assemblyai" / "gemini" / "fpt" cho từng provider). Một stage có thể cần nhiều class, được cấp
+	cùng lúc (all-or-nothing) nên không deadlock. Class không có trong limits thì không giới hạn.
+	slots_dir: giới hạn dùng chung giữa mọi process trên máy mở cùng thư mục. Mỗi class có limit file
+	<class>.<i>.lock, giữ slot = flock một file (tự nhả khi process chết); limits.json là giới hạn hiện hành,
+	configure() ghi lại nên đổi giới hạn ở web process áp dụng cho cả worker. Không có fcntl (Windows) hoặc
+	slots_dir=None thì chỉ giới hạn trong process.
+	"""
+
+	def __init__(self, limits: Optional[dict] = None, slots_dir: Optional[Path] = None):
+		self._condition = threading.Condition()
+		self._limits = {}
+		self._in_use = {}
+		self._held = {}  # class -> [fd slot file] process này đang giữ
+		self.slots_dir = Path(slots_dir) if slots_dir is not None and fcntl is not None else None
+		self._limits_mtime = None
+		if self.slots_dir is not None:
+			self.slots_dir.mkdir(parents=True, exist_ok=True)
+			# limits chỉ là giá trị ban đầu: process khác (hoặc /api/config) có thể đã đặt giới hạn dùng chung
+			if self._refresh_limits():
+				return
+		self.configure(limits or {})
+
+	@property
+	def _limits_path(self) -> Path:
+		return self.slots_dir / "limits.json"
+
+	def _refresh_limits(self) -> bool:
+		"""Đọc limits.json nếu đã đổi (process khác gọi configure). Trả về True nếu file có"""
+		import json
+
+		try:
+			mtime = self._limits_path.stat().st_mtime_ns
+		except FileNotFoundError:
+			return False
+		if mtime == self._limits_mtime:
+			return True
+		try:
+			limits = json.loads(self._limits_path.read_text(encoding="utf-8"))
+		except (OSError, ValueError) as e:
+			print(f"⚠️ Could not read shared resource limits: {e}")
+			return True
+		self._limits_mtime = mtime
+		with self._condition:
+			self._limits.update({name: max(1, int(limit)) for name, limit in limits.items()})
+			self._condition.notify_all()
+		return True
+
+	def configure(self, limits: dict) -> None:
+		"""Đổi giới hạn lúc đang chạy; stage đang giữ slot vẫn chạy tiếp, stage chờ được đánh thức"""
+		import json
+
+		with self._condition:
+			for name, limit in limits.items():
+				self._limits[name] = max(1, int(limit))
+			if self.slots_dir is not None:
+				tmp_path = self._limits_path.with_suffix(f".tmp{os.getpid()}")
+				tmp_path.write_text(json.dumps(self._limits, sort_keys=True), encoding="utf-8")
+				os.replace(tmp_path, self._limits_path)
+				self._limits_mtime = self._limits_path.stat().st_mtime_ns
+			self._condition.notify_all()
+
+	def _available(self, names: List[str]) -> bool:
+		return all(self._in_use.get(name, 0) < self._limits[name] for name in names if name in self._limits)
+
+	def _slot_path(self, name: str, index: int) -> Path:
+		return self.slots_dir / f"{name}.{index}.lock"
+
+	def _try_lock(self, name: str) -> Optional[int]:
+		"""flock một slot file còn trống của class (không chờ). None nếu mọi slot đang bị giữ"""
+		for index in range(self._limits[name]):
+			fd = os.open(str(self._slot_path(name, index)), os.O_CREAT | os.O_RDWR)
+			try:
+				fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+				return fd
+			except OSError:
+				os.close(fd)
+		return None
+
+	def _lock_slots(self, names: List[str]) -> Optional[dict]:
+		"""Giữ một slot file cho mỗi class có giới hạn, all-or-nothing. None nếu có class đã hết slot"""
+		if self.slots_dir is None:
+			return {}
+		locked = {}
+		for name in names:
+			if name not in self._limits:
+				continue
+			fd = self._try_lock(name)
+			if fd is None:
+				for held in locked.values():
+					os.close(held)  # đóng fd cũng nhả flock
+				return None
+			locked[name] = fd
+		return locked
+
+	def acquire(self, names) -> None:
+		"""Chờ đủ slot; job bị hủy trong lúc chờ thì raise Cancelled"""
+		names = sorted(set(names))
+		with self._condition:
+			while True:
+				check_cancelled()
+				if self.slots_dir is not None:
+					self._refresh_limits()
+				locked = self._lock_slots(names) if self._available(names) else None
+				if locked is not None:
+					break
+				self._condition.wait(RESOURCE_POLL_SEC if self.slots_dir is not None else 1)
+			for name in names:
+				self._in_use[name] = self._in_use.get(name, 0) + 1
+			for name, fd in locked.items():
+				self._held.setdefault(name, []).append(fd)
+
+	def release(self, names) -> None:
+		with self._condition:
+			for name in set(names):
+				self._in_use[name] -= 1
+				if self._held.get(name):
+					os.close(self._held[name].pop())
+			self._condition.notify_all()
+
+	@contextlib.contextmanager
+	def slots(self, names):
+		"""with pool.slots(["cpu"]): ..."""
+		self.acquire(names)
+		try:
+			yield
+		finally:
+			self.release(names)
+
+	def _slots_in_use(self, name: str) -> int:
+		"""Số slot file của class đang bị giữ (bởi bất kỳ process nào trên máy)"""
+		busy = 0
+		for index in range(self._limits[name]):
+			fd = os.open(str(self._slot_path(name, index)), os.O_CREAT | os.O_RDWR)
+			try:
+				fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+			except OSError:
+				busy += 1
+			finally:
+				os.close(fd)
+		return busy
+
+	def status(self) -> dict:
+		if self.slots_dir is not None:
+			self._refresh_limits()
+		with self._condition:
+			if self.slots_dir is None:
+				return {name: {"limit": limit, "in_use": self._in_use.get(name, 0)} for name, limit in self._limits.items()}
+			return {name: {"limit": limit, "in_use": self._slots_in_use(name)} for name, limit in self._limits.items()}
+
+
+class JobScheduler:
+	"""
+	Hàng đợi job có độ ưu tiên, chạy tối đa max_running job cùng lúc.
+	- submit / dispatch O(log N) bằng heap (priority cao chạy trước, cùng priority thì FIFO)
+	- dispatcher thread ngủ trên Condition, được đánh thức ngay khi có job mới hoặc một job xong
+	- mỗi job đang chạy có deadline (timeout cố định, hoặc hàm tính lúc job bắt đầu -- vd theo thời lượng video);
+	  dispatcher hẹn giờ thức dậy đúng deadline gần nhất, quá hạn thì gọi on_timeout(job_id, timeout)
+	  (không cần quét định kỳ). Slot chỉ được nhả khi run() trả về:
+	  hủy là cooperative, runner quá hạn có thể còn chạy ffmpeg / API một lúc, không được vượt max_running
+	- một job_id chỉ có tối đa một lần chạy; submit lại khi đang chạy thì chờ lần trước xong
+	- order(limit): tối đa limit job_id chạy tiếp theo do bên ngoài quyết định (vd đầu hàng đợi của job store
+	  theo policy SJF / weighted-fair, ORDER BY ... LIMIT trên index). Được gọi ngoài Condition (submit không
+	  phải chờ I/O của nó) và chỉ khi có slot trống; job không có trong kết quả chạy sau theo thứ tự heap
+	"""
+
+	def __init__(self, max_running: int = 1, on_timeout: Optional[Callable[[str, float], None]] = None,
+	             on_start: Optional[Callable[[str], None]] = None,
+	             order: Optional[Callable[[int], List[str]]] = None):
+		self._condition = threading.Condition()
+		self._queue = []  # (-priority, seq, job_id)
+		self._pending = {}  # job_id -> (seq, run, timeout), entry hiện hành của job trong heap
+		self._running = {}  # job_id -> token của lần chạy, tới khi run() trả về
+		self._expired = set()  # job_id đã quá deadline (đã gọi on_timeout) nhưng runner chưa thoát
+		self._deadlines = []  # (deadline time.monotonic, token, job_id, timeout)
+		self._seq = itertools.count()
+		self._generation = 0  # tăng mỗi lần hàng đợi / slot đổi (submit, job xong, configure)
+		self._thread = None
+		self.max_running = max(1, int(max_running))
+		self.on_timeout = on_timeout
+		self.on_start = on_start
+		self.order = order
+
+	def start(self) -> None:
+		with self._condition:
+			# Thread không còn sau fork (vd gunicorn preload_app) -> khởi động lại trong process con
+			if self._thread is None or not self._thread.is_alive():
+				self._thread = threading.Thread(target=self._dispatch_loop, name="job-scheduler", daemon=True)
+				self._thread.start()
+
+	@property
+	def running(self) -> bool:
+		return self._thread is not None and self._thread.is_alive()
+
+	def configure(self, max_running: int) -> None:
+		with self._condition:
+			self.max_running = max(1, int(max_running))
+			self._generation += 1
+			self._condition.notify_all()
+
+	def submit(self, job_id: str, run: Callable[[], None], priority: int = 0, timeout=None) -> None:
+		"""
+		Thêm job (hoặc thay entry đang chờ của cùng job_id). timeout: giây tối đa job được giữ slot, hoặc hàm
+		trả về số giây, được gọi trong thread của job lúc bắt đầu (ngoài Condition, được phép đọc DB)
+		"""
+		with self._condition:
+			seq = next(self._seq)
+			self._pending[job_id] = (seq, run, timeout)
+			heapq.heappush(self._queue, (-priority, seq, job_id))
+			self._generation += 1
+			self._condition.notify_all()
+
+	def cancel(self, job_id: str) -> bool:
+		"""Bỏ job khỏi hàng đợi (entry cũ trong heap bị bỏ qua khi pop). Job đang chạy không bị ảnh hưởng"""
+		with self._condition:
+			return self._pending.pop(job_id, None) is not None
+
+	def is_queued(self, job_id: str) -> bool:
+		with self._condition:
+			return job_id in self._pending
+
+	def queued(self) -> List[str]:
+		"""job_id đang chờ theo thứ tự sẽ chạy"""
+		with self._condition:
+			entries = sorted(entry for entry in self._queue if self._pending.get(entry[2], (None,))[0] == entry[1])
+			return [job_id for _, _, job_id in entries]
+
+	def status(self) -> dict:
+		with self._condition:
+			return {"queued": len(self._pending), "running": len(self._running), "expired": len(self._expired),
+			        "max_running": self.max_running}
+
+	def has_capacity(self) -> bool:
+		"""Còn slot cho job mới (kể cả job đã submit nhưng chưa được dispatch)"""
+		with self._condition:
+			return len(self._pending) + len(self._running) < self.max_running
+
+	def _finish(self, job_id: str, token: int) -> None:
+		with self._condition:
+			if self._running.get(job_id) == token:
+				del self._running[job_id]
+				self._expired.discard(job_id)
+			self._generation += 1
+			self._condition.notify_all()
+
+	def _set_deadline(self, job_id: str, token: int, timeout) -> None:
+		if callable(timeout):
+			try:
+				timeout = timeout()
+			except Exception as e:
+				print(f"⚠️ Could not compute timeout of job {job_id}, running without deadline: {e}")
+				return
+		if not timeout:
+			return
+		with self._condition:
+			if self._running.get(job_id) == token:
+				heapq.heappush(self._deadlines, (time.monotonic() + timeout, token, job_id, timeout))
+				self._condition.notify_all()  # dispatcher hẹn lại giờ thức dậy
+
+	def _run_job(self, job_id: str, run: Callable[[], None], token: int, timeout) -> None:
+		try:
+			self._set_deadline(job_id, token, timeout)
+			if self.on_start:
+				self.on_start(job_id)
+			run()
+		except Exception as e:
+			print(f"❌ Job {job_id} failed: {e}")
+		finally:
+			self._finish(job_id, token)
+
+	def _expire(self, now: float) -> List[tuple]:
+		expired = []
+		while self._deadlines and self._deadlines[0][0] <= now:
+			_, token, job_id, timeout = heapq.heappop(self._deadlines)
+			if self._running.get(job_id) == token and job_id not in self._expired:
+				# Giữ slot tới khi runner thoát (_finish), chỉ báo timeout để nó bị hủy
+				self._expired.add(job_id)
+				expired.append((job_id, timeout))
+		return expired
+
+	def _start(self, job_id: str) -> None:
+		_, run, timeout = self._pending.pop(job_id)
+		token = next(self._seq)
+		self._running[job_id] = token
+		threading.Thread(target=self._run_job, args=(job_id, run, token, timeout), daemon=True).start()
+
+	def _ranked(self) -> tuple:
+		"""
+		Hỏi order() các job chạy tiếp theo, gọi ngoài Condition. Trả về (generation lúc hỏi, job_ids);
+		job_ids rỗng nếu không có slot trống / không có order() / callback lỗi.
+		"""
+		with self._condition:
+			generation = self._generation
+			free = self.max_running - len(self._running)
+			if self.order is None or free <= 0 or not self._pending:
+				return generation, []
+		try:
+			return generation, list(self.order(free))
+		except Exception as e:
+			print(f"⚠️ Job order callback failed, using priority order: {e}")
+			return generation, []
+
+	def _dispatch(self, ranked: List[str]) -> None:
+		for job_id in ranked:
+			if len(self._running) >= self.max_running:
+				return
+			if job_id in self._pending and job_id not in self._running:
+				self._start(job_id)  # entry của job trong heap thành entry cũ, bị bỏ qua khi pop
+		deferred = []
+		while len(self._running) < self.max_running and self._queue:
+			entry = heapq.heappop(self._queue)
+			job_id = entry[2]
+			pending = self._pending.get(job_id)
+			if pending is None or pending[0] != entry[1]:
+				continue  # entry đã bị cancel hoặc submit lại
+			if job_id in self._running:
+				deferred.append(entry)
+				continue
+			self._start(job_id)
+		for entry in deferred:
+			heapq.heappush(self._queue, entry)
+
+	def _dispatch_loop(self) -> None:
+		while True:
+			generation, ranked = self._ranked()
+			with self._condition:
+				expired = self._expire(time.monotonic())
+				# Hàng đợi / slot đã đổi trong lúc hỏi order() -> hỏi lại trước khi dispatch
+				if not expired and generation == self._generation:
+					self._dispatch(ranked)
+					wait = self._deadlines[0][0] - time.monotonic() if self._deadlines else None
+					self._condition.wait(None if wait is None else max(0.0, wait))
+			for job_id, timeout in expired:
+				print(f"⚠️ Job {job_id} exceeded its deadline ({timeout / 60:.0f} min), cancelling it "
+				      f"(slot is freed when it stops)")
+				if self.on_timeout:
+					try:
+						self.on_timeout(job_id, timeout)
+					except Exception as e:
+						print(f"❌ on_timeout failed for job {job_id}: {e}")
+
+
+class Stage:
+	"""
+	Một bước trong stage graph.
+	- inputs / outputs: tên file trong workdir; stage phụ thuộc vào stage tạo ra input của nó
+	- params: config key mà output phụ thuộc (xem stage_params), values: tham số cố định (vd URL)
+	- after: stage phải xong trước dù không có quan hệ file
+	- step: tên bước hiển thị trên UI (project['steps']), mặc định là name
+	- resources: resource class cần giữ khi chạy (xem ResourcePool)
+	- pooled=False: stage tự giữ slot cho từng phần việc (vd run_windowed_pipeline); resources chỉ dùng cho affinity
+	- enabled=False: bỏ qua stage (coi như đã xong)
+	"""
+
+	__slots__ = ("name", "run", "inputs", "outputs", "params", "values", "after", "step", "resources", "pooled",
+	             "enabled")
+
+	def __init__(self, name: str, run: Callable[[], None], outputs, inputs=(), params=(), values: Optional[dict] = None,
+	             after=(), step: Optional[str] = None, resources=(), pooled: bool = True, enabled: bool = True):
+		self.name = name
+		self.run = run
+		self.inputs = list(inputs)
+		self.outputs = list(outputs)
+		self.params = list(params)
+		self.values = dict(values or {})
+		self.after = list(after)
+		self.step = step or name
+		self.resources = list(resources)
+		self.pooled = pooled
+		self.enabled = enabled
+
+	def __repr__(self) -> str:
+		return f"Stage({self.name!r}, inputs={self.inputs}, outputs={self.outputs})"
+
+
+def _load_stage_manifest(workdir: Path) -> dict:
+	import json
+
+	path = workdir / STAGE_MANIFEST_FILE
+	if not path.exists():
+		return {}
+	try:
+		with open(path, "r", encoding="utf-8") as f:
+			return json.load(f)
+	except (OSError, ValueError) as e:
+		print(f"⚠️ Could not read {STAGE_MANIFEST_FILE}, rebuilding all stages: {e}")
+		return {}
+
+
+def _save_stage_manifest(workdir: Path, manifest: dict) -> None:
+	import json
+
+	path = workdir / STAGE_MANIFEST_FILE
+	tmp_path = path.with_suffix(".tmp")
+	with open(tmp_path, "w", encoding="utf-8") as f:
+		json.dump(manifest, f, indent=1, sort_keys=True)
+	os.replace(tmp_path, path)
+
+
+def _stat_outputs(workdir: Path, names: List[str]) -> dict:
+	outputs = {}
+	for name in names:
+		stat = os.stat(workdir / name)
+		outputs[name] = {"digest": file_digest(workdir / name), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+	return outputs
+
+
+def _outputs_unchanged(workdir: Path, recorded: dict, names: List[str]) -> bool:
+	"""Output còn nguyên như lúc stage ghi manifest; đồng thời nạp digest vào memo để khỏi hash lại"""
+	for name in names:
+		info = recorded.get(name)
+		try:
+			stat = os.stat(workdir / name)
+		except FileNotFoundError:
+			return False
+		if not info or stat.st_size != info["size"] or stat.st_mtime_ns != info["mtime_ns"]:
+			return False
+		_file_digest_memo[(stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)] = info["digest"]
+	return True
+
+
+def stage_fingerprint(stage: Stage, workdir: Path, config: dict) -> str:
+	"""Fingerprint = hash(stage, nội dung inputs, params) - giống key của artifact store"""
+	params = stage_params(config, stage.params)
+	params.update(stage.values)
+	return artifact_key(stage.name, [workdir / name for name in stage.inputs], params)
+
+
+class StageHandoff(Exception):
+	"""
+	run_stage_graph dừng vì các stage còn lại không chạy được ở đây (can_run trả về False) và artifact store
+	chưa có output của chúng; worker khác có đủ resource class phải chạy tiếp.
+	"""
+
+	def __init__(self, stages: List["Stage"]):
+		self.stages = stages
+		super().__init__(f"Stages need another worker: {', '.join(stage.name for stage in stages)}")
+
+	@property
+	def resources(self) -> set:
+		return {name for stage in self.stages for name in stage.resources}
+
+
+class _StageDeferred(Exception):
+	pass
+
+
+def run_stage_graph(stages: List[Stage], workdir: Path, config: dict, project_id: str = "",
+                    store: Optional[ArtifactStore] = None, force=(),
+                    on_event: Optional[Callable[[Stage, str, Optional[Exception]], None]] = None,
+                    should_stop: Optional[Callable[[], bool]] = None, max_workers: int = 4,
+                    resources: Optional[ResourcePool] = None,
+                    can_run: Optional[Callable[[Stage], bool]] = None,
+                    cancel: Optional[CancelToken] = None) -> bool:
+	"""
+	Chạy stage graph kiểu make: stage nào có fingerprint (inputs + params) trùng manifest và output
+	còn nguyên thì bỏ qua; còn lại chạy (qua artifact store nếu có). Các stage độc lập chạy song song.
+	force: tên các stage phải chạy lại dù fingerprint không đổi.
+	on_event(stage, status, error) với status: running | completed | reused | up_to_date | skipped | error
+	resources: ResourcePool dùng chung giữa các project; stage chỉ giữ slot khi thật sự chạy
+	(không giữ khi up-to-date hay lấy lại từ artifact store).
+	can_run(stage): stage affinity, False thì stage chỉ được lấy lại từ artifact store chứ không chạy ở đây;
+	khi không còn stage nào chạy được mà vẫn thiếu stage đó thì raise StageHandoff.
+	cancel: token hủy của lần chạy, gắn vào từng stage thread; cancel() dừng luôn stage đang chạy
+	(ffmpeg bị terminate, HTTP / retry / TTS loop dừng) thay vì chờ tới ranh giới stage.
+	Trả về False nếu dừng giữa chừng do should_stop() hoặc cancel.
+	"""
+	from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+	by_name = {stage.name: stage for stage in stages}
+	producers = {}
+	for stage in stages:
+		for name in stage.outputs:
+			if name in producers:
+				raise ValueError(f"Output {name} is produced by both {producers[name]} and {stage.name}")
+			producers[name] = stage.name
+	deps = {}
+	for stage in stages:
+		deps[stage.name] = {producers[name] for name in stage.inputs if name in producers} | set(stage.after)
+		unknown = deps[stage.name] - set(by_name)
+		if unknown:
+			raise ValueError(f"Stage {stage.name} depends on unknown stages {sorted(unknown)}")
+
+	force = set(force)
+	manifest = _load_stage_manifest(workdir)
+	manifest_lock = threading.Lock()
+
+	def emit(stage: Stage, status: str, error: Optional[Exception] = None) -> None:
+		if on_event:
+			on_event(stage, status, error)
+
+	def stopped() -> bool:
+		return (cancel is not None and cancel.cancelled) or bool(should_stop and should_stop())
+
+	def execute(stage: Stage) -> None:
+		with cancel_scope(cancel):
+			execute_stage(stage)
+
+	def execute_stage(stage: Stage) -> None:
+		if not stage.enabled:
+			emit(stage, "skipped")
+			return
+		missing = [name for name in stage.inputs if not (workdir / name).exists()]
+		if missing:
+			raise RuntimeError(f"Stage '{stage.name}' is missing inputs: {', '.join(missing)}")
+		fingerprint = stage_fingerprint(stage, workdir, config)
+		recorded = manifest.get(stage.name) or {}
+		if (stage.name not in force and recorded.get("fingerprint") == fingerprint
+				and _outputs_unchanged(workdir, recorded.get("outputs") or {}, stage.outputs)):
+			emit(stage, "up_to_date")
+			return
+		params = stage_params(config, stage.params)
+		params.update(stage.values)
+		inputs = [workdir / name for name in stage.inputs]
+		if can_run is not None and not can_run(stage):
+			# Stage phải chạy ở worker khác; chỉ dùng được nếu artifact store đã có output
+			if (stage.name in force or store is None
+					or not store.fetch(artifact_key(stage.name, inputs, params), workdir, stage.outputs, project_id)):
+				raise _StageDeferred(stage.name)
+			reused = True
+		else:
+			emit(stage, "running")
+
+			def run() -> None:
+				if resources is None or not stage.resources or not stage.pooled:
+					stage.run()
+					return
+				with resources.slots(stage.resources):
+					stage.run()
+
+			reused = run_stage_cached(store, project_id, stage.name, workdir, inputs,
+			                          params, stage.outputs, run, force=stage.name in force)
+		missing = [name for name in stage.outputs if not (workdir / name).exists()]
+		if missing:
+			raise RuntimeError(f"Stage '{stage.name}' did not produce: {', '.join(missing)}")
+		with manifest_lock:
+			manifest[stage.name] = {"fingerprint": fingerprint, "outputs": _stat_outputs(workdir, stage.outputs)}
+			_save_stage_manifest(workdir, manifest)
+		emit(stage, "reused" if reused else "completed")
+
+	pending = [stage.name for stage in stages]
+	done = set()
+	running = {}
+	deferred = []
+	interrupted = []
+	first_error = None
+	with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+		while pending or running:
+			if first_error is None and not stopped():
+				for name in [n for n in pending if deps[n] <= done]:
+					pending.remove(name)
+					running[pool.submit(execute, by_name[name])] = name
+			if not running:
+				break
+			finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+			for future in finished:
+				name = running.pop(future)
+				error = future.exception()
+				if error is None:
+					done.add(name)
+				elif isinstance(error, _StageDeferred):
+					deferred.append(by_name[name])
+				elif isinstance(error, Cancelled) or (cancel is not None and cancel.cancelled):
+					# Lỗi do bị hủy giữa chừng (process bị terminate...) không phải lỗi của stage
+					interrupted.append(name)
+				else:
+					emit(by_name[name], "error", error)
+					first_error = first_error or error
+	if first_error is not None:
+		raise first_error
+	if deferred and not stopped():
+		raise StageHandoff(deferred)
+	return not pending and not deferred and not interrupted
 
 
 # -------------------- FFmpeg steps --------------------
 
+# Hệ số làm chậm của slow_down_video (audio tách riêng cũng phải làm chậm đúng hệ số này để khớp timing)
+SLOW_AUDIO_TEMPO = 0.7
+# Output cuối cùng: moov atom ở đầu file để trình duyệt / player phát ngay qua HTTP Range, không phải tải hết
+MP4_FASTSTART_ARGS = ["-movflags", "+faststart"]
+# Độ dài (giây) mỗi segment của bản HLS
+HLS_SEGMENT_SECONDS = 6
+# Hệ số tăng tốc của speed_up_130 (output cuối cùng nhanh hơn slow.mp4 bấy nhiêu lần)
+SPEED_UP_FACTOR = 1.3
+
+
 def slow_down_video(input_path: Path, output_path: Path) -> None:
 	has_audio = _has_audio_stream(input_path)
 	
 	if has_audio:
-		filter_complex = "[0:v]setpts=PTS*1.428571[v];[0:a]atempo=0.7[a]"
+		filter_complex = f"[0:v]setpts=PTS*{1 / SLOW_AUDIO_TEMPO:.6f}[v];[0:a]atempo={SLOW_AUDIO_TEMPO}[a]"
 		run_command([
 			"ffmpeg", "-y", "-i", str(input_path),
 			"-filter_complex", filter_complex,
@@ -111,7 +1660,7 @@ def slow_down_video(input_path: Path, output_path: Path) -> None:
 		])
 	else:
 		# Video only - no audio processing
-		filter_complex = "[0:v]setpts=PTS*1.428571[v]"
+		filter_complex = f"[0:v]setpts=PTS*{1 / SLOW_AUDIO_TEMPO:.6f}[v]"
 		run_command([
 			"ffmpeg", "-y", "-i", str(input_path),
 			"-filter_complex", filter_complex,
@@ -120,14 +1669,16 @@ def slow_down_video(input_path: Path, output_path: Path) -> None:
 		])
 
 
-def extract_audio_for_stt(input_path: Path, output_wav: Path) -> None:
+def extract_audio_for_stt(input_path: Path, output_wav: Path, tempo: Optional[float] = None) -> None:
+	"""tempo: áp dụng atempo khi input là audio gốc (chưa qua slow_down_video), vd SLOW_AUDIO_TEMPO"""
 	has_audio = _has_audio_stream(input_path)
 	
 	if has_audio:
+		tempo_args = ["-af", f"atempo={tempo}"] if tempo and tempo != 1.0 else []
 		# Mono 16kHz WAV to minimize upload size and improve STT speed
 		run_command([
 			"ffmpeg", "-y", "-i", str(input_path),
-			"-vn", "-ac", "1", "-ar", "16000", "-c:a", "pcm_s16le",
+			"-vn", *tempo_args, "-ac", "1", "-ar", "16000", "-c:a", "pcm_s16le",
 			str(output_wav),
 		])
 	else:
@@ -157,20 +1708,22 @@ def speed_up_130(video_in: Path, video_out: Path) -> None:
 	
 	if has_audio:
 		# Có audio - xử lý cả video và audio
-		filter_complex = "[0:v]setpts=PTS/1.3[v];[0:a]atempo=1.3[a]"
+		filter_complex = f"[0:v]setpts=PTS/{SPEED_UP_FACTOR}[v];[0:a]atempo={SPEED_UP_FACTOR}[a]"
 		run_command([
 			"ffmpeg", "-y", "-i", str(video_in),
 			"-filter_complex", filter_complex,
 			"-map", "[v]", "-map", "[a]",
+			*MP4_FASTSTART_ARGS,
 			str(video_out),
 		])
 	else:
 		# Không có audio - chỉ xử lý video
-		filter_complex = "[0:v]setpts=PTS/1.3[v]"
+		filter_complex = f"[0:v]setpts=PTS/{SPEED_UP_FACTOR}[v]"
 		run_command([
 			"ffmpeg", "-y", "-i", str(video_in),
 			"-filter_complex", filter_complex,
 			"-map", "[v]",
+			*MP4_FASTSTART_ARGS,
 			str(video_out),
 		])
 
@@ -203,11 +1756,322 @@ def overlay_template(video_in: Path, overlay_in: Path, video_out: Path) -> None:
 	])
 
 
+# -------------------- SRT cues --------------------
+
+class Cue:
+	"""Một subtitle cue gọn nhẹ: thời gian là số nguyên mili-giây, không dùng timedelta"""
+	__slots__ = ("index", "start_ms", "end_ms", "content")
+
+	def __init__(self, index: int, start_ms: int, end_ms: int, content: str):
+		self.index = index
+		self.start_ms = start_ms
+		self.end_ms = end_ms
+		self.content = content
+
+	def __repr__(self) -> str:
+		return f"Cue({self.index}, {self.start_ms}, {self.end_ms}, {self.content!r})"
+
+	def __eq__(self, other) -> bool:
+		if not isinstance(other, Cue):
+			return NotImplemented
+		return (self.index, self.start_ms, self.end_ms, self.content) == (other.index, other.start_ms, other.end_ms, other.content)
+
+
+# Giờ là tùy chọn: AI đôi khi trả về "MM:SS,mmm"
+_CUE_TIMING_RE = re.compile(
+	r'(?:(\d{1,2}):)?(\d{1,2}):(\d{2})[,.:](\d{1,3})\s*-->\s*(?:(\d{1,2}):)?(\d{1,2}):(\d{2})[,.:](\d{1,3})'
+)
+
+
+def _ms_to_srt_time(ms: int) -> str:
+	"""Format số mili-giây thành HH:MM:SS,mmm"""
+	hours, ms = divmod(int(ms), 3_600_000)
+	minutes, ms = divmod(ms, 60_000)
+	seconds, ms = divmod(ms, 1000)
+	return f"{hours:02d}:{minutes:02d}:{seconds:02d},{ms:03d}"
+
+
+def parse_srt_cues(srt_content: str) -> List[Cue]:
+	"""
+	Parse SRT thành list Cue (một lượt qua các dòng, chịu được lỗi format).
+
+	Chấp nhận BOM, CRLF, thiếu số thứ tự hoặc giờ, dấu '.' thay cho ',' và các dòng rác giữa các cue
+	(ví dụ lời giải thích của AI). Dòng trống kết thúc phần text của cue.
+	"""
+	cues = []
+	if not srt_content:
+		return cues
+
+	lines = srt_content.replace('\ufeff', '').replace('\r\n', '\n').replace('\r', '\n').split('\n')
+	current = None
+	text_lines = []
+	in_text = False
+	pending_index = None
+
+	for line in lines:
+		stripped = line.strip()
+		match = _CUE_TIMING_RE.match(stripped)
+		if match:
+			if current is not None:
+				# Thiếu dòng trống: số cuối cùng của text thực ra là index của cue mới
+				if len(text_lines) > 1 and text_lines[-1].isdigit():
+					pending_index = int(text_lines.pop())
+				current.content = '\n'.join(text_lines)
+				cues.append(current)
+			h1, m1, s1, ms1, h2, m2, s2, ms2 = match.groups()
+			start_ms = ((int(h1 or 0) * 60 + int(m1)) * 60 + int(s1)) * 1000 + int(ms1.ljust(3, '0'))
+			end_ms = ((int(h2 or 0) * 60 + int(m2)) * 60 + int(s2)) * 1000 + int(ms2.ljust(3, '0'))
+			index = pending_index if pending_index is not None else len(cues) + 1
+			current = Cue(index, start_ms, end_ms, "")
+			text_lines = []
+			in_text = True
+			pending_index = None
+			continue
+		if not stripped:
+			in_text = False
+			continue
+		if in_text:
+			text_lines.append(stripped)
+		elif stripped.isdigit():
+			pending_index = int(stripped)
+		# Các dòng khác nằm ngoài cue (markdown, giải thích...) bị bỏ qua
+
+	if current is not None:
+		current.content = '\n'.join(text_lines)
+		cues.append(current)
+	return cues
+
+
+def compose_srt_cues(cues: List[Cue], reindex: bool = True) -> str:
+	"""
+	Ghi list Cue thành text SRT.
+
+	Với reindex=True (giống srt.compose): sắp xếp theo thời gian, bỏ cue rỗng hoặc có
+	thời gian không hợp lệ và đánh số lại từ 1.
+	"""
+	if reindex:
+		cues = sorted(
+			(cue for cue in cues if cue.content.strip() and 0 <= cue.start_ms < cue.end_ms),
+			key=lambda cue: (cue.start_ms, cue.end_ms),
+		)
+	parts = []
+	for number, cue in enumerate(cues, 1):
+		content = '\n'.join(line for line in cue.content.strip().split('\n') if line.strip())
+		index = number if reindex else cue.index
+		parts.append(f"{index}\n{_ms_to_srt_time(cue.start_ms)} --> {_ms_to_srt_time(cue.end_ms)}\n{content}\n\n")
+	return ''.join(parts)
+
+
+def read_srt_cues(srt_path: Path) -> List[Cue]:
+	"""Đọc file SRT thành list Cue"""
+	return parse_srt_cues(srt_path.read_text(encoding="utf-8"))
+
+
+def write_srt_cues(srt_path: Path, cues: List[Cue]) -> None:
+	"""Ghi list Cue ra file SRT"""
+	srt_path.write_text(compose_srt_cues(cues), encoding="utf-8")
+
+
+# -------------------- STT pre-trim (VAD) --------------------
+
+# webrtcvad chỉ nhận PCM 16-bit mono ở các sample rate này, frame 10 / 20 / 30 ms
+_VAD_SAMPLE_RATES = (8000, 16000, 32000, 48000)
+
+
+def _vad_speech_regions(input_wav: Path, aggressiveness: int, frame_ms: int, smoothing_ms: int,
+                        speech_ratio: float) -> tuple:
+	"""
+	Các đoạn có giọng nói [(start_ms, end_ms)] của WAV, đọc từng frame (không nạp cả file) và phân loại bằng
+	webrtcvad (mô hình giọng nói, không phụ thuộc độ lớn: nhạc to không được coi là giọng, lời nhỏ dưới nhạc
+	không bị bỏ). Làm mượt theo cửa sổ smoothing_ms: vào đoạn giọng khi >= speech_ratio số frame là giọng, ra khi
+	>= 90% không phải (nghiêng về giữ lại: cắt nhầm thì mất luôn lời). Trả về (regions, total_ms).
+	"""
+	import collections
+	import wave
+	import webrtcvad
+
+	vad = webrtcvad.Vad(aggressiveness)
+	with wave.open(str(input_wav), "rb") as wav:
+		if wav.getnchannels() != 1 or wav.getsampwidth() != 2 or wav.getframerate() not in _VAD_SAMPLE_RATES:
+			raise ValueError(f"VAD needs 16-bit mono PCM at {_VAD_SAMPLE_RATES} Hz, got "
+			                 f"{wav.getnchannels()}ch/{wav.getsampwidth() * 8}bit/{wav.getframerate()}Hz")
+		rate = wav.getframerate()
+		samples_per_frame = rate * frame_ms // 1000
+		total_ms = wav.getnframes() * 1000 // rate
+		window = collections.deque(maxlen=max(1, smoothing_ms // frame_ms))
+		regions = []
+		speech_start = None
+		pos = 0
+		while True:
+			frame = wav.readframes(samples_per_frame)
+			if len(frame) < samples_per_frame * 2:
+				break
+			window.append(vad.is_speech(frame, rate))
+			pos += frame_ms
+			voiced = sum(window)
+			if speech_start is None and voiced >= speech_ratio * window.maxlen:
+				speech_start = max(0, pos - len(window) * frame_ms)
+				window.clear()
+			elif speech_start is not None and len(window) - voiced >= 0.9 * window.maxlen:
+				regions.append((speech_start, pos))
+				speech_start = None
+				window.clear()
+		if speech_start is not None:
+			regions.append((speech_start, total_ms))
+	return regions, total_ms
+
+
+def vad_pretrim_wav(input_wav: Path, output_wav: Path, min_silence_ms: int = 2000, padding_ms: int = 300,
+                    aggressiveness: int = 3, frame_ms: int = 30, smoothing_ms: int = 300,
+                    speech_ratio: float = 0.3) -> List[tuple]:
+	"""
+	Cắt các đoạn không có giọng nói (nhạc không lời, im lặng dài) khỏi WAV trước khi upload STT.
+	Cần webrtcvad (pip install webrtcvad); input là WAV của extract_audio_for_stt (16 kHz mono PCM).
+	Chỉ cắt khoảng không giọng dài hơn min_silence_ms, giữ padding_ms mỗi bên.
+
+	Trả về offset map: danh sách (trimmed_start_ms, original_start_ms, duration_ms) cho từng
+	đoạn được giữ lại, dùng để đưa timestamp của AssemblyAI về timeline gốc.
+	"""
+	import wave
+
+	speech, total_ms = _vad_speech_regions(input_wav, aggressiveness, frame_ms, smoothing_ms, speech_ratio)
+
+	# Giữ lại đoạn có giọng (+ padding), gộp các đoạn cách nhau dưới min_silence_ms
+	keep = []
+	for start, end in speech:
+		start, end = max(0, start - padding_ms), min(total_ms, end + padding_ms)
+		if keep and start - keep[-1][1] < min_silence_ms:
+			keep[-1] = (keep[-1][0], max(keep[-1][1], end))
+		else:
+			keep.append((start, end))
+	if not keep:
+		# Không nhận ra giọng nói nào: upload nguyên file thay vì file rỗng
+		keep = [(0, total_ms)]
+
+	offset_map = []
+	trimmed_pos = 0
+	for start, end in keep:
+		offset_map.append((trimmed_pos, start, end - start))
+		trimmed_pos += end - start
+
+	# Chép các đoạn giữ lại theo từng khối, không nạp cả file
+	with wave.open(str(input_wav), "rb") as source, wave.open(str(output_wav), "wb") as target:
+		target.setparams(source.getparams())
+		rate = source.getframerate()
+		for start, end in keep:
+			source.setpos(start * rate // 1000)
+			remaining = (end - start) * rate // 1000
+			while remaining > 0:
+				chunk = source.readframes(min(remaining, rate * 10))
+				if not chunk:
+					break
+				target.writeframes(chunk)
+				remaining -= len(chunk) // source.getsampwidth()
+
+	removed_ms = total_ms - trimmed_pos
+	print(f"✂️ VAD pre-trim: {total_ms / 1000:.1f}s -> {trimmed_pos / 1000:.1f}s "
+	      f"({removed_ms / 1000:.1f}s non-speech removed, {len(keep)} regions)")
+	return offset_map
+
+
+def _vad_remap_ms(ms, offset_map: List[tuple], starts: List[int], is_end: bool = False):
+	"""Đổi một timestamp trên timeline đã cắt về timeline gốc"""
+	if ms is None:
+		return ms
+	# Timestamp kết thúc đúng tại biên thuộc về đoạn trước, không phải đoạn sau
+	idx = (bisect.bisect_left(starts, ms) if is_end else bisect.bisect_right(starts, ms)) - 1
+	idx = max(idx, 0)
+	trimmed_start, original_start, duration = offset_map[idx]
+	return original_start + min(max(ms - trimmed_start, 0), duration)
+
+
+def vad_remap_transcript(json_data: dict, offset_map: List[tuple]) -> dict:
+	"""Đưa start/end của words và utterances trong transcript JSON về timeline gốc (in-place)"""
+	if not offset_map:
+		return json_data
+	starts = [entry[0] for entry in offset_map]
+
+	def _remap_items(items):
+		for item in items or []:
+			if "start" in item:
+				item["start"] = _vad_remap_ms(item["start"], offset_map, starts)
+			if "end" in item:
+				item["end"] = _vad_remap_ms(item["end"], offset_map, starts, is_end=True)
+
+	_remap_items(json_data.get("words"))
+	for key in ("utterances", "speaker_labels"):
+		utterances = json_data.get(key) or []
+		_remap_items(utterances)
+		for utterance in utterances:
+			_remap_items(utterance.get("words"))
+	return json_data
+
+
+def vad_remap_srt(srt_content: str, offset_map: List[tuple]) -> str:
+	"""Đưa timing trong SRT (tải từ AssemblyAI) về timeline gốc"""
+	if not offset_map:
+		return srt_content
+	starts = [entry[0] for entry in offset_map]
+
+	def _to_ms(h, m, s, ms):
+		return ((int(h) * 60 + int(m)) * 60 + int(s)) * 1000 + int(ms)
+
+	def _replace(match):
+		start = _vad_remap_ms(_to_ms(*match.group(1, 2, 3, 4)), offset_map, starts)
+		end = _vad_remap_ms(_to_ms(*match.group(5, 6, 7, 8)), offset_map, starts, is_end=True)
+		return f"{_ms_to_srt_time(start)} --> {_ms_to_srt_time(end)}"
+
+	return re.sub(
+		r"(\d{2}):(\d{2}):(\d{2})[,.](\d{3})\s*-->\s*(\d{2}):(\d{2}):(\d{2})[,.](\d{3})",
+		_replace,
+		srt_content,
+	)
+
+
+def _maybe_vad_pretrim(input_media: Path, config: Optional[dict]) -> tuple:
+	"""Chạy VAD pre-trim nếu được bật trong config; trả về (file để upload, offset map hoặc None)"""
+	if config is not None and not config.get('stt_vad_pretrim', True):
+		return input_media, None
+	try:
+		import webrtcvad  # noqa: F401
+	except ImportError:
+		# Thiếu dependency không được làm hỏng project: upload nguyên file như khi tắt pre-trim
+		print("⚠️ VAD pre-trim skipped: webrtcvad is not installed (pip install webrtcvad), uploading full audio")
+		return input_media, None
+	config = config or {}
+	trimmed_wav = input_media.with_name(f"{input_media.stem}_vad.wav")
+	try:
+		offset_map = vad_pretrim_wav(
+			input_media, trimmed_wav,
+			min_silence_ms=int(config.get('stt_vad_min_silence_ms', 2000)),
+			padding_ms=int(config.get('stt_vad_padding_ms', 300)),
+			aggressiveness=int(config.get('stt_vad_aggressiveness', 3)),
+		)
+	except Exception as e:
+		print(f"⚠️ VAD pre-trim failed, uploading full audio: {e}")
+		trimmed_wav.unlink(missing_ok=True)
+		return input_media, None
+	return trimmed_wav, offset_map
+
+
+def _upload_for_stt(input_media: Path, api_key: str, config: Optional[dict]) -> tuple:
+	"""VAD pre-trim (nếu bật) rồi upload; file tạm đã cắt bị xóa sau upload. Trả về (upload_url, offset map)"""
+	upload_media, offset_map = _maybe_vad_pretrim(input_media, config)
+	try:
+		return assemblyai_upload(upload_media, api_key), offset_map
+	finally:
+		if upload_media != input_media:
+			upload_media.unlink(missing_ok=True)
+
+
 # -------------------- STT (AssemblyAI REST) --------------------
 
-def _file_chunks(path: Path, chunk_size: int = 5_242_880) -> Iterator[bytes]:
+def _file_chunks(path: Path, chunk_size: int = 1_048_576, cancel: Optional[CancelToken] = None) -> Iterator[bytes]:
 	with path.open("rb") as f:
 		while True:
+			# Upload bị ngắt giữa chừng khi job bị hủy (generator chạy trong thread của http_request)
+			if cancel is not None:
+				cancel.check()
 			data = f.read(chunk_size)
 			if not data:
 				break
@@ -216,10 +2080,11 @@ def _file_chunks(path: Path, chunk_size: int = 5_242_880) -> Iterator[bytes]:
 
 def assemblyai_upload(file_path: Path, api_key: str) -> str:
 	print(f"📤 Uploading {file_path.name} to AssemblyAI...")
-	resp = requests.post(
+	resp = http_request(
+		"POST",
 		"https://api.assemblyai.com/v2/upload",
 		headers={"authorization": api_key, "Content-Type": "application/octet-stream"},
-		data=_file_chunks(file_path),
+		data=_file_chunks(file_path, cancel=current_cancel_token()),
 		timeout=3600,
 	)
 	if resp.status_code != 200:
@@ -265,7 +2130,8 @@ def assemblyai_request_transcript(upload_url: str, api_key: str, language_code:
 		payload["language_code"] = language_code
 	
 	print(f"📝 Requesting transcript with config: {payload}")
-	resp = requests.post(
+	resp = http_request(
+		"POST",
 		"https://api.assemblyai.com/v2/transcript",
 		headers={"authorization": api_key, "Content-Type": "application/json"},
 		json=payload,
@@ -291,7 +2157,8 @@ def assemblyai_poll_until_complete(transcript_id: str, api_key: str, poll_interv
 		elapsed = time.time() - start
 		
 		try:
-			resp = requests.get(
+			resp = http_request(
+				"GET",
 				f"https://api.assemblyai.com/v2/transcript/{transcript_id}",
 				headers={"authorization": api_key},
 				timeout=30,
@@ -324,32 +2191,34 @@ def assemblyai_poll_until_complete(transcript_id: str, api_key: str, poll_interv
 				print(f"⏰ AssemblyAI polling timed out after {timeout_sec}s")
 				raise TimeoutError("AssemblyAI transcription timed out")
 			
-			time.sleep(poll_interval_sec)
+			cancel_sleep(poll_interval_sec)
 
 		except requests.exceptions.Timeout:
 			print(f"⚠️ AssemblyAI request timeout on poll #{poll_count}")
 			if elapsed > timeout_sec:
 				raise TimeoutError("AssemblyAI transcription timed out")
-			time.sleep(poll_interval_sec)
+			cancel_sleep(poll_interval_sec)
 		except Exception as e:
 			print(f"❌ AssemblyAI polling exception: {e}")
 			if elapsed > timeout_sec:
 				raise TimeoutError("AssemblyAI transcription timed out")
-			time.sleep(poll_interval_sec)
+			cancel_sleep(poll_interval_sec)
 
 
-def assemblyai_download_srt(transcript_id: str, api_key: str, out_srt: Path, chars_per_caption: int = 200) -> None:
-	"""Download SRT with optimized caption length for complete sentences"""
+def assemblyai_download_srt(transcript_id: str, api_key: str, out_srt: Path, chars_per_caption: int = 200, offset_map: Optional[List[tuple]] = None, words: Optional[list] = None) -> List[Cue]:
+	"""Download SRT with optimized caption length for complete sentences (words: căn thời gian câu theo từ)"""
 	# Thử tải SRT với cấu hình tối ưu cho câu hoàn chỉnh
 	# Sử dụng sentences=true để AssemblyAI tự động chia câu
-	resp = requests.get(
+	resp = http_request(
+		"GET",
 		f"https://api.assemblyai.com/v2/transcript/{transcript_id}/srt?chars_per_caption={chars_per_caption}&sentences=true",
 		headers={"authorization": api_key},
 		timeout=60,
 	)
 	if resp.status_code != 200:
 		# Fallback to basic SRT với chars_per_caption cao hơn
-		resp = requests.get(
+		resp = http_request(
+			"GET",
 			f"https://api.assemblyai.com/v2/transcript/{transcript_id}/srt?chars_per_caption={chars_per_caption}",
 		headers={"authorization": api_key},
 		timeout=60,
@@ -359,18 +2228,51 @@ def assemblyai_download_srt(transcript_id: str, api_key: str, out_srt: Path, cha
 	
 	# Xử lý SRT để chia thành các câu ngắn hơn
 	srt_content = resp.text
-	processed_srt = process_srt_for_better_sentences(srt_content)
+	if offset_map:
+		srt_content = vad_remap_srt(srt_content, offset_map)
+	processed_srt = process_srt_for_better_sentences(srt_content, words=words)
 	
 	out_srt.write_text(processed_srt, encoding="utf-8")
 	print(f"✅ Downloaded and processed SRT with {chars_per_caption} chars per caption and sentences=true")
+	return parse_srt_cues(processed_srt)
 
-def process_srt_for_better_sentences(srt_content: str) -> str:
-	"""Process SRT content to create better sentence segmentation"""
-	import re
-	from datetime import datetime, timedelta
+_SRT_TIMING_RE = re.compile(r'(\d{2}):(\d{2}):(\d{2}),(\d{3})\s*-->\s*(\d{2}):(\d{2}):(\d{2}),(\d{3})')
+_SRT_ENTRY_SPLIT_RE = re.compile(r'\n\s*\n')
+
+
+def _align_sentences_to_words(sentences: list, words: list, word_starts: list, start_ms: int, end_ms: int) -> Optional[list]:
+	"""
+	Lấy thời gian thật của từ đầu/cuối mỗi câu trong caption [start_ms, end_ms).
+	Trả về None nếu số từ không khớp với text caption (khi đó dùng cách chia đều).
+	"""
+	first = bisect.bisect_left(word_starts, start_ms)
+	last = bisect.bisect_left(word_starts, end_ms)
+	sentence_lengths = [len(sentence.split()) for sentence in sentences]
+	if last - first != sum(sentence_lengths) or 0 in sentence_lengths:
+		return None
+
+	timings = []
+	cursor = first
+	for length in sentence_lengths:
+		timings.append((int(words[cursor]["start"]), int(words[cursor + length - 1]["end"])))
+		cursor += length
+	return timings
+
+
+def process_srt_for_better_sentences(srt_content: str, words: Optional[list] = None) -> str:
+	"""
+	Process SRT content to create better sentence segmentation.
+
+	Nếu có words (JSON word-level của AssemblyAI), mỗi câu lấy đúng thời gian của từ đầu
+	và từ cuối; nếu không thì chia đều thời lượng caption cho các câu như trước.
+	"""
+	word_starts = None
+	if words:
+		words = [word for word in words if word.get("start") is not None and word.get("end") is not None]
+		word_starts = [int(word["start"]) for word in words]
 	
 	# Split SRT into entries
-	entries = re.split(r'\n\s*\n', srt_content.strip())
+	entries = _SRT_ENTRY_SPLIT_RE.split(srt_content.strip())
 	processed_entries = []
 	entry_counter = 1
 	
@@ -382,15 +2284,15 @@ def process_srt_for_better_sentences(srt_content: str) -> str:
 		if len(lines) < 3:
 			continue
 			
-		# Parse timing
+		# Parse timing (số nguyên mili-giây)
 		timing_line = lines[1]
-		timing_match = re.match(r'(\d{2}:\d{2}:\d{2},\d{3})\s*-->\s*(\d{2}:\d{2}:\d{2},\d{3})', timing_line)
+		timing_match = _SRT_TIMING_RE.match(timing_line)
 		if not timing_match:
 			continue
-			
-		start_time_str, end_time_str = timing_match.groups()
-		start_time = datetime.strptime(start_time_str, '%H:%M:%S,%f')
-		end_time = datetime.strptime(end_time_str, '%H:%M:%S,%f')
+		
+		h1, m1, s1, ms1, h2, m2, s2, ms2 = map(int, timing_match.groups())
+		start_ms = ((h1 * 60 + m1) * 60 + s1) * 1000 + ms1
+		end_ms = ((h2 * 60 + m2) * 60 + s2) * 1000 + ms2
 		
 		# Get text content
 		text = ' '.join(lines[2:]).strip()
@@ -402,21 +2304,23 @@ def process_srt_for_better_sentences(srt_content: str) -> str:
 			# Single sentence, keep as is
 			processed_entries.append(f"{entry_counter}\n{timing_line}\n{sentences[0]}\n")
 			entry_counter += 1
-		else:
-			# Multiple sentences, split timing
-			total_duration = (end_time - start_time).total_seconds()
+			continue
+		
+		timings = None
+		if word_starts:
+			timings = _align_sentences_to_words(sentences, words, word_starts, start_ms, end_ms)
+		if timings is None:
+			# Multiple sentences, split timing evenly
 			sentence_count = len(sentences)
-			duration_per_sentence = total_duration / sentence_count
-			
-			for i, sentence in enumerate(sentences):
-				sentence_start = start_time + timedelta(seconds=i * duration_per_sentence)
-				sentence_end = start_time + timedelta(seconds=(i + 1) * duration_per_sentence)
-				
-				sentence_start_str = sentence_start.strftime('%H:%M:%S,%f')[:-3]
-				sentence_end_str = sentence_end.strftime('%H:%M:%S,%f')[:-3]
-				
-				processed_entries.append(f"{entry_counter}\n{sentence_start_str} --> {sentence_end_str}\n{sentence.strip()}\n")
-				entry_counter += 1
+			total_duration = end_ms - start_ms
+			timings = [
+				(start_ms + i * total_duration // sentence_count, start_ms + (i + 1) * total_duration // sentence_count)
+				for i in range(sentence_count)
+			]
+		
+		for sentence, (sentence_start, sentence_end) in zip(sentences, timings):
+			processed_entries.append(f"{entry_counter}\n{_ms_to_srt_time(sentence_start)} --> {_ms_to_srt_time(sentence_end)}\n{sentence.strip()}\n")
+			entry_counter += 1
 	
 	return '\n'.join(processed_entries)
 
@@ -465,7 +2369,8 @@ def split_text_into_sentences(text: str) -> list:
 
 def assemblyai_download_json(transcript_id: str, api_key: str) -> dict:
 	"""Download transcript as JSON for better control over sentence segmentation"""
-	resp = requests.get(
+	resp = http_request(
+		"GET",
 		f"https://api.assemblyai.com/v2/transcript/{transcript_id}",
 		headers={"authorization": api_key},
 		timeout=60,
@@ -576,11 +2481,8 @@ def _should_end_sentence_at_utterance(current_text: str, current_utterance: dict
 	return False
 
 
-def json_to_srt_with_utterances(json_data: dict, output_srt: Path) -> None:
+def json_to_srt_with_utterances(json_data: dict, output_srt: Path) -> List[Cue]:
 	"""Convert JSON transcript to SRT using AssemblyAI utterances for complete sentences"""
-	import srt
-	from datetime import timedelta
-	
 	# Lấy utterances từ speaker_labels hoặc utterances
 	utterances = json_data.get("utterances", [])
 	if not utterances:
@@ -596,34 +2498,133 @@ def json_to_srt_with_utterances(json_data: dict, output_srt: Path) -> None:
 	merged_sentences = _merge_utterances_to_sentences(utterances)
 	
 	# Convert to SRT format
-	srt_entries = []
-	for i, sentence in enumerate(merged_sentences, 1):
-		start_time = timedelta(milliseconds=int(sentence["start"]))
-		end_time = timedelta(milliseconds=int(sentence["end"]))
-		
-		srt_entry = srt.Subtitle(
-			index=i,
-			start=start_time,
-			end=end_time,
-			content=sentence["text"].strip()
-		)
-		srt_entries.append(srt_entry)
+	srt_entries = [
+		Cue(i, int(sentence["start"]), int(sentence["end"]), sentence["text"].strip())
+		for i, sentence in enumerate(merged_sentences, 1)
+	]
 	
 	# Write SRT file
 	with open(output_srt, 'w', encoding='utf-8') as f:
-		srt_content = srt.compose(srt_entries)
+		srt_content = compose_srt_cues(srt_entries)
 		# Đảm bảo SRT content sạch và chuẩn format
 		srt_content = srt_content.strip() + '\n'
 		f.write(srt_content)
 	
 	print(f"✅ Created {len(srt_entries)} complete sentences from {len(utterances)} utterances")
+	return srt_entries
+
+
+# Common abbreviations that shouldn't end a sentence
+_SENTENCE_ABBREVIATIONS = frozenset({
+	'mr.', 'mrs.', 'ms.', 'dr.', 'prof.', 'vs.', 'etc.', 'i.e.', 'e.g.', 'a.m.', 'p.m.',
+	'inc.', 'corp.', 'co.', 'ltd.', 'llc.', 'u.s.', 'u.k.', 'e.u.', 'n.a.t.o.',
+	'jan.', 'feb.', 'mar.', 'apr.', 'jun.', 'jul.', 'aug.', 'sep.', 'oct.', 'nov.', 'dec.',
+	'mon.', 'tue.', 'wed.', 'thu.', 'fri.', 'sat.', 'sun.',
+	'st.', 'nd.', 'rd.', 'th.', '1st', '2nd', '3rd', '4th', '5th', '6th', '7th', '8th', '9th', '10th'
+})
+
+# Sentence ending patterns (strong endings)
+_STRONG_ENDINGS = ('.', '!', '?')
+
+# Weak endings (pause but not necessarily sentence end)
+_WEAK_ENDINGS = (',', ';', ':')
+
+# Words that often start new sentences
+_SENTENCE_STARTERS = frozenset({
+	'the', 'a', 'an', 'this', 'that', 'these', 'those', 'i', 'you', 'he', 'she', 'it', 'we', 'they',
+	'my', 'your', 'his', 'her', 'its', 'our', 'their', 'mine', 'yours', 'hers', 'ours', 'theirs',
+	'and', 'but', 'or', 'nor', 'for', 'yet', 'so', 'because', 'although', 'however', 'therefore',
+	'first', 'second', 'third', 'finally', 'next', 'then', 'now', 'here', 'there', 'when', 'where',
+	'why', 'how', 'what', 'which', 'who', 'whom', 'whose'
+})
+
+_NUMBERED_ITEM_RE = re.compile(r'^\d+\.$')
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+def _clean_sentence_text(text: str) -> str:
+	"""Clean and format sentence text"""
+	# Remove extra spaces
+	text = _WHITESPACE_RE.sub(' ', text.strip())
+	# Ensure proper capitalization
+	if text and not text[0].isupper():
+		text = text[0].upper() + text[1:]
+	return text
+
+
+def segment_words_into_sentences(words: list, min_length: int = 20, max_length: int = 150) -> list:
+	"""
+	Chia danh sách words của AssemblyAI thành câu hoàn chỉnh.
+
+	Chạy tuyến tính theo số từ: chỉ giữ chỉ số từ đầu câu và bộ đếm số từ đang chạy,
+	không nối chuỗi hay split lại cả câu sau mỗi từ. Trả về list {"text", "start", "end"}.
+	"""
+	sentences = []
+	word_count = len(words)
+	texts = [word.get("text", "") for word in words]
+
+	def _flush(first: int, last: int, start, end) -> None:
+		cleaned_text = _clean_sentence_text(' '.join(texts[first:last + 1]))
+		if cleaned_text and len(cleaned_text.strip()) > 5:  # Minimum meaningful sentence
+			sentences.append({"text": cleaned_text, "start": start, "end": end})
+
+	sentence_first = None
+	sentence_words = 0
+	has_content = False
+	current_start = None
+	current_end = None
+
+	for i in range(word_count):
+		word_text = texts[i]
+		if sentence_first is None:
+			sentence_first = i
+			current_start = words[i].get("start", 0)
+		current_end = words[i].get("end", 0)
+		sentence_words += len(word_text.split())
+		has_content = has_content or bool(word_text.strip())
+
+		# Check if we should end the sentence
+		current_word = word_text.lower()
+		if current_word.endswith(_STRONG_ENDINGS):
+			# Don't split on abbreviations or numbers like "1.", "2."
+			should_end = current_word not in _SENTENCE_ABBREVIATIONS and not _NUMBERED_ITEM_RE.match(current_word)
+		elif sentence_words > max_length:  # Very long sentence, force break
+			should_end = True
+		else:
+			next_word = texts[i + 1].lower() if i + 1 < word_count else ""
+			should_end = (next_word in _SENTENCE_STARTERS and
+				sentence_words > min_length and
+				not current_word.endswith(_WEAK_ENDINGS))
+
+		if should_end:
+			_flush(sentence_first, i, current_start, current_end)
+			sentence_first = None
+			sentence_words = 0
+			has_content = False
+
+	# Add remaining text as last sentence
+	if sentence_first is not None and has_content:
+		_flush(sentence_first, word_count - 1, current_start or 0, current_end or 0)
+
+	# Merge very short sentences with previous ones (gom text theo list, join một lần)
+	merged_sentences = []
+	merged_parts = []
+	for sentence in sentences:
+		if len(sentence["text"].split()) < min_length and merged_sentences:
+			merged_parts[-1].append(sentence["text"])
+			merged_sentences[-1]["end"] = sentence["end"]
+		else:
+			merged_sentences.append(sentence)
+			merged_parts.append([sentence["text"]])
+	for sentence, parts in zip(merged_sentences, merged_parts):
+		if len(parts) > 1:
+			sentence["text"] = " ".join(parts)
+
+	return merged_sentences
+
 
-def json_to_srt_with_sentences(json_data: dict, output_srt: Path, config: dict = None) -> None:
+def json_to_srt_with_sentences(json_data: dict, output_srt: Path, config: dict = None) -> List[Cue]:
 	"""Convert JSON transcript to SRT with complete sentences based on semantic meaning"""
-	import srt
-	from datetime import timedelta
-	import re
-	
 	text = json_data.get("text", "")
 	words = json_data.get("words", [])
 	
@@ -631,146 +2632,23 @@ def json_to_srt_with_sentences(json_data: dict, output_srt: Path, config: dict =
 		# Fallback to empty SRT
 		with open(output_srt, 'w', encoding='utf-8') as f:
 			f.write("1\n00:00:00,000 --> 00:00:05,000\n[No audio detected]\n\n")
-		return
-	
-	# Common abbreviations that shouldn't end a sentence
-	ABBREVIATIONS = {
-		'mr.', 'mrs.', 'ms.', 'dr.', 'prof.', 'vs.', 'etc.', 'i.e.', 'e.g.', 'a.m.', 'p.m.',
-		'inc.', 'corp.', 'co.', 'ltd.', 'llc.', 'u.s.', 'u.k.', 'e.u.', 'n.a.t.o.',
-		'jan.', 'feb.', 'mar.', 'apr.', 'jun.', 'jul.', 'aug.', 'sep.', 'oct.', 'nov.', 'dec.',
-		'mon.', 'tue.', 'wed.', 'thu.', 'fri.', 'sat.', 'sun.',
-		'st.', 'nd.', 'rd.', 'th.', '1st', '2nd', '3rd', '4th', '5th', '6th', '7th', '8th', '9th', '10th'
-	}
-	
-	# Sentence ending patterns (strong endings)
-	STRONG_ENDINGS = ['.', '!', '?']
-	
-	# Weak endings (pause but not necessarily sentence end)
-	WEAK_ENDINGS = [',', ';', ':']
-	
-	# Words that often start new sentences
-	SENTENCE_STARTERS = {
-		'the', 'a', 'an', 'this', 'that', 'these', 'those', 'i', 'you', 'he', 'she', 'it', 'we', 'they',
-		'my', 'your', 'his', 'her', 'its', 'our', 'their', 'mine', 'yours', 'his', 'hers', 'ours', 'theirs',
-		'and', 'but', 'or', 'nor', 'for', 'yet', 'so', 'because', 'although', 'however', 'therefore',
-		'first', 'second', 'third', 'finally', 'next', 'then', 'now', 'here', 'there', 'when', 'where',
-		'why', 'how', 'what', 'which', 'who', 'whom', 'whose'
-	}
-	
-	def is_sentence_end(current_text, next_word, current_word, config=None):
-		"""Determine if current position should end a sentence"""
-		current_text = current_text.strip().lower()
-		current_word = current_word.lower()
-		next_word = next_word.lower() if next_word else ""
-		
-		# Check for strong sentence endings
-		if current_word.endswith(tuple(STRONG_ENDINGS)):
-			# Don't split on abbreviations
-			if current_word in ABBREVIATIONS:
-				return False
-			# Don't split on numbers like "1.", "2."
-			if re.match(r'^\d+\.$', current_word):
-				return False
-			return True
-		
-		# Get config values
-		min_length = config.get('min_sentence_length', 20) if config else 20
-		max_length = config.get('max_sentence_length', 150) if config else 150
-		
-		# Check for natural sentence boundaries
-		if len(current_text.split()) > max_length:  # Very long sentence, force break
-			return True
-		
-		# Check if next word is a sentence starter and we have a reasonable sentence
-		if (next_word in SENTENCE_STARTERS and 
-			len(current_text.split()) > min_length and  # Minimum sentence length
-			not current_word.endswith(tuple(WEAK_ENDINGS))):  # Don't break on weak endings
-			return True
-		
-		# Check for pause patterns (longer pause might indicate sentence end)
-		return False
-	
-	def clean_sentence(text):
-		"""Clean and format sentence text"""
-		# Remove extra spaces
-		text = re.sub(r'\s+', ' ', text.strip())
-		# Ensure proper capitalization
-		if text and not text[0].isupper():
-			text = text[0].upper() + text[1:]
-		return text
-	
-	# Build sentences with better logic
-	sentences = []
-	current_sentence = ""
-	current_start = None
-	current_end = None
-	
-	for i, word in enumerate(words):
-		word_text = word.get("text", "")
-		
-		if current_start is None:
-			current_start = word.get("start", 0)
-		
-		current_sentence += word_text + " "
-		current_end = word.get("end", 0)
-		
-		# Check if we should end the sentence
-		next_word = words[i + 1].get("text", "") if i + 1 < len(words) else ""
-		should_end = is_sentence_end(current_sentence, next_word, word_text, config)
-		
-		if should_end:
-			cleaned_text = clean_sentence(current_sentence)
-			if cleaned_text and len(cleaned_text.strip()) > 5:  # Minimum meaningful sentence
-				sentences.append({
-					"text": cleaned_text,
-					"start": current_start,
-					"end": current_end
-				})
-			current_sentence = ""
-			current_start = None
-			current_end = None
-	
-	# Add remaining text as last sentence
-	if current_sentence.strip():
-		cleaned_text = clean_sentence(current_sentence)
-		if cleaned_text and len(cleaned_text.strip()) > 5:
-			sentences.append({
-				"text": cleaned_text,
-				"start": current_start or 0,
-				"end": current_end or 0
-			})
+		return [Cue(1, 0, 5000, "[No audio detected]")]
 	
-	# Merge very short sentences with previous ones
-	merged_sentences = []
+	# Get config values
 	min_length = config.get('min_sentence_length', 20) if config else 20
+	max_length = config.get('max_sentence_length', 150) if config else 150
 	
-	for sentence in sentences:
-		word_count = len(sentence["text"].split())
-		if word_count < min_length and merged_sentences:
-			# Merge with previous sentence
-			prev = merged_sentences[-1]
-			prev["text"] += " " + sentence["text"]
-			prev["end"] = sentence["end"]
-		else:
-			merged_sentences.append(sentence)
+	merged_sentences = segment_words_into_sentences(words, min_length, max_length)
 	
 	# Convert to SRT format
-	srt_entries = []
-	for i, sentence in enumerate(merged_sentences, 1):
-		start_time = timedelta(milliseconds=int(sentence["start"]))
-		end_time = timedelta(milliseconds=int(sentence["end"]))
-		
-		srt_entry = srt.Subtitle(
-			index=i,
-			start=start_time,
-			end=end_time,
-			content=sentence["text"]
-		)
-		srt_entries.append(srt_entry)
+	srt_entries = [
+		Cue(i, int(sentence["start"]), int(sentence["end"]), sentence["text"])
+		for i, sentence in enumerate(merged_sentences, 1)
+	]
 	
 	# Write SRT file
 	with open(output_srt, 'w', encoding='utf-8') as f:
-		srt_content = srt.compose(srt_entries)
+		srt_content = compose_srt_cues(srt_entries)
 		# Đảm bảo SRT content sạch và chuẩn format
 		srt_content = srt_content.strip() + '\n'
 		f.write(srt_content)
@@ -784,10 +2662,11 @@ def json_to_srt_with_sentences(json_data: dict, output_srt: Path, config: dict =
 			print("✅ AI-enhanced sentence segmentation applied")
 		except Exception as e:
 			print(f"⚠️ AI segmentation failed: {e}")
+	
+	return srt_entries
 
 def improve_sentences_with_ai(srt_entries, config):
 	"""Use AI to improve sentence segmentation and merge fragmented sentences"""
-	import requests
 	
 	# Extract text from SRT entries
 	texts = [entry.content for entry in srt_entries]
@@ -814,7 +2693,7 @@ Hãy trả về văn bản đã được chia câu hoàn chỉnh:"""
 		headers = {"Content-Type": "application/json", "X-goog-api-key": config.get('gemini_api_key', '')}
 		payload = {"contents": [{"parts": [{"text": prompt}]}]}
 		
-		resp = requests.post(url, headers=headers, json=payload, timeout=60)
+		resp = http_request("POST", url, headers=headers, json=payload, timeout=60)
 		if resp.status_code == 200:
 			improved_text = resp.json()["candidates"][0]["content"]["parts"][0]["text"]
 			# TODO: Parse improved text and update SRT entries
@@ -827,24 +2706,28 @@ Hãy trả về văn bản đã được chia câu hoàn chỉnh:"""
 			"messages": [{"role": "user", "content": prompt}]
 		}
 		
-		resp = requests.post(url, headers=headers, json=payload, timeout=60)
+		resp = http_request("POST", url, headers=headers, json=payload, timeout=60)
 		if resp.status_code == 200:
 			improved_text = resp.json()["choices"][0]["message"]["content"]
 			# TODO: Parse improved text and update SRT entries
 			print("AI improvement applied")
 
 
-def stt_assemblyai(input_media: Path, output_srt: Path, api_key: str, on_update: Optional[Callable[[str], None]] = None, language_code: str = "en", config: dict = None) -> None:
-	"""STT với AssemblyAI sử dụng cấu hình tối ưu cho câu hoàn chỉnh"""
+def stt_assemblyai(input_media: Path, output_srt: Path, api_key: str, on_update: Optional[Callable[[str], None]] = None, language_code: str = "en", config: dict = None) -> List[Cue]:
+	"""STT với AssemblyAI sử dụng cấu hình tối ưu cho câu hoàn chỉnh (trả về cue của output_srt)"""
 	_notify(on_update, "stt_upload")
-	upload_url = assemblyai_upload(input_media, api_key)
+	upload_url, offset_map = _upload_for_stt(input_media, api_key, config)
 	_notify(on_update, "stt_transcribe")
 	transcript_id = assemblyai_request_transcript(upload_url, api_key, language_code=language_code, config=config)
 	assemblyai_poll_until_complete(transcript_id, api_key)
 	
 	# Sử dụng JSON với utterances để có câu hoàn chỉnh từ AssemblyAI
+	json_data = {}
 	try:
 		json_data = assemblyai_download_json(transcript_id, api_key)
+		if offset_map:
+			vad_remap_transcript(json_data, offset_map)
+		_persist_word_timings(json_data, output_srt)
 		
 		# Thử sử dụng utterances trước (câu hoàn chỉnh từ AssemblyAI)
 		if json_data.get("utterances") or json_data.get("speaker_labels"):
@@ -857,17 +2740,172 @@ def stt_assemblyai(input_media: Path, output_srt: Path, api_key: str, on_update:
 	except Exception as e:
 		print(f"⚠️ JSON processing failed, falling back to SRT: {e}")
 		# Fallback to SRT if JSON processing fails
-	assemblyai_download_srt(transcript_id, api_key, output_srt)
+	return assemblyai_download_srt(transcript_id, api_key, output_srt, offset_map=offset_map, words=json_data.get("words"))
 
-def stt_assemblyai_legacy(input_media: Path, output_srt: Path, api_key: str, on_update: Optional[Callable[[str], None]] = None, language_code: str = "en", config: dict = None) -> None:
+def stt_assemblyai_legacy(input_media: Path, output_srt: Path, api_key: str, on_update: Optional[Callable[[str], None]] = None, language_code: str = "en", config: dict = None) -> List[Cue]:
 	"""STT với AssemblyAI sử dụng SRT truyền thống (fallback)"""
 	_notify(on_update, "stt_upload")
-	upload_url = assemblyai_upload(input_media, api_key)
+	upload_url, offset_map = _upload_for_stt(input_media, api_key, config)
 	_notify(on_update, "stt_transcribe")
 	transcript_id = assemblyai_request_transcript(upload_url, api_key, language_code=language_code, config=config)
 	assemblyai_poll_until_complete(transcript_id, api_key)
 	chars_per_caption = config.get('stt_chars_per_caption', 80) if config else 80
-	assemblyai_download_srt(transcript_id, api_key, output_srt, chars_per_caption)
+	# Word-level JSON để căn thời gian từng câu theo từ thật thay vì chia đều
+	words = None
+	try:
+		json_data = assemblyai_download_json(transcript_id, api_key)
+		if offset_map:
+			vad_remap_transcript(json_data, offset_map)
+		_persist_word_timings(json_data, output_srt)
+		words = json_data.get("words")
+	except Exception as e:
+		print(f"⚠️ Word-level JSON unavailable, using uniform sentence timing: {e}")
+	return assemblyai_download_srt(transcript_id, api_key, output_srt, chars_per_caption, offset_map=offset_map, words=words)
+
+
+# -------------------- Word timings (columnar) --------------------
+
+WORD_TIMINGS_FILE = "stt_words.bin"
+_WORD_TIMINGS_MAGIC = b"ATWORDS1"
+_WORD_TIMINGS_ALIGN = 64
+
+
+class WordTimings:
+	"""
+	Word-level timing của STT ở dạng cột (memory-mapped, chỉ đọc).
+
+	start_ms/end_ms (int32), confidence (float32), text_offsets (int64, n + 1) và
+	text_blob (uint8, UTF-8): text của từ i là text_blob[text_offsets[i]:text_offsets[i + 1]].
+	"""
+	__slots__ = ("start_ms", "end_ms", "confidence", "text_offsets", "text_blob")
+
+	def __init__(self, start_ms, end_ms, confidence, text_offsets, text_blob):
+		self.start_ms = start_ms
+		self.end_ms = end_ms
+		self.confidence = confidence
+		self.text_offsets = text_offsets
+		self.text_blob = text_blob
+
+	def __len__(self) -> int:
+		return len(self.start_ms)
+
+	def text(self, i: int) -> str:
+		return bytes(self.text_blob[self.text_offsets[i]:self.text_offsets[i + 1]]).decode("utf-8")
+
+	def texts(self) -> List[str]:
+		blob = bytes(self.text_blob)
+		offsets = self.text_offsets.tolist()
+		return [blob[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(len(self))]
+
+	def to_words(self) -> list:
+		"""Trả về list dict giống json_data["words"] của AssemblyAI"""
+		return [
+			{"text": text, "start": start, "end": end, "confidence": confidence}
+			for text, start, end, confidence in zip(
+				self.texts(), self.start_ms.tolist(), self.end_ms.tolist(), self.confidence.tolist()
+			)
+		]
+
+
+def save_word_timings(words: list, path: Path) -> None:
+	"""Ghi words của AssemblyAI ra một file cột: header JSON + các mảng NumPy căn lề 64 byte"""
+	import json
+	import numpy as np
+
+	# Từ không có timestamp không đặt được lên timeline (coi là 0 sẽ tạo từ giả ở đầu video)
+	timed = [word for word in words if word.get("start") is not None and word.get("end") is not None]
+	if len(timed) < len(words):
+		print(f"⚠️ Skipping {len(words) - len(timed)} word(s) without timestamps")
+	words = timed
+	encoded = [(word.get("text") or "").encode("utf-8") for word in words]
+	text_offsets = np.zeros(len(words) + 1, dtype="<i8")
+	if encoded:
+		np.cumsum([len(text) for text in encoded], out=text_offsets[1:])
+	columns = {
+		"start_ms": np.array([int(word["start"]) for word in words], dtype="<i4"),
+		"end_ms": np.array([int(word["end"]) for word in words], dtype="<i4"),
+		"confidence": np.array([float(word.get("confidence") or 0.0) for word in words], dtype="<f4"),
+		"text_offsets": text_offsets,
+		"text_blob": np.frombuffer(b"".join(encoded), dtype="u1"),
+	}
+
+	def _align(n):
+		return (n + _WORD_TIMINGS_ALIGN - 1) // _WORD_TIMINGS_ALIGN * _WORD_TIMINGS_ALIGN
+
+	# Tính offset của từng cột sau header (header có độ dài cố định sau khi căn lề)
+	layout = {}
+	header_size = _WORD_TIMINGS_ALIGN * 8
+	position = header_size
+	for name, array in columns.items():
+		layout[name] = [position, array.dtype.str, int(array.shape[0])]
+		position = _align(position + array.nbytes)
+	header = json.dumps({"count": len(words), "columns": layout}).encode("utf-8")
+	if len(_WORD_TIMINGS_MAGIC) + 4 + len(header) > header_size:
+		raise RuntimeError("Word timings header too large")
+
+	tmp_path = path.with_name(path.name + ".tmp")
+	with tmp_path.open("wb") as f:
+		f.write(_WORD_TIMINGS_MAGIC)
+		f.write(len(header).to_bytes(4, "little"))
+		f.write(header)
+		for name, array in columns.items():
+			f.seek(layout[name][0])
+			f.write(array.tobytes())
+		f.truncate(max(position, header_size))
+	os.replace(tmp_path, path)
+
+
+def load_word_timings(path: Path) -> WordTimings:
+	"""Mở file word timings bằng memory mapping (không parse JSON, không copy dữ liệu)"""
+	import json
+	import numpy as np
+
+	with path.open("rb") as f:
+		if f.read(len(_WORD_TIMINGS_MAGIC)) != _WORD_TIMINGS_MAGIC:
+			raise ValueError(f"Not a word timings file: {path}")
+		header_len = int.from_bytes(f.read(4), "little")
+		header = json.loads(f.read(header_len).decode("utf-8"))
+
+	arrays = {}
+	for name, (offset, dtype, length) in header["columns"].items():
+		if length == 0:
+			arrays[name] = np.zeros(0, dtype=dtype)
+		else:
+			arrays[name] = np.memmap(str(path), dtype=dtype, mode="r", offset=offset, shape=(length,))
+	return WordTimings(**arrays)
+
+
+def _persist_word_timings(json_data: dict, output_srt: Path) -> None:
+	"""Lưu words cạnh file SRT để các bước sau dùng lại (lỗi ở đây không làm hỏng STT)"""
+	words = json_data.get("words") or []
+	if not words:
+		return
+	try:
+		save_word_timings(words, output_srt.parent / WORD_TIMINGS_FILE)
+		print(f"💾 Saved {len(words)} word timings to {WORD_TIMINGS_FILE}")
+	except Exception as e:
+		print(f"⚠️ Could not save word timings: {e}")
+
+
+def speech_regions_from_word_timings(timings: WordTimings, min_gap_ms: int = 400) -> List[tuple]:
+	"""Các đoạn có lời (start_ms, end_ms) dựa trên khoảng trống giữa các từ >= min_gap_ms"""
+	import numpy as np
+
+	if len(timings) == 0:
+		return []
+	gaps = np.asarray(timings.start_ms[1:]) - np.asarray(timings.end_ms[:-1])
+	breaks = np.nonzero(gaps >= min_gap_ms)[0]
+	region_starts = np.concatenate(([0], breaks + 1))
+	region_ends = np.concatenate((breaks, [len(timings) - 1]))
+	return list(zip(np.asarray(timings.start_ms)[region_starts].tolist(), np.asarray(timings.end_ms)[region_ends].tolist()))
+
+
+def word_timings_to_srt(words_path: Path, output_srt: Path, config: dict = None) -> List[Cue]:
+	"""Chia câu lại từ file word timings đã lưu, không cần tải lại transcript từ AssemblyAI"""
+	timings = load_word_timings(words_path)
+	words = timings.to_words()
+	text = " ".join(word["text"] for word in words)
+	return json_to_srt_with_sentences({"text": text, "words": words}, output_srt, config)
 
 
 # -------------------- Translation (Gemini) --------------------
@@ -894,22 +2932,22 @@ def _gemini_generate_text(api_key: str, model: str, text: str) -> str:
 	max_retries = 3
 	for attempt in range(max_retries):
 		try:
-			resp = requests.post(url, headers=headers, json=payload, timeout=120)
+			resp = http_request("POST", url, headers=headers, json=payload, timeout=120)
 			if resp.status_code == 429:
 				# Rate limit - wait longer
 				wait_time = 60 if attempt < max_retries - 1 else 30
-				time.sleep(wait_time)
+				cancel_sleep(wait_time)
 				continue
 			break
 		except requests.exceptions.Timeout:
 			if attempt < max_retries - 1:
-				time.sleep(30)  # Wait before retry
+				cancel_sleep(30)  # Wait before retry
 				continue
 			else:
 				raise RuntimeError("Gemini API timeout after multiple retries")
 		except requests.exceptions.RequestException as e:
 			if attempt < max_retries - 1:
-				time.sleep(30)
+				cancel_sleep(30)
 				continue
 			else:
 				raise RuntimeError(f"Gemini API connection error: {e}")
@@ -954,22 +2992,22 @@ def _deepseek_generate_text(api_key: str, model: str, text: str) -> str:
 	max_retries = 3
 	for attempt in range(max_retries):
 		try:
-			resp = requests.post(url, headers=headers, json=payload, timeout=120)
+			resp = http_request("POST", url, headers=headers, json=payload, timeout=120)
 			if resp.status_code == 429:
 				# Rate limit - wait longer
 				wait_time = 60 if attempt < max_retries - 1 else 30
-				time.sleep(wait_time)
+				cancel_sleep(wait_time)
 				continue
 			break
 		except requests.exceptions.Timeout:
 			if attempt < max_retries - 1:
-				time.sleep(30)  # Wait before retry
+				cancel_sleep(30)  # Wait before retry
 				continue
 			else:
 				raise RuntimeError("DeepSeek API timeout after multiple retries")
 		except requests.exceptions.RequestException as e:
 			if attempt < max_retries - 1:
-				time.sleep(30)
+				cancel_sleep(30)
 				continue
 			else:
 				raise RuntimeError(f"DeepSeek API connection error: {e}")
@@ -1010,7 +3048,7 @@ Hãy trả về SRT đã được cải thiện segmentation. CHÍNH XÁC format
 	}
 	
 	try:
-		response = requests.post(url, headers=headers, json=payload, timeout=60)
+		response = http_request("POST", url, headers=headers, json=payload, timeout=60)
 		if response.status_code == 200:
 			result = response.json()
 			improved_srt = result["candidates"][0]["content"]["parts"][0]["text"].strip()
@@ -1061,21 +3099,21 @@ Hãy trả về SRT đã được dịch sang tiếng Việt với format giốn
 	max_retries = 3
 	for attempt in range(max_retries):
 		try:
-			resp = requests.post(url, headers=headers, json=payload, timeout=120)
+			resp = http_request("POST", url, headers=headers, json=payload, timeout=120)
 			if resp.status_code == 429:
 				wait_time = 60 if attempt < max_retries - 1 else 30
-				time.sleep(wait_time)
+				cancel_sleep(wait_time)
 				continue
 			break
 		except requests.exceptions.Timeout:
 			if attempt < max_retries - 1:
-				time.sleep(30)
+				cancel_sleep(30)
 				continue
 			else:
 				raise RuntimeError("Gemini API timeout after multiple retries")
 		except requests.exceptions.RequestException as e:
 			if attempt < max_retries - 1:
-				time.sleep(30)
+				cancel_sleep(30)
 				continue
 			else:
 				raise RuntimeError(f"Gemini API connection error: {e}")
@@ -1145,21 +3183,21 @@ Hãy trả về SRT đã được dịch sang tiếng Việt với format giốn
 	max_retries = 3
 	for attempt in range(max_retries):
 		try:
-			resp = requests.post(url, headers=headers, json=payload, timeout=120)
+			resp = http_request("POST", url, headers=headers, json=payload, timeout=120)
 			if resp.status_code == 429:
 				wait_time = 60 if attempt < max_retries - 1 else 30
-				time.sleep(wait_time)
+				cancel_sleep(wait_time)
 				continue
 			break
 		except requests.exceptions.Timeout:
 			if attempt < max_retries - 1:
-				time.sleep(30)
+				cancel_sleep(30)
 				continue
 			else:
 				raise RuntimeError("DeepSeek API timeout after multiple retries")
 		except requests.exceptions.RequestException as e:
 			if attempt < max_retries - 1:
-				time.sleep(30)
+				cancel_sleep(30)
 				continue
 			else:
 				raise RuntimeError(f"DeepSeek API connection error: {e}")
@@ -1176,7 +3214,8 @@ Hãy trả về SRT đã được dịch sang tiếng Việt với format giốn
 	return _clean_ai_srt_response(response_text)
 
 
-def translate_srt_ai(input_srt: Path, output_srt: Path, model: str, api_key: Optional[str] = None, provider: str = "gemini", config: dict = None) -> None:
+def translate_srt_ai(input_srt: Path, output_srt: Path, model: str, api_key: Optional[str] = None, provider: str = "gemini", config: dict = None, cues: Optional[List[Cue]] = None) -> List[Cue]:
+	"""Dịch SRT; nếu có cues (từ bước trước trong cùng lần chạy) thì không đọc lại file. Trả về cue đã dịch."""
 	if provider == "gemini":
 		api_key = api_key or os.getenv("GOOGLE_GEMINI_API_KEY")
 		if not api_key:
@@ -1188,9 +3227,12 @@ def translate_srt_ai(input_srt: Path, output_srt: Path, model: str, api_key: Opt
 	else:
 		raise ValueError(f"Unsupported provider: {provider}")
 	
-	# Đọc toàn bộ SRT
-	with input_srt.open("r", encoding="utf-8") as f:
-		srt_content = f.read()
+	# Đọc toàn bộ SRT (dùng cue trong bộ nhớ nếu có)
+	if cues is not None:
+		srt_content = compose_srt_cues(cues)
+	else:
+		with input_srt.open("r", encoding="utf-8") as f:
+			srt_content = f.read()
 	
 	# Cải thiện segmentation trước khi dịch nếu được bật
 	if provider == "gemini" and config and config.get('use_ai_segmentation', False):
@@ -1211,6 +3253,8 @@ def translate_srt_ai(input_srt: Path, output_srt: Path, model: str, api_key: Opt
 	# Ghi file dịch
 	with output_srt.open("w", encoding="utf-8") as f:
 		f.write(translated_srt)
+	
+	return parse_srt_cues(translated_srt)
 
 
 # -------------------- TTS (ElevenLabs) --------------------
@@ -1231,12 +3275,12 @@ def elevenlabs_tts_to_segment(api_key: str, voice_id: str, model_id: str, text:
 	max_retries = 3
 	for attempt in range(max_retries):
 		try:
-			resp = requests.post(url, headers=headers, json=payload, timeout=120)
+			resp = http_request("POST", url, headers=headers, json=payload, timeout=120)
 			if resp.status_code == 429:
 				# Rate limit - wait longer
 				wait_time = 60 if attempt < max_retries - 1 else 30
 				print(f"ElevenLabs rate limit, waiting {wait_time}s... (attempt {attempt + 1}/{max_retries})")
-				time.sleep(wait_time)
+				cancel_sleep(wait_time)
 				continue
 			elif resp.status_code == 401:
 				# Unauthorized - API key lỗi
@@ -1253,14 +3297,14 @@ def elevenlabs_tts_to_segment(api_key: str, voice_id: str, model_id: str, text:
 		except requests.exceptions.Timeout:
 			if attempt < max_retries - 1:
 				print(f"ElevenLabs timeout, retrying... (attempt {attempt + 1}/{max_retries})")
-				time.sleep(30)
+				cancel_sleep(30)
 				continue
 			else:
 				raise RuntimeError("ElevenLabs API timeout after multiple retries")
 		except requests.exceptions.RequestException as e:
 			if attempt < max_retries - 1:
 				print(f"ElevenLabs connection error, retrying... (attempt {attempt + 1}/{max_retries})")
-				time.sleep(30)
+				cancel_sleep(30)
 				continue
 			else:
 				raise RuntimeError(f"ElevenLabs API connection error: {e}")
@@ -1334,22 +3378,10 @@ def _clean_ai_srt_response(response_text: str) -> str:
 	return _clean_srt_content(result)
 
 
-def srt_to_aligned_audio_elevenlabs(input_srt: Path, output_audio_wav: Path, api_key: str, voice_id: str, model_id: str) -> None:
+def srt_to_aligned_audio_elevenlabs(input_srt: Path, output_audio_wav: Path, api_key: str, voice_id: str, model_id: str, cues: Optional[List[Cue]] = None) -> None:
 	try:
-		with input_srt.open("r", encoding="utf-8") as f:
-			srt_content = f.read().strip()
-		
-		# Clean SRT content để tránh lỗi parsing
-		srt_content = _clean_srt_content(srt_content)
-		if not srt_content:
-			print("Warning: SRT file is empty")
-			AudioSegment.silent(duration=1000).export(str(output_audio_wav), format="wav")
-			return
-		
-		# Debug: in nội dung SRT để kiểm tra
-		print(f"SRT content preview: {repr(srt_content[:200])}")
-		
-		subtitles = list(srt.parse(srt_content))
+		# Dùng cue trong bộ nhớ nếu bước trước đã truyền sang, không thì đọc file
+		subtitles = cues if cues is not None else read_srt_cues(input_srt)
 		if not subtitles:
 			print("Warning: No subtitles found in SRT file")
 			AudioSegment.silent(duration=1000).export(str(output_audio_wav), format="wav")
@@ -1362,9 +3394,10 @@ def srt_to_aligned_audio_elevenlabs(input_srt: Path, output_audio_wav: Path, api
 		print(f"SRT file path: {input_srt}")
 		# Tạo audio silent thay thế
 		AudioSegment.silent(duration=5000).export(str(output_audio_wav), format="wav")
+		mark_artifact_incomplete("could not read SRT")
 		return
 	
-	last_end_ms = int(subtitles[-1].end.total_seconds() * 1000)
+	last_end_ms = subtitles[-1].end_ms
 	timeline = AudioSegment.silent(duration=last_end_ms + 1000)
 	
 	# Đếm số segment thành công và thất bại
@@ -1372,6 +3405,7 @@ def srt_to_aligned_audio_elevenlabs(input_srt: Path, output_audio_wav: Path, api
 	failed_count = 0
 	
 	for sub in tqdm(subtitles, desc="Synthesizing TTS (ElevenLabs)"):
+		check_cancelled()
 		content = _sanitize_tts_text(sub.content)
 		# Skip empty or accidental numeric-only fragments
 		if (not content) or content.isdigit():
@@ -1379,19 +3413,18 @@ def srt_to_aligned_audio_elevenlabs(input_srt: Path, output_audio_wav: Path, api
 		
 		try:
 			segment = elevenlabs_tts_to_segment(api_key, voice_id, model_id, content)
-			start_ms = int(sub.start.total_seconds() * 1000)
-			timeline = timeline.overlay(segment, position=start_ms)
+			timeline = timeline.overlay(segment, position=sub.start_ms)
 			success_count += 1
 		except Exception as e:
 			print(f"ElevenLabs TTS failed for text '{content[:50]}...': {e}")
 			failed_count += 1
 			# Tạo silent segment thay thế
-			silent_duration = int((sub.end - sub.start).total_seconds() * 1000)
-			silent_segment = AudioSegment.silent(duration=silent_duration)
-			start_ms = int(sub.start.total_seconds() * 1000)
-			timeline = timeline.overlay(silent_segment, position=start_ms)
+			silent_segment = AudioSegment.silent(duration=sub.end_ms - sub.start_ms)
+			timeline = timeline.overlay(silent_segment, position=sub.start_ms)
 	
 	print(f"ElevenLabs TTS completed: {success_count} successful, {failed_count} failed")
+	if failed_count:
+		mark_artifact_incomplete(f"{failed_count} ElevenLabs TTS segments failed")
 	
 	# Kiểm tra xem có audio nào được tạo không
 	if success_count == 0:
@@ -1430,13 +3463,13 @@ def fpt_ai_tts_to_segment(api_key: str, voice: str, speed: str, text: str, forma
 	for attempt in range(max_retries):
 		try:
 			# FPT AI yêu cầu data dạng text UTF-8
-			response = requests.post(url, data=text.encode('utf-8'), headers=headers, timeout=60, proxies=proxies)
+			response = http_request("POST", url, data=text.encode('utf-8'), headers=headers, timeout=60, proxies=proxies)
 			
 			if response.status_code == 429:
 				# Rate limit
 				wait_time = 30 if attempt < max_retries - 1 else 15
 				print(f"FPT AI rate limit, waiting {wait_time}s... (attempt {attempt + 1}/{max_retries})")
-				time.sleep(wait_time)
+				cancel_sleep(wait_time)
 				continue
 			elif response.status_code == 401:
 				# Unauthorized - API key lỗi
@@ -1456,7 +3489,7 @@ def fpt_ai_tts_to_segment(api_key: str, voice: str, speed: str, text: str, forma
 				if 'async_url' in result and result['async_url']:
 					# Nếu có async_url, tải file audio
 					audio_url = result['async_url']
-					audio_response = requests.get(audio_url, timeout=60)
+					audio_response = http_request("GET", audio_url, timeout=60)
 					if audio_response.status_code == 200:
 						return AudioSegment.from_file(io.BytesIO(audio_response.content))
 					else:
@@ -1465,8 +3498,8 @@ def fpt_ai_tts_to_segment(api_key: str, voice: str, speed: str, text: str, forma
 					# FPT AI trả về async với URL trực tiếp
 					audio_url = result['async']
 					# Đợi một chút vì file có thể chưa sẵn sàng
-					time.sleep(3)
-					audio_response = requests.get(audio_url, timeout=60)
+					cancel_sleep(3)
+					audio_response = http_request("GET", audio_url, timeout=60)
 					if audio_response.status_code == 200:
 						return AudioSegment.from_file(io.BytesIO(audio_response.content))
 					else:
@@ -1481,10 +3514,10 @@ def fpt_ai_tts_to_segment(api_key: str, voice: str, speed: str, text: str, forma
 					request_id = result.get('request_id')
 					if request_id:
 						# Đợi và poll kết quả (simplified version)
-						time.sleep(2)  # Đợi 2 giây
+						cancel_sleep(2)  # Đợi 2 giây
 						poll_url = f"https://api.fpt.ai/hmi/tts/v5?request_id={request_id}"
 						poll_headers = {'api-key': api_key}
-						poll_response = requests.get(poll_url, headers=poll_headers, timeout=60)
+						poll_response = http_request("GET", poll_url, headers=poll_headers, timeout=60)
 						if poll_response.status_code == 200:
 							poll_result = poll_response.json()
 							if 'audio' in poll_result and poll_result['audio']:
@@ -1513,14 +3546,14 @@ def fpt_ai_tts_to_segment(api_key: str, voice: str, speed: str, text: str, forma
 		except requests.exceptions.Timeout:
 			if attempt < max_retries - 1:
 				print(f"FPT AI timeout, retrying... (attempt {attempt + 1}/{max_retries})")
-				time.sleep(15)
+				cancel_sleep(15)
 				continue
 			else:
 				raise RuntimeError("FPT AI API timeout after multiple retries")
 		except requests.exceptions.RequestException as e:
 			if attempt < max_retries - 1:
 				print(f"FPT AI connection error, retrying... (attempt {attempt + 1}/{max_retries})")
-				time.sleep(15)
+				cancel_sleep(15)
 				continue
 			else:
 				raise RuntimeError(f"FPT AI API connection error: {e}")
@@ -1621,11 +3654,12 @@ def remove_silence_ffmpeg(input_video: Path, output_video: Path, threshold: floa
 		"-af", f"silenceremove=stop_periods=-1:stop_duration={min_duration}:stop_threshold={threshold}dB",
 		"-c:v", "copy",  # Copy video stream
 		"-c:a", "aac", "-b:a", "128k",
+		*MP4_FASTSTART_ARGS,
 		str(output_video)
 	]
 	
 	try:
-		result = subprocess.run(cmd, capture_output=True, text=True, timeout=600)
+		result = run_process(cmd, capture_output=True, text=True, timeout=600)
 		if result.returncode != 0:
 			# Thử lại với phương pháp đơn giản hơn
 			print(f"⚠️ Complex silence removal failed, trying simple method: {result.stderr}")
@@ -1636,9 +3670,10 @@ def remove_silence_ffmpeg(input_video: Path, output_video: Path, threshold: floa
 				"-af", f"silenceremove=stop_periods=-1:stop_duration={min_duration}:stop_threshold={threshold}dB",
 				"-c:v", "copy",  # Copy video stream
 				"-c:a", "aac", "-b:a", "128k",
+				*MP4_FASTSTART_ARGS,
 				str(output_video)
 			]
-			result = subprocess.run(cmd_alt, capture_output=True, text=True, timeout=600)
+			result = run_process(cmd_alt, capture_output=True, text=True, timeout=600)
 			if result.returncode != 0:
 				# Phương pháp 3: Sử dụng trim filter để cắt cả video và audio
 				print(f"⚠️ Simple silence removal failed, trying trim method: {result.stderr}")
@@ -1654,7 +3689,7 @@ def remove_silence_ffmpeg(input_video: Path, output_video: Path, threshold: floa
 				]
 				
 				try:
-					detect_result = subprocess.run(detect_cmd, capture_output=True, text=True, timeout=300)
+					detect_result = run_process(detect_cmd, capture_output=True, text=True, timeout=300)
 					if detect_result.returncode == 0:
 						# Parse silence periods và tạo trim filter
 						# Đây là phương pháp phức tạp, tạm thời fallback về copy
@@ -1663,9 +3698,10 @@ def remove_silence_ffmpeg(input_video: Path, output_video: Path, threshold: floa
 							"ffmpeg", "-y", "-i", str(input_video),
 							"-c:v", "copy",  # Copy video stream
 							"-c:a", "copy",  # Copy audio stream
+							*MP4_FASTSTART_ARGS,
 							str(output_video)
 						]
-						result = subprocess.run(cmd_fallback, capture_output=True, text=True, timeout=600)
+						result = run_process(cmd_fallback, capture_output=True, text=True, timeout=600)
 						if result.returncode != 0:
 							raise RuntimeError(f"FFmpeg copy failed: {result.stderr}")
 						else:
@@ -1678,9 +3714,10 @@ def remove_silence_ffmpeg(input_video: Path, output_video: Path, threshold: floa
 						"ffmpeg", "-y", "-i", str(input_video),
 						"-c:v", "copy",  # Copy video stream
 						"-c:a", "copy",  # Copy audio stream
+						*MP4_FASTSTART_ARGS,
 						str(output_video)
 					]
-					result = subprocess.run(cmd_fallback, capture_output=True, text=True, timeout=600)
+					result = run_process(cmd_fallback, capture_output=True, text=True, timeout=600)
 					if result.returncode != 0:
 						raise RuntimeError(f"FFmpeg copy failed: {result.stderr}")
 					else:
@@ -1693,8 +3730,25 @@ def remove_silence_ffmpeg(input_video: Path, output_video: Path, threshold: floa
 		raise RuntimeError("FFmpeg not found. Please install FFmpeg.")
 
 
+def _subtract_regions(period: tuple, regions: List[tuple]) -> List[tuple]:
+	"""Phần của period (start, end) không giao với regions (đã sắp xếp theo start)"""
+	start, end = period
+	pieces = []
+	index = bisect.bisect_left([region_end for _, region_end in regions], start)
+	for region_start, region_end in regions[index:]:
+		if region_start >= end:
+			break
+		if region_start > start:
+			pieces.append((start, region_start))
+		start = max(start, region_end)
+	if start < end:
+		pieces.append((start, end))
+	return pieces
+
+
 def remove_silence_ffmpeg_video_audio(input_video: Path, output_video: Path, threshold: float = -50.0, 
-                                     min_duration: float = 0.4, max_duration: float = 2.0, padding: float = 0.1) -> None:
+                                     min_duration: float = 0.4, max_duration: float = 2.0, padding: float = 0.1,
+                                     speech_regions: Optional[List[tuple]] = None) -> None:
 	"""
 	Cắt khoảng lặng từ video sử dụng FFmpeg - cắt cả video và audio
 	Phương pháp: Detect silence periods, sau đó sử dụng trim filter
@@ -1706,8 +3760,9 @@ def remove_silence_ffmpeg_video_audio(input_video: Path, output_video: Path, thr
 		min_duration: Thời gian tối thiểu của khoảng lặng để cắt (giây)
 		max_duration: Thời gian tối đa của khoảng lặng cần cắt (giây)
 		padding: Thời gian padding sau khi cắt (giây)
+		speech_regions: đoạn người nói gốc đang nói (giây, timeline input_video, vd từ word timings);
+			khoảng lặng của audio lồng tiếng nằm trong các đoạn này không bị cắt để hình không bị nhảy giữa câu
 	"""
-	import subprocess
 	import re
 	
 	print(f"🔇 Removing silence from video and audio: {input_video} -> {output_video}")
@@ -1721,7 +3776,7 @@ def remove_silence_ffmpeg_video_audio(input_video: Path, output_video: Path, thr
 	]
 	
 	try:
-		detect_result = subprocess.run(detect_cmd, capture_output=True, text=True, timeout=300)
+		detect_result = run_process(detect_cmd, capture_output=True, text=True, timeout=300)
 		if detect_result.returncode != 0:
 			print(f"⚠️ Silence detection failed, using simple method: {detect_result.stderr}")
 			# Fallback to simple method
@@ -1740,15 +3795,18 @@ def remove_silence_ffmpeg_video_audio(input_video: Path, output_video: Path, thr
 			print(f"⚠️ Inconsistent silence detection, using simple method")
 			remove_silence_ffmpeg(input_video, output_video, threshold, min_duration, max_duration, padding)
 			return
+		silences = [(float(start), float(end)) for start, end in zip(silence_starts, silence_ends)]
+		if speech_regions:
+			regions = sorted(speech_regions)
+			silences = [piece for period in silences for piece in _subtract_regions(period, regions)
+			            if piece[1] - piece[0] >= min_duration]
+			print(f"   {len(silences)}/{len(silence_starts)} silence(s) outside source speech")
 		
 		# Tạo danh sách các khoảng cần giữ lại (không phải silence)
 		keep_periods = []
 		last_end = 0.0
 		
-		for start, end in zip(silence_starts, silence_ends):
-			start_time = float(start)
-			end_time = float(end)
-			
+		for start_time, end_time in silences:
 			# Chỉ cắt khoảng lặng trong giới hạn max_duration
 			if end_time - start_time <= max_duration:
 				# Thêm khoảng trước silence
@@ -1789,10 +3847,11 @@ def remove_silence_ffmpeg_video_audio(input_video: Path, output_video: Path, thr
 			"-map", "[outv]", "-map", "[outa]",
 			"-c:v", "libx264", "-preset", "fast", "-crf", "23",
 			"-c:a", "aac", "-b:a", "128k",
+			*MP4_FASTSTART_ARGS,
 			str(output_video)
 		]
 		
-		result = subprocess.run(cmd, capture_output=True, text=True, timeout=600)
+		result = run_process(cmd, capture_output=True, text=True, timeout=600)
 		if result.returncode != 0:
 			print(f"⚠️ Complex silence removal failed: {result.stderr}")
 			print(f"⚠️ Falling back to simple method")
@@ -1805,6 +3864,555 @@ def remove_silence_ffmpeg_video_audio(input_video: Path, output_video: Path, thr
 		remove_silence_ffmpeg(input_video, output_video, threshold, min_duration, max_duration, padding)
 
 
+def package_hls(video: Path, hls_dir: Path, segment_seconds: int = HLS_SEGMENT_SECONDS) -> Path:
+	"""
+	Bản HLS (VOD) của video để xem / tua ngay trên trình duyệt: remux (-c copy, không encode lại) thành
+	segment .ts + index.m3u8 trong hls_dir. Ghi vào thư mục tạm rồi đổi tên nên không ai đọc được bản dở.
+	Trả về đường dẫn playlist.
+	"""
+	hls_dir = Path(hls_dir)
+	tmp_dir = hls_dir.with_name(f"{hls_dir.name}.tmp")
+	shutil.rmtree(tmp_dir, ignore_errors=True)
+	tmp_dir.mkdir(parents=True)
+	run_command([
+		"ffmpeg", "-y", "-i", str(video),
+		"-map", "0:v:0", "-map", "0:a:0?",
+		"-c", "copy",
+		"-f", "hls", "-hls_time", str(segment_seconds), "-hls_playlist_type", "vod",
+		"-hls_segment_filename", str(tmp_dir / "segment_%05d.ts"),
+		str(tmp_dir / "index.m3u8"),
+	])
+	shutil.rmtree(hls_dir, ignore_errors=True)
+	os.rename(tmp_dir, hls_dir)
+	return hls_dir / "index.m3u8"
+
+
+class ProgressiveHlsRenderer:
+	"""
+	Bản xem trước HLS (playlist EVENT) của output trong khi pipeline còn chạy: mỗi cửa sổ thời gian của
+	slow.mp4 có audio TTS đã xong được ghép audio, tăng tốc SPEED_UP_FACTOR và encode thành một segment .ts
+	(timestamp liên tục qua -output_ts_offset), rồi thêm vào index.m3u8. Không gồm bước cắt khoảng lặng
+	(bước đó cần toàn bộ video).
+	- feed_timeline(timeline, ready_ms): audio [0, ready_ms) của timeline đã cố định (gọi từ vòng TTS)
+	- add_window(start_ms, end_ms, audio_path, on_rendered): cửa sổ đã có file audio riêng (pipeline theo cửa sổ);
+	  on_rendered(số segment) được gọi khi segment của cửa sổ đã encode xong
+	- resume=True: giữ các segment đã có trong out_dir (playlist của lần chạy trước), keep_segments(n) chọn
+	  số segment giữ lại trước khi thêm cửa sổ mới
+	- finish(): không còn audio mới, phần còn lại được encode rồi playlist được đóng (ENDLIST)
+	- close(wait): chủ lần chạy gọi khi pipeline dừng; wait=False bỏ các cửa sổ chưa encode
+	- video_ready: Event báo slow.mp4 đã có (stage slow có thể chạy song song với TTS, hoặc ở node khác)
+	Segment được encode ở thread riêng theo thứ tự nên vòng TTS không bị chặn bởi ffmpeg.
+	"""
+
+	def __init__(self, video: Path, out_dir: Path, window_sec: float = 30.0,
+	             video_ready: Optional[threading.Event] = None, resume: bool = False):
+		self.video = Path(video)
+		self.out_dir = Path(out_dir)
+		# Cửa sổ tính trên timeline của slow.mp4: window_sec giây output = window_sec * SPEED_UP_FACTOR giây slow
+		self.window_ms = max(1000, int(window_sec * SPEED_UP_FACTOR * 1000))
+		self.video_ready = video_ready
+		self.cancel = current_cancel_token()
+		self._next_ms = 0
+		self._windows = itertools.count()
+		self._segments = []  # (file name, duration giây)
+		self._pending = []
+		self._condition = threading.Condition()
+		self._timeline = None
+		self._ready_ms = 0
+		self._ended = False
+		self._discard = False
+		self._error = None
+		if resume and self.playlist.exists():
+			self._segments = self._read_segments()
+		else:
+			shutil.rmtree(self.out_dir, ignore_errors=True)
+			self.out_dir.mkdir(parents=True)
+		self._write_playlist(ended=False)
+		self._thread = threading.Thread(target=self._render_loop, name="progressive-hls", daemon=True)
+		self._thread.start()
+
+	@property
+	def playlist(self) -> Path:
+		return self.out_dir / "index.m3u8"
+
+	@property
+	def segment_count(self) -> int:
+		return len(self._segments)
+
+	def _read_segments(self) -> list:
+		"""Segment (tên, duration) trong playlist đã ghi, dừng ở segment đầu tiên không còn file"""
+		segments = []
+		duration = None
+		for line in self.playlist.read_text(encoding="utf-8").splitlines():
+			if line.startswith("#EXTINF:"):
+				duration = float(line[len("#EXTINF:"):].rstrip(","))
+			elif line and not line.startswith("#") and duration is not None:
+				if not (self.out_dir / line).exists():
+					break
+				segments.append((line, duration))
+				duration = None
+		return segments
+
+	def keep_segments(self, count: int) -> None:
+		"""Chỉ giữ count segment đầu (lần chạy trước đã xác nhận), xóa phần còn lại; gọi trước add_window"""
+		with self._condition:
+			for name, _ in self._segments[count:]:
+				(self.out_dir / name).unlink(missing_ok=True)
+			del self._segments[count:]
+		self._write_playlist(ended=False)
+
+	def feed_timeline(self, timeline: AudioSegment, ready_ms: int) -> None:
+		"""Cắt các cửa sổ đầy đủ nằm trong [0, ready_ms) của timeline và đưa vào hàng đợi encode"""
+		self._timeline, self._ready_ms = timeline, ready_ms
+		while self._next_ms + self.window_ms <= ready_ms:
+			self._add_slice(timeline, self._next_ms + self.window_ms)
+
+	def _add_slice(self, timeline: AudioSegment, end_ms: int) -> None:
+		start_ms = self._next_ms
+		audio_path = self.out_dir / f"window_{next(self._windows):05d}.wav"
+		window = timeline[start_ms:end_ms]
+		if len(window) < end_ms - start_ms:
+			window += AudioSegment.silent(duration=end_ms - start_ms - len(window), frame_rate=timeline.frame_rate)
+		window.export(str(audio_path), format="wav")
+		self.add_window(start_ms, end_ms, audio_path)
+
+	def add_window(self, start_ms: int, end_ms: int, audio_path: Path,
+	               on_rendered: Optional[Callable[[int], None]] = None) -> None:
+		with self._condition:
+			self._pending.append((start_ms, end_ms, Path(audio_path), on_rendered))
+			self._next_ms = end_ms
+			self._condition.notify_all()
+
+	def finish(self) -> None:
+		"""Đưa phần cuối (cửa sổ chưa đủ dài) vào hàng đợi; playlist được đóng khi encode xong"""
+		if self._timeline is not None and self._ready_ms > self._next_ms:
+			self._add_slice(self._timeline, self._ready_ms)
+		self._timeline = None
+		with self._condition:
+			self._ended = True
+			self._condition.notify_all()
+
+	@property
+	def error(self) -> Optional[BaseException]:
+		"""Lỗi làm thread encode dừng (None nếu chưa có)"""
+		return self._error
+
+	def export(self, output_video: Path) -> None:
+		"""Ghép các segment đã encode (sau close) thành một MP4 faststart, không encode lại"""
+		run_command([
+			"ffmpeg", "-y", "-i", str(self.playlist),
+			"-c", "copy", "-bsf:a", "aac_adtstoasc",
+			*MP4_FASTSTART_ARGS,
+			str(output_video),
+		])
+
+	def close(self, wait: bool = True) -> None:
+		"""Dừng renderer (idempotent). wait=True: chờ encode hết hàng đợi; False: bỏ các cửa sổ chưa encode"""
+		self._timeline = None
+		with self._condition:
+			if not wait:
+				self._discard = True
+				for _, _, audio_path, _ in self._pending:
+					audio_path.unlink(missing_ok=True)
+				self._pending.clear()
+			self._ended = True
+			self._condition.notify_all()
+		self._thread.join()
+
+	def _render_loop(self) -> None:
+		with cancel_scope(self.cancel):
+			try:
+				while True:
+					with self._condition:
+						while not self._pending and not self._ended:
+							self._condition.wait()
+						if not self._pending:
+							break
+						start_ms, end_ms, audio_path, on_rendered = self._pending[0]
+					if self.video_ready is not None:
+						while not self.video_ready.wait(1):
+							check_cancelled()
+							if self._discard:
+								return
+					self._render(start_ms, end_ms, audio_path)
+					if on_rendered is not None:
+						on_rendered(len(self._segments))
+					with self._condition:
+						if self._pending:
+							self._pending.pop(0)
+				if not self._discard:
+					self._write_playlist(ended=True)
+			except BaseException as e:
+				# Bản xem trước lỗi không làm hỏng lần chạy; playlist giữ các segment đã có
+				self._error = e
+				if not isinstance(e, Cancelled):
+					print(f"⚠️ Progressive preview stopped: {e}")
+
+	def _render(self, start_ms: int, end_ms: int, audio_path: Path) -> None:
+		name = f"segment_{len(self._segments):05d}.ts"
+		run_command([
+			"ffmpeg", "-y",
+			"-ss", f"{start_ms / 1000:.3f}", "-t", f"{(end_ms - start_ms) / 1000:.3f}", "-i", str(self.video),
+			"-i", str(audio_path),
+			"-filter_complex", f"[0:v]setpts=(PTS-STARTPTS)/{SPEED_UP_FACTOR}[v];[1:a]atempo={SPEED_UP_FACTOR}[a]",
+			"-map", "[v]", "-map", "[a]",
+			"-c:v", "libx264", "-preset", "veryfast", "-crf", "23",
+			"-c:a", "aac", "-b:a", "128k",
+			"-output_ts_offset", f"{start_ms / 1000 / SPEED_UP_FACTOR:.3f}",
+			"-f", "mpegts", str(self.out_dir / name),
+		])
+		audio_path.unlink(missing_ok=True)
+		self._segments.append((name, (end_ms - start_ms) / 1000 / SPEED_UP_FACTOR))
+		self._write_playlist(ended=False)
+
+	def _write_playlist(self, ended: bool) -> None:
+		lines = [
+			"#EXTM3U",
+			"#EXT-X-VERSION:3",
+			f"#EXT-X-TARGETDURATION:{math.ceil(max([duration for _, duration in self._segments], default=1))}",
+			"#EXT-X-MEDIA-SEQUENCE:0",
+			"#EXT-X-PLAYLIST-TYPE:EVENT",
+		]
+		for name, duration in self._segments:
+			lines += [f"#EXTINF:{duration:.3f},", name]
+		if ended:
+			lines.append("#EXT-X-ENDLIST")
+		tmp_path = self.playlist.with_suffix(".tmp")
+		tmp_path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+		os.replace(tmp_path, self.playlist)
+
+
+# Pipeline streaming (run_windowed_pipeline): độ dài cửa sổ và phần audio STT đọc thêm trước / sau cửa sổ
+# (giây trên timeline slow.mp4)
+STREAM_WINDOW_SEC = 300
+STREAM_OVERLAP_SEC = 10
+# Câu của cửa sổ kết thúc trong STREAM_CUT_EDGE_MS cuối đoạn audio STT thì có thể đã bị cắt giữa chừng:
+# đọc thêm STREAM_EXTEND_SEC giây audio rồi STT lại
+STREAM_CUT_EDGE_MS = 1000
+STREAM_EXTEND_SEC = 30
+# Checkpoint của pipeline streaming: work_dir/stream.json (tham số của lần chạy) + window_*/done.json cho mỗi
+# cửa sổ đã encode xong, để lần chạy lại (timeout, worker restart) bỏ qua các cửa sổ đã xong
+STREAM_CHECKPOINT_FILE = "stream.json"
+STREAM_WINDOW_DONE_FILE = "done.json"
+
+
+class StreamWindow:
+	"""
+	Một cửa sổ của pipeline streaming. [start_ms, end_ms) là phần timeline (slow.mp4) cửa sổ sở hữu;
+	cues / translated: cue thuộc cửa sổ, thời gian tuyệt đối.
+	"""
+	__slots__ = ("index", "start_ms", "end_ms", "dir", "cues", "translated")
+
+	def __init__(self, index: int, start_ms: int, end_ms: int, dir: Path, cues: List[Cue]):
+		self.index = index
+		self.start_ms = start_ms
+		self.end_ms = end_ms
+		self.dir = dir
+		self.cues = cues
+		self.translated = []
+
+	def __repr__(self) -> str:
+		return f"StreamWindow({self.index}, {self.start_ms}, {self.end_ms}, cues={len(self.cues)})"
+
+
+def _run_pipelined(items, steps: List[Callable], cancel: Optional[CancelToken] = None) -> None:
+	"""
+	Chạy items qua các bước như một dây chuyền: mỗi bước một thread, giữa hai bước là hàng đợi 1 phần tử nên
+	item i ở bước sau chạy song song với item i+1 ở bước trước và số item đang xử lý bị chặn trên.
+	Bước trả về None thì item không được chuyển tiếp. Lỗi ở một bước dừng cả dây chuyền và được raise lại.
+	"""
+	done = object()
+	failed = threading.Event()
+	errors = []
+	queues = [queue.Queue(maxsize=1) for _ in steps]
+
+	def put(target: queue.Queue, item) -> bool:
+		while not failed.is_set():
+			try:
+				target.put(item, timeout=0.2)
+				return True
+			except queue.Full:
+				pass
+		return False
+
+	def work(step: Callable, inbox: queue.Queue, outbox: Optional[queue.Queue]) -> None:
+		with cancel_scope(cancel):
+			try:
+				while True:
+					try:
+						item = inbox.get(timeout=0.2)
+					except queue.Empty:
+						if failed.is_set():
+							return
+						continue
+					if item is done:
+						break
+					result = step(item)
+					if result is not None and outbox is not None and not put(outbox, result):
+						return
+				if outbox is not None:
+					put(outbox, done)
+			except BaseException as e:
+				errors.append(e)
+				failed.set()
+
+	threads = [
+		threading.Thread(target=work, args=(step, queues[i], queues[i + 1] if i + 1 < len(steps) else None),
+		                 name=f"pipelined-{getattr(step, '__name__', i)}", daemon=True)
+		for i, step in enumerate(steps)
+	]
+	for thread in threads:
+		thread.start()
+	for item in items:
+		if not put(queues[0], item):
+			break
+	else:
+		put(queues[0], done)
+	for thread in threads:
+		thread.join()
+	if errors:
+		raise errors[0]
+
+
+def _write_json_atomic(path: Path, data) -> None:
+	import json
+
+	tmp_path = path.with_suffix(".tmp")
+	tmp_path.write_text(json.dumps(data), encoding="utf-8")
+	os.replace(tmp_path, path)
+
+
+def _file_identity(path: Path) -> Optional[list]:
+	try:
+		stat = os.stat(path)
+	except FileNotFoundError:
+		return None
+	return [stat.st_size, stat.st_mtime_ns]
+
+
+def _cue_rows(cues: List[Cue]) -> list:
+	return [[cue.start_ms, cue.end_ms, cue.content] for cue in cues]
+
+
+def _rows_to_cues(rows: list) -> List[Cue]:
+	return [Cue(i + 1, start_ms, end_ms, content) for i, (start_ms, end_ms, content) in enumerate(rows)]
+
+
+def _load_stream_checkpoint(work_dir: Path, key: dict) -> Optional[List[dict]]:
+	"""
+	Marker (done.json) của các cửa sổ liên tiếp từ cửa sổ 0 đã xong ở lần chạy trước với cùng key.
+	None: không có checkpoint dùng lại được (khác tham số / input, hoặc lần trước đã chạy hết -- chạy lại là cố ý)
+	"""
+	import json
+
+	try:
+		meta = json.loads((work_dir / STREAM_CHECKPOINT_FILE).read_text(encoding="utf-8"))
+	except (OSError, ValueError):
+		return None
+	if meta.get("key") != key or meta.get("complete"):
+		return None
+	done = []
+	while True:
+		try:
+			marker_path = work_dir / f"window_{len(done):05d}" / STREAM_WINDOW_DONE_FILE
+			done.append(json.loads(marker_path.read_text(encoding="utf-8")))
+		except (OSError, ValueError):
+			return done
+
+
+def _mix(base: AudioSegment, other: AudioSegment) -> AudioSegment:
+	"""Overlay hai đoạn audio, giữ độ dài của đoạn dài hơn"""
+	if len(other) > len(base):
+		base, other = other, base
+	return base.overlay(other) if len(other) else base
+
+
+def run_windowed_pipeline(stt_wav: Path, renderer: ProgressiveHlsRenderer, work_dir: Path,
+                          transcribe: Callable[[Path, Path], Optional[List[Cue]]],
+                          translate: Callable[[Path, Path, List[Cue]], Optional[List[Cue]]],
+                          synthesize: Callable[[Path, Path, List[Cue]], None],
+                          window_sec: float = STREAM_WINDOW_SEC, overlap_sec: float = STREAM_OVERLAP_SEC,
+                          resources: Optional[ResourcePool] = None, step_resources: Optional[dict] = None,
+                          on_progress: Optional[Callable[[str, int, int], None]] = None,
+                          params: Optional[dict] = None) -> tuple:
+	"""
+	Pipeline streaming cho video dài: stt.wav (timeline slow.mp4) được chia thành các cửa sổ window_sec giây, mỗi
+	cửa sổ đi qua STT -> dịch -> TTS -> ghép video + tăng tốc (renderer.add_window) như một dây chuyền, nên cửa sổ i
+	được dịch / lồng tiếng trong khi cửa sổ i+1 đang STT và bộ nhớ chỉ phụ thuộc độ dài cửa sổ, không phụ thuộc video.
+	- STT đọc thêm overlap_sec trước / sau cửa sổ; câu thuộc cửa sổ chứa thời điểm bắt đầu của nó, câu vắt qua
+	  ranh giới thì ranh giới được lùi tới cuối câu (cửa sổ sau bỏ các câu bắt đầu trước đó). Câu dài hơn phần
+	  overlap chạm tới cuối audio STT thì audio được đọc thêm (STREAM_EXTEND_SEC) và STT lại, không cắt cụt câu
+	- Audio TTS tràn quá cuối cửa sổ được cộng vào đầu cửa sổ sau
+	- overlap_sec phải nhỏ hơn window_sec
+	- Mỗi cửa sổ đã encode xong được ghi checkpoint (cue, cue đã dịch, audio tràn sang cửa sổ sau, số segment):
+	  chạy lại với cùng stt.wav / video / params thì tiếp tục từ cửa sổ chưa xong. renderer phải được tạo với
+	  resume=True để giữ segment của lần trước; params: tham số ảnh hưởng output (vd stage_params của stage)
+	Chỉ các bước từ STT trở đi được chia cửa sổ: tải video, làm chậm (slow.mp4) và tách stt.wav vẫn xử lý cả video
+	trước khi gọi hàm này (cần đủ dung lượng đĩa cho các file đó).
+	transcribe(wav, srt) / translate(srt, out_srt, cues) trả về cue (None thì đọc từ file srt);
+	synthesize(srt, wav, cues) ghi audio căn theo cue (thời gian tính từ đầu cửa sổ).
+	step_resources: slot của resources mỗi bước giữ khi xử lý một cửa sổ, vd {"stt": ["assemblyai"], "tts": ["fpt"]}.
+	on_progress(step, done, total) với step: stt | translate | tts.
+	Sau khi trả về, renderer đã encode xong mọi cửa sổ (xem ProgressiveHlsRenderer.export).
+	Trả về (cue gốc, cue đã dịch) của cả video, thời gian tuyệt đối.
+	"""
+	window_ms = max(10_000, int(window_sec * 1000))
+	overlap_ms = max(0, int(overlap_sec * 1000))
+	if overlap_ms >= window_ms:
+		raise ValueError(f"stream overlap ({overlap_ms / 1000:g}s) must be shorter than the window ({window_ms / 1000:g}s)")
+	duration = probe_duration(str(stt_wav))
+	if not duration:
+		raise RuntimeError(f"Could not read duration of {stt_wav}")
+	duration_ms = int(duration * 1000)
+	total = max(1, math.ceil(duration_ms / window_ms))
+	step_resources = step_resources or {}
+	print(f"🪟 Streaming pipeline: {total} window(s) of {window_ms / 1000:.0f}s (+{overlap_ms / 1000:.0f}s overlap)")
+
+	import json
+
+	key = json.loads(json.dumps({
+		"window_ms": window_ms, "overlap_ms": overlap_ms, "duration_ms": duration_ms,
+		"stt_wav": _file_identity(stt_wav), "video": _file_identity(renderer.video), "params": params or {},
+	}, sort_keys=True, default=str))
+	done = _load_stream_checkpoint(work_dir, key) or []
+	# Chỉ dùng các cửa sổ mà segment của chúng còn trong renderer
+	segments = 0
+	for count, marker in enumerate(done):
+		if marker.get("segments", segments) > renderer.segment_count:
+			done = done[:count]
+			break
+		segments = marker.get("segments", segments)
+	if done:
+		for window_dir in work_dir.glob("window_*"):
+			if int(window_dir.name.split("_")[1]) >= len(done):
+				shutil.rmtree(window_dir, ignore_errors=True)
+		print(f"♻️ Resuming streaming pipeline at window {len(done) + 1}/{total}")
+	else:
+		shutil.rmtree(work_dir, ignore_errors=True)
+		work_dir.mkdir(parents=True)
+		_write_json_atomic(work_dir / STREAM_CHECKPOINT_FILE, {"key": key, "complete": False})
+	renderer.keep_segments(segments)
+
+	source_cues = []
+	translated_cues = []
+	state = {"cut_ms": 0, "carry": AudioSegment.empty(), "stt": len(done), "translate": len(done), "tts": len(done)}
+	carry_wav = None
+	for index, marker in enumerate(done):
+		state["cut_ms"] = marker["cut_ms"]
+		if not marker.get("skipped"):
+			source_cues.extend(_rows_to_cues(marker["cues"]))
+			translated_cues.extend(_rows_to_cues(marker["translated"]))
+			carry_wav = work_dir / f"window_{index:05d}" / "carry.wav"
+	if carry_wav is not None and carry_wav.exists():
+		state["carry"] = AudioSegment.from_file(str(carry_wav))
+	if done and on_progress is not None:
+		for step in ("stt", "translate", "tts"):
+			on_progress(step, len(done), total)
+
+	def slots(step: str):
+		if resources is None or not step_resources.get(step):
+			return contextlib.nullcontext()
+		return resources.slots(step_resources[step])
+
+	def report(step: str) -> None:
+		state[step] += 1
+		if on_progress is not None:
+			on_progress(step, state[step], total)
+
+	def stt(index: int) -> Optional[StreamWindow]:
+		last = index == total - 1
+		start_ms = state["cut_ms"]
+		nominal_end = duration_ms if last else (index + 1) * window_ms
+		audio_start = max(0, start_ms - overlap_ms)
+		audio_end = min(duration_ms, nominal_end + overlap_ms)
+		window_dir = work_dir / f"window_{index:05d}"
+		window_dir.mkdir()
+		owned = []
+		while start_ms < nominal_end:
+			window_wav = window_dir / "stt.wav"
+			run_command([
+				"ffmpeg", "-y", "-ss", f"{audio_start / 1000:.3f}", "-t", f"{(audio_end - audio_start) / 1000:.3f}",
+				"-i", str(stt_wav), "-c", "copy", str(window_wav),
+			])
+			with slots("stt"):
+				cues = transcribe(window_wav, window_dir / "source_raw.srt")
+			if cues is None:
+				cues = read_srt_cues(window_dir / "source_raw.srt")
+			window_wav.unlink(missing_ok=True)
+			owned = []
+			for cue in cues:
+				cue_start = cue.start_ms + audio_start
+				if start_ms <= cue_start < nominal_end:
+					owned.append(Cue(len(owned) + 1, cue_start, cue.end_ms + audio_start, cue.content))
+			if audio_end >= duration_ms or all(cue.end_ms < audio_end - STREAM_CUT_EDGE_MS for cue in owned):
+				break
+			# Câu bị cắt ở cuối audio STT: cửa sổ sau sẽ bỏ phần còn lại (bắt đầu trước ranh giới) -> đọc thêm
+			audio_end = min(duration_ms, audio_end + int(STREAM_EXTEND_SEC * 1000))
+			print(f"🪟 Window {index}: a sentence runs past the STT audio, extending it to {audio_end / 1000:.1f}s")
+		# Ranh giới trước có thể đã lùi quá nominal_end của cửa sổ này -> không cho cut_ms đi lùi
+		end_ms = max([nominal_end, start_ms] + [cue.end_ms for cue in owned])
+		state["cut_ms"] = end_ms
+		report("stt")
+		if end_ms <= start_ms:
+			_write_json_atomic(window_dir / STREAM_WINDOW_DONE_FILE, {"skipped": True, "cut_ms": end_ms})
+			return None
+		return StreamWindow(index, start_ms, end_ms, window_dir, owned)
+
+	def translate_window(window: StreamWindow) -> StreamWindow:
+		source_srt = window.dir / "source.srt"
+		translated_srt = window.dir / "translated.srt"
+		write_srt_cues(source_srt, window.cues)
+		if window.cues:
+			with slots("translate"):
+				translated = translate(source_srt, translated_srt, window.cues)
+			window.translated = translated if translated is not None else read_srt_cues(translated_srt)
+		source_cues.extend(window.cues)
+		translated_cues.extend(window.translated)
+		report("translate")
+		return window
+
+	def tts(window: StreamWindow) -> None:
+		if renderer.error is not None:
+			raise RuntimeError(f"Rendering failed: {renderer.error}")
+		length = window.end_ms - window.start_ms
+		relative = [Cue(i + 1, cue.start_ms - window.start_ms, cue.end_ms - window.start_ms, cue.content)
+		            for i, cue in enumerate(window.translated)]
+		speech = AudioSegment.empty()
+		if relative:
+			tts_wav = window.dir / "tts.wav"
+			with slots("tts"):
+				synthesize(window.dir / "translated.srt", tts_wav, relative)
+			speech = AudioSegment.from_file(str(tts_wav))
+			tts_wav.unlink(missing_ok=True)
+		audio = _mix(state["carry"], speech)
+		window_audio = AudioSegment.silent(duration=length).overlay(audio)
+		state["carry"] = audio[length:]
+		audio_path = window.dir / "audio.wav"
+		window_audio.export(str(audio_path), format="wav")
+		if len(state["carry"]):
+			state["carry"].export(str(window.dir / "carry.wav"), format="wav")
+		marker = {"cut_ms": window.end_ms, "cues": _cue_rows(window.cues), "translated": _cue_rows(window.translated)}
+
+		def checkpoint(segment_count: int) -> None:
+			# Segment đã nằm trong playlist -> cửa sổ không phải chạy lại
+			_write_json_atomic(window.dir / STREAM_WINDOW_DONE_FILE, dict(marker, segments=segment_count))
+
+		renderer.add_window(window.start_ms, window.end_ms, audio_path, on_rendered=checkpoint)
+		report("tts")
+
+	try:
+		_run_pipelined(range(len(done), total), [stt, translate_window, tts], cancel=current_cancel_token())
+		renderer.finish()
+		renderer.close(wait=True)
+	except BaseException:
+		renderer.close(wait=False)
+		raise
+	if renderer.error is not None:
+		raise RuntimeError(f"Rendering failed: {renderer.error}")
+	_write_json_atomic(work_dir / STREAM_CHECKPOINT_FILE, {"key": key, "complete": True})
+	return source_cues, translated_cues
+
+
 def _get_current_fpt_key(config):
 	"""Lấy FPT API key hiện tại"""
 	keys = config.get('fpt_api_keys', [])
@@ -1861,7 +4469,8 @@ def _get_proxy_config(config):
 		print(f"⚠️ Error parsing proxy config: {e}")
 		return None
 
-def srt_to_aligned_audio_fpt_ai_with_failover(input_srt: Path, output_audio_wav: Path, config: dict, voice: str, speed: str = '', format: str = 'mp3', speech_speed: str = '0.8', proxies=None) -> None:
+def srt_to_aligned_audio_fpt_ai_with_failover(input_srt: Path, output_audio_wav: Path, config: dict, voice: str, speed: str = '', format: str = 'mp3', speech_speed: str = '0.8', proxies=None, cues: Optional[List[Cue]] = None,
+                                              on_audio_ready: Optional[Callable[[AudioSegment, int], None]] = None) -> None:
 	"""Chuyển SRT thành audio sử dụng FPT AI TTS với auto-failover keys"""
 	
 	proxies = _get_proxy_config(config)
@@ -1879,7 +4488,8 @@ def srt_to_aligned_audio_fpt_ai_with_failover(input_srt: Path, output_audio_wav:
 		
 		try:
 			# Try with current key
-			return srt_to_aligned_audio_fpt_ai(input_srt, output_audio_wav, current_key, voice, speed, format, speech_speed, proxies)
+			return srt_to_aligned_audio_fpt_ai(input_srt, output_audio_wav, current_key, voice, speed, format, speech_speed, proxies, cues=cues,
+			                                   on_audio_ready=on_audio_ready)
 			
 		except Exception as e:
 			error_str = str(e).lower()
@@ -1903,23 +4513,16 @@ def srt_to_aligned_audio_fpt_ai_with_failover(input_srt: Path, output_audio_wav:
 	raise RuntimeError("Failed to process TTS with any available FPT AI key")
 
 
-def srt_to_aligned_audio_fpt_ai(input_srt: Path, output_audio_wav: Path, api_key: str, voice: str, speed: str = '', format: str = 'mp3', speech_speed: str = '0.8', proxies=None) -> None:
-	"""Chuyển SRT thành audio sử dụng FPT AI TTS"""
+def srt_to_aligned_audio_fpt_ai(input_srt: Path, output_audio_wav: Path, api_key: str, voice: str, speed: str = '', format: str = 'mp3', speech_speed: str = '0.8', proxies=None, cues: Optional[List[Cue]] = None,
+                                on_audio_ready: Optional[Callable[[AudioSegment, int], None]] = None) -> None:
+	"""
+	Chuyển SRT thành audio sử dụng FPT AI TTS.
+	on_audio_ready(timeline, ready_ms): gọi sau mỗi cue; audio trước ready_ms (start của cue tiếp theo) đã cố định
+	vì các cue sau chỉ overlay từ start của chúng trở đi (vd ProgressiveHlsRenderer.feed_timeline).
+	"""
 	try:
-		with input_srt.open("r", encoding="utf-8") as f:
-			srt_content = f.read().strip()
-		
-		# Clean SRT content để tránh lỗi parsing
-		srt_content = _clean_srt_content(srt_content)
-		if not srt_content:
-			print("Warning: SRT file is empty")
-			AudioSegment.silent(duration=1000).export(str(output_audio_wav), format="wav")
-			return
-		
-		# Debug: in nội dung SRT để kiểm tra
-		print(f"SRT content preview: {repr(srt_content[:200])}")
-		
-		subtitles = list(srt.parse(srt_content))
+		# Dùng cue trong bộ nhớ nếu bước trước đã truyền sang, không thì đọc file
+		subtitles = cues if cues is not None else read_srt_cues(input_srt)
 		if not subtitles:
 			print("Warning: No subtitles found in SRT file")
 			AudioSegment.silent(duration=1000).export(str(output_audio_wav), format="wav")
@@ -1939,16 +4542,18 @@ def srt_to_aligned_audio_fpt_ai(input_srt: Path, output_audio_wav: Path, api_key
 		print(f"SRT file path: {input_srt}")
 		# Tạo audio silent thay thế
 		AudioSegment.silent(duration=5000).export(str(output_audio_wav), format="wav")
+		mark_artifact_incomplete("could not read SRT")
 		return
 	
-	last_end_ms = int(subtitles[-1].end.total_seconds() * 1000)
+	last_end_ms = subtitles[-1].end_ms
 	timeline = AudioSegment.silent(duration=last_end_ms + 1000)
 	
 	# Đếm số segment thành công và thất bại
 	success_count = 0
 	failed_count = 0
 	
-	for sub in tqdm(subtitles, desc="Synthesizing TTS (FPT AI)"):
+	for index, sub in enumerate(tqdm(subtitles, desc="Synthesizing TTS (FPT AI)")):
+		check_cancelled()
 		content = _sanitize_tts_text(sub.content)
 		# Skip empty or accidental numeric-only fragments
 		if (not content) or content.isdigit():
@@ -1957,19 +4562,20 @@ def srt_to_aligned_audio_fpt_ai(input_srt: Path, output_audio_wav: Path, api_key
 		
 		try:
 			segment = fpt_ai_tts_to_segment(api_key, voice, adjusted_speed, content, format, speech_speed, proxies)
-			start_ms = int(sub.start.total_seconds() * 1000)
-			timeline = timeline.overlay(segment, position=start_ms)
+			timeline = timeline.overlay(segment, position=sub.start_ms)
 			success_count += 1
 		except Exception as e:
 			print(f"FPT AI TTS failed for text '{content[:50]}...': {e}")
 			failed_count += 1
 			# Tạo silent segment thay thế
-			silent_duration = int((sub.end - sub.start).total_seconds() * 1000)
-			silent_segment = AudioSegment.silent(duration=silent_duration)
-			start_ms = int(sub.start.total_seconds() * 1000)
-			timeline = timeline.overlay(silent_segment, position=start_ms)
+			silent_segment = AudioSegment.silent(duration=sub.end_ms - sub.start_ms)
+			timeline = timeline.overlay(silent_segment, position=sub.start_ms)
+		if on_audio_ready is not None:
+			on_audio_ready(timeline, subtitles[index + 1].start_ms if index + 1 < len(subtitles) else len(timeline))
 	
 	print(f"FPT AI TTS completed: {success_count} successful, {failed_count} failed")
+	if failed_count:
+		mark_artifact_incomplete(f"{failed_count} FPT AI TTS segments failed")
 	
 	# Kiểm tra xem có audio nào được tạo không
 	if success_count == 0:
@@ -1979,7 +4585,7 @@ def srt_to_aligned_audio_fpt_ai(input_srt: Path, output_audio_wav: Path, api_key
 	timeline.export(str(output_audio_wav), format="wav")
 
 
-def srt_to_aligned_audio_edge_tts(srt_path: Path, output_audio_wav: Path, voice: str = "vi-VN-HoaiMyNeural") -> None:
+def srt_to_aligned_audio_edge_tts(srt_path: Path, output_audio_wav: Path, voice: str = "vi-VN-HoaiMyNeural", cues: Optional[List[Cue]] = None) -> None:
 	"""Convert SRT to aligned audio using Edge TTS (fallback for ElevenLabs)"""
 	import asyncio
 	import edge_tts
@@ -1987,7 +4593,7 @@ def srt_to_aligned_audio_edge_tts(srt_path: Path, output_audio_wav: Path, voice:
 	import os
 	
 	async def _tts():
-		subs = srt.parse(srt_path.read_text(encoding='utf-8'))
+		subs = cues if cues is not None else read_srt_cues(srt_path)
 		timeline = AudioSegment.empty()
 		
 		# Đếm số segment thành công và thất bại
@@ -1995,6 +4601,7 @@ def srt_to_aligned_audio_edge_tts(srt_path: Path, output_audio_wav: Path, voice:
 		failed_count = 0
 		
 		for sub in tqdm(subs, desc="Synthesizing TTS (Edge TTS)"):
+			check_cancelled()
 			content = sub.content.strip()
 			if (not content) or content.isdigit():
 				continue
@@ -2021,18 +4628,15 @@ def srt_to_aligned_audio_edge_tts(srt_path: Path, output_audio_wav: Path, voice:
 				os.unlink(temp_path)
 				
 				# Align timing
-				start_ms = int(sub.start.total_seconds() * 1000)
-				timeline = timeline.overlay(audio_segment, position=start_ms)
+				timeline = timeline.overlay(audio_segment, position=sub.start_ms)
 				success_count += 1
 				
 			except Exception as e:
 				print(f"Edge TTS failed for text '{content[:50]}...': {e}")
 				failed_count += 1
 				# Tạo silent segment thay thế
-				silent_duration = int((sub.end - sub.start).total_seconds() * 1000)
-				silent_segment = AudioSegment.silent(duration=silent_duration)
-				start_ms = int(sub.start.total_seconds() * 1000)
-				timeline = timeline.overlay(silent_segment, position=start_ms)
+				silent_segment = AudioSegment.silent(duration=sub.end_ms - sub.start_ms)
+				timeline = timeline.overlay(silent_segment, position=sub.start_ms)
 				
 				# Clean up temp file nếu có
 				if 'temp_path' in locals() and os.path.exists(temp_path):
@@ -2042,6 +4646,8 @@ def srt_to_aligned_audio_edge_tts(srt_path: Path, output_audio_wav: Path, voice:
 						pass
 		
 		print(f"Edge TTS completed: {success_count} successful, {failed_count} failed")
+		if failed_count:
+			mark_artifact_incomplete(f"{failed_count} Edge TTS segments failed")
 		
 		# Kiểm tra xem có audio nào được tạo không
 		if success_count == 0:
@@ -2052,15 +4658,14 @@ def srt_to_aligned_audio_edge_tts(srt_path: Path, output_audio_wav: Path, voice:
 	asyncio.run(_tts())
 
 
-def merge_srt_segments_with_ai(srt_path: Path, output_srt: Path, api_key: str, model: str = "gemini-2.0-flash", provider: str = "gemini") -> None:
+def merge_srt_segments_with_ai(srt_path: Path, output_srt: Path, api_key: str, model: str = "gemini-2.0-flash", provider: str = "gemini", cues: Optional[List[Cue]] = None) -> List[Cue]:
 	"""Sử dụng Gemini để gộp các segment SRT một cách thông minh với timing hợp lý"""
-	with srt_path.open("r", encoding="utf-8") as f:
-		subs = list(srt.parse(f.read()))
+	subs = cues if cues is not None else read_srt_cues(srt_path)
 	
 	if not subs:
 		# Nếu không có subtitle, copy file gốc
 		shutil.copy(srt_path, output_srt)
-		return
+		return subs
 	
 	# Chia thành chunks 200 câu
 	chunk_size = 200
@@ -2071,7 +4676,7 @@ def merge_srt_segments_with_ai(srt_path: Path, output_srt: Path, api_key: str, m
 		print(f"Processing chunk {i//chunk_size + 1}/{(len(subs) + chunk_size - 1)//chunk_size} ({len(chunk_subs)} segments)")
 		
 		# Tạo SRT content cho chunk này
-		chunk_srt_content = srt.compose(chunk_subs)
+		chunk_srt_content = compose_srt_cues(chunk_subs)
 		
 		# Tạo prompt cho Gemini
 		prompt = f"""Bạn là chuyên gia xử lý subtitle. Hãy gộp các segment SRT sau thành các câu hoàn chỉnh và mạch lạc.
@@ -2130,12 +4735,12 @@ Hãy trả về SRT đã được gộp với timing chính xác."""
 		max_attempts = 5
 		for attempt in range(1, max_attempts + 1):
 			try:
-				resp = requests.post(url, headers=headers, json=payload, timeout=60)  # Giảm timeout xuống 60s
+				resp = http_request("POST", url, headers=headers, json=payload, timeout=60)  # Giảm timeout xuống 60s
 				if resp.status_code == 429:
 					# Rate limit - wait longer
 					wait_time = min(30 * attempt, 120)  # Giảm thời gian chờ, tối đa 2 phút
 					print(f"{provider.title()} rate limit, waiting {wait_time}s... (attempt {attempt})")
-					time.sleep(wait_time)
+					cancel_sleep(wait_time)
 					continue
 				elif resp.status_code != 200:
 					raise RuntimeError(f"{provider.title()} API error {resp.status_code}: {resp.text}")
@@ -2160,7 +4765,9 @@ Hãy trả về SRT đã được gộp với timing chính xác."""
 					raise ValueError(f"Unsupported provider: {provider}")
 				
 				# Parse merged SRT và thêm vào kết quả
-				merged_subs = list(srt.parse(merged_srt))
+				merged_subs = parse_srt_cues(_clean_ai_srt_response(merged_srt))
+				if not merged_subs:
+					raise RuntimeError(f"{provider.title()} returned no SRT cues")
 				all_merged_subs.extend(merged_subs)
 				
 				print(f"Chunk {i//chunk_size + 1} merged successfully with {provider.title()} on attempt {attempt}")
@@ -2171,7 +4778,7 @@ Hãy trả về SRT đã được gộp với timing chính xác."""
 				if attempt < max_attempts:
 					wait_time = min(15 * attempt, 60)  # Giảm thời gian chờ, tối đa 1 phút
 					print(f"Retrying in {wait_time}s...")
-					time.sleep(wait_time)
+					cancel_sleep(wait_time)
 				else:
 					# Fallback: sử dụng merge cũ cho chunk này
 					print("Using fallback merge for this chunk...")
@@ -2182,13 +4789,13 @@ Hãy trả về SRT đã được gộp với timing chính xác."""
 	all_merged_subs = _adjust_timing(all_merged_subs)
 	
 	# Ghi file mới
-	with output_srt.open("w", encoding="utf-8") as f:
-		f.write(srt.compose(all_merged_subs))
+	write_srt_cues(output_srt, all_merged_subs)
 	
 	print(f"Total merged: {len(subs)} segments -> {len(all_merged_subs)} sentences")
+	return all_merged_subs
 
 
-def _merge_chunk_fallback(subs: List[srt.Subtitle]) -> List[srt.Subtitle]:
+def _merge_chunk_fallback(subs: List[Cue]) -> List[Cue]:
 	"""Fallback merge cho chunk khi Gemini lỗi"""
 	merged_subs = []
 	current_group = []
@@ -2199,11 +4806,11 @@ def _merge_chunk_fallback(subs: List[srt.Subtitle]) -> List[srt.Subtitle]:
 		else:
 			# Kiểm tra khoảng cách và độ dài
 			last_sub = current_group[-1]
-			gap = (sub.start - last_sub.end).total_seconds()
-			group_duration = (last_sub.end - current_group[0].start).total_seconds()
+			gap_ms = sub.start_ms - last_sub.end_ms
+			group_duration_ms = last_sub.end_ms - current_group[0].start_ms
 			
 			# Gộp nếu khoảng cách nhỏ hoặc group còn ngắn
-			if gap <= 1.0 or group_duration < 5.0:
+			if gap_ms <= 1000 or group_duration_ms < 5000:
 				current_group.append(sub)
 			else:
 				merged_subs.append(_merge_group(current_group))
@@ -2215,7 +4822,7 @@ def _merge_chunk_fallback(subs: List[srt.Subtitle]) -> List[srt.Subtitle]:
 	return merged_subs
 
 
-def _adjust_timing(subs: List[srt.Subtitle]) -> List[srt.Subtitle]:
+def _adjust_timing(subs: List[Cue]) -> List[Cue]:
 	"""Điều chỉnh timing hợp lý khi gộp các segment"""
 	adjusted_subs = []
 	
@@ -2224,28 +4831,22 @@ def _adjust_timing(subs: List[srt.Subtitle]) -> List[srt.Subtitle]:
 		
 		# Giữ nguyên timing gốc từ Gemini
 		# Chỉ điều chỉnh nếu có vấn đề về overlap
-		start_time = sub.start
-		end_time = sub.end
+		start_ms = sub.start_ms
+		end_ms = sub.end_ms
 		
 		# Kiểm tra overlap với subtitle tiếp theo
 		if i < len(subs) - 1:
-			next_start = subs[i + 1].start
-			if end_time > next_start:
+			next_start_ms = subs[i + 1].start_ms
+			if end_ms > next_start_ms:
 				# Có overlap - điều chỉnh thời gian kết thúc
-				end_time = next_start - timedelta(seconds=0.1)
+				end_ms = next_start_ms - 100
 		
 		# Kiểm tra thời gian tối thiểu (ít nhất 0.5 giây)
-		min_duration = 0.5
-		if (end_time - start_time).total_seconds() < min_duration:
-			end_time = start_time + timedelta(seconds=min_duration)
+		min_duration_ms = 500
+		if end_ms - start_ms < min_duration_ms:
+			end_ms = start_ms + min_duration_ms
 		
-		adjusted_sub = srt.Subtitle(
-			index=sub.index,
-			start=start_time,
-			end=end_time,
-			content=content
-		)
-		adjusted_subs.append(adjusted_sub)
+		adjusted_subs.append(Cue(sub.index, start_ms, end_ms, content))
 	
 	return adjusted_subs
 
@@ -2267,15 +4868,17 @@ def _count_syllables(text: str) -> int:
 	return syllable_count
 
 
-def merge_srt_segments(srt_path: Path, output_srt: Path, max_gap_seconds: float = 1.0, min_duration_seconds: float = 2.0) -> None:
+def merge_srt_segments(srt_path: Path, output_srt: Path, max_gap_seconds: float = 1.0, min_duration_seconds: float = 2.0, cues: Optional[List[Cue]] = None) -> List[Cue]:
 	"""Gộp các segment SRT ngắn thành câu dài hơn (fallback method)"""
-	with srt_path.open("r", encoding="utf-8") as f:
-		subs = list(srt.parse(f.read()))
+	subs = cues if cues is not None else read_srt_cues(srt_path)
 	
 	if not subs:
 		# Nếu không có subtitle, copy file gốc
 		shutil.copy(srt_path, output_srt)
-		return
+		return subs
+	
+	max_gap_ms = int(max_gap_seconds * 1000)
+	min_duration_ms = int(min_duration_seconds * 1000)
 	
 	merged_subs = []
 	current_group = []
@@ -2286,13 +4889,13 @@ def merge_srt_segments(srt_path: Path, output_srt: Path, max_gap_seconds: float
 		else:
 			# Kiểm tra khoảng cách với segment trước
 			last_sub = current_group[-1]
-			gap = (sub.start - last_sub.end).total_seconds()
+			gap_ms = sub.start_ms - last_sub.end_ms
 			
 			# Kiểm tra độ dài của group hiện tại
-			group_duration = (last_sub.end - current_group[0].start).total_seconds()
+			group_duration_ms = last_sub.end_ms - current_group[0].start_ms
 			
 			# Gộp nếu khoảng cách nhỏ hoặc group còn ngắn
-			if gap <= max_gap_seconds or group_duration < min_duration_seconds:
+			if gap_ms <= max_gap_ms or group_duration_ms < min_duration_ms:
 				current_group.append(sub)
 			else:
 				# Lưu group hiện tại và bắt đầu group mới
@@ -2304,29 +4907,20 @@ def merge_srt_segments(srt_path: Path, output_srt: Path, max_gap_seconds: float
 		merged_subs.append(_merge_group(current_group))
 	
 	# Ghi file mới
-	with output_srt.open("w", encoding="utf-8") as f:
-		f.write(srt.compose(merged_subs))
+	write_srt_cues(output_srt, merged_subs)
+	return merged_subs
 
 
-def _merge_group(subs: List[srt.Subtitle]) -> srt.Subtitle:
+def _merge_group(subs: List[Cue]) -> Cue:
 	"""Gộp một nhóm subtitle thành một subtitle duy nhất"""
 	if not subs:
 		return None
 	
-	# Lấy thời gian bắt đầu và kết thúc
-	start_time = subs[0].start
-	end_time = subs[-1].end
-	
-	# Gộp nội dung
+	# Gộp nội dung, thời gian = đầu của cue đầu tiên -> cuối của cue cuối cùng
 	content = " ".join(sub.content.strip() for sub in subs)
 	
-	# Tạo subtitle mới
-	return srt.Subtitle(
-		index=len(subs),  # Index mới
-		start=start_time,
-		end=end_time,
-		content=content
-	)
+	# Tạo subtitle mới (index được đánh lại khi ghi file)
+	return Cue(len(subs), subs[0].start_ms, subs[-1].end_ms, content)
 
 
 # -------------------- Orchestration --------------------
@@ -2403,10 +4997,191 @@ def run_pipeline(
 	return current_video
 
 
+# -------------------- Batch --------------------
+
+# URL playlist / kênh (YouTube) được mở rộng thành từng video qua metadata của yt-dlp
+PLAYLIST_URL_PATTERN = re.compile(
+	r"[?&]list=|/playlist\b|youtube\.com/(@[^/?#]+|channel/|c/|user/)", re.IGNORECASE
+)
+# Số video tối đa lấy từ một playlist / kênh
+BATCH_PLAYLIST_MAX_ENTRIES = int(os.getenv("BATCH_PLAYLIST_MAX_ENTRIES", "500"))
+
+
+def is_playlist_url(url: str) -> bool:
+	return bool(PLAYLIST_URL_PATTERN.search(url))
+
+
+def expand_playlist(url: str, max_entries: int = BATCH_PLAYLIST_MAX_ENTRIES) -> List[dict]:
+	"""
+	Danh sách video của playlist / kênh: [{"url", "name"}], chỉ đọc metadata (extract_flat), không resolve
+	từng video. URL không phải playlist trả về chính nó.
+	"""
+	import yt_dlp
+
+	options = _ytdlp_options(extract_flat="in_playlist", noplaylist=False, playlistend=max_entries)
+	with yt_dlp.YoutubeDL(options) as ydl:
+		info = ydl.extract_info(url, download=False)
+	if not info:
+		raise RuntimeError(f"yt-dlp returned no metadata for {url}")
+	if info.get("_type") not in ("playlist", "multi_video"):
+		return [{"url": info.get("webpage_url") or url, "name": info.get("title") or "", "duration": info.get("duration")}]
+
+	entries = []
+
+	def collect(playlist: dict) -> None:
+		for entry in playlist.get("entries") or []:
+			if len(entries) >= max_entries or not entry:
+				return
+			if entry.get("_type") == "playlist":
+				collect(entry)  # Kênh: các tab (Videos, Shorts...) là playlist lồng nhau
+				continue
+			video_url = entry.get("webpage_url") or entry.get("url")
+			if video_url and not video_url.startswith("http") and entry.get("ie_key") == "Youtube":
+				video_url = f"https://www.youtube.com/watch?v={video_url}"
+			if video_url:
+				# duration có sẵn trong metadata flat của playlist -> không cần probe lại khi submit
+				entries.append({"url": video_url, "name": entry.get("title") or "", "duration": entry.get("duration")})
+
+	collect(info)
+	print(f"📃 Playlist {info.get('title') or url}: {len(entries)} video(s)")
+	return entries
+
+
+def parse_batch_manifest(text: str) -> List[dict]:
+	"""
+	Manifest của batch:
+	- JSON: ["url", ...] hoặc [{"url": ..., "name": ..., "priority": ...}, ...]
+	- text: mỗi dòng một URL, có thể kèm tên sau dấu tab; dòng trống / bắt đầu bằng # bị bỏ qua
+	"""
+	import json
+
+	text = text.strip()
+	if text.startswith("["):
+		entries = []
+		for item in json.loads(text):
+			entry = {"url": item} if isinstance(item, str) else dict(item)
+			if not entry.get("url"):
+				raise ValueError(f"Manifest entry without url: {item}")
+			entries.append(entry)
+		return entries
+	entries = []
+	for line in text.splitlines():
+		line = line.strip()
+		if not line or line.startswith("#"):
+			continue
+		url, _, name = line.partition("\t")
+		entries.append({"url": url.strip(), "name": name.strip()})
+	return entries
+
+
+def collect_batch_entries(urls=(), manifest: Optional[str] = None) -> List[dict]:
+	"""URL + manifest -> danh sách video của batch; playlist / kênh được mở rộng, URL trùng bị bỏ"""
+	entries = [{"url": url} for url in urls if url and url.strip()]
+	if manifest:
+		entries.extend(parse_batch_manifest(manifest))
+	result = []
+	seen = set()
+	for entry in entries:
+		entry["url"] = entry["url"].strip()
+		expanded = expand_playlist(entry["url"]) if is_playlist_url(entry["url"]) else [entry]
+		for video in expanded:
+			if video["url"] in seen:
+				continue
+			seen.add(video["url"])
+			result.append(dict(entry, **video) if video is not entry else entry)
+	return result
+
+
+def format_batch_progress(batch: dict) -> str:
+	counts = batch.get("counts") or {}
+	parts = [f"{status}: {count}" for status, count in sorted(counts.items())]
+	return f"📦 Batch {batch.get('name') or batch['id'][:8]}: {batch.get('progress', 0)}% ({', '.join(parts)})"
+
+
+def run_batch_cli(sources: List[str], name: str = "", priority: int = 0, config_path: Optional[str] = None,
+                  wait: bool = True, poll_interval: float = 5.0) -> int:
+	"""
+	Tạo batch trong job store của web app (dùng chung hàng đợi, download cache, artifact store).
+	sources: URL video / playlist / kênh hoặc đường dẫn file manifest.
+	Process này chỉ submit: project đang chờ khác trong store do web app / pipeline_worker.py chạy.
+	wait=True mà không có pipeline_worker.py nào đang chạy thì process này tự chạy các project của batch
+	(chỉ chúng) và trước khi thoát trả project đang chạy dở về hàng đợi, chờ runner nhả lease.
+	"""
+	import json
+
+	# import web_app không được tự đưa mọi project đang chờ của store dùng chung vào scheduler của process này
+	os.environ["EMBEDDED_WORKER"] = "0"
+	import web_app
+
+	urls, manifests = [], []
+	for source in sources:
+		path = Path(source)
+		if not source.startswith(("http://", "https://")) and path.is_file():
+			manifests.append(path.read_text(encoding="utf-8"))
+		else:
+			urls.append(source)
+	entries = collect_batch_entries(urls, "\n".join(manifests) if manifests else None)
+	if not entries:
+		print("❌ No videos to submit")
+		return 1
+	config = web_app.DEFAULT_CONFIG.copy()
+	if config_path:
+		config.update(json.loads(Path(config_path).read_text(encoding="utf-8")))
+	batch = web_app.submit_batch(entries, config, name=name, priority=priority)
+	print(f"📦 Batch {batch['id']} submitted: {batch['total']} project(s)")
+	if not wait:
+		return 0
+
+	local = not web_app.job_store.live_workers()
+	if local:
+		print("🧵 No pipeline worker is running, processing the batch in this process")
+		for project_id in batch["project_ids"]:
+			project = web_app.job_store.get(project_id)
+			if project is not None:
+				web_app.schedule_project(project_id, project.get("priority", 0))
+	try:
+		while True:
+			progress = web_app.job_store.batch_progress(batch["id"])
+			print(format_batch_progress(progress))
+			if progress["finished"]:
+				break
+			time.sleep(poll_interval)
+	except KeyboardInterrupt:
+		print("⏹️ Interrupted")
+		return 130
+	finally:
+		if local:
+			_drain_batch_runs(web_app, batch["project_ids"])
+	return 0 if not progress["counts"].get("error") else 2
+
+
+def _drain_batch_runs(web_app, project_ids: List[str], grace_period: float = 30) -> None:
+	"""Bỏ project chưa chạy khỏi scheduler, trả project đang chạy về hàng đợi và chờ runner nhả lease"""
+	for project_id in project_ids:
+		web_app.project_scheduler.cancel(project_id)
+		if web_app.job_store.requeue(project_id):
+			print(f"↩️ Re-queued project {project_id}")
+	# Runner thấy lần chạy không còn hiện hành -> hủy công việc đang dở rồi nhả lease
+	deadline = time.monotonic() + grace_period
+	while web_app.project_scheduler.status()["running"] and time.monotonic() < deadline:
+		time.sleep(0.5)
+
+
 # -------------------- CLI wrapper --------------------
 
 def main() -> None:
 	parser = argparse.ArgumentParser(description="Automate video processing pipeline (GUI can call run_pipeline)")
+	parser.add_argument("--batch", nargs="+", metavar="SOURCE",
+	                    help="Batch mode: URL video / playlist / kênh hoặc file manifest, chạy qua job store của web app")
+	parser.add_argument("--batch_name", default="")
+	parser.add_argument("--priority", type=int, default=0)
+	parser.add_argument("--config", default=None, help="Batch mode: file JSON ghi đè DEFAULT_CONFIG của web app")
+	parser.add_argument("--no_wait", action="store_true",
+	                    help="Batch mode: chỉ submit, không chờ (web app / pipeline_worker.py chạy batch)")
+	if "--batch" in sys.argv:
+		args = parser.parse_args()
+		load_dotenv()
+		sys.exit(run_batch_cli(args.batch, args.batch_name, args.priority, args.config, wait=not args.no_wait))
 	parser.add_argument("--url", required=True)
 	parser.add_argument("--workdir", default=".")
 	parser.add_argument("--assemblyai_api_key", required=True)
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Worker process chạy pipeline, tách khỏi web tier (Flask/gunicorn).
+Web app (EMBEDDED_WORKER=0) chỉ ghi project vào job store; worker claim project đầu hàng đợi và chạy nó,
+nên recycle gunicorn worker không giết job đang chạy và pydub/segmentation không tranh GIL với request.
+
+Nhiều node dùng chung một coordinator: thư mục chứa job store (projects/jobs.db), thư mục project và
+artifact store (cache/artifacts), vd mount NFS. Mỗi lần chạy giữ lease được gia hạn bằng heartbeat;
+node chết thì lease hết hạn và project được worker khác chạy tiếp. Output từng stage được đẩy vào artifact
+store của coordinator nên node khác lấy lại thay vì chạy lại.
+
+Stage affinity: --capabilities là các resource class node nhận (xem resource_limits). Stage cần class khác
+(vd "cpu" cho ffmpeg encode) được trả về hàng đợi cho node có class đó.
+
+Chạy:
+    python pipeline_worker.py                  # 1 process, 1 project một lúc
+    python pipeline_worker.py --slots 2        # 1 process, 2 project song song
+    python pipeline_worker.py --processes 4    # 4 worker process trên cùng máy
+    python pipeline_worker.py --coordinator /mnt/autotranslate --workdir /tmp/autotranslate \\
+        --capabilities network,assemblyai,gemini,deepseek,fpt   # node chỉ chạy stage tải / gọi API
+"""
+
+import os
+
+# Worker tự claim job từ job store, không dùng scheduler trong process của web_app
+os.environ['EMBEDDED_WORKER'] = '0'
+
+import argparse
+import logging
+import signal
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+# Setup logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler('worker.log'),
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger(__name__)
+
+HEARTBEAT_INTERVAL = 10
+
+
+def use_coordinator(coordinator_dir):
+    """Trỏ job store, thư mục project, artifact store và upload tới coordinator (phải gọi trước khi import web_app)"""
+    coordinator_dir = Path(coordinator_dir).resolve()
+    os.environ['JOB_STORE_PATH'] = str(coordinator_dir / 'projects' / 'jobs.db')
+    os.environ['PROJECTS_DIR'] = str(coordinator_dir / 'projects')
+    os.environ['ARTIFACT_STORE_DIR'] = str(coordinator_dir / 'cache' / 'artifacts')
+    os.environ['UPLOADS_DIR'] = str(coordinator_dir / 'uploads')
+
+
+class PipelineWorker:
+    def __init__(self, slots=1, poll_interval=1.0, workdir=None, capabilities=None):
+        # Import muộn: đường dẫn job store / artifact store đọc từ env lúc import (xem use_coordinator)
+        import web_app
+        from job_store import process_owner
+        from pipeline import JobScheduler
+
+        self.app = web_app
+        self.slots = max(1, slots)
+        self.poll_interval = poll_interval
+        self.workdir = workdir
+        self.capabilities = set(capabilities) if capabilities is not None else None
+        self.worker_id = process_owner()
+        self.running = False
+        self._wakeup = threading.Event()
+        # Deadline/stuck detection giống scheduler trong web process
+        self.scheduler = JobScheduler(self.slots, on_timeout=web_app.handle_project_timeout)
+        self.active = set()
+
+    def can_run(self, stage):
+        return self.capabilities is None or set(stage.resources) <= self.capabilities
+
+    def start(self):
+        """Claim và chạy project cho tới khi nhận SIGINT/SIGTERM"""
+        capabilities = ', '.join(sorted(self.capabilities)) if self.capabilities is not None else 'all'
+        logger.info(f"🚀 Starting pipeline worker {self.worker_id} ({self.slots} slot(s), capabilities: {capabilities})")
+        self.running = True
+        signal.signal(signal.SIGINT, self.signal_handler)
+        signal.signal(signal.SIGTERM, self.signal_handler)
+
+        # import web_app đã reconcile job store (đưa lại vào hàng đợi project mà process chạy chúng đã chết)
+        self.scheduler.start()
+        last_heartbeat = 0.0
+
+        while self.running:
+            if time.monotonic() - last_heartbeat >= HEARTBEAT_INTERVAL:
+                self.app.job_store.heartbeat_worker(self.worker_id, self.slots, self.capabilities)
+                last_heartbeat = time.monotonic()
+
+            claimed = None
+            if self.scheduler.has_capacity():
+                claimed = self.app.job_store.claim_next(self.worker_id, self.capabilities)
+            if claimed is None:
+                # Hàng đợi trống hoặc hết slot: chờ job xong (wakeup) hoặc poll lại job store
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+
+            project_id, run_id = claimed
+            logger.info(f"📥 Claimed project {project_id}")
+            self.active.add(project_id)
+            self.scheduler.submit(project_id, lambda project_id=project_id, run_id=run_id: self.run_project(project_id, run_id),
+                                  timeout=lambda project_id=project_id: self.app.project_timeout_sec(project_id))
+
+        self.shutdown()
+
+    def run_project(self, project_id, run_id):
+        try:
+            self.app.run_claimed_project(project_id, run_id, workdir_root=self.workdir, can_run=self.can_run)
+            project = self.app.job_store.get(project_id) or {}
+            logger.info(f"✅ Finished project {project_id} (status: {project.get('status')})")
+        finally:
+            self.active.discard(project_id)
+            self._wakeup.set()
+
+    def shutdown(self, grace_period=30):
+        """Trả project đang chạy về hàng đợi để worker khác chạy tiếp từ artifact hợp lệ cuối cùng"""
+        for project_id in list(self.active):
+            if self.app.job_store.requeue(project_id):
+                logger.info(f"↩️ Re-queued project {project_id}")
+        # Runner hủy công việc đang dở (ffmpeg bị terminate, HTTP call bỏ dở) rồi nhả lease
+        deadline = time.monotonic() + grace_period
+        while self.active and time.monotonic() < deadline:
+            time.sleep(0.5)
+        self.app.job_store.remove_worker(self.worker_id)
+        logger.info("✅ Worker stopped")
+
+    def signal_handler(self, signum, frame):
+        """Handle shutdown signals"""
+        logger.info(f"   Received signal {signum}")
+        self.running = False
+        self._wakeup.set()
+
+
+def run_processes(count, argv):
+    """Chạy count worker process (mỗi process một PipelineWorker), chuyển tiếp SIGINT/SIGTERM cho chúng"""
+    command = [sys.executable, os.path.abspath(__file__)] + argv + ['--processes', '1']
+    children = [subprocess.Popen(command) for _ in range(count)]
+    logger.info(f"🚀 Started {count} worker process(es): {[child.pid for child in children]}")
+
+    def forward(signum, frame):
+        for child in children:
+            if child.poll() is None:
+                child.send_signal(signum)
+
+    signal.signal(signal.SIGINT, forward)
+    signal.signal(signal.SIGTERM, forward)
+    return max(child.wait() for child in children)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Auto Translate Video pipeline worker")
+    parser.add_argument('--slots', type=int, default=int(os.getenv('WORKER_SLOTS', '1')),
+                        help='Số project chạy song song trong một process')
+    parser.add_argument('--processes', type=int, default=int(os.getenv('WORKER_PROCESSES', '1')),
+                        help='Số worker process trên máy này')
+    parser.add_argument('--poll-interval', type=float, default=1.0,
+                        help='Số giây giữa hai lần kiểm tra hàng đợi khi rảnh')
+    parser.add_argument('--coordinator', default=os.getenv('COORDINATOR_DIR'),
+                        help='Thư mục coordinator dùng chung (job store, projects/, cache/artifacts)')
+    parser.add_argument('--workdir', default=os.getenv('WORKER_WORKDIR'),
+                        help='Thư mục làm việc cục bộ của node (mặc định: projects/ của coordinator)')
+    parser.add_argument('--capabilities', default=os.getenv('WORKER_CAPABILITIES'),
+                        help='Resource class node nhận, cách nhau bởi dấu phẩy (mặc định: tất cả)')
+    args = parser.parse_args()
+
+    if args.processes > 1:
+        sys.exit(run_processes(args.processes, sys.argv[1:]))
+    if args.coordinator:
+        use_coordinator(args.coordinator)
+    capabilities = [name.strip() for name in args.capabilities.split(',') if name.strip()] if args.capabilities else None
+    PipelineWorker(args.slots, args.poll_interval, args.workdir, capabilities).start()
+
+
+if __name__ == "__main__":
+    main()
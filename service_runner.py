@@ -77,12 +77,11 @@ class AutoTranslateService:
         
         # Cleanup nếu cần
         try:
-            # Dừng queue processor
+            # Trạng thái project nằm trong job store: project đang chạy sẽ được đưa lại vào hàng đợi khi khởi động lại
             if hasattr(self, 'app') and self.app:
-                # Set global flag to stop queue processor
                 import web_app
-                web_app.queue_processor_running = False
-                logger.info("   Queue processor stopped")
+                counts = web_app.job_store.count_by_status()
+                logger.info(f"   {counts.get('running', 0)} running / {counts.get('queued', 0)} queued project(s) will resume on next start")
                 
         except Exception as e:
             logger.error(f"   Error during cleanup: {e}")
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# Module của app nằm ở thư mục gốc repo (không có package)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
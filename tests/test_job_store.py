@@ -0,0 +1,201 @@
+import pytest
+
+from job_store import JobStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return JobStore(tmp_path / "jobs.db")
+
+
+def make_project(project_id, status="queued", created_at="2026-01-01T00:00:00", **fields):
+    return dict({"id": project_id, "status": status, "priority": 0, "created_at": created_at, "steps": {}}, **fields)
+
+
+def restart(store, project_id):
+    """Như /api/restart: ghi đè project về 'queued' trong khi runner cũ có thể vẫn đang chạy"""
+    store.put(make_project(project_id))
+
+
+def test_put_get_list_round_trip(store):
+    store.put(make_project("p2", created_at="2026-01-02T00:00:00", name="b"))
+    store.put(make_project("p1", status="completed", name="a"))
+    assert store.get("p1")["name"] == "a"
+    assert store.get("missing") is None
+    assert [project["id"] for project in store.list()] == ["p1", "p2"]
+    assert [project["id"] for project in store.list("queued")] == ["p2"]
+    assert [project["id"] for project in store.list(("queued", "completed"))] == ["p1", "p2"]
+
+
+def test_state_is_shared_across_store_instances(store, tmp_path):
+    store.put(make_project("p1"))
+    other = JobStore(tmp_path / "jobs.db")
+    assert other.update_status("p1", "stopped")
+    assert store.get("p1")["status"] == "stopped"
+
+
+# ---- claim / lease / fencing ----
+
+def test_claim_is_exclusive(store):
+    store.put(make_project("p1"))
+    run_id = store.claim("p1", owner="a")
+    assert run_id is not None
+    assert store.claim("p1", owner="b") is None
+    assert store.is_current_run("p1", run_id)
+
+
+def test_claim_refused_while_active_run_is_held(store):
+    store.put(make_project("p1"))
+    run_id = store.claim("p1", owner="a")
+    with store.hold_lease("p1", run_id):
+        restart(store, "p1")
+        assert store.get("p1")["status"] == "queued"
+        # Runner cũ chưa thoát -> chưa ai claim được lần chạy mới
+        assert store.claim("p1", owner="b") is None
+        assert store.claim_next(owner="b") is None
+    # Ra khỏi hold_lease = runner cũ đã nhả lease
+    assert store.claim("p1", owner="b") is not None
+
+
+def test_claim_allowed_after_active_run_lease_expires(store):
+    store.put(make_project("p1"))
+    run_id = store.claim("p1", owner="a")
+    restart(store, "p1")
+    store._connect().execute("UPDATE projects SET lease_expires_at = 0 WHERE id = 'p1'")
+    assert store.claim("p1", owner="b") not in (None, run_id)
+
+
+def test_save_run_fenced_after_stop(store):
+    store.put(make_project("p1"))
+    run_id = store.claim("p1")
+    project = store.get("p1")
+    project["progress"] = 10
+    assert store.save_run(project, run_id)
+
+    assert store.update_status("p1", "stopped", expected=("queued", "running"))
+    project["progress"] = 50
+    assert not store.save_run(project, run_id)
+    project["status"] = "completed"
+    assert not store.finish_run(project, run_id)
+    assert store.get("p1")["status"] == "stopped"
+    assert store.get("p1")["progress"] == 10
+    assert not store.is_current_run("p1", run_id)
+
+
+def test_save_run_fenced_after_restart(store):
+    store.put(make_project("p1"))
+    old_run = store.claim("p1")
+    restart(store, "p1")
+    store.release("p1", old_run)
+    new_run = store.claim("p1")
+    project = store.get("p1")
+    assert not store.save_run(dict(project, progress=99), old_run)
+    assert store.save_run(dict(project, progress=1), new_run)
+    assert store.get("p1")["progress"] == 1
+
+
+# ---- change feed ----
+
+def test_change_feed_tracks_insert_update_delete(store):
+    start = store.current_version()
+    store.put(make_project("p1"))
+    store.put(make_project("p2"))
+    after_insert = store.current_version()
+    assert after_insert == start + 2
+
+    changed, deleted, version = store.changes_since(start)
+    assert [project["id"] for project in changed] == ["p1", "p2"]
+    assert deleted == []
+    assert version == after_insert
+
+    store.update_status("p1", "stopped")
+    changed, deleted, version = store.changes_since(after_insert)
+    assert [project["id"] for project in changed] == ["p1"]
+    assert changed[0]["version"] == version
+
+    store.delete("p2")
+    changed, deleted, latest = store.changes_since(version)
+    assert changed == []
+    assert deleted == ["p2"]
+    assert latest == store.current_version()
+
+
+def test_change_feed_ignores_lease_renewal(store):
+    store.put(make_project("p1"))
+    run_id = store.claim("p1")
+    version = store.current_version()
+    assert store.renew_lease("p1", run_id)
+    assert store.current_version() == version
+    assert store.changes_since(version) == ([], [], version)
+
+
+def test_reinserted_project_leaves_deleted_feed(store):
+    store.put(make_project("p1"))
+    store.delete("p1")
+    version = store.current_version()
+    store.put(make_project("p1"))
+    changed, deleted, _ = store.changes_since(0)
+    assert [project["id"] for project in changed] == ["p1"]
+    assert deleted == []
+    assert store.changes_since(version)[1] == []
+
+
+def test_wait_for_change_returns_new_version(store):
+    version = store.current_version()
+    assert store.wait_for_change(version, 0.01) == version
+    store.put(make_project("p1"))
+    assert store.wait_for_change(version, 5) > version
+
+
+# ---- keyset pagination ----
+
+def test_page_walks_every_project_once_in_order(store):
+    ids = []
+    for index in range(7):
+        project_id = f"p{index}"
+        # created_at trùng nhau -> id là khóa phụ của cursor
+        store.put(make_project(project_id, created_at=f"2026-01-0{1 + index // 2}T00:00:00"))
+        ids.append(project_id)
+
+    seen, cursor = [], None
+    while True:
+        projects, cursor = store.page(limit=3, after=cursor)
+        seen.extend(project["id"] for project in projects)
+        if cursor is None:
+            break
+    assert seen == ids
+
+
+def test_page_with_status_filter(store):
+    for index in range(6):
+        store.put(make_project(f"p{index}", status="queued" if index % 2 else "completed",
+                               created_at=f"2026-01-01T00:00:0{index}"))
+    first, cursor = store.page(status="queued", limit=2)
+    assert [project["id"] for project in first] == ["p1", "p3"]
+    rest, cursor = store.page(status="queued", limit=2, after=cursor)
+    assert [project["id"] for project in rest] == ["p5"]
+    assert cursor is None
+
+
+def test_page_exact_fit_has_no_next_cursor(store):
+    for index in range(2):
+        store.put(make_project(f"p{index}", created_at=f"2026-01-01T00:00:0{index}"))
+    projects, cursor = store.page(limit=2)
+    assert len(projects) == 2
+    assert cursor is None
+
+
+def test_requeue_keeps_queue_position(store):
+    store.configure_queue("fifo", None)
+    store.put(make_project("p1"))
+    store.put(make_project("p2"))
+    run_id = store.claim("p1")
+    queued_at = store._connect().execute("SELECT queued_at FROM projects WHERE id = 'p1'").fetchone()[0]
+    assert store.requeue("p1")
+    assert store.get("p1")["status"] == "queued"
+    assert not store.is_current_run("p1", run_id)
+    assert store._connect().execute("SELECT queued_at FROM projects WHERE id = 'p1'").fetchone()[0] == queued_at
+    # Runner cũ nhả lease khi thoát -> p1 chạy lại trước p2 như trước khi bị gián đoạn
+    store.release("p1", run_id)
+    assert store.queue_head(2) == ["p1", "p2"]
+    assert not store.requeue("p2")
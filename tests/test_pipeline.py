@@ -0,0 +1,502 @@
+import multiprocessing
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+from pipeline import (ArtifactStore, CancelToken, Cancelled, Cue, JobScheduler, ResourcePool, Stage, artifact_key,
+                      cancel_scope, compose_srt_cues, current_cancel_token, load_word_timings, parse_srt_cues, run_process,
+                      run_stage_cached, run_stage_graph, save_word_timings, _load_stream_checkpoint,
+                      _run_pipelined, _write_json_atomic)
+
+
+@pytest.fixture
+def artifacts(tmp_path):
+    return ArtifactStore(tmp_path / "artifacts")
+
+
+def write_outputs(workdir, **files):
+    workdir.mkdir(parents=True, exist_ok=True)
+    for name, content in files.items():
+        (workdir / name).write_text(content, encoding="utf-8")
+
+
+# ---- artifact store ----
+
+def test_fetch_links_stored_blob_and_adds_ref(artifacts, tmp_path):
+    write_outputs(tmp_path / "p1", **{"out.srt": "hello"})
+    assert not artifacts.fetch("k1", tmp_path / "p2", ["out.srt"], "p2")
+    artifacts.put("k1", tmp_path / "p1", ["out.srt"], "p1")
+    assert artifacts.fetch("k1", tmp_path / "p2", ["out.srt"], "p2")
+    assert (tmp_path / "p2" / "out.srt").read_text(encoding="utf-8") == "hello"
+    assert sorted(path.name for path in (artifacts.refs_dir / "k1").iterdir()) == ["p1", "p2"]
+    assert not artifacts.fetch("k1", tmp_path / "p2", ["out.srt", "missing.wav"], "p2")
+
+
+def test_release_keeps_blob_while_another_project_references_it(artifacts, tmp_path):
+    write_outputs(tmp_path / "p1", **{"out.srt": "hello"})
+    artifacts.put("k1", tmp_path / "p1", ["out.srt"], "p1")
+    assert artifacts.fetch("k1", tmp_path / "p2", ["out.srt"], "p2")
+
+    assert artifacts.release_project("p1") == []
+    assert artifacts.has("k1", ["out.srt"])
+    # Project còn lại vẫn đọc được file của mình, project mới vẫn dùng lại được blob
+    assert (tmp_path / "p2" / "out.srt").read_text(encoding="utf-8") == "hello"
+    assert artifacts.fetch("k1", tmp_path / "p3", ["out.srt"], "p3")
+
+    assert artifacts.release_project("p2") == []
+    assert artifacts.release_project("p3") == ["k1"]
+    assert not artifacts.has("k1", ["out.srt"])
+    assert not (artifacts.refs_dir / "k1").exists()
+    assert artifacts.release_project("p3") == []
+
+
+def test_put_replace_keeps_files_of_old_projects(artifacts, tmp_path):
+    write_outputs(tmp_path / "p1", **{"out.srt": "old"})
+    artifacts.put("k1", tmp_path / "p1", ["out.srt"], "p1")
+    write_outputs(tmp_path / "p2", **{"out.srt": "new"})
+    artifacts.put("k1", tmp_path / "p2", ["out.srt"], "p2", replace=True)
+    assert artifacts.fetch("k1", tmp_path / "p3", ["out.srt"], "p3")
+    assert (tmp_path / "p3" / "out.srt").read_text(encoding="utf-8") == "new"
+    assert (tmp_path / "p1" / "out.srt").read_text(encoding="utf-8") == "old"
+    # p1 vẫn tham chiếu key: xóa p2, p3 không được xóa blob
+    assert artifacts.release_project("p2") == []
+    assert artifacts.release_project("p3") == []
+    assert artifacts.release_project("p1") == ["k1"]
+
+
+def test_legacy_refs_json_is_migrated_once(tmp_path):
+    root = tmp_path / "artifacts"
+    write_outputs(tmp_path / "p1", **{"out.srt": "hello"})
+    ArtifactStore(root).put("k1", tmp_path / "p1", ["out.srt"], "p1")
+    (root / "refs.json").write_text('{"k1": ["p1", "p2"]}', encoding="utf-8")
+
+    artifacts = ArtifactStore(root)
+    assert not (root / "refs.json").exists()
+    assert (root / "refs.json.migrated").exists()
+    assert artifacts.release_project("p1") == []
+    assert artifacts.release_project("p2") == ["k1"]
+
+
+# ---- single-flight ----
+
+def start_slow_stage(artifacts, workdir, project_id, release, fail=False):
+    """Chạy stage 'stt' trong thread riêng; run() chờ release rồi ghi output (hoặc lỗi)"""
+    def run():
+        release.wait(5)
+        if fail:
+            raise RuntimeError("provider down")
+        write_outputs(workdir, **{"out.srt": project_id})
+
+    def target():
+        try:
+            run_stage_cached(artifacts, project_id, "stt", workdir, [workdir.parent / "in.wav"], {}, ["out.srt"], run)
+        except RuntimeError:
+            pass
+
+    thread = threading.Thread(target=target)
+    thread.start()
+    return thread
+
+
+def wait_in_flight(artifacts, key):
+    lock = artifacts.in_flight(key)
+    for _ in range(500):
+        if lock.locked():
+            return
+        time.sleep(0.01)
+    raise AssertionError("stage never started")
+
+
+def test_identical_stage_waits_for_in_flight_run_and_reuses_it(artifacts, tmp_path):
+    write_outputs(tmp_path, **{"in.wav": "audio"})
+    key = artifact_key("stt", [tmp_path / "in.wav"], {})
+    release = threading.Event()
+    first = start_slow_stage(artifacts, tmp_path / "p1", "p1", release)
+    wait_in_flight(artifacts, key)
+
+    calls = []
+    release_timer = threading.Timer(0.2, release.set)
+    release_timer.start()
+    reused = run_stage_cached(artifacts, "p2", "stt", tmp_path / "p2", [tmp_path / "in.wav"], {}, ["out.srt"],
+                              lambda: calls.append("p2"))
+    first.join()
+    assert reused
+    assert calls == []
+    assert (tmp_path / "p2" / "out.srt").read_text(encoding="utf-8") == "p1"
+
+
+def test_waiting_stage_runs_itself_when_in_flight_run_fails(artifacts, tmp_path):
+    write_outputs(tmp_path, **{"in.wav": "audio"})
+    key = artifact_key("stt", [tmp_path / "in.wav"], {})
+    release = threading.Event()
+    first = start_slow_stage(artifacts, tmp_path / "p1", "p1", release, fail=True)
+    wait_in_flight(artifacts, key)
+
+    release_timer = threading.Timer(0.2, release.set)
+    release_timer.start()
+    reused = run_stage_cached(artifacts, "p2", "stt", tmp_path / "p2", [tmp_path / "in.wav"], {}, ["out.srt"],
+                              lambda: write_outputs(tmp_path / "p2", **{"out.srt": "p2"}))
+    first.join()
+    assert not reused
+    assert (tmp_path / "p2" / "out.srt").read_text(encoding="utf-8") == "p2"
+    assert artifacts.has(key, ["out.srt"])
+
+
+# ---- stage graph ----
+
+def make_stages(workdir, calls):
+    def step(name, source, target):
+        def run():
+            calls.append(name)
+            (workdir / target).write_text((workdir / source).read_text(encoding="utf-8") + name, encoding="utf-8")
+        return run
+
+    return [
+        Stage("translate", step("translate", "a.srt", "b.srt"), outputs=["b.srt"], inputs=["a.srt"],
+              params=["target_language"]),
+        Stage("stt", step("stt", "in.wav", "a.srt"), outputs=["a.srt"], inputs=["in.wav"]),
+    ]
+
+
+def run_graph(workdir, calls, config, **kwargs):
+    events = []
+    assert run_stage_graph(make_stages(workdir, calls), workdir, config,
+                           on_event=lambda stage, status, error: events.append((stage.name, status)), **kwargs)
+    return dict(events)
+
+
+def test_stage_graph_skips_up_to_date_stages(tmp_path):
+    write_outputs(tmp_path, **{"in.wav": "audio"})
+    calls = []
+    run_graph(tmp_path, calls, {"target_language": "vi"})
+    assert calls == ["stt", "translate"]
+    assert (tmp_path / "b.srt").read_text(encoding="utf-8") == "audiostttranslate"
+
+    calls.clear()
+    assert run_graph(tmp_path, calls, {"target_language": "vi"}) == {"stt": "up_to_date", "translate": "up_to_date"}
+    assert calls == []
+
+    # Đổi param của một stage -> chỉ stage đó chạy lại
+    events = run_graph(tmp_path, calls, {"target_language": "en"})
+    assert calls == ["translate"]
+    assert events["stt"] == "up_to_date"
+
+
+def test_stage_graph_reruns_stage_whose_input_changed(tmp_path):
+    write_outputs(tmp_path, **{"in.wav": "audio"})
+    calls = []
+    run_graph(tmp_path, calls, {})
+    calls.clear()
+    write_outputs(tmp_path, **{"in.wav": "other audio"})
+    run_graph(tmp_path, calls, {})
+    assert calls == ["stt", "translate"]
+
+
+def test_stage_graph_force_reruns_up_to_date_stage(tmp_path):
+    write_outputs(tmp_path, **{"in.wav": "audio"})
+    calls = []
+    run_graph(tmp_path, calls, {})
+    calls.clear()
+    events = run_graph(tmp_path, calls, {}, force=["translate"])
+    assert calls == ["translate"]
+    assert events == {"stt": "up_to_date", "translate": "completed"}
+
+
+def test_stage_graph_reuses_other_project_output_from_store(tmp_path):
+    artifacts = ArtifactStore(tmp_path / "artifacts")
+    for project_id in ("p1", "p2"):
+        write_outputs(tmp_path / project_id, **{"in.wav": "audio"})
+    calls = []
+    run_graph(tmp_path / "p1", calls, {}, store=artifacts, project_id="p1")
+    calls.clear()
+    assert run_graph(tmp_path / "p2", calls, {}, store=artifacts, project_id="p2") == {"stt": "reused",
+                                                                                       "translate": "reused"}
+    assert calls == []
+    assert (tmp_path / "p2" / "b.srt").read_text(encoding="utf-8") == "audiostttranslate"
+
+
+# ---- resource pool ----
+
+def hold_cpu_slot(slots_dir, holding, release):
+    pool = ResourcePool(slots_dir=slots_dir)
+    with pool.slots(["cpu"]):
+        holding.set()
+        release.wait(10)
+
+
+def test_resource_pool_limit_is_shared_across_processes(tmp_path):
+    pytest.importorskip("fcntl")
+    pool = ResourcePool({"cpu": 1}, slots_dir=tmp_path / "slots")
+    context = multiprocessing.get_context("fork")
+    holding, release = context.Event(), context.Event()
+    other = context.Process(target=hold_cpu_slot, args=(tmp_path / "slots", holding, release))
+    other.start()
+    try:
+        assert holding.wait(10)
+        assert pool.status()["cpu"] == {"limit": 1, "in_use": 1}
+
+        acquired = threading.Event()
+
+        def acquire():
+            with pool.slots(["cpu"]):
+                acquired.set()
+
+        waiter = threading.Thread(target=acquire)
+        waiter.start()
+        assert not acquired.wait(1)
+        release.set()
+        assert acquired.wait(10)
+        waiter.join()
+    finally:
+        release.set()
+        other.join(10)
+
+
+def test_resource_pool_limits_are_shared_through_slots_dir(tmp_path):
+    pytest.importorskip("fcntl")
+    ResourcePool({"cpu": 1}, slots_dir=tmp_path / "slots").configure({"cpu": 3})
+    # Process khác mở cùng thư mục: dùng giới hạn đã cấu hình, không phải giá trị ban đầu của nó
+    assert ResourcePool({"cpu": 1}, slots_dir=tmp_path / "slots").status()["cpu"] == {"limit": 3, "in_use": 0}
+
+
+# ---- job scheduler ----
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not reached")
+        time.sleep(0.01)
+
+
+def test_expired_job_keeps_its_slot_until_runner_returns():
+    timeouts, started = [], []
+    scheduler = JobScheduler(max_running=1, on_timeout=lambda job_id, timeout: timeouts.append((job_id, timeout)))
+    scheduler.start()
+    release = threading.Event()
+
+    def slow():
+        started.append("a")
+        release.wait(10)  # runner không dừng ngay khi bị báo timeout
+
+    scheduler.submit("a", slow, timeout=0.05)
+    scheduler.submit("b", lambda: started.append("b"))
+    wait_until(lambda: timeouts)
+    assert timeouts == [("a", 0.05)]
+    assert scheduler.status()["expired"] == 1
+    time.sleep(0.2)
+    assert started == ["a"]
+    release.set()
+    wait_until(lambda: started == ["a", "b"])
+    wait_until(lambda: scheduler.status() == {"queued": 0, "running": 0, "expired": 0, "max_running": 1})
+
+
+def test_scheduler_runs_by_priority_then_fifo():
+    order = []
+    scheduler = JobScheduler(max_running=1)
+    for job_id, priority in (("low", 0), ("high", 5), ("low2", 0)):
+        scheduler.submit(job_id, lambda job_id=job_id: order.append(job_id), priority=priority)
+    assert scheduler.queued() == ["high", "low", "low2"]
+    scheduler.start()
+    wait_until(lambda: len(order) == 3)
+    assert order == ["high", "low", "low2"]
+
+
+def test_callable_timeout_is_evaluated_when_job_starts():
+    timeouts = []
+    computed = []
+    scheduler = JobScheduler(max_running=1, on_timeout=lambda job_id, timeout: timeouts.append((job_id, timeout)))
+    release = threading.Event()
+
+    def timeout():
+        computed.append("a")
+        return 0.05
+
+    scheduler.submit("a", lambda: release.wait(10), timeout=timeout)
+    assert computed == []
+    scheduler.start()
+    wait_until(lambda: timeouts)
+    assert computed == ["a"]
+    assert timeouts == [("a", 0.05)]
+    release.set()
+
+
+def test_scheduler_dispatches_in_order_callback_ranking():
+    started = []
+    asked = []
+
+    def order(limit):
+        asked.append(limit)
+        return ["short", "long"][:limit]  # vd SJF từ job store: job ngắn chạy trước dù submit sau
+
+    scheduler = JobScheduler(max_running=1, order=order)
+    scheduler.submit("long", lambda: started.append("long"))
+    scheduler.submit("short", lambda: started.append("short"))
+    scheduler.submit("other", lambda: started.append("other"))
+    scheduler.start()
+    wait_until(lambda: len(started) == 3)
+    assert started == ["short", "long", "other"]
+    assert set(asked) == {1}
+
+
+# ---- SRT cues ----
+
+def test_parse_srt_cues_tolerates_malformed_input():
+    content = ("\ufeffHere is the translation:\r\n\r\n"
+               "1\r\n00:00:01,000 --> 00:00:02,500\r\nXin chào\r\n\r\n"
+               "00:03.2 --> 00:04,000\r\nThiếu số thứ tự, giờ và dấu chấm\r\n"
+               "7\n00:00:05,000 --> 00:00:06,000\nHai\ndòng\n"
+               "8\n00:00:07,000 --> 00:00:08,000\nThiếu dòng trống ở trên\n")
+    assert parse_srt_cues(content) == [
+        Cue(1, 1000, 2500, "Xin chào"),
+        Cue(2, 3200, 4000, "Thiếu số thứ tự, giờ và dấu chấm"),
+        Cue(7, 5000, 6000, "Hai\ndòng"),
+        Cue(8, 7000, 8000, "Thiếu dòng trống ở trên"),
+    ]
+    assert parse_srt_cues("") == []
+    assert parse_srt_cues("no cues here") == []
+
+
+def test_compose_srt_cues_round_trip_reindexes_and_drops_invalid():
+    cues = [Cue(5, 4000, 5000, "second"), Cue(9, 1000, 2000, "first\n\n  \nline"),
+            Cue(3, 3000, 3000, "zero length"), Cue(4, 6000, 7000, "   ")]
+    content = compose_srt_cues(cues)
+    assert content == ("1\n00:00:01,000 --> 00:00:02,000\nfirst\nline\n\n"
+                       "2\n00:00:04,000 --> 00:00:05,000\nsecond\n\n")
+    assert compose_srt_cues(parse_srt_cues(content)) == content
+    assert compose_srt_cues([Cue(5, 4000, 5000, "keep")], reindex=False).startswith("5\n")
+
+
+# ---- word timings ----
+
+def test_word_timings_round_trip(tmp_path):
+    words = [{"text": "Xin", "start": 100, "end": 300, "confidence": 0.5},
+             {"text": "chào", "start": 350, "end": 700, "confidence": 0.25},
+             {"text": "", "start": 800, "end": 900},
+             {"text": "lost", "start": None, "end": 1000}]
+    save_word_timings(words, tmp_path / "words.bin")
+    timings = load_word_timings(tmp_path / "words.bin")
+    assert len(timings) == 3
+    assert timings.text(1) == "chào"
+    # Từ không có timestamp bị bỏ, confidence thiếu thành 0
+    assert timings.to_words() == [dict(words[0]), dict(words[1]), dict(words[2], confidence=0.0)]
+
+
+def test_word_timings_round_trip_empty(tmp_path):
+    save_word_timings([], tmp_path / "words.bin")
+    timings = load_word_timings(tmp_path / "words.bin")
+    assert len(timings) == 0
+    assert timings.to_words() == []
+
+
+def test_load_word_timings_rejects_other_files(tmp_path):
+    (tmp_path / "words.bin").write_bytes(b"not a word timings file")
+    with pytest.raises(ValueError):
+        load_word_timings(tmp_path / "words.bin")
+
+
+# ---- cancellation ----
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    return True
+
+
+needs_shell = pytest.mark.skipif(sys.platform == "win32", reason="needs a POSIX shell")
+
+
+@needs_shell
+def test_cancel_terminates_running_child_process(tmp_path):
+    token = CancelToken()
+    pid_file = tmp_path / "child.pid"
+    threading.Timer(0.3, token.cancel).start()
+    started = time.monotonic()
+    with cancel_scope(token), pytest.raises(Cancelled):
+        run_process(["sh", "-c", f"echo $$ > {pid_file}; exec sleep 30"])
+    assert time.monotonic() - started < CancelToken.KILL_GRACE_SEC
+    assert not process_alive(int(pid_file.read_text()))
+
+
+@needs_shell
+def test_cancelled_token_does_not_start_process(tmp_path):
+    token = CancelToken()
+    token.cancel()
+    with cancel_scope(token), pytest.raises(Cancelled):
+        run_process(["sh", "-c", f"touch {tmp_path / 'started'}"])
+    assert not (tmp_path / "started").exists()
+
+
+def test_cancel_interrupts_blocking_call_and_runs_callbacks():
+    token = CancelToken()
+    closed = []
+    release = threading.Event()
+    threading.Timer(0.1, token.cancel).start()
+    with token.on_cancel(lambda: closed.append(True)), pytest.raises(Cancelled):
+        token.call(release.wait, 10)
+    release.set()
+    assert closed == [True]
+
+
+def test_resource_wait_is_cancellable():
+    pool = ResourcePool({"cpu": 1})
+    token = CancelToken()
+    with pool.slots(["cpu"]):
+        threading.Timer(0.1, token.cancel).start()
+        with cancel_scope(token), pytest.raises(Cancelled):
+            pool.acquire(["cpu"])
+    assert pool.status()["cpu"] == {"limit": 1, "in_use": 0}
+
+
+# ---- windowed pipeline ----
+
+def test_run_pipelined_passes_items_through_steps_in_order():
+    seen = []
+    token = CancelToken()
+
+    def last(item):
+        assert current_cancel_token() is token
+        seen.append(item)
+
+    _run_pipelined(range(6), [lambda item: item * 10, lambda item: None if item == 20 else item + 1, last],
+                   cancel=token)
+    assert seen == [1, 11, 31, 41, 51]
+
+
+def test_run_pipelined_reraises_error_from_middle_step():
+    fed, seen = [], []
+
+    def items():
+        for item in range(100):
+            fed.append(item)
+            yield item
+
+    def middle(item):
+        if item == 2:
+            raise RuntimeError("translate failed")
+        return item
+
+    with pytest.raises(RuntimeError, match="translate failed"):
+        _run_pipelined(items(), [lambda item: item, middle, seen.append])
+    assert seen == [0, 1]
+    # Dây chuyền dừng: không đọc hết items sau khi một bước lỗi
+    assert len(fed) < 10
+
+
+def test_stream_checkpoint_resumes_only_same_key_and_unfinished_run(tmp_path):
+    key = {"window_sec": 300, "params": {"target_language": "vi"}}
+    assert _load_stream_checkpoint(tmp_path, key) is None
+    _write_json_atomic(tmp_path / "stream.json", {"key": key, "complete": False})
+    for index in (0, 1, 3):  # window 2 chưa xong -> window 3 không được dùng
+        (tmp_path / f"window_{index:05d}").mkdir()
+        _write_json_atomic(tmp_path / f"window_{index:05d}" / "done.json", {"cut_ms": index})
+    assert _load_stream_checkpoint(tmp_path, key) == [{"cut_ms": 0}, {"cut_ms": 1}]
+    assert _load_stream_checkpoint(tmp_path, dict(key, window_sec=600)) is None
+
+    _write_json_atomic(tmp_path / "stream.json", {"key": key, "complete": True})
+    assert _load_stream_checkpoint(tmp_path, key) is None
@@ -0,0 +1,108 @@
+import io
+import time
+
+import pytest
+
+from upload_store import UploadError, UploadStore, UPLOAD_UNUSED_TTL_SEC, UPLOAD_PART_TTL_SEC
+
+
+@pytest.fixture
+def store(tmp_path):
+    return UploadStore(tmp_path / "uploads", max_bytes=1024)
+
+
+def test_append_in_parts_completes_upload(store):
+    upload = store.create("clip.mp4", 10)
+    upload = store.append(upload["id"], 0, io.BytesIO(b"01234"), 5)
+    assert upload["offset"] == 5 and not upload["completed"]
+    upload = store.append(upload["id"], 5, io.BytesIO(b"56789"), 5)
+    assert upload["completed"]
+    assert store.path(upload["id"]).read_bytes() == b"0123456789"
+
+
+def test_offset_mismatch_is_409(store):
+    upload = store.create("clip.mp4", 10)
+    store.append(upload["id"], 0, io.BytesIO(b"01234"), 5)
+    with pytest.raises(UploadError) as error:
+        store.append(upload["id"], 3, io.BytesIO(b"34567"), 5)
+    assert error.value.status == 409
+    assert store.info(upload["id"])["offset"] == 5
+
+
+def test_append_to_completed_upload_is_409(store):
+    upload = store.create("clip.mp4", 3)
+    store.append(upload["id"], 0, io.BytesIO(b"abc"), 3)
+    with pytest.raises(UploadError) as error:
+        store.append(upload["id"], 3, io.BytesIO(b"d"), 1)
+    assert error.value.status == 409
+
+
+def test_concurrent_writer_is_423(store):
+    upload = store.create("clip.mp4", 10)
+    (store.root / f"{upload['id']}.lock").touch()
+    with pytest.raises(UploadError) as error:
+        store.append(upload["id"], 0, io.BytesIO(b"0"), 1)
+    assert error.value.status == 423
+
+
+def test_create_rejects_bad_input(store):
+    with pytest.raises(UploadError) as error:
+        store.create("notes.txt", 10)
+    assert error.value.status == 415
+    with pytest.raises(UploadError) as error:
+        store.create("clip.mp4", 4096)
+    assert error.value.status == 413
+    with pytest.raises(UploadError) as error:
+        store.info("../../etc/passwd")
+    assert error.value.status == 404
+
+
+def test_release_deletes_upload_after_last_project(store):
+    upload = store.create("clip.mp4", 3)
+    store.append(upload["id"], 0, io.BytesIO(b"abc"), 3)
+    store.attach(upload["id"], "p1")
+    store.attach(upload["id"], "p2")
+    assert not store.release(upload["id"], "p1")
+    assert store.path(upload["id"]).exists()
+    assert store.release(upload["id"], "p2")
+    with pytest.raises(UploadError):
+        store.info(upload["id"])
+
+
+def test_expire_removes_stale_parts_and_unused_uploads(store):
+    stale = store.create("stale.mp4", 10)
+    store.append(stale["id"], 0, io.BytesIO(b"01"), 2)
+    unused = store.create("music.mp3", 3)
+    store.append(unused["id"], 0, io.BytesIO(b"abc"), 3)
+    used = store.create("clip.mp4", 3)
+    store.append(used["id"], 0, io.BytesIO(b"abc"), 3)
+    store.attach(used["id"], "p1")
+
+    assert store.expire(now=time.time() + 60) == []
+    later = time.time() + max(UPLOAD_PART_TTL_SEC, UPLOAD_UNUSED_TTL_SEC) + 60
+    assert sorted(store.expire(now=later)) == sorted([stale["id"], unused["id"]])
+    assert store.info(used["id"])["completed"]
+
+
+def test_patch_offset_mismatch_returns_409(tmp_path, monkeypatch):
+    """Qua route tus của web app: PATCH sai Upload-Offset -> 409"""
+    for name, value in {"EMBEDDED_WORKER": "0", "JOB_STORE_PATH": str(tmp_path / "jobs.db"),
+                        "PROJECTS_DIR": str(tmp_path / "projects"), "UPLOADS_DIR": str(tmp_path / "uploads"),
+                        "RESOURCE_SLOTS_DIR": str(tmp_path / "slots")}.items():
+        monkeypatch.setenv(name, value)
+    monkeypatch.chdir(tmp_path)
+    web_app = pytest.importorskip("web_app")
+    monkeypatch.setattr(web_app, "upload_store", UploadStore(tmp_path / "uploads"))
+    client = web_app.app.test_client()
+
+    created = client.post("/api/uploads", headers={"Upload-Length": "10", "Tus-Resumable": "1.0.0"},
+                          json={"filename": "clip.mp4"})
+    assert created.status_code == 201
+    location = created.headers["Location"]
+    headers = {"Content-Type": "application/offset+octet-stream", "Tus-Resumable": "1.0.0"}
+    response = client.patch(location, data=b"01234", headers=dict(headers, **{"Upload-Offset": "0"}))
+    assert response.status_code == 204
+    assert response.headers["Upload-Offset"] == "5"
+    response = client.patch(location, data=b"56789", headers=dict(headers, **{"Upload-Offset": "2"}))
+    assert response.status_code == 409
+    assert client.head(location).headers["Upload-Offset"] == "5"
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+Upload video theo từng phần, tiếp tục được khi bị ngắt (kiểu tus: client gửi offset của phần tiếp theo).
+
+- Mỗi upload là uploads/<id>.part (dữ liệu) + uploads/<id>.json (tên file, tổng dung lượng)
+- Offset hiện tại chính là kích thước file .part trên đĩa, nên còn nguyên sau restart / giữa các gunicorn worker
+- Mỗi phần được ghi thẳng xuống đĩa theo từng chunk (bộ nhớ không phụ thuộc kích thước file)
+- Một upload chỉ nhận một request ghi tại một thời điểm (lock file uploads/<id>.lock)
+- Đủ dung lượng thì .part được đổi tên thành uploads/<id><đuôi file gốc> và project tạo từ upload_id
+  dùng file đó làm input thay cho bước tải video
+- Project dùng upload được ghi vào metadata (attach); xóa project thì release, upload không còn project nào
+  thì bị xóa. expire() dọn .part bỏ dở và upload xong mà không project nào dùng (chạy kèm create)
+"""
+
+import json
+import os
+import time
+import uuid
+from pathlib import Path
+
+from werkzeug.utils import secure_filename
+
+UPLOADS_DIR = Path(os.getenv("UPLOADS_DIR", "uploads"))
+# Dung lượng tối đa một upload (GB)
+UPLOAD_MAX_BYTES = int(float(os.getenv("UPLOAD_MAX_GB", "50")) * 1024 ** 3)
+# Kích thước chunk khi chép request body xuống đĩa
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# Lock ghi của một upload không được touch quá số giây này coi như request ghi đã chết
+UPLOAD_LOCK_STALE_SEC = 60
+# Upload chưa xong không nhận thêm dữ liệu quá số giờ này thì bị xóa
+UPLOAD_PART_TTL_SEC = float(os.getenv("UPLOAD_PART_TTL_HOURS", "24")) * 3600
+# Upload đã xong mà không project nào dùng (vd nhạc nền từ /api/upload) được giữ bấy nhiêu giờ
+UPLOAD_UNUSED_TTL_SEC = float(os.getenv("UPLOAD_UNUSED_TTL_HOURS", "168")) * 3600
+# Khoảng cách tối thiểu (giây) giữa hai lần expire() tự chạy trong create()
+UPLOAD_EXPIRE_INTERVAL_SEC = 600
+# Video làm input của project; audio cho nhạc nền (/api/upload)
+UPLOAD_EXTENSIONS = {".mp4", ".mov", ".mkv", ".webm", ".avi", ".m4v", ".mxf", ".ts", ".mp3", ".wav", ".m4a", ".aac"}
+
+
+class UploadError(Exception):
+    """Lỗi upload kèm HTTP status để web tier trả về"""
+
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
+
+
+class UploadStore:
+    def __init__(self, root=UPLOADS_DIR, max_bytes: int = UPLOAD_MAX_BYTES):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self._last_expire = 0.0
+
+    def _meta_path(self, upload_id: str) -> Path:
+        return self.root / f"{upload_id}.json"
+
+    def _part_path(self, upload_id: str) -> Path:
+        return self.root / f"{upload_id}.part"
+
+    @staticmethod
+    def _check_id(upload_id: str) -> None:
+        try:
+            uuid.UUID(upload_id)
+        except (ValueError, TypeError):
+            raise UploadError("Upload not found", 404)
+
+    def _write_meta(self, meta: dict) -> None:
+        path = self._meta_path(meta["id"])
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, path)
+
+    def create(self, filename: str, length: int) -> dict:
+        """Tạo upload rỗng cho file filename dài length byte"""
+        filename = secure_filename(filename or "") or "video.mp4"
+        extension = Path(filename).suffix.lower()
+        if extension not in UPLOAD_EXTENSIONS:
+            raise UploadError(f"Unsupported file type: {extension or filename}", 415)
+        if length <= 0:
+            raise UploadError("Upload-Length must be positive")
+        if length > self.max_bytes:
+            raise UploadError(f"File is larger than {self.max_bytes // 1024 ** 3} GB", 413)
+        self.root.mkdir(parents=True, exist_ok=True)
+        if time.monotonic() - self._last_expire > UPLOAD_EXPIRE_INTERVAL_SEC:
+            self._last_expire = time.monotonic()
+            self.expire()
+        meta = {"id": str(uuid.uuid4()), "filename": filename, "length": length, "created_at": time.time(),
+                "projects": []}
+        self._part_path(meta["id"]).touch()
+        self._write_meta(meta)
+        return self.info(meta["id"])
+
+    def info(self, upload_id: str) -> dict:
+        """Metadata + offset hiện tại; completed=True khi đã nhận đủ"""
+        self._check_id(upload_id)
+        try:
+            with open(self._meta_path(upload_id), "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            raise UploadError("Upload not found", 404)
+        path = self.path(upload_id, meta)
+        if path.exists():
+            meta.update(offset=meta["length"], completed=True)
+        else:
+            part = self._part_path(upload_id)
+            meta.update(offset=part.stat().st_size if part.exists() else 0, completed=False)
+        return meta
+
+    def path(self, upload_id: str, meta=None) -> Path:
+        """File đã upload xong (đuôi file giữ nguyên để ffmpeg / ffprobe nhận dạng)"""
+        if meta is None:
+            meta = self.info(upload_id)
+        return self.root / f"{upload_id}{Path(meta['filename']).suffix.lower()}"
+
+    def append(self, upload_id: str, offset: int, stream, length=None) -> dict:
+        """
+        Ghi phần tiếp theo (bắt đầu tại offset) từ stream, đọc từng UPLOAD_CHUNK_SIZE byte.
+        length: số byte của phần này (Content-Length), None thì đọc tới hết stream.
+        Offset không khớp với dữ liệu đã nhận -> UploadError 409 (client HEAD lại để lấy offset).
+        """
+        meta = self.info(upload_id)
+        if meta["completed"]:
+            raise UploadError("Upload already completed", 409)
+        lock_path = self.root / f"{upload_id}.lock"
+        self._acquire(lock_path)
+        try:
+            part = self._part_path(upload_id)
+            current = part.stat().st_size
+            if offset != current:
+                raise UploadError(f"Upload-Offset {offset} does not match {current}", 409)
+            remaining = meta["length"] - current
+            if length is not None and length > remaining:
+                raise UploadError("Chunk exceeds Upload-Length", 413)
+            written = 0
+            last_touch = time.monotonic()
+            with open(part, "r+b") as f:
+                f.seek(current)
+                while written < remaining and (length is None or written < length):
+                    chunk = stream.read(min(UPLOAD_CHUNK_SIZE, remaining - written))
+                    if not chunk:
+                        break
+                    f.write(chunk)
+                    written += len(chunk)
+                    if time.monotonic() - last_touch > UPLOAD_LOCK_STALE_SEC / 4:
+                        os.utime(lock_path, None)
+                        last_touch = time.monotonic()
+            if current + written == meta["length"]:
+                os.replace(part, self.path(upload_id, meta))
+                print(f"📦 Upload {upload_id} completed: {meta['filename']} ({meta['length']} bytes)")
+        finally:
+            try:
+                lock_path.unlink()
+            except FileNotFoundError:
+                pass
+        return self.info(upload_id)
+
+    def _acquire(self, lock_path: Path) -> None:
+        """Một request ghi mỗi upload; request khác đang ghi -> 423 (như tus)"""
+        while True:
+            try:
+                fd = os.open(str(lock_path), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                os.close(fd)
+                return
+            except FileExistsError:
+                try:
+                    if time.time() - lock_path.stat().st_mtime <= UPLOAD_LOCK_STALE_SEC:
+                        raise UploadError("Upload is being written by another request", 423)
+                    lock_path.unlink()
+                except FileNotFoundError:
+                    pass
+
+    def delete(self, upload_id: str) -> bool:
+        """Hủy upload (cả file đã nhận xong)"""
+        meta = self.info(upload_id)
+        for path in (self._part_path(upload_id), self.path(upload_id, meta), self._meta_path(upload_id)):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+        return True
+
+    @staticmethod
+    def _stored_meta(meta: dict, projects: list) -> dict:
+        """Metadata ghi xuống đĩa (bỏ offset / completed do info() tính)"""
+        stored = {key: value for key, value in meta.items() if key not in ("offset", "completed")}
+        stored["projects"] = projects
+        return stored
+
+    def attach(self, upload_id: str, project_id: str) -> dict:
+        """Ghi nhận project dùng upload làm input (upload chỉ bị xóa khi mọi project dùng nó đã release)"""
+        meta = self.info(upload_id)
+        projects = meta.get("projects") or []
+        if project_id not in projects:
+            self._write_meta(self._stored_meta(meta, projects + [project_id]))
+        return self.info(upload_id)
+
+    def release(self, upload_id: str, project_id: str) -> bool:
+        """Project không dùng upload nữa (bị xóa); xóa upload nếu không còn project nào. Trả về True nếu đã xóa"""
+        meta = self.info(upload_id)
+        projects = [owner for owner in meta.get("projects") or [] if owner != project_id]
+        if projects:
+            self._write_meta(self._stored_meta(meta, projects))
+            return False
+        return self.delete(upload_id)
+
+    def expire(self, now=None) -> list:
+        """
+        Xóa upload chưa xong không nhận thêm dữ liệu quá UPLOAD_PART_TTL_SEC, và upload đã xong không project
+        nào dùng quá UPLOAD_UNUSED_TTL_SEC (tính từ lúc nhận xong). Upload tạo trước khi có attach (metadata không
+        có "projects") không bị xóa vì không biết project nào đang dùng. Trả về id các upload đã xóa.
+        """
+        now = time.time() if now is None else now
+        removed = []
+        for meta_path in self.root.glob("*.json"):
+            upload_id = meta_path.stem
+            try:
+                meta = self.info(upload_id)
+                if meta["completed"]:
+                    if meta.get("projects") != []:
+                        continue
+                    age = now - self.path(upload_id, meta).stat().st_mtime
+                    expired = age > UPLOAD_UNUSED_TTL_SEC
+                else:
+                    lock_path = self.root / f"{upload_id}.lock"
+                    if lock_path.exists() and now - lock_path.stat().st_mtime <= UPLOAD_LOCK_STALE_SEC:
+                        continue  # đang có request ghi
+                    part = self._part_path(upload_id)
+                    last_write = part.stat().st_mtime if part.exists() else meta["created_at"]
+                    expired = now - last_write > UPLOAD_PART_TTL_SEC
+            except (UploadError, OSError, KeyError, ValueError):
+                continue
+            if expired:
+                self.delete(upload_id)
+                removed.append(upload_id)
+        if removed:
+            print(f"🗑️ Expired {len(removed)} upload(s)")
+        return removed
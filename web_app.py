@@ -1,4 +1,4 @@
-from flask import Flask, render_template, request, jsonify, send_file, session
+from flask import Flask, Response, render_template, request, jsonify, send_file, send_from_directory, session
 from flask_cors import CORS
 import os
 import json
@@ -8,17 +8,24 @@ from pathlib import Path
 import tempfile
 import uuid
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 import threading
 import time
-from werkzeug.utils import secure_filename
 
 # Import các function từ pipeline gốc
+from job_store import JobStore, QUEUE_POLICIES, JOB_LEASE_SEC, DEFAULT_JOB_DURATION_SEC
+from upload_store import UploadStore, UploadError
 from pipeline import (
-    download_with_ytdlp, slow_down_video, extract_audio_for_stt,
+    download_with_ytdlp, download_with_cache, import_local_video, AudioFirstDownload, DOWNLOAD_CACHE_DIR, SLOW_AUDIO_TEMPO,
+    ArtifactStore, ResourcePool, RESOURCE_SLOTS_DIR, JobScheduler, Stage, StageHandoff, run_stage_graph, stage_params, CancelToken, Cancelled, cancel_sleep,
+    collect_batch_entries, probe_duration, extract_video_info, YTDLP_INFO_MAX_AGE_SEC, detach_artifact, save_word_timings, load_word_timings, WORD_TIMINGS_FILE,
+    word_timings_to_srt, speech_regions_from_word_timings, read_srt_cues, SPEED_UP_FACTOR,
+    slow_down_video, extract_audio_for_stt,
     stt_assemblyai, translate_srt_ai, srt_to_aligned_audio_fpt_ai,
     srt_to_aligned_audio_fpt_ai_with_failover,
     replace_audio, speed_up_130, add_background_music, overlay_template,
-    remove_silence_ffmpeg, get_vietnamese_error_message
+    remove_silence_ffmpeg, package_hls, ProgressiveHlsRenderer, run_windowed_pipeline, write_srt_cues,
+    get_vietnamese_error_message
 )
 
 app = Flask(__name__)
@@ -55,6 +62,10 @@ DEFAULT_CONFIG = {
     'stt_chars_per_caption': 300,  # Số ký tự mỗi caption khi dùng SRT (tăng để có câu hoàn chỉnh)
     'stt_speech_threshold': 0.5,  # Ngưỡng phát hiện speech (0.0-1.0)
     'stt_disfluencies': False,    # Loại bỏ filler words
+    'stt_vad_pretrim': True,      # Cắt đoạn không có giọng nói trước khi upload STT (giảm phút tính phí, cần webrtcvad; thiếu thì upload nguyên file)
+    'stt_vad_min_silence_ms': 2000,  # Chỉ cắt khoảng không giọng nói dài hơn (ms)
+    'stt_vad_padding_ms': 300,       # Giữ lại padding quanh mỗi đoạn có giọng nói (ms)
+    'stt_vad_aggressiveness': 3,     # Độ chặt của webrtcvad (0-3, càng cao càng ít coi nhạc / tiếng ồn là giọng)
     'use_ai_segmentation': True,  # Sử dụng AI để cải thiện SRT segmentation
     'min_sentence_length': 20,    # Độ dài tối thiểu mỗi câu
     'max_sentence_length': 150,   # Độ dài tối đa mỗi câu
@@ -64,21 +75,98 @@ DEFAULT_CONFIG = {
     'min_silence_duration': 0.4,     # Thời gian tối thiểu khoảng lặng (giây)
     'max_silence_duration': 2.0,     # Thời gian tối đa khoảng lặng cần cắt (giây)
     'silence_padding': 0.1,          # Padding sau khi cắt (giây)
+    'silence_keep_source_speech': True,  # Không cắt khoảng lặng nằm trong đoạn người nói gốc đang nói (theo word timings)
+    
+    # Output settings
+    'output_hls': False,             # Tạo thêm bản HLS (segment ~6s) để xem / tua ngay trên trình duyệt
+    'progressive_preview': False,    # Xem trước (HLS) từng đoạn đã lồng tiếng xong trong khi project còn chạy
+    'progressive_window_sec': 30,    # Độ dài mỗi đoạn xem trước (giây output)
+    'streaming_mode': False,         # Video rất dài: STT -> dịch -> TTS -> ghép theo từng cửa sổ thời gian, bộ nhớ không phụ thuộc độ dài
+    'stream_window_sec': 300,        # Độ dài mỗi cửa sổ (giây, timeline video đã làm chậm)
+    'stream_overlap_sec': 10,        # Audio STT đọc thêm trước / sau mỗi cửa sổ để không cắt ngang câu
+    
+    # Download cache settings
+    'download_cache_enabled': True,  # Dùng lại video đã tải (cùng video ID + format) giữa các project
+    'download_cache_max_gb': 20,     # Dung lượng tối đa của cache/downloads (GB), xóa file cũ nhất khi vượt
+    'download_concurrent_fragments': 4,  # Số fragment (DASH/HLS) tải song song
+    'download_audio_first': True,    # Tải audio trước để STT chạy song song với việc tải video
+    'artifact_store_enabled': True,  # Lưu output từng bước theo hash (input + tham số) để dùng chung giữa các project
+    
+    # Scheduler settings
+    'max_concurrent_projects': 4,    # Số project chạy đồng thời (các stage bị giới hạn theo resource_limits)
+    'project_timeout_minutes': 30,   # Phần cố định của deadline một lần chạy (project quá deadline coi là bị treo)
+    'project_timeout_duration_factor': 3,  # + thời lượng video x tốc độ xử lý trung vị x hệ số này (video dài được chạy lâu hơn)
+    'queue_policy': os.getenv('QUEUE_POLICY', 'sjf'),  # Thứ tự hàng đợi: sjf (video ngắn trước), fifo, weighted_fair (chia lượt giữa các batch)
+    'queue_aging_factor': float(os.getenv('QUEUE_AGING_FACTOR', '1.0')),  # Mỗi giây chờ bù bấy nhiêu giây thời lượng (job dài không bị bỏ đói)
+    'resource_limits': {             # Số stage chạy đồng thời theo từng loại tài nguyên
+        'cpu': max(1, (os.cpu_count() or 2) // 2),  # ffmpeg (slow, replace_audio, speed_up, ...)
+        'network': 2,                # Tải video
+        'assemblyai': 2,             # STT
+        'gemini': 2,                 # Dịch (Gemini)
+        'deepseek': 2,               # Dịch (DeepSeek)
+        'fpt': 2,                    # TTS (FPT AI)
+    },
     
     # Proxy settings
     'proxy_enabled': False,          # Bật proxy
     'proxy_config': '',              # Format: IP:PORT:USER:PASS
 }
 
-# Lưu trữ trạng thái các project
-projects = {}
+# Thư mục project (workdir của pipeline, output cuối cùng). Worker ở node khác trỏ tới thư mục của coordinator
+PROJECTS_DIR = Path(os.getenv('PROJECTS_DIR', 'projects'))
 
-# Hệ thống queue để xử lý nhiều dự án tuần tự
-import queue
-import threading
+# Lưu trữ trạng thái các project (SQLite, dùng chung giữa các gunicorn worker)
+job_store = JobStore()
+# QUEUE_POLICY / QUEUE_AGING_FACTOR chỉ khởi tạo store lần đầu; giá trị hiện hành nằm trong job store
+DEFAULT_CONFIG['queue_policy'] = job_store.queue_policy
+DEFAULT_CONFIG['queue_aging_factor'] = job_store.queue_aging
+# Video upload theo từng phần (tus), dùng làm input của project thay cho URL
+upload_store = UploadStore()
+# Chạy pipeline ngay trong web process (python web_app.py / service_runner.py). Đặt EMBEDDED_WORKER=0 khi chạy
+# pipeline_worker.py riêng (gunicorn): web tier khi đó chỉ enqueue và báo trạng thái
+EMBEDDED_WORKER = os.getenv('EMBEDDED_WORKER', '1') != '0'
+
+# SSE /api/events: comment keep-alive sau mỗi khoảng không có thay đổi; đóng stream sau EVENT_STREAM_MAX_AGE
+# giây để EventSource kết nối lại (tiếp tục từ Last-Event-ID) thay vì giữ một kết nối mãi
+EVENT_STREAM_KEEPALIVE = 15
+EVENT_STREAM_MAX_AGE = 300
+# Số project tối đa mỗi trang của /api/projects?limit=
+PROJECTS_PAGE_MAX = 200
 
-project_queue = queue.Queue()
-queue_processor_running = False
+PROJECT_STEPS = ['download', 'slow', 'stt', 'translate', 'tts', 'replace_audio', 'silence_removal', 'speed_up', 'music', 'overlay']
+
+def new_project_record(project_id, name, url, priority=0):
+    """Project mới với tất cả các bước ở trạng thái pending"""
+    return {
+        'id': project_id,
+        'name': name,
+        'url': url,
+        'status': 'starting',
+        'priority': priority,  # Cao hơn thì được chạy trước trong hàng đợi
+        'current_step': 'download',
+        'progress': 0,
+        'steps': {step: {'status': 'pending', 'progress': 0, 'error': None} for step in PROJECT_STEPS},
+        'created_at': datetime.now().isoformat(),
+        'output_file': None
+    }
+
+def recover_project(project_id, project_dir):
+    """Dựng lại project từ thư mục projects/<id> không có trong job store (vd store mới tạo)"""
+    created_at = datetime.fromtimestamp(project_dir.stat().st_mtime).isoformat()
+    project = new_project_record(project_id, f"Project {project_id[:8]}", '')
+    project['created_at'] = created_at
+    for output in ['silence_removed.mp4', 'fast_video.mp4']:
+        if (project_dir / output).exists():
+            project['status'] = 'completed'
+            project['progress'] = 100
+            project['output_file'] = str(project_dir / output)
+            for step in project['steps'].values():
+                step['status'] = 'completed'
+                step['progress'] = 100
+            return project
+    project['status'] = 'error'
+    project['error'] = 'Không tìm thấy trạng thái project (server đã khởi động lại), hãy chạy lại'
+    return project
 
 # FPT AI Key Management
 def get_current_fpt_key(config):
@@ -179,132 +267,283 @@ def get_proxy_config(config):
         print(f"⚠️ Error parsing proxy config: {e}")
         return None
 
-def start_queue_processor():
-    """Bắt đầu queue processor để xử lý dự án tuần tự"""
-    global queue_processor_running
-    if not queue_processor_running:
-        queue_processor_running = True
-        processor_thread = threading.Thread(target=process_project_queue, daemon=True)
-        processor_thread.start()
-        
-        # Thêm background thread để kiểm tra queue định kỳ
-        queue_checker_thread = threading.Thread(target=queue_checker_loop, daemon=True)
-        queue_checker_thread.start()
-        
-        # Khởi động ngay lập tức để kiểm tra queue
-        check_and_start_next_project()
-        
-        print("✅ Queue processor and checker started")
+artifact_store = ArtifactStore()
+# Slot theo resource class dùng chung cho stage của mọi project, giữa mọi process trên máy (web + pipeline_worker);
+# giới hạn hiện hành nằm trong RESOURCE_SLOTS_DIR, DEFAULT_CONFIG chỉ là giá trị ban đầu
+resource_pool = ResourcePool(DEFAULT_CONFIG['resource_limits'], slots_dir=RESOURCE_SLOTS_DIR)
+DEFAULT_CONFIG['resource_limits'] = {**DEFAULT_CONFIG['resource_limits'],
+                                     **{name: slot['limit'] for name, slot in resource_pool.status().items()}}
 
-def process_project_queue():
-    """Xử lý queue dự án tuần tự (legacy - không sử dụng nữa)"""
-    global queue_processor_running
-    print("🔄 Queue processor running (legacy mode)...")
-    
-    while queue_processor_running:
+def apply_scheduler_config(config):
+    """
+    Áp dụng giới hạn concurrency mới từ config. resource_limits và policy hàng đợi được lưu dùng chung nên
+    áp dụng cho cả pipeline_worker; max_concurrent_projects chỉ là số slot của scheduler trong web process
+    (EMBEDDED_WORKER), worker dùng --slots.
+    """
+    if 'resource_limits' in config:
+        DEFAULT_CONFIG['resource_limits'] = {**DEFAULT_CONFIG['resource_limits'], **config['resource_limits']}
+        resource_pool.configure(DEFAULT_CONFIG['resource_limits'])
+    if 'max_concurrent_projects' in config:
+        DEFAULT_CONFIG['max_concurrent_projects'] = max(1, int(config['max_concurrent_projects']))
+        project_scheduler.configure(DEFAULT_CONFIG['max_concurrent_projects'])
+    if 'project_timeout_minutes' in config:
+        DEFAULT_CONFIG['project_timeout_minutes'] = max(1, int(config['project_timeout_minutes']))
+    if 'project_timeout_duration_factor' in config:
+        DEFAULT_CONFIG['project_timeout_duration_factor'] = max(1.0, float(config['project_timeout_duration_factor']))
+    # Policy hàng đợi lưu trong job store: worker process đọc cùng giá trị, /api/queue/status khớp thứ tự chạy thật
+    job_store.configure_queue(config['queue_policy'] if config.get('queue_policy') in QUEUE_POLICIES else None,
+                              config.get('queue_aging_factor'))
+    DEFAULT_CONFIG['queue_policy'] = job_store.queue_policy
+    DEFAULT_CONFIG['queue_aging_factor'] = job_store.queue_aging
+
+def get_artifact_store(config):
+    """Artifact store dùng chung, None nếu bị tắt trong config"""
+    return artifact_store if config.get('artifact_store_enabled', True) else None
+
+def download_progress_callback(project, save=None, interval=1.0):
+    """
+    Callback ghi progress byte-level của yt-dlp vào project['steps']['download'].
+    save: lưu project vào job store, gọi tối đa mỗi interval giây
+    """
+    step = project['steps']['download']
+    last_save = [0.0]
+    def progress_callback(status):
+        step['progress'] = int(status['percent'])
+        step['downloaded_bytes'] = status['downloaded_bytes']
+        step['total_bytes'] = status['total_bytes']
+        step['speed'] = status.get('speed')
+        step['eta'] = status.get('eta')
+        if save is not None and time.monotonic() - last_save[0] >= interval:
+            last_save[0] = time.monotonic()
+            save()
+    return progress_callback
+
+def download_input_video(url, input_mp4, config, project=None, save=None, info=None):
+    """
+    Tải video đầu vào, qua download cache nếu được bật. Progress (byte-level) ghi vào project['steps']['download'].
+    info: metadata yt-dlp đã extract (xem load_source_info), không gọi extractor lại.
+    """
+    progress_callback = download_progress_callback(project, save) if project is not None else None
+    concurrent_fragments = config.get('download_concurrent_fragments', 4)
+    if not config.get('download_cache_enabled', True):
+        download_with_ytdlp(url, input_mp4, progress_callback, concurrent_fragments, info=info)
+        return False
+    max_bytes = int(float(config.get('download_cache_max_gb', 20)) * 1024 ** 3)
+    return download_with_cache(url, input_mp4, max_bytes=max_bytes,
+                               progress_callback=progress_callback,
+                               concurrent_fragments=concurrent_fragments, info=info)
+
+# Metadata yt-dlp lấy lúc probe thời lượng, để bước tải không phải extract lại
+SOURCE_INFO_FILE = 'source_info.json'
+
+def save_source_info(project_id, info):
+    path = PROJECTS_DIR / project_id / SOURCE_INFO_FILE
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix('.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(info, f)
+    os.replace(tmp_path, path)
+
+def load_source_info(project_id):
+    """Metadata đã lưu lúc probe nếu còn mới (URL stream trong đó hết hạn sau vài giờ), không thì None"""
+    path = PROJECTS_DIR / project_id / SOURCE_INFO_FILE
+    try:
+        if time.time() - path.stat().st_mtime > YTDLP_INFO_MAX_AGE_SEC:
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def project_timeout_sec(project_id):
+    """
+    Deadline (giây) của một lần chạy: project_timeout_minutes + thời lượng video x processing_ratio x
+    project_timeout_duration_factor. Gọi lúc project bắt đầu chạy nên dùng được duration probe nền vừa ghi;
+    chưa có duration thì tính như job mặc định (DEFAULT_JOB_DURATION_SEC).
+    """
+    project = job_store.get(project_id) or {}
+    duration = project.get('duration') or DEFAULT_JOB_DURATION_SEC
+    factor = DEFAULT_CONFIG.get('project_timeout_duration_factor', 3)
+    return DEFAULT_CONFIG.get('project_timeout_minutes', 30) * 60 + duration * job_store.processing_ratio() * factor
+
+def handle_project_timeout(project_id, timeout):
+    """Scheduler báo project quá deadline (timeout: số giây đã áp dụng): đánh dấu lỗi để runner bị hủy"""
+    timeout_minutes = round(timeout / 60)
+    if job_store.update_status(project_id, 'error', expected='running',
+                               error=f'Project stuck - timeout after {timeout_minutes} minutes'):
+        print(f"⚠️ Project {project_id[:8]} seems stuck (running for {timeout_minutes}+ minutes), marking as error")
+
+def order_queued_projects(limit):
+    """Project chạy tiếp theo = đầu hàng đợi trong job store (queue_policy, có aging)"""
+    return job_store.queue_head(limit)
+
+# Hàng đợi project: Condition + thứ tự theo queue_policy, project được khởi động ngay khi có slot trống
+project_scheduler = JobScheduler(DEFAULT_CONFIG['max_concurrent_projects'], on_timeout=handle_project_timeout,
+                                 order=order_queued_projects)
+
+# Probe thời lượng (yt-dlp metadata / ffprobe) chạy nền để submit không phải chờ; tạo lại sau fork
+PROBE_WORKERS = 4
+_probe_executor = None
+_probe_executor_pid = None
+
+def probe_project_durations(projects):
+    """Probe thời lượng của các project chưa có duration rồi ghi vào job store (dùng cho SJF và ETA)"""
+    global _probe_executor, _probe_executor_pid
+    projects = [project for project in projects if not project.get('duration') and project_source(project)]
+    if not projects:
+        return
+    if _probe_executor is None or _probe_executor_pid != os.getpid():
+        _probe_executor = ThreadPoolExecutor(max_workers=PROBE_WORKERS, thread_name_prefix='duration-probe')
+        _probe_executor_pid = os.getpid()
+    for project in projects:
+        _probe_executor.submit(record_project_duration, project['id'], project_source(project))
+
+def project_source(project):
+    """Input của project: đường dẫn file đã upload, hoặc URL"""
+    if project.get('upload_id'):
+        return str(upload_store.path(project['upload_id']))
+    return project.get('url')
+
+def record_project_duration(project_id, source):
+    info = None
+    if not Path(source).is_file():
         try:
-            # Chỉ sleep để không block
-            time.sleep(10)
+            info = extract_video_info(source)
         except Exception as e:
-            print(f"❌ Queue processor error: {e}")
-            continue
+            print(f"⚠️ Could not probe duration of {source}: {str(e)[:200]}")
+            return
+        if job_store.exists(project_id):
+            save_source_info(project_id, info)
+    duration = probe_duration(source, info)
+    if duration and job_store.set_duration(project_id, duration):
+        print(f"⏱️ Project {project_id[:8]} duration: {duration:.0f}s")
 
-def queue_checker_loop():
-    """Background loop để kiểm tra và khởi động dự án trong queue"""
-    global queue_processor_running
-    print("🔍 Queue checker started...")
-    
-    while queue_processor_running:
+_requeue_thread = None
+
+def start_queue_processor():
+    """Bắt đầu dispatcher thread của scheduler và thread thu hồi lease (idempotent)"""
+    global _requeue_thread
+    if not project_scheduler.running:
+        project_scheduler.start()
+        print("✅ Project scheduler started")
+    if EMBEDDED_WORKER and (_requeue_thread is None or not _requeue_thread.is_alive()):
+        _requeue_thread = threading.Thread(target=requeue_orphaned_projects_loop, name="job-requeue", daemon=True)
+        _requeue_thread.start()
+
+def requeue_orphaned_projects_loop():
+    """
+    EMBEDDED_WORKER: định kỳ thu hồi lần chạy có lease hết hạn (process chạy nó đã chết, vd CLI batch bị kill)
+    và đưa project 'queued' chưa có trong scheduler (vd được process khác trả về hàng đợi) vào scheduler.
+    """
+    while True:
+        time.sleep(JOB_LEASE_SEC / 2)
         try:
-            # Kiểm tra mỗi 5 giây (nhanh hơn)
-            time.sleep(5)
-            
-            # Kiểm tra xem có dự án nào đang chạy không
-            running_projects = [p for p in projects.values() if p['status'] == 'running']
-            queued_projects = [p for p in projects.values() if p['status'] == 'queued']
-            
-            print(f"🔍 Queue checker: {len(running_projects)} running, {len(queued_projects)} queued")
-            
-            # Kiểm tra các project đang chạy có bị stuck không
-            current_time = time.time()
-            for project in running_projects:
-                # Kiểm tra nếu project đang chạy quá lâu (30 phút)
-                if 'start_time' not in project:
-                    project['start_time'] = current_time
-                elif current_time - project['start_time'] > 1800:  # 30 phút
-                    print(f"⚠️ Project {project['id'][:8]} seems stuck (running for 30+ minutes), marking as error")
-                    project['status'] = 'error'
-                    project['error'] = 'Project stuck - timeout after 30 minutes'
-                    check_and_start_next_project()
-                    break
-            
-            # Kiểm tra nếu không có project nào đang chạy và có project trong queue
-            if len(running_projects) == 0 and len(queued_projects) > 0:
-                print(f"🔍 Queue checker found {len(queued_projects)} projects in queue, no running projects")
-                check_and_start_next_project()
-                
+            job_store.reclaim_expired()
+            for project_id in job_store.queued_ids():
+                if not project_scheduler.is_queued(project_id):
+                    project = job_store.get(project_id)
+                    if project is not None:
+                        schedule_project(project_id, project.get('priority', 0))
         except Exception as e:
-            print(f"❌ Queue checker error: {e}")
-            continue
+            print(f"⚠️ Error re-queueing orphaned projects: {e}")
 
-def get_queue_status():
-    """Lấy trạng thái queue"""
-    queued_projects = [p for p in projects.values() if p['status'] == 'queued']
-    queue_size = len(queued_projects)
-    
-    # Cập nhật queue position cho các project
-    position = 1
-    for project_id, project in projects.items():
-        if project['status'] == 'queued':
-            project['queue_position'] = position
-            position += 1
-    
-    return {
-        'queue_size': queue_size,
-        'processor_running': queue_processor_running
-    }
+def run_claimed_project(project_id, run_id, workdir_root=None, can_run=None):
+    """
+    Chạy project đã claim trong job store với config lưu lúc enqueue (dùng chung với pipeline_worker.py).
+    Lease của lần chạy được gia hạn trong nền cho tới khi pipeline dừng. Khi lần chạy bị stop / restart /
+    xóa / timeout (từ bất kỳ process nào) thì công việc đang dở bị hủy ngay qua CancelToken.
+    workdir_root: thư mục làm việc riêng của worker (node khác); output cuối cùng được copy về PROJECTS_DIR.
+    can_run: stage affinity, xem run_stage_graph.
+    """
+    project = job_store.get(project_id)
+    if project is None:
+        return
+    config = DEFAULT_CONFIG.copy()
+    config.update(job_store.get_config(project_id) or {})
+    workdir = Path(workdir_root) / project_id if workdir_root else PROJECTS_DIR / project_id
+    cancel = CancelToken()
+    with job_store.hold_lease(project_id, run_id, on_lost=cancel.cancel):
+        run_pipeline_async(project_id, project['url'], workdir, config, run_id=run_id, can_run=can_run,
+                           publish_dir=PROJECTS_DIR / project_id, cancel=cancel)
+    # Lần chạy mới (retry / restart) không claim được khi runner này chưa thoát -> đưa lại vào scheduler
+    if EMBEDDED_WORKER:
+        project = job_store.get(project_id)
+        if project is not None and project['status'] == 'queued':
+            schedule_project(project_id, project.get('priority', 0))
 
-def check_and_start_next_project():
-    """Kiểm tra và bắt đầu dự án tiếp theo trong queue"""
-    print(f"🔍 Checking for next project in queue...")
-    
-    # Kiểm tra xem có project nào đang chạy không
-    running_projects = [p for p in projects.values() if p['status'] == 'running']
-    queued_projects = [p for p in projects.values() if p['status'] == 'queued']
-    
-    print(f"📊 Current status: {len(running_projects)} running projects, {len(queued_projects)} queued projects")
+def schedule_project(project_id, priority=0):
+    """
+    Đưa project đang 'queued' trong job store vào scheduler của process này.
+    Khi tới lượt, project chỉ chạy nếu claim được (process khác có thể đã lấy nó, hoặc runner của lần chạy
+    trước chưa thoát -- khi thoát nó tự đưa project lại vào scheduler).
+    """
+    def run():
+        run_id = job_store.claim(project_id)
+        if run_id is not None:
+            run_claimed_project(project_id, run_id)
     
-    if len(running_projects) == 0 and len(queued_projects) > 0:
-        # Không có project nào đang chạy và có project trong queue
-        # Lấy project đầu tiên trong danh sách queued
-        next_project = queued_projects[0]
-        next_project_id = next_project['id']
-        
-        print(f"🎯 Starting next project from queue: {next_project_id}")
-        
-        # Cập nhật trạng thái
-        next_project['status'] = 'running'
-        next_project['queue_position'] = 0
-        
-        # Sử dụng DEFAULT_CONFIG thay vì session config để tránh lỗi context
-        config = DEFAULT_CONFIG.copy()
-        
-        # Chạy project trong thread riêng
-        thread = threading.Thread(target=run_pipeline_async, args=(next_project_id, next_project['url'], Path(f"projects/{next_project_id}"), config))
-        thread.daemon = True
-        thread.start()
-        
-        print(f"✅ Next project {next_project_id} started successfully")
-        
-        # Cập nhật queue positions cho các project còn lại
-        remaining_queued = [p for p in projects.values() if p['status'] == 'queued']
-        for i, project in enumerate(remaining_queued):
-            project['queue_position'] = i + 1
-            
-    elif len(running_projects) > 0:
-        print(f"📋 {len(running_projects)} projects still running, queue will be processed later")
-    else:
-        print(f"📋 No projects in queue to process")
+    start_queue_processor()
+    project_scheduler.submit(project_id, run, priority=int(priority),
+                             timeout=lambda: project_timeout_sec(project_id))
+
+def enqueue_project(project, config=None, force_steps=None):
+    """
+    Lưu project vào job store ở trạng thái 'queued' và đưa vào hàng đợi; chạy ngay nếu còn slot trống.
+    config: config cho lần chạy (None = giữ config đã lưu từ lần enqueue trước).
+    force_steps: các bước phải chạy lại khi project tới lượt (xem run_pipeline_async).
+    """
+    if force_steps:
+        project['force_steps'] = list(force_steps)
+    project['status'] = 'queued'
+    job_store.put(project, config)
+    if EMBEDDED_WORKER:
+        schedule_project(project['id'], project.get('priority', 0))
+    print(f"📋 Project {project['id']} queued (priority: {project.get('priority', 0)})")
+
+def restore_queued_projects():
+    """Khi khởi động: đồng bộ job store với projects/ và đưa các project còn chờ / bị gián đoạn vào hàng đợi"""
+    try:
+        queued_ids = job_store.reconcile(PROJECTS_DIR, recover_project)
+    except Exception as e:
+        print(f"⚠️ Error reconciling job store: {e}")
+        return
+    if not EMBEDDED_WORKER:
+        return
+    for project_id in queued_ids:
+        project = job_store.get(project_id)
+        if project is not None:
+            schedule_project(project_id, project.get('priority', 0))
+    if queued_ids:
+        print(f"📋 Restored {len(queued_ids)} queued project(s)")
+
+def get_queue_status(estimates=False):
+    """
+    Lấy trạng thái queue.
+    estimates: kèm thời điểm bắt đầu / xong ước lượng của từng project đang chạy / chờ (theo thời lượng
+    video, tốc độ xử lý của các project gần đây và số slot hiện có)
+    """
+    counts = job_store.count_by_status()
+    workers = [] if EMBEDDED_WORKER else job_store.live_workers()
+    status = {
+        'queue_size': counts.get('queued', 0),
+        'running': counts.get('running', 0),
+        'processor_running': project_scheduler.running if EMBEDDED_WORKER else bool(workers),
+        'workers': workers,
+        'max_concurrent_projects': DEFAULT_CONFIG.get('max_concurrent_projects', 1),
+        'queue_policy': job_store.queue_policy,
+        'resources': resource_pool.status()
+    }
+    if estimates:
+        slots = project_scheduler.max_running if EMBEDDED_WORKER else sum(worker['slots'] for worker in workers)
+        status['estimates'] = {
+            project_id: {
+                'estimated_start': datetime.fromtimestamp(estimate['estimated_start']).isoformat(),
+                'estimated_finish': datetime.fromtimestamp(estimate['estimated_finish']).isoformat(),
+                'estimated_seconds': round(estimate['estimated_seconds'])
+            }
+            for project_id, estimate in job_store.estimate_queue(max(1, slots)).items()
+        }
+    return status
 
 @app.route('/')
 def index():
@@ -315,31 +554,192 @@ def config():
     if request.method == 'POST':
         config_data = request.json
         session['config'] = config_data
+        apply_scheduler_config(config_data)
         return jsonify({'status': 'success'})
     else:
-        return jsonify(session.get('config', DEFAULT_CONFIG))
+        config_data = dict(session.get('config', DEFAULT_CONFIG))
+        config_data.update(queue_policy=job_store.queue_policy, queue_aging_factor=job_store.queue_aging)
+        return jsonify(config_data)
+
+def queue_positions():
+    """Vị trí trong hàng đợi tính từ index thứ tự hàng đợi (queue_rank, queue_key) của job store"""
+    return {project_id: position for position, project_id in enumerate(job_store.queued_ids(), 1)}
+
+def project_diff(old, new):
+    """Field của project đã đổi so với lần gửi trước; steps chỉ gồm các step đã đổi"""
+    diff = {}
+    for key, value in new.items():
+        if key == 'steps' and isinstance(old.get('steps'), dict) and isinstance(value, dict):
+            steps = {name: step for name, step in value.items() if old['steps'].get(name) != step}
+            if steps:
+                diff['steps'] = steps
+        elif old.get(key) != value:
+            diff[key] = value
+    return diff
+
+def format_event(event, data, event_id=None):
+    """event_id: version của job store; EventSource gửi lại qua Last-Event-ID khi kết nối lại"""
+    prefix = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{prefix}event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def versioned_response(payload, etag):
+    """JSON response có ETag; client revalidate bằng If-None-Match thay vì dùng bản cache cũ"""
+    response = jsonify(payload)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 @app.route('/api/projects', methods=['GET'])
 def get_projects():
-    # Cập nhật queue positions
-    get_queue_status()
-    return jsonify(list(projects.values()))
+    """
+    Danh sách project:
+    - không tham số: toàn bộ danh sách (mảng, như trước)
+    - ?status=queued,running: chỉ các trạng thái này
+    - ?limit=50[&cursor=...]: phân trang theo thứ tự tạo -> {version, projects, next_cursor}
+    - ?since=<version>: chỉ project đổi / bị xóa sau version -> {version, changed, deleted, queue_positions}
+      (không lọc theo status: project rời khỏi trạng thái đang lọc vẫn phải báo cho client)
+    ETag theo version của job store: If-None-Match khớp thì trả 304 mà không đọc danh sách.
+    """
+    version = job_store.current_version()
+    etag = f"projects-{version}"
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+
+    positions = queue_positions()
+    since = request.args.get('since', type=int)
+    if since is not None:
+        changed, deleted, latest = job_store.changes_since(since)
+        for project in changed:
+            project['queue_position'] = positions.get(project['id'], 0)
+        return versioned_response({
+            'version': latest,
+            'changed': changed,
+            'deleted': deleted,
+            'queue_positions': positions
+        }, etag)
+
+    statuses = [status for status in request.args.get('status', '').split(',') if status] or None
+    limit = request.args.get('limit', type=int)
+    if limit is None:
+        project_list = job_store.list(statuses)
+        for project in project_list:
+            project['queue_position'] = positions.get(project['id'], 0)
+        return versioned_response(project_list, etag)
+
+    after = None
+    if request.args.get('cursor'):
+        created_at, separator, project_id = request.args['cursor'].partition('|')
+        if not separator:
+            return jsonify({'error': 'Invalid cursor'}), 400
+        after = (created_at, project_id)
+    project_list, next_cursor = job_store.page(statuses, max(1, min(limit, PROJECTS_PAGE_MAX)), after)
+    for project in project_list:
+        project['queue_position'] = positions.get(project['id'], 0)
+    return versioned_response({
+        'version': version,
+        'projects': project_list,
+        'next_cursor': '|'.join(next_cursor) if next_cursor else None
+    }, etag)
+
+@app.route('/api/events')
+def project_events():
+    """
+    Server-Sent Events thay cho poll /api/projects + /api/queue/status:
+    - snapshot: toàn bộ danh sách project + trạng thái queue khi kết nối lần đầu
+    - resume: kết nối lại với Last-Event-ID (hoặc ?since=<version>): chỉ project đổi / bị xóa sau version đó
+      (bản đầy đủ, dùng index version) + vị trí trong hàng đợi, không gửi lại cả danh sách
+    - projects: {changed: [diff từng project, có id], deleted: [id]} mỗi khi job store đổi version
+    - queue: trạng thái queue khi nó đổi
+    snapshot / resume / projects mang id = version. Tab không có thay đổi chỉ nhận comment keep-alive; mọi
+    stream trong process dùng chung một thread theo dõi version của job store. Stream giữ kết nối lâu nên
+    chạy trên worker gevent riêng khi deploy (xem deploy.sh), không chiếm thread của gthread worker.
+    """
+    since = request.headers.get('Last-Event-ID') or request.args.get('since')
+    try:
+        since = int(since) if since else None
+    except ValueError:
+        since = None
+
+    def stream():
+        version = job_store.current_version()
+        positions = queue_positions()
+        sent = {}
+        queue = get_queue_status()
+        if since is not None and since <= version:
+            changed, deleted, version = job_store.changes_since(since)
+            for project in changed:
+                project['queue_position'] = positions.get(project['id'], 0)
+                sent[project['id']] = project
+            # Vị trí của project chờ không đổi version nhưng bị đẩy lên / xuống
+            for project_id, position in positions.items():
+                sent.setdefault(project_id, {'queue_position': position})
+            changed = [dict(project, id=project_id) for project_id, project in sent.items()]
+            yield "retry: 3000\n" + format_event('resume', {'version': version, 'changed': changed,
+                                                            'deleted': deleted, 'queue': queue}, version)
+        else:
+            for project in job_store.list():
+                project['queue_position'] = positions.get(project['id'], 0)
+                sent[project['id']] = project
+            yield "retry: 3000\n" + format_event('snapshot', {'version': version, 'projects': list(sent.values()),
+                                                              'queue': queue}, version)
+
+        opened = time.monotonic()
+        while time.monotonic() - opened < EVENT_STREAM_MAX_AGE:
+            if job_store.wait_for_change(version, EVENT_STREAM_KEEPALIVE) <= version:
+                yield ": keep-alive\n\n"
+                continue
+            changed, deleted, version = job_store.changes_since(version)
+            positions = queue_positions()
+            diffs = {}
+            for project in changed:
+                project['queue_position'] = positions.get(project['id'], 0)
+                diff = project_diff(sent.get(project['id'], {}), project)
+                sent[project['id']] = project
+                if diff:
+                    diffs[project['id']] = diff
+            deleted = [project_id for project_id in deleted if sent.pop(project_id, None) is not None]
+            # Project khác bị đẩy lên / xuống trong hàng đợi
+            for project_id, project in sent.items():
+                position = positions.get(project_id, 0)
+                if project.get('queue_position') != position:
+                    project['queue_position'] = position
+                    diffs.setdefault(project_id, {})['queue_position'] = position
+            if diffs or deleted:
+                changed = [dict(diff, id=project_id) for project_id, diff in diffs.items()]
+                yield format_event('projects', {'version': version, 'changed': changed, 'deleted': deleted}, version)
+            status = get_queue_status()
+            if status != queue:
+                queue = status
+                yield format_event('queue', queue)
+
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/api/queue/status')
 def get_queue_status_api():
-    """API để lấy trạng thái queue"""
-    return jsonify(get_queue_status())
+    """API để lấy trạng thái queue (kèm ETA từng project)"""
+    return jsonify(get_queue_status(estimates=True))
 
 @app.route('/api/projects/<project_id>', methods=['GET'])
 def get_project(project_id):
-    if project_id in projects:
-        return jsonify(projects[project_id])
-    return jsonify({'error': 'Project not found'}), 404
+    project = job_store.get(project_id)
+    if project is None:
+        return jsonify({'error': 'Project not found'}), 404
+    etag = f"project-{project_id}-{project['version']}"
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+    return versioned_response(project, etag)
 
 @app.route('/api/start', methods=['POST'])
 def start_project():
+    """Tạo project từ URL, hoặc từ video đã upload xong (upload_id, xem /api/uploads)"""
     data = request.json
-    url = data.get('url')
+    url = data.get('url') or ''
+    upload_id = data.get('upload_id')
     project_name = data.get('name', '')  # Lấy tên dự án từ request
     
     # Đảm bảo config có đầy đủ thông tin
@@ -347,376 +747,589 @@ def start_project():
     config = DEFAULT_CONFIG.copy()
     config.update(session_config)
     
-    if not url:
+    upload = None
+    if upload_id:
+        try:
+            upload = upload_store.info(upload_id)
+        except UploadError as e:
+            return jsonify({'error': str(e)}), e.status
+        if not upload['completed']:
+            return jsonify({'error': 'Upload is not complete'}), 409
+    elif not url:
         return jsonify({'error': 'URL is required'}), 400
     
     # Tạo project ID và tên
     project_id = str(uuid.uuid4())
     if not project_name:
-        # Tạo tên tự động từ URL
-        try:
-            from urllib.parse import urlparse
-            parsed_url = urlparse(url)
-            if 'youtube.com' in parsed_url.netloc:
-                project_name = f"YouTube Video {project_id[:8]}"
-            else:
-                project_name = f"Video {project_id[:8]}"
-        except:
-            project_name = f"Project {project_id[:8]}"
+        project_name = Path(upload['filename']).stem if upload else default_project_name(project_id, url)
     
-    project_dir = Path(f"projects/{project_id}")
+    project_dir = PROJECTS_DIR / project_id
     project_dir.mkdir(parents=True, exist_ok=True)
     
     # Khởi tạo project
-    project = {
-        'id': project_id,
-        'name': project_name,
-        'url': url,
-        'status': 'starting',
-        'current_step': 'download',
-        'progress': 0,
-        'steps': {
-            'download': {'status': 'pending', 'progress': 0, 'error': None},
-            'slow': {'status': 'pending', 'progress': 0, 'error': None},
-            'stt': {'status': 'pending', 'progress': 0, 'error': None},
-            'translate': {'status': 'pending', 'progress': 0, 'error': None},
-            'tts': {'status': 'pending', 'progress': 0, 'error': None},
-            'replace_audio': {'status': 'pending', 'progress': 0, 'error': None},
-            'silence_removal': {'status': 'pending', 'progress': 0, 'error': None},
-            'speed_up': {'status': 'pending', 'progress': 0, 'error': None},
-            'music': {'status': 'pending', 'progress': 0, 'error': None},
-            'overlay': {'status': 'pending', 'progress': 0, 'error': None}
-        },
-        'created_at': datetime.now().isoformat(),
-        'output_file': None
-    }
+    project = new_project_record(project_id, project_name, url, priority=int(data.get('priority', 0)))
+    if upload:
+        # Bước download chỉ link file đã upload vào project (không tải, không copy)
+        project['upload_id'] = upload_id
+        project['source_name'] = upload['filename']
+        upload_store.attach(upload_id, project_id)
     
-    projects[project_id] = project
+    # Scheduler chạy ngay nếu còn slot (max_concurrent_projects), các stage được giới hạn theo resource class
+    enqueue_project(project, config)
+    probe_project_durations([project])
     
-    # Bắt đầu queue processor nếu chưa chạy
-    start_queue_processor()
+    return jsonify(project)
+
+def default_project_name(project_id, url):
+    """Tạo tên tự động từ URL"""
+    try:
+        from urllib.parse import urlparse
+        parsed_url = urlparse(url)
+        if 'youtube.com' in parsed_url.netloc:
+            return f"YouTube Video {project_id[:8]}"
+        return f"Video {project_id[:8]}"
+    except:
+        return f"Project {project_id[:8]}"
+
+def submit_batch(entries, config, name='', priority=0):
+    """
+    Tạo batch: mọi project được ghi vào job store trong một transaction với chung một bản config,
+    rồi vào hàng đợi như project thường (dùng chung download cache / artifact store / resource limits).
+    entries: [{'url', 'name'?, 'priority'?, 'duration'?}] (xem pipeline.collect_batch_entries).
+    """
+    batch = {'id': str(uuid.uuid4()), 'name': name, 'created_at': datetime.now().isoformat()}
+    projects = []
+    for entry in entries:
+        project_id = str(uuid.uuid4())
+        (PROJECTS_DIR / project_id).mkdir(parents=True, exist_ok=True)
+        project = new_project_record(project_id, entry.get('name') or default_project_name(project_id, entry['url']),
+                                     entry['url'], priority=int(entry.get('priority', priority)))
+        project['status'] = 'queued'
+        project['batch_id'] = batch['id']
+        if entry.get('duration'):
+            project['duration'] = float(entry['duration'])
+        projects.append(project)
+    job_store.put_batch(batch, projects, config)
+    if EMBEDDED_WORKER:
+        for project in projects:
+            schedule_project(project['id'], project['priority'])
+    probe_project_durations(projects)
+    print(f"📦 Batch {batch['id']} queued: {len(projects)} project(s)")
+    return dict(batch, total=len(projects), project_ids=[project['id'] for project in projects])
+
+@app.route('/api/batch', methods=['POST'])
+def start_batch():
+    """
+    Tạo nhiều project một lần. JSON: {urls: [...], manifest: "...", name, priority}, hoặc multipart với
+    file 'manifest' (+ field urls mỗi dòng một URL). URL playlist / kênh được mở rộng thành từng video.
+    """
+    if request.files.get('manifest'):
+        data = request.form
+        manifest = request.files['manifest'].read().decode('utf-8')
+        urls = (data.get('urls') or '').split()
+    else:
+        data = request.json or {}
+        manifest = data.get('manifest')
+        urls = data.get('urls') or []
+        if isinstance(urls, str):
+            urls = urls.split()
     
-    # Kiểm tra xem có project nào đang chạy không
-    running_projects = [p for p in projects.values() if p['status'] == 'running']
-    print(f"🔍 Current running projects: {len(running_projects)}")
-    for p in running_projects:
-        print(f"   - Project {p['id'][:8]}... (status: {p['status']})")
+    try:
+        entries = collect_batch_entries(urls, manifest)
+    except Exception as e:
+        return jsonify({'error': f'Could not read batch: {e}'}), 400
+    if not entries:
+        return jsonify({'error': 'No URLs in batch'}), 400
     
-    # Đảm bảo chỉ có 1 project chạy tại một thời điểm
-    if len(running_projects) == 0:
-        # Không có project nào đang chạy, chạy ngay
-        project['status'] = 'running'
-        project['queue_position'] = 0
-        print(f"🚀 Starting project {project_id} immediately")
-        thread = threading.Thread(target=run_pipeline_async, args=(project_id, url, project_dir, config))
-        thread.daemon = True
-        thread.start()
+    session_config = session.get('config', {})
+    config = DEFAULT_CONFIG.copy()
+    config.update(session_config)
+    batch = submit_batch(entries, config, name=data.get('name', ''), priority=int(data.get('priority', 0)))
+    return jsonify(batch)
+
+@app.route('/api/batch/<batch_id>', methods=['GET'])
+def get_batch(batch_id):
+    batch = job_store.batch_progress(batch_id)
+    if batch is None:
+        return jsonify({'error': 'Batch not found'}), 404
+    return jsonify(batch)
+
+@app.route('/api/batches', methods=['GET'])
+def list_batches():
+    return jsonify(job_store.list_batches(request.args.get('limit', 50, type=int)))
+
+def describe_download_error(error_msg):
+    """Thông báo lỗi tải video dễ hiểu cho người dùng"""
+    if "HTTP Error 403" in error_msg:
+        return f"Lỗi tải video: Video không thể truy cập (403 Forbidden). Có thể video đã bị xóa, private, hoặc có hạn chế địa lý. Hãy thử URL khác."
+    elif "Requested format is not available" in error_msg:
+        return f"Lỗi tải video: Định dạng video không khả dụng. Hãy thử URL khác."
+    elif "fragment 1 not found" in error_msg:
+        return f"Lỗi tải video: Video có vấn đề về định dạng. Hãy thử URL khác."
+    return f"Lỗi tải video: {error_msg}"
+
+def translate_with_failover(config, subs_srt, subs_translated_srt, cues=None):
+    """Dịch SRT. Với Gemini: thử lần lượt tất cả key, tối đa 3 vòng, trước khi báo lỗi"""
+    if config['ai_provider'] != 'gemini':
+        return translate_srt_ai(subs_srt, subs_translated_srt, model=config.get(f"{config['ai_provider']}_model"), api_key=config.get(f"{config['ai_provider']}_api_key"), provider=config['ai_provider'], config=config, cues=cues)
+    
+    max_retries = 3  # 3 lần retry, mỗi lần thử tất cả keys
+    last_error = None
+    
+    # Thử tất cả keys trước khi báo lỗi
+    backup_keys = config.get('gemini_backup_keys', [])
+    user_key = config.get('gemini_api_key', '').strip()
+    all_keys = [user_key] + backup_keys if user_key else backup_keys
+    
+    for retry_attempt in range(max_retries):
+        for key_index, current_gemini_key in enumerate(all_keys):
+            if not current_gemini_key:
+                continue
+            
+            try:
+                print(f"🔄 Translation attempt {retry_attempt + 1}/{max_retries} with Gemini key #{key_index + 1}")
+                translated_cues = translate_srt_ai(subs_srt, subs_translated_srt, model=config['gemini_model'], api_key=current_gemini_key, provider='gemini', config=config, cues=cues)
+                print(f"✅ Translation completed successfully with key #{key_index + 1}")
+                return translated_cues
+            except Exception as e:
+                last_error = e
+                print(f"❌ Translation failed with key #{key_index + 1}: {e}")
+                
+                # Chờ một chút trước khi thử key tiếp theo
+                if key_index < len(all_keys) - 1:
+                    cancel_sleep(1)
+        
+        # Chờ lâu hơn trước khi retry toàn bộ
+        if retry_attempt < max_retries - 1:
+            print(f"🔄 Retrying all keys (attempt {retry_attempt + 2}/{max_retries})")
+            cancel_sleep(3)
+    
+    raise RuntimeError(f"Translation error: {last_error}")
+
+def run_stt(config, stt_wav, subs_srt_raw):
+    """
+    STT -> subs_raw.srt + word timings (stt_words.bin cạnh nó). Không có AssemblyAI key thì ghi SRT placeholder.
+    Chia câu là bước riêng (run_segment) nên đổi min/max_sentence_length không phải upload / trả phí STT lại.
+    """
+    words_path = subs_srt_raw.parent / WORD_TIMINGS_FILE
+    detach_artifact(subs_srt_raw)
+    subs_cues = None
+    api_key = (config.get('assemblyai_api_key') or '').strip()
+    if api_key:
+        # Sử dụng phương pháp STT dựa trên cấu hình
+        if config.get('stt_method', 'utterances') in ('utterances', 'json'):
+            subs_cues = stt_assemblyai(stt_wav, subs_srt_raw, api_key, language_code=config['stt_language'], config=config)
+        else:  # srt
+            from pipeline import stt_assemblyai_legacy
+            subs_cues = stt_assemblyai_legacy(stt_wav, subs_srt_raw, api_key, language_code=config['stt_language'], config=config)
     else:
-        # Có project đang chạy, thêm vào queue
-        print(f"⚠️ Found {len(running_projects)} running projects, adding to queue")
+        # Skip STT if no API key, create empty SRT
+        with open(subs_srt_raw, 'w', encoding='utf-8') as f:
+            f.write("1\n00:00:00,000 --> 00:00:05,000\n[No audio detected]\n\n")
+    if not words_path.exists():
+        save_word_timings([], words_path)
+    return subs_cues
+
+def run_segment(config, subs_srt_raw, subs_srt):
+    """
+    Chia câu: subs.srt dựng lại từ word timings (stt_words.bin, thời gian câu theo từ thật) với
+    min/max_sentence_length. stt_method 'srt' hoặc không có word timings thì dùng nguyên SRT của AssemblyAI.
+    """
+    words_path = subs_srt_raw.parent / WORD_TIMINGS_FILE
+    detach_artifact(subs_srt)
+    if config.get('stt_method', 'utterances') != 'srt' and words_path.exists() and len(load_word_timings(words_path)):
+        return word_timings_to_srt(words_path, subs_srt, config)
+    cues = read_srt_cues(subs_srt_raw)
+    write_srt_cues(subs_srt, cues)
+    return cues
+
+def word_timing_speech_regions(words_path):
+    """Đoạn có lời của video gốc (giây trên timeline fast_video) từ word timings; None nếu không có"""
+    if not words_path.exists():
+        return None
+    timings = load_word_timings(words_path)
+    if not len(timings):
+        return None
+    # Word timings nằm trên timeline slow.mp4; fast_video tăng tốc SPEED_UP_FACTOR
+    return [(start / 1000 / SPEED_UP_FACTOR, end / 1000 / SPEED_UP_FACTOR)
+            for start, end in speech_regions_from_word_timings(timings)]
+
+def build_pipeline_stages(project, workdir, config, ctx, save_progress=None):
+    """
+    Stage graph của pipeline. Mỗi stage khai báo file input/output và config key nó phụ thuộc,
+    run_stage_graph bỏ qua stage có fingerprint không đổi.
+    ctx: dữ liệu truyền trong bộ nhớ giữa các stage của cùng một lần chạy (cue SRT, downloader,
+    bản xem trước). ctx['stage_ready'][name]: Event được set khi stage name xong (xem run_pipeline_async).
+    save_progress: lưu project vào job store khi progress trong một stage thay đổi (vd byte đã tải).
+    """
+    url = project['url']
+    input_mp4 = workdir / "input.mp4"
+    slow_mp4 = workdir / "slow.mp4"
+    stt_wav = workdir / "stt.wav"
+    subs_srt_raw = workdir / "subs_raw.srt"
+    subs_srt = workdir / "subs.srt"
+    subs_translated_srt = workdir / "subs_vi.srt"
+    tts_wav = workdir / "tts.wav"
+    final_video = workdir / "final_video.mp4"
+    fast_video = workdir / "fast_video.mp4"
+    silence_removed_video = workdir / "silence_removed.mp4"
+    
+    # Audio-first: STT chạy trên audio-only trong khi video vẫn đang tải
+    audio_first = config.get('download_audio_first', True)
+    # Audio gốc chưa qua slow_down_video -> làm chậm cùng hệ số để timestamp khớp slow.mp4
+    stt_tempo = SLOW_AUDIO_TEMPO if audio_first else None
+    
+    def run_download_audio():
+        if input_mp4.exists():
+            # Video đã có sẵn (chạy lại) -> tách audio từ video, không cần tải
+            extract_audio_for_stt(input_mp4, stt_wav, tempo=stt_tempo)
+            return
+        cache_dir = DOWNLOAD_CACHE_DIR if config.get('download_cache_enabled', True) else None
+        downloader = AudioFirstDownload(
+            url, input_mp4,
+            progress_callback=download_progress_callback(project, save_progress),
+            concurrent_fragments=config.get('download_concurrent_fragments', 4),
+            cache_dir=cache_dir,
+            max_bytes=int(float(config.get('download_cache_max_gb', 20)) * 1024 ** 3),
+            info=load_source_info(project['id']),
+        )
+        ctx['downloader'] = downloader
+        extract_audio_for_stt(downloader.start(), stt_wav, tempo=stt_tempo)
+    
+    def run_download():
+        downloader = ctx.pop('downloader', None)
+        if downloader is not None:
+            downloader.wait()
+        else:
+            download_input_video(url, input_mp4, config, project, save_progress, info=load_source_info(project['id']))
+    
+    def run_stt_stage():
+        run_stt(config, stt_wav, subs_srt_raw)
+    
+    def run_segment_stage():
+        ctx['subs_cues'] = run_segment(config, subs_srt_raw, subs_srt)
+    
+    def run_translate():
+        ctx['translated_cues'] = translate_with_failover(config, subs_srt, subs_translated_srt, cues=ctx.get('subs_cues'))
+    
+    def start_preview():
+        """Bản xem trước HLS: mỗi đoạn có audio TTS xong được ghép vào slow.mp4 và encode ngay"""
+        preview = ProgressiveHlsRenderer(slow_mp4, ctx.get('publish_dir', workdir) / 'live',
+                                         window_sec=config.get('progressive_window_sec', 30),
+                                         video_ready=ctx['stage_ready']['slow'])
+        ctx['preview'] = preview
+        project['live_hls_url'] = f"/api/live/{project['id']}/index.m3u8"
+        if save_progress is not None:
+            save_progress()
+        return preview
+    
+    def run_tts():
+        if config.get('tts_provider', 'fpt') != 'fpt':
+            # ElevenLabs đã bị loại bỏ, chỉ sử dụng FPT AI
+            raise RuntimeError("ElevenLabs TTS đã bị loại bỏ. Chỉ sử dụng FPT AI.")
+        print("Using FPT AI TTS...")
+        preview = start_preview() if config.get('progressive_preview', False) else None
+        # Không truyền proxies để tránh lỗi
+        srt_to_aligned_audio_fpt_ai_with_failover(
+            subs_translated_srt, tts_wav,
+            config,  # Pass full config for key management
+            config['fpt_voice'],
+            config.get('fpt_speed', ''),
+            config.get('fpt_format', 'mp3'),
+            speech_speed=config.get('fpt_speech_speed', '0.8'),
+            cues=ctx.get('translated_cues'),
+            on_audio_ready=preview.feed_timeline if preview is not None else None
+        )
+        if preview is not None:
+            preview.finish()
+    
+    def run_silence_removal():
+        from pipeline import remove_silence_ffmpeg_video_audio
+        remove_silence_ffmpeg_video_audio(
+            fast_video, silence_removed_video,  # Sử dụng fast_video (đã tăng tốc)
+            threshold=config.get('silence_threshold', -50.0),
+            min_duration=config.get('min_silence_duration', 0.4),
+            max_duration=config.get('max_silence_duration', 2.0),
+            padding=config.get('silence_padding', 0.1),
+            speech_regions=word_timing_speech_regions(workdir / WORD_TIMINGS_FILE)
+            if config.get('silence_keep_source_speech', True) else None
+        )
+    
+    def run_import():
+        import_local_video(upload_store.path(project['upload_id']), input_mp4)
+    
+    stream_params = ['stt_', 'min_sentence_length', 'max_sentence_length', 'ai_provider',
+                     f"{config['ai_provider']}_model", 'use_ai_segmentation',
+                     'tts_provider', 'fpt_voice', 'fpt_speed', 'fpt_format', 'fpt_speech_speed',
+                     'stream_window_sec', 'stream_overlap_sec']
+    
+    def run_stream():
+        """
+        Streaming mode: thay các bước stt -> speed_up bằng pipeline theo cửa sổ (xem run_windowed_pipeline).
+        Cửa sổ đã xong được checkpoint trong workdir/stream: chạy lại sau timeout / restart worker tiếp tục
+        từ cửa sổ chưa xong thay vì từ đầu video.
+        """
+        if config.get('tts_provider', 'fpt') != 'fpt':
+            raise RuntimeError("ElevenLabs TTS đã bị loại bỏ. Chỉ sử dụng FPT AI.")
+        if config.get('progressive_preview', False):
+            renderer = ProgressiveHlsRenderer(slow_mp4, ctx.get('publish_dir', workdir) / 'live', resume=True)
+            project['live_hls_url'] = f"/api/live/{project['id']}/index.m3u8"
+        else:
+            renderer = ProgressiveHlsRenderer(slow_mp4, workdir / 'stream_segments', resume=True)
+        ctx['preview'] = renderer
         
-        # Thêm project mới vào queue (chỉ thêm vào danh sách, không dùng queue.Queue)
-        project['status'] = 'queued'
+        def on_progress(step_name, done, total):
+            step = project['steps'][step_name]
+            step['status'] = 'completed' if done == total else 'running'
+            step['progress'] = int(done * 100 / total)
+            if save_progress is not None:
+                save_progress()
         
-        # Tính queue position dựa trên số project đang queued
-        queued_projects = [p for p in projects.values() if p['status'] == 'queued']
-        project['queue_position'] = len(queued_projects)
+        def transcribe(wav_path, srt_path):
+            srt_raw = srt_path.with_name('subs_raw.srt')
+            run_stt(config, wav_path, srt_raw)
+            return run_segment(config, srt_raw, srt_path)
         
-        print(f"📋 Project {project_id} added to queue (position: {project['queue_position']})")
-        print(f"   Currently running: {running_projects[0]['id'][:8]}...")
-    
-    return jsonify(project)
+        def synthesize(srt_path, wav_path, cues):
+            srt_to_aligned_audio_fpt_ai_with_failover(
+                srt_path, wav_path, config, config['fpt_voice'],
+                config.get('fpt_speed', ''), config.get('fpt_format', 'mp3'),
+                speech_speed=config.get('fpt_speech_speed', '0.8'), cues=cues
+            )
+        
+        source_cues, translated_cues = run_windowed_pipeline(
+            stt_wav, renderer, workdir / 'stream',
+            transcribe=transcribe,
+            translate=lambda srt, out_srt, cues: translate_with_failover(config, srt, out_srt, cues=cues),
+            synthesize=synthesize,
+            window_sec=config.get('stream_window_sec', 300),
+            overlap_sec=config.get('stream_overlap_sec', 10),
+            resources=resource_pool,
+            step_resources={'stt': ['assemblyai'], 'translate': [config['ai_provider']],
+                            'tts': [config.get('tts_provider', 'fpt')]},
+            on_progress=on_progress,
+            params=stage_params(config, stream_params),
+        )
+        write_srt_cues(subs_srt, source_cues)
+        write_srt_cues(subs_translated_srt, translated_cues)
+        renderer.export(fast_video)
+        ctx.pop('preview', None)
+        for step_name in ('replace_audio', 'speed_up'):
+            project['steps'][step_name].update(status='completed', progress=100)
+    
+    if config.get('progressive_preview', False):
+        ctx.setdefault('stage_ready', {})['slow'] = threading.Event()
+    
+    stages = []
+    if project.get('upload_id'):
+        # Video đã upload: thay bước tải bằng link file; audio cho STT tách từ video gốc song song với slow
+        stages.append(Stage('download', run_import, outputs=['input.mp4'], values={'upload': project['upload_id']}))
+        if audio_first:
+            stages.append(Stage('extract_audio', lambda: extract_audio_for_stt(input_mp4, stt_wav, tempo=stt_tempo),
+                                inputs=['input.mp4'], outputs=['stt.wav'], values={'tempo': stt_tempo}, step='stt',
+                                resources=['cpu']))
+    elif audio_first:
+        stages.append(Stage('download_audio', run_download_audio, outputs=['stt.wav'],
+                            values={'url': url, 'tempo': stt_tempo}, step='download', resources=['network']))
+        stages.append(Stage('download', run_download, outputs=['input.mp4'], values={'url': url}, after=['download_audio'],
+                            resources=['network']))
+    else:
+        stages.append(Stage('download', run_download, outputs=['input.mp4'], values={'url': url}, resources=['network']))
+    stages.append(Stage('slow', lambda: slow_down_video(input_mp4, slow_mp4), inputs=['input.mp4'], outputs=['slow.mp4'],
+                        resources=['cpu']))
+    if not audio_first:
+        stages.append(Stage('extract_audio', lambda: extract_audio_for_stt(slow_mp4, stt_wav), inputs=['slow.mp4'],
+                            outputs=['stt.wav'], step='stt', resources=['cpu']))
+    # Silence Removal (optional) - cắt khoảng lặng cuối cùng (sau khi tăng tốc)
+    # Streaming mode giữ word timings theo từng cửa sổ, không có stt_words.bin của cả video
+    streaming = config.get('streaming_mode', False)
+    silence_removal = Stage('silence_removal', run_silence_removal,
+                            inputs=['fast_video.mp4'] + ([] if streaming else [WORD_TIMINGS_FILE]),
+                            outputs=['silence_removed.mp4'],
+                            params=['silence_threshold', 'min_silence_duration', 'max_silence_duration', 'silence_padding',
+                                    'silence_keep_source_speech'],
+                            values={'faststart': True}, enabled=config.get('enable_silence_removal', False),
+                            resources=['cpu'])
+    if streaming:
+        stages += [
+            Stage('stream', run_stream, inputs=['slow.mp4', 'stt.wav'], outputs=['subs.srt', 'subs_vi.srt', 'fast_video.mp4'],
+                  params=stream_params,
+                  values={'enabled': bool((config.get('assemblyai_api_key') or '').strip()), 'faststart': True},
+                  step='stt', resources=['cpu', 'assemblyai', config['ai_provider'], config.get('tts_provider', 'fpt')],
+                  pooled=False),
+            silence_removal,
+        ]
+        return stages
+    stages += [
+        Stage('stt', run_stt_stage, inputs=['stt.wav'], outputs=['subs_raw.srt', WORD_TIMINGS_FILE],
+              params=['stt_'],
+              values={'enabled': bool((config.get('assemblyai_api_key') or '').strip())}, resources=['assemblyai']),
+        Stage('segment', run_segment_stage, inputs=['subs_raw.srt', WORD_TIMINGS_FILE], outputs=['subs.srt'],
+              params=['stt_method', 'min_sentence_length', 'max_sentence_length', 'use_ai_segmentation'], step='stt',
+              resources=[config['ai_provider']] if config.get('use_ai_segmentation', False) else []),
+        Stage('translate', run_translate, inputs=['subs.srt'], outputs=['subs_vi.srt'],
+              params=['ai_provider', f"{config['ai_provider']}_model", 'use_ai_segmentation'],
+              resources=[config['ai_provider']]),
+        Stage('tts', run_tts, inputs=['subs_vi.srt'], outputs=['tts.wav'],
+              params=['tts_provider', 'fpt_voice', 'fpt_speed', 'fpt_format', 'fpt_speech_speed'],
+              resources=[config.get('tts_provider', 'fpt')]),
+        Stage('replace_audio', lambda: replace_audio(slow_mp4, tts_wav, final_video),
+              inputs=['slow.mp4', 'tts.wav'], outputs=['final_video.mp4'], resources=['cpu']),
+        Stage('speed_up', lambda: speed_up_130(final_video, fast_video),
+              inputs=['final_video.mp4'], outputs=['fast_video.mp4'], values={'faststart': True}, resources=['cpu']),
+        silence_removal,
+    ]
+    return stages
 
-def run_pipeline_async(project_id, url, workdir, config):
+def run_pipeline_async(project_id, url, workdir, config, force_steps=None, run_id=None, can_run=None, publish_dir=None,
+                       cancel=None):
+    """
+    Chạy pipeline của project qua stage graph. Bước nào đã có output hợp lệ (fingerprint không đổi)
+    thì bỏ qua, nên chạy lại sau crash sẽ tiếp tục từ artifact hợp lệ cuối cùng.
+    force_steps: các bước (tên trên UI) phải chạy lại dù fingerprint không đổi.
+    run_id: lần chạy đã claim trong job store (xem JobStore.claim); tiến độ chỉ được ghi khi
+    lần chạy này còn là lần chạy hiện hành của project.
+    can_run: stage affinity; stage không chạy được ở đây thì project được trả về hàng đợi cho worker khác.
+    publish_dir: nơi đặt output cuối cùng nếu khác workdir (worker ở node khác).
+    cancel: CancelToken của lần chạy (xem run_claimed_project).
+    """
+    project = job_store.get(project_id)
+    if project is None:
+        print(f"❌ Project {project_id} no longer exists")
+        return
+    
+    def save_progress():
+        job_store.save_run(project, run_id)
+    
+    # Bản xem trước ghi vào publish_dir để web tier phục vụ được khi worker chạy ở node khác
+    ctx = {'publish_dir': Path(publish_dir if publish_dir is not None else workdir)}
     try:
-        project = projects[project_id]
-        
         # Đảm bảo config có đầy đủ thông tin
         full_config = DEFAULT_CONFIG.copy()
-        full_config.update(config)
+        full_config.update(config or {})
+        if force_steps is None:
+            force_steps = project.pop('force_steps', None) or []
         
         # Cập nhật trạng thái
         project['status'] = 'running'
-        project['current_step'] = 'download'
-        project['steps']['download']['status'] = 'running'
+        project['error'] = None
+        project['live_hls_url'] = None  # Có lại khi bước TTS chạy với progressive_preview
         project['start_time'] = time.time()  # Ghi lại thời gian bắt đầu
+        save_progress()
+        workdir.mkdir(parents=True, exist_ok=True)
         
         print(f"🚀 Starting pipeline for project {project_id}")
         
-        # 1. Download
-        input_mp4 = workdir / "input.mp4"
-        try:
-            download_with_ytdlp(url, input_mp4)
-            project['steps']['download']['status'] = 'completed'
-            project['steps']['download']['progress'] = 100
-            project['progress'] = 10
-        except Exception as e:
-            project['steps']['download']['status'] = 'error'
-            project['steps']['download']['progress'] = 0
-            project['steps']['download']['error'] = str(e)
-            project['status'] = 'error'
-            
-            # Cung cấp thông tin lỗi chi tiết hơn
-            error_msg = str(e)
-            if "HTTP Error 403" in error_msg:
-                project['error'] = f"Lỗi tải video: Video không thể truy cập (403 Forbidden). Có thể video đã bị xóa, private, hoặc có hạn chế địa lý. Hãy thử URL khác."
-            elif "Requested format is not available" in error_msg:
-                project['error'] = f"Lỗi tải video: Định dạng video không khả dụng. Hãy thử URL khác."
-            elif "fragment 1 not found" in error_msg:
-                project['error'] = f"Lỗi tải video: Video có vấn đề về định dạng. Hãy thử URL khác."
-            else:
-                project['error'] = f"Lỗi tải video: {error_msg}"
-            return
-        
-        # 2. Slow down
-        project['current_step'] = 'slow'
-        project['steps']['slow']['status'] = 'running'
-        slow_mp4 = workdir / "slow.mp4"
-        slow_down_video(input_mp4, slow_mp4)
-        project['steps']['slow']['status'] = 'completed'
-        project['steps']['slow']['progress'] = 100
-        project['progress'] = 20
-        
-        # 3. STT
-        if full_config.get('assemblyai_api_key') and full_config['assemblyai_api_key'].strip():
-            project['current_step'] = 'stt'
-            project['steps']['stt']['status'] = 'running'
-            stt_wav = workdir / "stt.wav"
-            subs_srt_raw = workdir / "subs_raw.srt"
-            extract_audio_for_stt(slow_mp4, stt_wav)
-            try:
-                # Sử dụng phương pháp STT dựa trên cấu hình
-                stt_method = full_config.get('stt_method', 'utterances')
-                if stt_method == 'utterances':
-                    from pipeline import stt_assemblyai
-                    stt_assemblyai(stt_wav, subs_srt_raw, full_config['assemblyai_api_key'], language_code=full_config['stt_language'], config=full_config)
-                elif stt_method == 'json':
-                    from pipeline import stt_assemblyai
-                    stt_assemblyai(stt_wav, subs_srt_raw, full_config['assemblyai_api_key'], language_code=full_config['stt_language'], config=full_config)
-                else:  # srt
-                    from pipeline import stt_assemblyai_legacy
-                    stt_assemblyai_legacy(stt_wav, subs_srt_raw, full_config['assemblyai_api_key'], language_code=full_config['stt_language'], config=full_config)
-                
-                project['steps']['stt']['status'] = 'completed'
-                project['steps']['stt']['progress'] = 100
-            except Exception as e:
-                print(f"AssemblyAI STT failed: {e}")
-                # Fallback to empty SRT
-                with open(subs_srt_raw, 'w', encoding='utf-8') as f:
-                    f.write("1\n00:00:00,000 --> 00:00:05,000\n[Audio processing failed]\n\n")
-                project['steps']['stt']['status'] = 'error'
-                project['steps']['stt']['progress'] = 100
-                project['steps']['stt']['error'] = str(e)
-            project['progress'] = 25
-        else:
-            # Skip STT if no API key, create empty SRT
-            subs_srt_raw = workdir / "subs_raw.srt"
-            with open(subs_srt_raw, 'w', encoding='utf-8') as f:
-                f.write("1\n00:00:00,000 --> 00:00:05,000\n[No audio detected]\n\n")
-            project['steps']['stt']['status'] = 'skipped'
-            project['steps']['stt']['progress'] = 100
-            project['progress'] = 25
-
-        # 4. Copy SRT (skip merge step)
-        subs_srt = workdir / "subs.srt"
-        subs_srt_raw.rename(subs_srt)  # Sử dụng SRT gốc thay vì merge
-        project['progress'] = 30
-        
-        # 5. Translate
-        project['current_step'] = 'translate'
-        project['steps']['translate']['status'] = 'running'
-        subs_translated_srt = workdir / "subs_vi.srt"
+        stages = build_pipeline_stages(project, workdir, full_config, ctx, save_progress)
+        remaining = {}
+        for stage in stages:
+            remaining[stage.step] = remaining.get(stage.step, 0) + 1
+        finished = []
         
-        if full_config['ai_provider'] == 'gemini':
-            # Sử dụng Gemini với retry logic và key management
-            max_retries = 3  # 3 lần retry, mỗi lần thử tất cả keys
-            last_error = None
-            
-            # Thử tất cả keys trước khi báo lỗi
-            backup_keys = full_config.get('gemini_backup_keys', [])
-            user_key = full_config.get('gemini_api_key', '').strip()
-            all_keys = [user_key] + backup_keys if user_key else backup_keys
-            
-            translation_success = False
-            for retry_attempt in range(max_retries):
-                for key_index, current_gemini_key in enumerate(all_keys):
-                    if not current_gemini_key:
-                        continue
-                        
-                    try:
-                        print(f"🔄 Translation attempt {retry_attempt + 1}/{max_retries} with Gemini key #{key_index + 1}")
-                        
-                        translate_srt_ai(subs_srt, subs_translated_srt, model=full_config['gemini_model'], api_key=current_gemini_key, provider='gemini', config=full_config)
-                        
-                        project['steps']['translate']['status'] = 'completed'
-                        project['steps']['translate']['progress'] = 100
-                        project['progress'] = 40
-                        print(f"✅ Translation completed successfully with key #{key_index + 1}")
-                        translation_success = True
-                        break  # Thoát khỏi vòng lặp key nếu thành công
-                        
-                    except Exception as e:
-                        last_error = e
-                        print(f"❌ Translation failed with key #{key_index + 1}: {e}")
-                        
-                        # Chờ một chút trước khi thử key tiếp theo
-                        if key_index < len(all_keys) - 1:
-                            time.sleep(1)
-                
-                # Nếu translation thành công, thoát khỏi vòng lặp retry
-                if translation_success:
-                    break
-                
-                # Chờ lâu hơn trước khi retry toàn bộ
-                if retry_attempt < max_retries - 1:
-                    print(f"🔄 Retrying all keys (attempt {retry_attempt + 2}/{max_retries})")
-                    time.sleep(3)
-            
-            # Nếu tất cả retry đều thất bại
-            if not translation_success:
-                project['steps']['translate']['status'] = 'error'
-                project['steps']['translate']['error'] = str(last_error)
-                project['status'] = 'error'
-                project['error'] = f"Translation error: {str(last_error)}"
-                return
-                
-        elif full_config['ai_provider'] == 'deepseek':
-            translate_srt_ai(subs_srt, subs_translated_srt, model=full_config['deepseek_model'], api_key=full_config['deepseek_api_key'], provider='deepseek', config=full_config)
-            project['steps']['translate']['status'] = 'completed'
-            project['steps']['translate']['progress'] = 100
-            project['progress'] = 40
-        
-        # 6. TTS
-        project['current_step'] = 'tts'
-        project['steps']['tts']['status'] = 'running'
-        tts_wav = workdir / "tts.wav"
-        subs_translated_srt = workdir / "subs_vi.srt"
+        def on_event(stage, status, error):
+            step = project['steps'][stage.step]
+            if status == 'running':
+                project['current_step'] = stage.step
+                step['status'] = 'running'
+                step['error'] = None
+                print(f"🔄 Running stage: {stage.name}")
+            elif status == 'error':
+                step['status'] = 'error'
+                step['error'] = str(error)
+            else:
+                if status == 'up_to_date':
+                    print(f"⏭️ Stage {stage.name} is up to date")
+                ready = ctx.get('stage_ready', {}).get(stage.name)
+                if ready is not None:
+                    ready.set()
+                finished.append(stage.name)
+                remaining[stage.step] -= 1
+                if remaining[stage.step] == 0:
+                    step['status'] = 'completed'
+                    step['progress'] = 100
+                project['progress'] = min(99, int(len(finished) * 100 / len(stages)))
+            save_progress()
         
+        force = [stage.name for stage in stages if stage.step in force_steps]
         try:
-            # Chọn TTS provider dựa trên cấu hình
-            if full_config.get('tts_provider', 'fpt') == 'fpt':
-                print("Using FPT AI TTS...")
-                from pipeline import srt_to_aligned_audio_fpt_ai_with_failover
-                # Không truyền proxies để tránh lỗi
-                srt_to_aligned_audio_fpt_ai_with_failover(
-                    subs_translated_srt, tts_wav, 
-                    full_config,  # Pass full config for key management
-                    full_config['fpt_voice'],
-                    full_config.get('fpt_speed', ''),
-                    full_config.get('fpt_format', 'mp3'),
-                    speech_speed=full_config.get('fpt_speech_speed', '0.8')
-                )
-            else:
-                # ElevenLabs đã bị loại bỏ, chỉ sử dụng FPT AI
-                raise RuntimeError("ElevenLabs TTS đã bị loại bỏ. Chỉ sử dụng FPT AI.")
-                
-            project['steps']['tts']['status'] = 'completed'
-            project['steps']['tts']['progress'] = 100
-            project['progress'] = 50
+            completed = run_stage_graph(
+                stages, workdir, full_config, project_id=project_id,
+                store=get_artifact_store(full_config), force=force, on_event=on_event,
+                # Dừng ở ranh giới stage khi bị stop / xóa / timeout hoặc được đưa lại vào hàng đợi (retry),
+                # kể cả khi lệnh đó được gửi tới gunicorn worker khác
+                should_stop=lambda: not job_store.is_current_run(project_id, run_id),
+                resources=resource_pool,
+                can_run=can_run,
+                cancel=cancel,
+            )
+        except StageHandoff as handoff:
+            # Artifact đã nằm trong artifact store dùng chung, worker nhận tiếp sẽ lấy lại thay vì chạy lại
+            project['force_steps'] = [step for step in force_steps if remaining.get(step, 0) > 0]
+            job_store.handoff(project, run_id, handoff.resources)
+            print(f"↪️ Project {project_id} handed off: {', '.join(stage.name for stage in handoff.stages)} "
+                  f"need {', '.join(sorted(handoff.resources))}")
+            return
         except Exception as e:
-            print(f"TTS failed: {e}")
-            project['steps']['tts']['status'] = 'error'
-            project['steps']['tts']['progress'] = 100
-            project['steps']['tts']['error'] = str(e)
+            failed_step = project.get('current_step')
             project['status'] = 'error'
-            project['error'] = f"TTS error: {str(e)}"
+            if failed_step == 'download':
+                project['error'] = describe_download_error(str(e))
+            else:
+                project['error'] = get_vietnamese_error_message(str(e))
+            job_store.finish_run(project, run_id)
+            print(f"❌ Pipeline error for project {project_id} at step {failed_step}: {e}")
             return
         
-        # 7. Replace audio (thêm âm thanh tiếng Việt vào video slow)
-        project['current_step'] = 'replace_audio'
-        project['steps']['replace_audio']['status'] = 'running'
-        final_video = workdir / "final_video.mp4"
-        replace_audio(slow_mp4, tts_wav, final_video)
-        project['steps']['replace_audio']['status'] = 'completed'
-        project['steps']['replace_audio']['progress'] = 100
-        project['progress'] = 60
-        
-        # 8. Speed up (tăng tốc video có âm thanh tiếng Việt)
-        project['current_step'] = 'speed_up'
-        project['steps']['speed_up']['status'] = 'running'
-        fast_video = workdir / "fast_video.mp4"
-        speed_up_130(final_video, fast_video)
-        project['steps']['speed_up']['status'] = 'completed'
-        project['steps']['speed_up']['progress'] = 100
-        project['progress'] = 70
-        
-        # 9. Silence Removal (optional) - cắt khoảng lặng cuối cùng (sau khi tăng tốc)
-        project['current_step'] = 'silence_removal'
-        project['steps']['silence_removal']['status'] = 'running'
+        if not completed:
+            print(f"🛑 Project {project_id} was stopped, ending pipeline")
+            return
+        if ctx.get('preview') is not None:
+            # Các đoạn xem trước cuối cùng thường đã encode xong trong lúc chạy các bước sau TTS
+            ctx.pop('preview').close(wait=True)
         
+        # Hoàn thành
         if full_config.get('enable_silence_removal', False):
-            silence_removed_video = workdir / "silence_removed.mp4"
-            from pipeline import remove_silence_ffmpeg_video_audio
-            remove_silence_ffmpeg_video_audio(
-                fast_video, silence_removed_video,  # Sử dụng fast_video (đã tăng tốc)
-                threshold=full_config.get('silence_threshold', -50.0),
-                min_duration=full_config.get('min_silence_duration', 0.4),
-                max_duration=full_config.get('max_silence_duration', 2.0),
-                padding=full_config.get('silence_padding', 0.1)
-            )
-            final_output = silence_removed_video  # Use processed video as final output
+            final_output = workdir / "silence_removed.mp4"
         else:
-            final_output = fast_video  # Use speed-up video as final output
-        
-        project['steps']['silence_removal']['status'] = 'completed'
-        project['steps']['silence_removal']['progress'] = 100
-        project['progress'] = 80
-        
-        # 8. Music (optional) - Skip for now as we need to handle file uploads
-        # if data.get('music_path'):
-        #     project['current_step'] = 'music'
-        #     project['steps']['music']['status'] = 'running'
-        #     final_with_music = workdir / "final_with_music.mp4"
-        #     add_background_music(fast_video, Path(data['music_path']), final_with_music)
-        #     project['steps']['music']['status'] = 'completed'
-        #     project['steps']['music']['progress'] = 100
-        #     project['progress'] = 80
-        
-        # 9. Overlay (optional) - Skip for now as we need to handle file uploads
-        # if data.get('overlay_path'):
-        #     project['current_step'] = 'overlay'
-        #     project['steps']['overlay']['status'] = 'running'
-        #     final_output = workdir / "final_output.mp4"
-        #     overlay_template(fast_video, Path(data['overlay_path']), final_output)
-        #     project['steps']['overlay']['status'] = 'completed'
-        #     project['steps']['overlay']['progress'] = 100
-        #     project['progress'] = 90
-        
-        # Hoàn thành
+            final_output = workdir / "fast_video.mp4"
+        if publish_dir is not None and Path(publish_dir).resolve() != workdir.resolve():
+            Path(publish_dir).mkdir(parents=True, exist_ok=True)
+            final_output = Path(shutil.copy2(final_output, Path(publish_dir) / final_output.name))
+        project['hls_url'] = None
+        if full_config.get('output_hls', False):
+            try:
+                package_hls(final_output, final_output.parent / 'hls')
+                project['hls_url'] = f'/api/hls/{project_id}/index.m3u8'
+            except Exception as e:
+                # Bản HLS chỉ để xem thử, không làm hỏng project
+                print(f"⚠️ Could not package HLS for project {project_id}: {e}")
         project['status'] = 'completed'
         project['progress'] = 100
         project['output_file'] = str(final_output)
+        job_store.finish_run(project, run_id)
         
         print(f"✅ Project {project_id} completed successfully!")
         
-        # Kích hoạt dự án tiếp theo trong queue
-        print(f"🔄 Checking queue for next project...")
-        check_and_start_next_project()
-        
+    except Cancelled:
+        # Lần chạy đã bị thay thế / dừng, trạng thái do bên hủy ghi
+        print(f"🛑 Project {project_id} was cancelled, ending pipeline")
     except Exception as e:
         print(f"❌ Pipeline error for project {project_id}: {e}")
-        
-        # Kiểm tra xem project có tồn tại không
-        if project_id in projects:
-            project = projects[project_id]
-            project['status'] = 'error'
-            vietnamese_error = get_vietnamese_error_message(str(e))
-            project['error'] = vietnamese_error
-            print(f"Vietnamese error message: {vietnamese_error}")
-        else:
-            print(f"Project {project_id} not found when handling pipeline error: {e}")
-        
-        # Kích hoạt dự án tiếp theo trong queue ngay cả khi dự án hiện tại bị lỗi
-        print(f"🔄 Project {project_id} failed, starting next project in queue...")
-        check_and_start_next_project()
+        project['status'] = 'error'
+        vietnamese_error = get_vietnamese_error_message(str(e))
+        project['error'] = vietnamese_error
+        print(f"Vietnamese error message: {vietnamese_error}")
+        job_store.finish_run(project, run_id)
+    finally:
+        if ctx.get('preview') is not None:
+            ctx['preview'].close(wait=False)
 
 @app.route('/api/retry/<project_id>/<step_name>', methods=['POST'])
 def retry_step(project_id, step_name):
-    if project_id not in projects:
+    project = job_store.get(project_id)
+    if project is None:
         return jsonify({'error': 'Project not found'}), 404
     
-    project = projects[project_id]
-    
     if step_name not in project['steps']:
         return jsonify({'error': 'Invalid step name'}), 400
     
@@ -731,10 +1344,9 @@ def retry_step(project_id, step_name):
     # Cho phép retry từ bất kỳ bước nào, kể cả khi project đã completed hoặc error
     print(f"🔄 Retry requested for project {project_id} from step '{step_name}' (current status: {project['status']})")
     
-    # DỪNG tiến trình hiện tại nếu đang chạy
+    # DỪNG tiến trình hiện tại nếu đang chạy (runner hủy công việc đang dở khi lần chạy không còn hiện hành)
     if project['status'] == 'running':
         print(f"🛑 Stopping current pipeline for project {project_id}")
-        project['status'] = 'stopped'
         # Đánh dấu tất cả các bước đang chạy thành pending
         for step_name_inner, step_data in project['steps'].items():
             if step_data['status'] == 'running':
@@ -755,415 +1367,38 @@ def retry_step(project_id, step_name):
     project['progress'] = int((completed_steps / total_steps) * 100)
     
     # Reset trạng thái dự án
-    project['status'] = 'running'
     project['current_step'] = step_name
     project['error'] = None
     project['output_file'] = None
     
     print(f"🔄 Starting retry from step '{step_name}' for project {project_id}")
     
-    # Chạy lại pipeline từ bước được chọn
-    thread = threading.Thread(target=run_pipeline_from_step, args=(project_id, step_name))
-    thread.daemon = True
-    thread.start()
+    # Chạy lại pipeline từ bước được chọn (scheduler chờ lần chạy cũ dừng hẳn rồi mới khởi động)
+    enqueue_project(project, force_steps=[step_name])
     
     return jsonify({'status': 'success', 'message': f'Retrying pipeline from step: {step_name}'})
 
 def run_pipeline_from_step(project_id, start_step, config=None):
-    """Chạy pipeline từ một bước cụ thể, sử dụng tài nguyên từ các bước trước đó"""
-    try:
-        project = projects[project_id]
-        workdir = Path(f"projects/{project_id}")
-        
-        # Đảm bảo config có đầy đủ thông tin
-        if config is None:
-            config = DEFAULT_CONFIG.copy()
-        else:
-            full_config = DEFAULT_CONFIG.copy()
-            full_config.update(config)
-            config = full_config
-        
-        print(f"🔄 Running pipeline from step: {start_step} for project {project_id}")
-        
-        # Danh sách các bước theo thứ tự
-        step_order = ['download', 'slow', 'stt', 'translate', 'tts', 'replace_audio', 'silence_removal', 'speed_up', 'music', 'overlay']
-        
-        try:
-            start_index = step_order.index(start_step)
-        except ValueError:
-            print(f"❌ Invalid step name: {start_step}")
-            project['status'] = 'error'
-            project['error'] = f'Invalid step name: {start_step}'
-            return
-        
-        # Kiểm tra và tạo các file cần thiết từ các bước trước đó
-        print(f"🔍 Checking required files from previous steps...")
-        
-        # Mapping các file cần thiết cho từng bước
-        required_files = {
-            'slow': ['input.mp4'],
-            'stt': ['slow.mp4'],
-            'translate': ['subs_raw.srt'],
-            'tts': ['subs_vi.srt'],
-            'replace_audio': ['slow.mp4', 'tts.wav'],
-            'silence_removal': ['final_video.mp4'],
-            'speed_up': ['silence_removed.mp4'],
-            'music': ['fast_video.mp4'],
-            'overlay': ['final_video.mp4']
-        }
-        
-        # Kiểm tra file cần thiết cho bước hiện tại
-        if start_step in required_files:
-            missing_files = []
-            for file_name in required_files[start_step]:
-                file_path = workdir / file_name
-                if not file_path.exists():
-                    missing_files.append(file_name)
-            
-            if missing_files:
-                error_msg = f"Missing required files for step '{start_step}': {', '.join(missing_files)}"
-                print(f"❌ {error_msg}")
-                project['status'] = 'error'
-                project['error'] = error_msg
-                check_and_start_next_project()
-                return
-        
-        # Chạy từ bước bắt đầu đến cuối
-        for i in range(start_index, len(step_order)):
-            step = step_order[i]
-            
-            # Kiểm tra xem project có còn tồn tại không
-            if project_id not in projects:
-                print(f"❌ Project {project_id} no longer exists, stopping pipeline")
-                return
-            
-            # Kiểm tra xem project có bị dừng không
-            if project['status'] == 'stopped':
-                print(f"🛑 Project {project_id} was stopped, ending pipeline")
-                return
-            
-            # Cập nhật bước hiện tại
-            project['current_step'] = step
-            project['steps'][step]['status'] = 'running'
-            
-            print(f"🔄 Running step: {step}")
-            
-            try:
-                # Chạy bước hiện tại
-                run_single_step(project_id, step, workdir, config)
-                
-                # Cập nhật trạng thái thành công
-                project['steps'][step]['status'] = 'completed'
-                project['steps'][step]['progress'] = 100
-                
-                # Tính progress tổng thể
-                completed_steps = len([s for s in project['steps'].values() if s['status'] == 'completed'])
-                total_steps = len(project['steps'])
-                project['progress'] = int((completed_steps / total_steps) * 100)
-                
-            except Exception as e:
-                # Cập nhật trạng thái lỗi
-                project['steps'][step]['status'] = 'error'
-                project['steps'][step]['progress'] = 0
-                project['steps'][step]['error'] = str(e)
-                project['status'] = 'error'
-                project['error'] = str(e)
-                
-                vietnamese_error = get_vietnamese_error_message(str(e))
-                print(f"❌ Error in step {step}: {vietnamese_error}")
-                
-                # Kích hoạt dự án tiếp theo trong queue
-                check_and_start_next_project()
-                return
-        
-        # Hoàn thành tất cả các bước
-        project['status'] = 'completed'
-        project['progress'] = 100
-        
-        # Tìm file output cuối cùng
-        final_output = None
-        for output_file in ['final_video.mp4', 'fast_video.mp4', 'silence_removed.mp4', 'slow.mp4']:
-            if (workdir / output_file).exists():
-                final_output = workdir / output_file
-                break
-        
-        if final_output:
-            project['output_file'] = str(final_output)
-        
-        print(f"✅ Project {project_id} completed from step {start_step}")
-        
-        # Kích hoạt dự án tiếp theo trong queue
-        check_and_start_next_project()
-        
-    except Exception as e:
-        print(f"❌ Pipeline error for project {project_id}: {e}")
-        
-        # Kiểm tra xem project có tồn tại không
-        if project_id in projects:
-            project = projects[project_id]
-            project['status'] = 'error'
-            vietnamese_error = get_vietnamese_error_message(str(e))
-            project['error'] = vietnamese_error
-            print(f"Vietnamese error message: {vietnamese_error}")
-        else:
-            print(f"Project {project_id} not found when handling pipeline error: {e}")
-        
-        # Kích hoạt dự án tiếp theo trong queue ngay cả khi dự án hiện tại bị lỗi
-        print(f"🔄 Project {project_id} failed, starting next project in queue...")
-        check_and_start_next_project()
-
-
-def run_single_step(project_id, step_name, workdir=None, config=None):
-    """Chạy lại một step cụ thể"""
-    try:
-        project = projects[project_id]
-        
-        # Kiểm tra nếu dự án đã bị dừng
-        if project['status'] == 'stopped':
-            print(f"Project {project_id} is stopped, skipping step {step_name}")
-            return
-        
-        # Đảm bảo config có đầy đủ thông tin
-        if config is None:
-            config = DEFAULT_CONFIG.copy()
-        else:
-            full_config = DEFAULT_CONFIG.copy()
-            full_config.update(config)
-            config = full_config
-            
-        if workdir is None:
-            workdir = Path(f"projects/{project_id}")
-        
-        # Cập nhật trạng thái
-        project['current_step'] = step_name
-        project['steps'][step_name]['status'] = 'running'
-        project['status'] = 'running'
-        
-        if step_name == 'download':
-            # Download lại video
-            input_mp4 = workdir / "input.mp4"
-            download_with_ytdlp(project['url'], input_mp4)
-            project['steps']['download']['status'] = 'completed'
-            project['steps']['download']['progress'] = 100
-            project['progress'] = 10
-            
-        elif step_name == 'slow':
-            # Giảm tốc độ video
-            input_mp4 = workdir / "input.mp4"
-            if not input_mp4.exists():
-                raise RuntimeError("File input.mp4 không tồn tại. Hãy chạy bước 'download' trước.")
-            
-            slow_mp4 = workdir / "slow.mp4"
-            slow_down_video(input_mp4, slow_mp4)
-            project['steps']['slow']['status'] = 'completed'
-            project['steps']['slow']['progress'] = 100
-            project['progress'] = 20
-            
-        elif step_name == 'stt':
-            # Speech-to-Text - sử dụng file slow.mp4 đã có
-            slow_mp4 = workdir / "slow.mp4"
-            if not slow_mp4.exists():
-                raise RuntimeError("File slow.mp4 không tồn tại. Hãy chạy bước 'slow' trước.")
-            
-            stt_wav = workdir / "stt.wav"
-            subs_srt_raw = workdir / "subs_raw.srt"
-            extract_audio_for_stt(slow_mp4, stt_wav)
-            try:
-                stt_assemblyai(stt_wav, subs_srt_raw, config['assemblyai_api_key'], language_code=config['stt_language'])
-                project['steps']['stt']['status'] = 'completed'
-                project['steps']['stt']['progress'] = 100
-            except Exception as e:
-                print(f"AssemblyAI STT failed: {e}")
-                with open(subs_srt_raw, 'w', encoding='utf-8') as f:
-                    f.write("1\n00:00:00,000 --> 00:00:05,000\n[Audio processing failed]\n\n")
-                project['steps']['stt']['status'] = 'error'
-                project['steps']['stt']['progress'] = 100
-                project['steps']['stt']['error'] = str(e)
-                raise e  # Re-raise để xử lý trong exception handler
-            project['progress'] = 25
-            
-
-            
-        elif step_name == 'translate':
-            # Dịch thuật - sử dụng file subs.srt đã có
-            subs_srt = workdir / "subs.srt"
-            if not subs_srt.exists():
-                raise RuntimeError("File subs.srt không tồn tại. Hãy chạy bước 'stt' trước.")
-            
-            subs_translated_srt = workdir / "subs_vi.srt"
-            
-            # Sử dụng Gemini với retry logic và key management
-            max_retries = 3  # 3 lần retry, mỗi lần thử tất cả keys
-            last_error = None
-            
-            # Thử tất cả keys trước khi báo lỗi
-            backup_keys = config.get('gemini_backup_keys', [])
-            user_key = config.get('gemini_api_key', '').strip()
-            all_keys = [user_key] + backup_keys if user_key else backup_keys
-            
-            translation_success = False
-            for retry_attempt in range(max_retries):
-                for key_index, current_gemini_key in enumerate(all_keys):
-                    if not current_gemini_key:
-                        continue
-                        
-                    try:
-                        print(f"🔄 Translation attempt {retry_attempt + 1}/{max_retries} with Gemini key #{key_index + 1}")
-                        
-                        # Chỉ sử dụng Gemini cho AI translation
-                        translate_srt_ai(subs_srt, subs_translated_srt, model=config['gemini_model'], api_key=current_gemini_key, provider='gemini', config=config)
-                        
-                        project['steps']['translate']['status'] = 'completed'
-                        project['steps']['translate']['progress'] = 100
-                        project['progress'] = 40
-                        print(f"✅ Translation completed successfully with key #{key_index + 1}")
-                        translation_success = True
-                        break  # Thoát khỏi vòng lặp key nếu thành công
-                        
-                    except Exception as e:
-                        last_error = e
-                        print(f"❌ Translation failed with key #{key_index + 1}: {e}")
-                        
-                        # Chờ một chút trước khi thử key tiếp theo
-                        if key_index < len(all_keys) - 1:
-                            time.sleep(1)
-                
-                # Nếu translation thành công, thoát khỏi vòng lặp retry
-                if translation_success:
-                    break
-                
-                # Chờ lâu hơn trước khi retry toàn bộ
-                if retry_attempt < max_retries - 1:
-                    print(f"🔄 Retrying all keys (attempt {retry_attempt + 2}/{max_retries})")
-                    time.sleep(3)
-            
-            # Kiểm tra nếu translation đã thành công
-            if project['steps']['translate']['status'] == 'completed':
-                print(f"✅ Translation step completed successfully")
-            else:
-                # Nếu tất cả retry đều thất bại
-                project['steps']['translate']['status'] = 'error'
-                project['steps']['translate']['error'] = str(last_error)
-                raise last_error
-            
-        elif step_name == 'tts':
-            # Text-to-Speech - sử dụng file subs_vi.srt đã có
-            subs_translated_srt = workdir / "subs_vi.srt"
-            if not subs_translated_srt.exists():
-                raise RuntimeError("File subs_vi.srt không tồn tại. Hãy chạy bước 'translate' trước.")
-            
-            tts_wav = workdir / "tts.wav"
-            
-            try:
-                # Chọn TTS provider dựa trên cấu hình
-                # Chỉ sử dụng FPT AI cho TTS với key management
-                from pipeline import srt_to_aligned_audio_fpt_ai_with_failover
-                current_key = get_current_fpt_key(config)
-                if not current_key:
-                    raise RuntimeError("No FPT AI API key available")
-                
-                srt_to_aligned_audio_fpt_ai_with_failover(
-                    subs_translated_srt, tts_wav,
-                    config,  # Pass full config for key management
-                    config['fpt_voice'],
-                    config.get('fpt_speed', '-1'),
-                    config.get('fpt_format', 'mp3'),
-                    speech_speed=config.get('fpt_speech_speed', '0.8')
-                )
-                project['steps']['tts']['status'] = 'completed'
-                project['steps']['tts']['progress'] = 100
-                project['progress'] = 50
-            except Exception as e:
-                print(f"TTS retry failed: {e}")
-                project['steps']['tts']['status'] = 'error'
-                project['steps']['tts']['error'] = str(e)
-                raise e
-            
-        elif step_name == 'replace_audio':
-            # Thay thế audio - sử dụng file slow.mp4 và tts.wav đã có
-            slow_mp4 = workdir / "slow.mp4"
-            if not slow_mp4.exists():
-                raise RuntimeError("File slow.mp4 không tồn tại. Hãy chạy bước 'slow' trước.")
-            
-            tts_wav = workdir / "tts.wav"
-            if not tts_wav.exists():
-                raise RuntimeError("File tts.wav không tồn tại. Hãy chạy bước 'tts' trước.")
-            
-            final_video = workdir / "final_video.mp4"
-            replace_audio(slow_mp4, tts_wav, final_video)
-            project['steps']['replace_audio']['status'] = 'completed'
-            project['steps']['replace_audio']['progress'] = 100
-            project['progress'] = 60
-            
-        elif step_name == 'speed_up':
-            # Tăng tốc độ (video có âm thanh tiếng Việt)
-            final_video = workdir / "final_video.mp4"
-            if not final_video.exists():
-                raise RuntimeError("File final_video.mp4 không tồn tại. Hãy chạy bước 'replace_audio' trước.")
-            
-            fast_video = workdir / "fast_video.mp4"
-            speed_up_130(final_video, fast_video)
-            project['steps']['speed_up']['status'] = 'completed'
-            project['steps']['speed_up']['progress'] = 100
-            project['progress'] = 70
-            
-        elif step_name == 'silence_removal':
-            # Cắt khoảng lặng cuối cùng (tùy chọn)
-            fast_video = workdir / "fast_video.mp4"
-            if not fast_video.exists():
-                raise RuntimeError("File fast_video.mp4 không tồn tại. Hãy chạy bước 'speed_up' trước.")
-            
-            if config.get('enable_silence_removal', False):
-                print(f"🔇 Silence removal enabled, processing video...")
-                silence_removed_video = workdir / "silence_removed.mp4"
-                from pipeline import remove_silence_ffmpeg_video_audio
-                remove_silence_ffmpeg_video_audio(
-                    fast_video, silence_removed_video,
-                    threshold=config.get('silence_threshold', -50.0),
-                    min_duration=config.get('min_silence_duration', 0.4),
-                    max_duration=config.get('max_silence_duration', 2.0),
-                    padding=config.get('silence_padding', 0.1)
-                )
-                final_output = silence_removed_video
-                print(f"✅ Silence removal completed: {silence_removed_video}")
-            else:
-                print(f"⏭️ Silence removal disabled, skipping...")
-                final_output = fast_video
-            
-            project['steps']['silence_removal']['status'] = 'completed'
-            project['steps']['silence_removal']['progress'] = 100
-            project['progress'] = 80
-            
-        # Cập nhật trạng thái tổng thể
-        if all(step['status'] == 'completed' for step in project['steps'].values()):
-            project['status'] = 'completed'
-            project['progress'] = 100
-            # Xác định output file cuối cùng
-            if config.get('enable_silence_removal', False):
-                project['output_file'] = str(workdir / "silence_removed.mp4")
-            else:
-                project['output_file'] = str(workdir / "fast_video.mp4")
-            print(f"✅ All steps completed for project {project_id}")
-                    
-    except Exception as e:
-        # Kiểm tra xem project có tồn tại không
-        if project_id in projects:
-            project = projects[project_id]
-            vietnamese_error = get_vietnamese_error_message(str(e))
-            project['steps'][step_name]['status'] = 'error'
-            project['steps'][step_name]['error'] = vietnamese_error
-            project['error'] = vietnamese_error
-            print(f"Step {step_name} error: {e}")
-            print(f"Vietnamese message: {vietnamese_error}")
-        else:
-            print(f"Project {project_id} not found when handling error for step {step_name}: {e}")
+    """
+    Chạy lại pipeline từ một bước: bước đó luôn chạy lại, các bước sau chỉ chạy lại khi input của chúng thay đổi,
+    các bước trước dùng lại output đã có.
+    """
+    project = job_store.get(project_id)
+    if project is None:
+        print(f"❌ Project {project_id} no longer exists")
+        return
+    print(f"🔄 Running pipeline from step: {start_step} for project {project_id}")
+    enqueue_project(project, config, force_steps=[start_step])
 
 @app.route('/api/download/<project_id>')
 def download_result(project_id):
-    if project_id not in projects:
+    """
+    Output cuối cùng, hỗ trợ HTTP Range (tua / tải tiếp) và If-None-Match.
+    ?inline=1: phát trực tiếp trên trình duyệt thay vì tải về (output là MP4 faststart).
+    """
+    project = job_store.get(project_id)
+    if project is None:
         return jsonify({'error': 'Project not found'}), 404
-    
-    project = projects[project_id]
     if project['status'] != 'completed':
         return jsonify({'error': 'Project not completed'}), 400
     
@@ -1171,35 +1406,51 @@ def download_result(project_id):
     if not output_file.exists():
         return jsonify({'error': 'Output file not found'}), 404
     
-    return send_file(output_file, as_attachment=True)
+    return send_file(output_file.resolve(), as_attachment=request.args.get('inline') != '1',
+                     conditional=True, etag=True, max_age=0)
+
+@app.route('/api/live/<project_id>/<path:filename>')
+def live_hls_file(project_id, filename):
+    """Playlist (EVENT, được thêm segment trong khi project chạy) / segment của bản xem trước"""
+    if not job_store.exists(project_id):
+        return jsonify({'error': 'Project not found'}), 404
+    response = send_from_directory((PROJECTS_DIR / project_id / 'live').resolve(), filename,
+                                   conditional=True, etag=True, max_age=0)
+    if filename.endswith('.m3u8'):
+        response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/api/hls/<project_id>/<path:filename>')
+def hls_file(project_id, filename):
+    """Playlist / segment của bản HLS (xem config output_hls)"""
+    project = job_store.get(project_id)
+    if project is None or not project.get('hls_url') or not project.get('output_file'):
+        return jsonify({'error': 'HLS rendition not found'}), 404
+    return send_from_directory(Path(project['output_file']).resolve().parent / 'hls', filename,
+                               conditional=True, etag=True, max_age=0)
 
 @app.route('/api/stop/<project_id>', methods=['POST'])
 def stop_project(project_id):
     """Dừng một project đang chạy"""
-    if project_id not in projects:
+    project = job_store.get(project_id)
+    if project is None:
         return jsonify({'error': 'Project not found'}), 404
     
-    project = projects[project_id]
-    
-    if project['status'] != 'running':
-        return jsonify({'error': 'Project is not running'}), 400
-    
     print(f"🛑 Stopping project {project_id}...")
     
-    # Đánh dấu project là stopped
-    project['status'] = 'stopped'
-    project['error'] = 'Project stopped by user'
+    # Đánh dấu project là stopped (chỉ khi vẫn đang chạy); runner hủy ngay ffmpeg / HTTP call đang chạy
+    if not job_store.update_status(project_id, 'stopped', expected='running', error='Project stopped by user'):
+        return jsonify({'error': 'Project is not running'}), 400
     
     return jsonify({'status': 'success', 'message': f'Project {project_id} stopped successfully'})
 
 @app.route('/api/restart/<project_id>', methods=['POST'])
 def restart_project(project_id):
     """Restart một project từ đầu"""
-    if project_id not in projects:
+    project = job_store.get(project_id)
+    if project is None:
         return jsonify({'error': 'Project not found'}), 404
     
-    project = projects[project_id]
-    
     print(f"🔄 Restarting project {project_id} from beginning...")
     
     # Reset tất cả các bước về pending
@@ -1217,7 +1468,7 @@ def restart_project(project_id):
     project['start_time'] = None
     
     # Xóa các file cũ nếu có
-    project_dir = Path(f"projects/{project_id}")
+    project_dir = PROJECTS_DIR / project_id
     if project_dir.exists():
         try:
             # Xóa các file đã tạo trước đó
@@ -1233,37 +1484,18 @@ def restart_project(project_id):
         except Exception as e:
             print(f"⚠️ Error cleaning old files: {e}")
     
-    # Kiểm tra xem có project nào đang chạy không
-    running_projects = [p for p in projects.values() if p['status'] == 'running']
-    
-    if len(running_projects) == 0:
-        # Không có project nào đang chạy, chạy ngay
-        project['status'] = 'running'
-        project['queue_position'] = 0
-        print(f"🚀 Starting restarted project {project_id} immediately")
-        
-        # Sử dụng DEFAULT_CONFIG
-        config = DEFAULT_CONFIG.copy()
-        
-        thread = threading.Thread(target=run_pipeline_async, args=(project_id, project['url'], project_dir, config))
-        thread.daemon = True
-        thread.start()
-    else:
-        # Có project đang chạy, thêm vào queue
-        queued_projects = [p for p in projects.values() if p['status'] == 'queued']
-        project['queue_position'] = len(queued_projects)
-        print(f"📋 Restarted project {project_id} added to queue (position: {project['queue_position']})")
+    # Chạy ngay nếu còn slot trống, không thì chờ trong hàng đợi
+    enqueue_project(project)
     
     return jsonify({'status': 'success', 'message': f'Project {project_id} restarted successfully'})
 
 @app.route('/api/restart-from-step/<project_id>/<step_name>', methods=['POST'])
 def restart_from_step(project_id, step_name):
     """Restart một project từ một bước cụ thể, sử dụng tài nguyên từ các bước trước đó"""
-    if project_id not in projects:
+    project = job_store.get(project_id)
+    if project is None:
         return jsonify({'error': 'Project not found'}), 404
     
-    project = projects[project_id]
-    
     # Danh sách các bước theo thứ tự
     step_order = ['download', 'slow', 'stt', 'translate', 'tts', 'replace_audio', 'silence_removal', 'speed_up', 'music', 'overlay']
     
@@ -1272,11 +1504,6 @@ def restart_from_step(project_id, step_name):
     
     print(f"🔄 Restarting project {project_id} from step: {step_name}")
     
-    # Nếu project đang chạy, dừng nó trước
-    if project['status'] == 'running':
-        project['status'] = 'stopped'
-        project['error'] = 'Project stopped to restart from step'
-    
     # Reset tất cả các bước từ step_name trở đi về pending
     step_index = step_order.index(step_name)
     for i in range(step_index, len(step_order)):
@@ -1306,26 +1533,8 @@ def restart_from_step(project_id, step_name):
     total_steps = len(project['steps'])
     project['progress'] = int((completed_steps / total_steps) * 100)
     
-    # Kiểm tra xem có project nào đang chạy không
-    running_projects = [p for p in projects.values() if p['status'] == 'running']
-    
-    if len(running_projects) == 0:
-        # Không có project nào đang chạy, chạy ngay
-        project['status'] = 'running'
-        project['queue_position'] = 0
-        print(f"🚀 Starting project {project_id} from step {step_name} immediately")
-        
-        # Sử dụng DEFAULT_CONFIG
-        config = DEFAULT_CONFIG.copy()
-        
-        thread = threading.Thread(target=run_pipeline_from_step, args=(project_id, step_name, config))
-        thread.daemon = True
-        thread.start()
-    else:
-        # Có project đang chạy, thêm vào queue
-        queued_projects = [p for p in projects.values() if p['status'] == 'queued']
-        project['queue_position'] = len(queued_projects)
-        print(f"📋 Project {project_id} restarted from step {step_name} added to queue (position: {project['queue_position']})")
+    # Chạy ngay nếu còn slot trống, không thì chờ trong hàng đợi (bước này sẽ được chạy lại bắt buộc khi tới lượt)
+    enqueue_project(project, force_steps=[step_name])
     
     return jsonify({
         'status': 'success', 
@@ -1337,13 +1546,12 @@ def restart_from_step(project_id, step_name):
 
 @app.route('/api/delete/<project_id>', methods=['DELETE'])
 def delete_project(project_id):
-    if project_id not in projects:
+    project = job_store.get(project_id)
+    if project is None:
         return jsonify({'error': 'Project not found'}), 404
     
-    project = projects[project_id]
-    
     # Xóa folder dự án
-    project_dir = Path(f"projects/{project_id}")
+    project_dir = PROJECTS_DIR / project_id
     if project_dir.exists():
         try:
             shutil.rmtree(project_dir)
@@ -1351,16 +1559,33 @@ def delete_project(project_id):
         except Exception as e:
             print(f"⚠️ Error deleting project folder: {e}")
     
-    # Xóa khỏi danh sách projects
-    del projects[project_id]
+    # Bỏ tham chiếu tới artifact store, chỉ xóa blob không còn project nào dùng
+    try:
+        removed_blobs = artifact_store.release_project(project_id)
+        if removed_blobs:
+            print(f"🗑️ Removed {len(removed_blobs)} unreferenced artifact(s)")
+    except Exception as e:
+        print(f"⚠️ Error releasing artifacts: {e}")
+    
+    # Video đã upload bị xóa khi không còn project nào dùng
+    if project.get('upload_id'):
+        try:
+            if upload_store.release(project['upload_id'], project_id):
+                print(f"🗑️ Deleted upload {project['upload_id']}")
+        except UploadError as e:
+            print(f"⚠️ Error releasing upload: {e}")
+    
+    # Xóa khỏi job store và hàng đợi của scheduler
+    job_store.delete(project_id)
+    project_scheduler.cancel(project_id)
     
-    # Xóa khỏi queue nếu đang trong queue (không cần thiết nữa vì không dùng queue.Queue)
     print(f"🗑️ Project {project_id} removed from projects list")
     
     return jsonify({'status': 'success', 'message': 'Project deleted successfully'})
 
 @app.route('/api/upload', methods=['POST'])
 def upload_file():
+    """Upload cả file trong một request multipart (file nhỏ); file lớn dùng /api/uploads"""
     if 'file' not in request.files:
         return jsonify({'error': 'No file provided'}), 400
     
@@ -1368,14 +1593,91 @@ def upload_file():
     if file.filename == '':
         return jsonify({'error': 'No file selected'}), 400
     
-    filename = secure_filename(file.filename)
-    upload_dir = Path('uploads')
-    upload_dir.mkdir(exist_ok=True)
-    
-    file_path = upload_dir / filename
-    file.save(file_path)
+    # Werkzeug đã spool file xuống đĩa; chép sang upload store theo từng chunk
+    file.stream.seek(0, os.SEEK_END)
+    length = file.stream.tell()
+    file.stream.seek(0)
+    try:
+        upload = upload_store.create(file.filename, length)
+        upload = upload_store.append(upload['id'], 0, file.stream, length)
+    except UploadError as e:
+        return jsonify({'error': str(e)}), e.status
     
-    return jsonify({'file_path': str(file_path)})
+    return jsonify({'file_path': str(upload_store.path(upload['id'])), 'upload_id': upload['id']})
+
+# Upload theo từng phần, tiếp tục được sau khi mất kết nối (tus 1.0 core + creation):
+#   POST /api/uploads (Upload-Length, Upload-Metadata: filename <base64>) -> 201, Location
+#   HEAD /api/uploads/<id> -> Upload-Offset đã nhận
+#   PATCH /api/uploads/<id> (Upload-Offset, Content-Type: application/offset+octet-stream, body = phần tiếp theo)
+TUS_VERSION = '1.0.0'
+
+def upload_headers(upload):
+    return {
+        'Tus-Resumable': TUS_VERSION,
+        'Upload-Offset': str(upload['offset']),
+        'Upload-Length': str(upload['length']),
+        'Cache-Control': 'no-store'
+    }
+
+def upload_metadata():
+    """filename từ Upload-Metadata (tus: "key base64,key base64") hoặc JSON body"""
+    import base64
+    metadata = {}
+    for item in (request.headers.get('Upload-Metadata') or '').split(','):
+        key, _, value = item.strip().partition(' ')
+        if key:
+            try:
+                metadata[key] = base64.b64decode(value).decode('utf-8') if value else ''
+            except (ValueError, UnicodeDecodeError):
+                pass
+    return metadata
+
+@app.route('/api/uploads', methods=['POST', 'OPTIONS'])
+def create_upload():
+    if request.method == 'OPTIONS':
+        return Response(status=204, headers={'Tus-Resumable': TUS_VERSION, 'Tus-Version': TUS_VERSION,
+                                             'Tus-Extension': 'creation,termination',
+                                             'Tus-Max-Size': str(upload_store.max_bytes)})
+    data = request.get_json(silent=True) or {}
+    filename = upload_metadata().get('filename') or data.get('filename')
+    try:
+        length = int(request.headers.get('Upload-Length') or data.get('length') or 0)
+        upload = upload_store.create(filename, length)
+    except ValueError:
+        return jsonify({'error': 'Invalid Upload-Length'}), 400
+    except UploadError as e:
+        return jsonify({'error': str(e)}), e.status
+    response = jsonify(upload)
+    response.status_code = 201
+    response.headers.update(upload_headers(upload))
+    response.headers['Location'] = f"/api/uploads/{upload['id']}"
+    return response
+
+@app.route('/api/uploads/<upload_id>', methods=['GET', 'HEAD', 'PATCH', 'DELETE'])
+def upload_resource(upload_id):
+    try:
+        if request.method == 'DELETE':
+            upload_store.delete(upload_id)
+            return Response(status=204, headers={'Tus-Resumable': TUS_VERSION})
+        if request.method == 'PATCH':
+            if request.mimetype != 'application/offset+octet-stream':
+                return jsonify({'error': 'Content-Type must be application/offset+octet-stream'}), 415
+            try:
+                offset = int(request.headers['Upload-Offset'])
+            except (KeyError, ValueError):
+                return jsonify({'error': 'Upload-Offset header is required'}), 400
+            upload = upload_store.append(upload_id, offset, request.stream, request.content_length)
+            return Response(status=204, headers=upload_headers(upload))
+        upload = upload_store.info(upload_id)
+    except UploadError as e:
+        return jsonify({'error': str(e)}), e.status
+    if request.method == 'HEAD':
+        return Response(status=200, headers=upload_headers(upload))
+    response = jsonify(upload)
+    response.headers.update(upload_headers(upload))
+    return response
+
+restore_queued_projects()
 
 if __name__ == '__main__':
     app.run(debug=False, host='0.0.0.0', port=5000)